@@ -28,7 +28,7 @@ class FilterForm(forms.Form):
         #import pdb; pdb.set_trace()
         if pattern:
             self.pattern = pattern
-            et = EventType.objects.get(name="Transfer")
+            et = EventType.objects.cached(name="Transfer")
             self.fields["resource_type"].queryset = pattern.get_resource_types(event_type=et)
             
 class TransferFlowForm(forms.Form):
@@ -55,11 +55,16 @@ class TransferFlowForm(forms.Form):
         empty_label=None,
         queryset=Unit.objects.filter(unit_type='value'))
         
-    def __init__(self, assoc_type_identifier=None, context_agent=None, qty_help=None, *args, **kwargs):
+    def __init__(self, assoc_type_identifier=None, context_agent=None, qty_help=None, choices=None, *args, **kwargs):
         super(TransferFlowForm, self).__init__(*args, **kwargs)
         #import pdb; pdb.set_trace()
         if context_agent and assoc_type_identifier:
-            self.fields["to_agent"].queryset = context_agent.all_has_associates_by_type(assoc_type_identifier=assoc_type_identifier)   
+            if choices:
+                choices.fill(self.fields["to_agent"], *choices.has_associates(context_agent, assoc_type_identifier))
+            else:
+                self.fields["to_agent"].queryset = context_agent.all_has_associates_by_type(assoc_type_identifier=assoc_type_identifier)   
+        if choices:
+            choices.fill(self.fields["unit_of_value"])
         if qty_help:
             self.fields["quantity"].help_text = qty_help
             
@@ -87,11 +92,16 @@ class ExchangeFlowForm(forms.Form):
     #paid = forms.ChoiceField(required=True,
     #    widget=forms.RadioSelect, choices=PAID_CHOICES)
         
-    def __init__(self, assoc_type_identifier=None, context_agent=None, qty_help=None, *args, **kwargs):
+    def __init__(self, assoc_type_identifier=None, context_agent=None, qty_help=None, choices=None, *args, **kwargs):
         super(ExchangeFlowForm, self).__init__(*args, **kwargs)
         #import pdb; pdb.set_trace()
         if context_agent and assoc_type_identifier:
-            self.fields["to_agent"].queryset = context_agent.all_has_associates_by_type(assoc_type_identifier=assoc_type_identifier)   
+            if choices:
+                choices.fill(self.fields["to_agent"], *choices.has_associates(context_agent, assoc_type_identifier))
+            else:
+                self.fields["to_agent"].queryset = context_agent.all_has_associates_by_type(assoc_type_identifier=assoc_type_identifier)   
+        if choices:
+            choices.fill(self.fields["unit_of_value"])
         if qty_help:
             self.fields["quantity"].help_text = qty_help
             
@@ -198,10 +208,14 @@ class CombineResourcesForm(forms.Form):
     notes = forms.CharField(required=False,
         widget=forms.Textarea(attrs={'class': 'item-description',}))
         
-    def __init__(self, stage=None, resource_type=None, *args, **kwargs):
+    def __init__(self, stage=None, resource_type=None, resources=None, *args, **kwargs):
         super(CombineResourcesForm, self).__init__(*args, **kwargs)
         #import pdb; pdb.set_trace()
-        if resource_type and stage:
+        if resources is not None:
+            field = self.fields["resources"]
+            field.queryset = EconomicResource.objects.filter(pk__in=[res.pk for res in resources])
+            field.choices = [(res.pk, field.label_from_instance(res)) for res in resources]
+        elif resource_type and stage:
             self.fields["resources"].queryset = resource_type.onhand_for_exchange_stage(stage=stage)
 
 class ReceiveForm(forms.Form):
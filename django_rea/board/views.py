@@ -19,6 +19,7 @@ from django.conf import settings
 
 from django_rea.valueaccounting.models import *
 from django_rea.board.forms import *
+from django_rea.valueaccounting.forms import FormChoices
 from django_rea.valueaccounting.views import get_agent
 
 def default_context_agent():
@@ -36,41 +37,45 @@ def dhen_board(request, context_agent_id=None):
     else:
         context_agent = default_context_agent()
     seller = EconomicAgent.objects.get(id=4) #todo: even worse hack!!
-    rec_extype = ExchangeType.objects.get(name="Purchase to Drying Site")
+    rec_extype = ExchangeType.objects.cached(name="Purchase to Drying Site")
     e_date = datetime.date.today()
     init = {"start_date": e_date }
-    available_extype = ExchangeType.objects.get(name="Make Available")
+    available_extype = ExchangeType.objects.cached(name="Make Available")
     available_form = AvailableForm(initial=init, exchange_type=available_extype, context_agent=context_agent, prefix="AVL")
     init = {"event_date": e_date, "paid": "later", }
     receive_form = ReceiveForm(initial=init, exchange_type=rec_extype, context_agent=context_agent, prefix="REC")
-    et = EventType.objects.get(name="Resource Production")
+    et = EventType.objects.cached(name="Resource Production")
     farm_stage = None  
     #harvester_stage = ExchangeType.objects.get(name="Farm to Harvester")  
-    dryer_stage = ExchangeType.objects.get(name="Harvester to Drying Site")  
-    seller_stage = ExchangeType.objects.get(name="Drying Site to Seller")
-    rts = pattern.get_resource_types(event_type=et)
+    dryer_stage = ExchangeType.objects.cached(name="Harvester to Drying Site")  
+    seller_stage = ExchangeType.objects.cached(name="Drying Site to Seller")
+    rts = EconomicResourceType.objects.exchange_stages(
+        pattern.get_resource_types(event_type=et),
+        commitment_stage=farm_stage,
+        resource_stages=[dryer_stage, seller_stage])
+    choices = FormChoices()
     for rt in rts:
         init = {"event_date": e_date,}
-        rt.farm_commits = rt.commits_for_exchange_stage(stage=farm_stage)
+        rt.farm_commits = rt.stage_commits
         for com in rt.farm_commits:
             if com.start_date > e_date:
                 com.future = True
             prefix = com.form_prefix()
             qty_help = " ".join([com.unit_of_quantity.abbrev, ", up to 2 decimal places"])
-            com.transfer_form = ExchangeFlowForm(initial=init, qty_help=qty_help, assoc_type_identifier="DryingSite", context_agent=context_agent, prefix=prefix)
+            com.transfer_form = ExchangeFlowForm(initial=init, qty_help=qty_help, assoc_type_identifier="DryingSite", context_agent=context_agent, choices=choices, prefix=prefix)
             com.zero_form = ZeroOutForm(prefix=prefix)
             com.lot_form = NewResourceForm(prefix=prefix)
-            com.multiple_formset = create_exchange_formset(context_agent=context_agent, assoc_type_identifier="Harvester", prefix=prefix)            
-        rt.dryer_resources = rt.onhand_for_exchange_stage(stage=dryer_stage)
+            com.multiple_formset = create_exchange_formset(context_agent=context_agent, assoc_type_identifier="Harvester", prefix=prefix, choices=choices)
+        rt.dryer_resources = rt.stage_resources.get(dryer_stage.id, [])
         init = {"event_date": e_date, "paid": "later"}
         for res in rt.dryer_resources:
             prefix = res.form_prefix()
             qty_help = " ".join([res.unit_of_quantity().abbrev, ", up to 2 decimal places"])
-            res.transfer_form = TransferFlowForm(initial=init, qty_help=qty_help, assoc_type_identifier="Seller", context_agent=context_agent, prefix=prefix)
-        rt.seller_resources = rt.onhand_for_exchange_stage(stage=seller_stage)
+            res.transfer_form = TransferFlowForm(initial=init, qty_help=qty_help, assoc_type_identifier="Seller", context_agent=context_agent, choices=choices, prefix=prefix)
+        rt.seller_resources = rt.stage_resources.get(seller_stage.id, [])
         if rt.seller_resources:
             init_rt = {"event_date": e_date,} 
-            rt.combine_form = CombineResourcesForm(prefix = rt.form_prefix(), initial=init_rt, resource_type=rt, stage=seller_stage)
+            rt.combine_form = CombineResourcesForm(prefix = rt.form_prefix(), initial=init_rt, resources=rt.seller_resources)
     
     return render_to_response("board/dhen_board.html", {
         "agent": agent,
@@ -91,7 +96,7 @@ def add_available(request, context_agent_id):
         form = AvailableForm(data=request.POST, prefix="AVL")
         if form.is_valid():
             commit = form.save(commit=False)
-            commit.event_type = EventType.objects.get(name="Give")
+            commit.event_type = EventType.objects.cached(name="Give")
             commit.to_agent = context_agent
             commit.context_agent = context_agent
             commit.due_date = commit.start_date
@@ -108,8 +113,8 @@ def receive_directly(request, context_agent_id):
     if request.method == "POST":
         #import pdb; pdb.set_trace()
         context_agent = EconomicAgent.objects.get(id=context_agent_id)
-        stage = ExchangeType.objects.get(name="Harvester to Drying Site") 
-        exchange_type = ExchangeType.objects.get(name="Purchase to Drying Site") #todo: odd to have stage different....
+        stage = ExchangeType.objects.cached(name="Harvester to Drying Site") 
+        exchange_type = ExchangeType.objects.cached(name="Purchase to Drying Site") #todo: odd to have stage different....
         form = ReceiveForm(data=request.POST, prefix="REC")
         if form.is_valid():        
             data = form.cleaned_data
@@ -123,12 +128,12 @@ def receive_directly(request, context_agent_id):
             paid = data["paid"]
             value = data["value"]
             unit_of_value = data["unit_of_value"]
-            receive_et = EventType.objects.get(name="Receive")
-            give_et = EventType.objects.get(name="Give")
+            receive_et = EventType.objects.cached(name="Receive")
+            give_et = EventType.objects.cached(name="Give")
             pay_rt = EconomicResourceType.objects.filter(unit__unit_type="value")[0]
             exchange = Exchange(
                 name="Purchase " + resource_type.name + " from " + from_agent.nick,
-                use_case=UseCase.objects.get(identifier="supply_xfer"),
+                use_case=UseCase.objects.cached(identifier="supply_xfer"),
                 start_date=event_date,
                 context_agent=context_agent,
                 exchange_type=exchange_type, 
@@ -239,14 +244,20 @@ def receive_directly(request, context_agent_id):
     return HttpResponseRedirect('/%s/%s/'
         % ('board/dhen-board', context_agent_id))
 
-def create_exchange_formset(context_agent, assoc_type_identifier, prefix, data=None):
+def create_exchange_formset(context_agent, assoc_type_identifier, prefix, data=None, choices=None):
     ExchangeFormSet = formset_factory(MultipleExchangeEventForm, extra=10)
     #init = {"paid": "paid"}
     formset = ExchangeFormSet(data=data, prefix=prefix)
-    to_agents = context_agent.all_has_associates_by_type(assoc_type_identifier=assoc_type_identifier)
+    if choices:
+        key, to_agents = choices.has_associates(context_agent, assoc_type_identifier)
+    else:
+        to_agents = context_agent.all_has_associates_by_type(assoc_type_identifier=assoc_type_identifier)
     for form in formset:
         #id = int(form["facet_id"].value())
-        form.fields["to_agent"].queryset = to_agents
+        if choices:
+            choices.fill(form.fields["to_agent"], key, to_agents)
+        else:
+            form.fields["to_agent"].queryset = to_agents
         form.fields["paid_stage_1"].initial = "never"
         form.fields["paid_stage_2"].initial = "later"
     return formset
@@ -254,11 +265,11 @@ def create_exchange_formset(context_agent, assoc_type_identifier, prefix, data=N
 #todo: hardcoded recipe and exchange types
 def get_next_stage(exchange_type=None):
     if not exchange_type:
-        next_stage = ExchangeType.objects.get(name="Farm to Harvester")
+        next_stage = ExchangeType.objects.cached(name="Farm to Harvester")
     elif exchange_type.name == "Farm to Harvester":
-        next_stage = ExchangeType.objects.get(name="Harvester to Drying Site")
+        next_stage = ExchangeType.objects.cached(name="Harvester to Drying Site")
     elif exchange_type.name == "Harvester to Drying Site":
-        next_stage = ExchangeType.objects.get(name="Drying Site to Seller")
+        next_stage = ExchangeType.objects.cached(name="Drying Site to Seller")
     else:
         next_stage = None
     return next_stage
@@ -293,19 +304,19 @@ def purchase_resource(request, context_agent_id, commitment_id): #this is the fa
             notes  = data["notes"]
             lot_data = lot_form.cleaned_data
             identifier = lot_data["identifier"]
-            purch_use_case = UseCase.objects.get(identifier="supply_xfer")
-            purch_exchange_type = ExchangeType.objects.get(name="Farm to Harvester")
-            xfer_use_case = UseCase.objects.get(identifier="intrnl_xfer")
-            xfer_exchange_type = ExchangeType.objects.get(name="Harvester to Drying Site")
-            proc_use_case = UseCase.objects.get(identifier="rand")
+            purch_use_case = UseCase.objects.cached(identifier="supply_xfer")
+            purch_exchange_type = ExchangeType.objects.cached(name="Farm to Harvester")
+            xfer_use_case = UseCase.objects.cached(identifier="intrnl_xfer")
+            xfer_exchange_type = ExchangeType.objects.cached(name="Harvester to Drying Site")
+            proc_use_case = UseCase.objects.cached(identifier="rand")
             proc_pattern = None
             proc_patterns = [puc.pattern for puc in proc_use_case.patterns.all()]
             if proc_patterns:
                 proc_pattern = proc_patterns[0]
-            give_et = EventType.objects.get(name="Give")
-            receive_et = EventType.objects.get(name="Receive")
-            consume_et = EventType.objects.get(name="Resource Consumption")
-            produce_et = EventType.objects.get(name="Resource Production")
+            give_et = EventType.objects.cached(name="Give")
+            receive_et = EventType.objects.cached(name="Receive")
+            consume_et = EventType.objects.cached(name="Resource Consumption")
+            produce_et = EventType.objects.cached(name="Resource Production")
             pay_rt = EconomicResourceType.objects.filter(unit__unit_type="value")[0]
             formset = create_exchange_formset(prefix=prefix, data=request.POST, context_agent=context_agent, assoc_type_identifier="Harvester")
             quantity = 0
@@ -627,7 +638,7 @@ def transfer_resource(request, context_agent_id, resource_id): #this is drying s
         #import pdb; pdb.set_trace()
         resource = get_object_or_404(EconomicResource, id=resource_id)
         context_agent = EconomicAgent.objects.get(id=context_agent_id)
-        stage = ExchangeType.objects.get(name="Harvester to Drying Site")
+        stage = ExchangeType.objects.cached(name="Harvester to Drying Site")
         next_stage = get_next_stage(stage)
         prefix = resource.form_prefix()
         form = TransferFlowForm(prefix=prefix, data=request.POST)
@@ -643,10 +654,10 @@ def transfer_resource(request, context_agent_id, resource_id): #this is drying s
             unit_of_value = data["unit_of_value"]
             paid = data["paid"]
             notes = data["notes"]
-            xfer_use_case = UseCase.objects.get(identifier="intrnl_xfer")
+            xfer_use_case = UseCase.objects.cached(identifier="intrnl_xfer")
             exchange_type = next_stage
-            give_et = EventType.objects.get(name="Give")
-            receive_et = EventType.objects.get(name="Receive")
+            give_et = EventType.objects.cached(name="Give")
+            receive_et = EventType.objects.cached(name="Receive")
             pay_rt = EconomicResourceType.objects.filter(unit__unit_type="value")[0]
             #import pdb; pdb.set_trace()
                         
@@ -795,7 +806,7 @@ def combine_resources(request, context_agent_id, resource_type_id):
         #import pdb; pdb.set_trace()
         resource_type = get_object_or_404(EconomicResourceType, id=resource_type_id)
         context_agent = EconomicAgent.objects.get(id=context_agent_id)
-        stage = ExchangeType.objects.get(name="Drying Site to Seller") #actually the stage here should be the process stage, and the rest should handle that
+        stage = ExchangeType.objects.cached(name="Drying Site to Seller") #actually the stage here should be the process stage, and the rest should handle that
         prefix = resource_type.form_prefix()
         form = CombineResourcesForm(prefix=prefix, data=request.POST)
         if form.is_valid():
@@ -804,13 +815,13 @@ def combine_resources(request, context_agent_id, resource_type_id):
             resources = data["resources"]
             identifier = data["identifier"]
             notes = data["notes"]
-            proc_use_case = UseCase.objects.get(identifier="rand")
+            proc_use_case = UseCase.objects.cached(identifier="rand")
             proc_pattern = None
             proc_patterns = [puc.pattern for puc in proc_use_case.patterns.all()]
             if proc_patterns:
                 proc_pattern = proc_patterns[0]
-            consume_et = EventType.objects.get(name="Resource Consumption")
-            produce_et = EventType.objects.get(name="Resource Production")
+            consume_et = EventType.objects.cached(name="Resource Consumption")
+            produce_et = EventType.objects.cached(name="Resource Production")
             if resources:
                 process = Process(
                     name="Combined: new lot",
@@ -70,13 +70,13 @@ def log_equipment_use(request, scenario, equip_resource_id, context_agent_id, pa
             quantity = data["quantity"]
             technician = data["technician"]
             technician_quantity = data["technician_hours"]
-            et_ship = EventType.objects.get(name="Shipment")
-            et_use = EventType.objects.get(name="Resource use")
-            et_consume = EventType.objects.get(name="Resource Consumption")
-            et_work = EventType.objects.get(name="Time Contribution")
-            et_create = EventType.objects.get(name="Resource Production")
-            et_fee = EventType.objects.get(name="Fee")
-            et_transfer = EventType.objects.get(name="Transfer")
+            et_ship = EventType.objects.cached(name="Shipment")
+            et_use = EventType.objects.cached(name="Resource use")
+            et_consume = EventType.objects.cached(name="Resource Consumption")
+            et_work = EventType.objects.cached(name="Time Contribution")
+            et_create = EventType.objects.cached(name="Resource Production")
+            et_fee = EventType.objects.cached(name="Fee")
+            et_transfer = EventType.objects.cached(name="Transfer")
             total_price = 0
             next_process = None
             if scenario == '2':
@@ -197,7 +197,7 @@ def log_equipment_use(request, scenario, equip_resource_id, context_agent_id, pa
             sale = Exchange(
                 name="Use of " + equipment.identifier,
                 process_pattern=sale_pattern,
-                use_case=UseCase.objects.get(identifier="sale"),
+                use_case=UseCase.objects.cached(identifier="sale"),
                 start_date=input_date,
                 customer=cust,
                 context_agent=context_agent,
@@ -379,7 +379,7 @@ def pay_equipment_use(request, scenario, sale_id, process_id, payment_rt_id, equ
             data = pay_form.cleaned_data
             payment_method = data["payment_method"]
             
-            cr_et = EventType.objects.get(name="Cash Receipt")
+            cr_et = EventType.objects.cached(name="Cash Receipt")
             money_resource = sale.context_agent.virtual_accounts()[0]
             cr_event = EconomicEvent(
                 event_type = cr_et,
@@ -403,7 +403,7 @@ def pay_equipment_use(request, scenario, sale_id, process_id, payment_rt_id, equ
             money_resource.save()
             paid = True
 
-            use_case = UseCase.objects.get(identifier="distribution")
+            use_case = UseCase.objects.cached(identifier="distribution")
             dist_pattern = ProcessPattern.objects.usecase_patterns(use_case)[0]
             ve_exchange = Exchange(name="Distribution for use of " + equipment.identifier,
                 process_pattern=dist_pattern,
@@ -477,7 +477,7 @@ def log_additional_inputs(request, cite_rt_id, process_id):
         input_date = datetime.date.today()
         if cite:
             if cite_form.is_valid():
-                cite_et = EventType.objects.get(name="Citation")
+                cite_et = EventType.objects.cached(name="Citation")
                 citation = cite_form.save(commit=False)
                 citation.event_type = cite_et
                 citation.resource_type = citation.resource.resource_type
@@ -491,7 +491,7 @@ def log_additional_inputs(request, cite_rt_id, process_id):
                 citation.save()
         elif work:
             if work_form.is_valid():
-                work_et = EventType.objects.get(name="Time Contribution")
+                work_et = EventType.objects.cached(name="Time Contribution")
                 work_event = work_form.save(commit=False)
                 work_event.event_type = work_et
                 work_event.event_date = input_date
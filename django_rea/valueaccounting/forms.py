@@ -8,6 +8,7 @@ from django.utils.translation import ugettext_lazy as _
 import json as simplejson
 
 from django_rea.valueaccounting.models import *
+from django_rea.valueaccounting.models._equations import compile_equation
 
 from django_rea.valueaccounting.widgets import DurationWidget, DecimalDurationWidget
 
@@ -53,6 +54,53 @@ class ValueEquationModelChoiceField(forms.ModelChoiceField):
         else:
             label = ": ".join([obj.name , "Test Only"])
         return label
+
+
+class FormChoices(object):
+    """Choices for the forms on one page, computed once and shared by all of them.
+
+    Make one per request and pass it as the choices argument
+    of the forms that take one; forms built without it query for themselves.
+    """
+
+    def __init__(self):
+        self.cache = {}
+
+    def get(self, key, make):
+        if key not in self.cache:
+            self.cache[key] = make()
+        return self.cache[key]
+
+    def fill(self, field, key=None, objects=None):
+        """Sets a ModelChoiceField's choices from cached objects.
+
+        objects, a callable returning the objects, is only called for a new key.
+        Without them, the field's own queryset is used, keyed by its sql.
+        """
+        if objects is None:
+            queryset = field.queryset
+            key = ("queryset", queryset.model, str(queryset.query))
+            objs = self.get(key, lambda: list(queryset))
+        else:
+            objs = self.get(key, lambda: list(objects()))
+            # the queryset is still what validates bound forms
+            field.queryset = field.queryset.model._default_manager.filter(pk__in=[obj.pk for obj in objs])
+        choices = self.get((key, type(field), field.empty_label),
+            lambda: [(field.prepare_value(obj), field.label_from_instance(obj)) for obj in objs])
+        if field.empty_label is not None:
+            choices = [("", field.empty_label)] + choices
+        field.choices = choices
+
+    def work_resource_types(self, pattern):
+        return ("resource_types", pattern.id, "work"), pattern.work_resource_types
+
+    def members(self, context_agent):
+        return ("members", context_agent.id), context_agent.all_members
+
+    def has_associates(self, context_agent, assoc_type_identifier):
+        return (("has_associates", context_agent.id, assoc_type_identifier),
+            lambda: context_agent.all_has_associates_by_type(assoc_type_identifier=assoc_type_identifier))
+
         
 from ocp.work.models import REQUEST_STATE_CHOICES
 
@@ -735,15 +783,25 @@ class UnplannedWorkEventForm(forms.ModelForm):
         model = EconomicEvent
         fields = ('event_date', 'resource_type', 'from_agent', 'quantity', 'unit_of_quantity', 'is_contribution', 'description')
 
-    def __init__(self, pattern=None, context_agent=None, *args, **kwargs):
+    def __init__(self, pattern=None, context_agent=None, choices=None, *args, **kwargs):
         #import pdb; pdb.set_trace()
         super(UnplannedWorkEventForm, self).__init__(*args, **kwargs)
         if pattern:
             self.pattern = pattern
-            self.fields["resource_type"].choices = [(rt.id, rt) for rt in pattern.work_resource_types()]
+            if choices:
+                key, objects = choices.work_resource_types(pattern)
+                self.fields["resource_type"].choices = choices.get(
+                    ("choices",) + key, lambda: [(rt.id, rt) for rt in objects()])
+            else:
+                self.fields["resource_type"].choices = [(rt.id, rt) for rt in pattern.work_resource_types()]
         if context_agent:
             self.context_agent = context_agent
-            self.fields["from_agent"].queryset = context_agent.all_members()
+            if choices:
+                choices.fill(self.fields["from_agent"], *choices.members(context_agent))
+            else:
+                self.fields["from_agent"].queryset = context_agent.all_members()
+        if choices:
+            choices.fill(self.fields["unit_of_quantity"])
             
 
 class UninventoriedProductionEventForm(forms.ModelForm):
@@ -1434,12 +1492,17 @@ class WorkEventAgentForm(forms.ModelForm):
         model = EconomicEvent
         fields = ('event_date', 'resource_type','quantity', 'description', 'from_agent', 'is_contribution')
 
-    def __init__(self, context_agent=None, *args, **kwargs):
+    def __init__(self, context_agent=None, choices=None, *args, **kwargs):
         super(WorkEventAgentForm, self).__init__(*args, **kwargs)
         #import pdb; pdb.set_trace()
         if context_agent:
             self.context_agent = context_agent
-            self.fields["from_agent"].queryset = context_agent.all_members()
+            if choices:
+                choices.fill(self.fields["from_agent"], *choices.members(context_agent))
+            else:
+                self.fields["from_agent"].queryset = context_agent.all_members()
+        if choices:
+            choices.fill(self.fields["resource_type"])
 
  
 class WorkCommitmentForm(forms.ModelForm):
@@ -1460,12 +1523,17 @@ class WorkCommitmentForm(forms.ModelForm):
         model = Commitment
         fields = ('due_date', 'resource_type','quantity', 'unit_of_quantity', 'description')
 
-    def __init__(self, pattern=None, *args, **kwargs):
+    def __init__(self, pattern=None, choices=None, *args, **kwargs):
         #import pdb; pdb.set_trace()
         super(WorkCommitmentForm, self).__init__(*args, **kwargs)
         if pattern:
             self.pattern = pattern
-            self.fields["resource_type"].queryset = pattern.work_resource_types()
+            if choices:
+                choices.fill(self.fields["resource_type"], *choices.work_resource_types(pattern))
+            else:
+                self.fields["resource_type"].queryset = pattern.work_resource_types()
+        if choices:
+            choices.fill(self.fields["unit_of_quantity"])
 
             
 class InviteCollaboratorForm(forms.ModelForm):
@@ -1607,10 +1675,12 @@ class InputEventAgentForm(forms.ModelForm):
         model = EconomicEvent
         fields = ('event_date', 'from_agent', 'quantity', 'is_contribution', 'description', )
 
-    def __init__(self, qty_help=None, *args, **kwargs):
+    def __init__(self, qty_help=None, choices=None, *args, **kwargs):
         super(InputEventAgentForm, self).__init__(*args, **kwargs)
         if qty_help:
             self.fields["quantity"].help_text = qty_help
+        if choices:
+            choices.fill(self.fields["from_agent"])
             
 #may be obsolete
 class WorkContributionChangeForm(forms.ModelForm):
@@ -3485,7 +3555,7 @@ class SaleForm(forms.ModelForm):
     def __init__(self, context_agent=None, *args, **kwargs):
         #import pdb; pdb.set_trace()
         super(SaleForm, self).__init__(*args, **kwargs)
-        use_case = UseCase.objects.get(identifier="sale")
+        use_case = UseCase.objects.cached(identifier="sale")
         self.fields["process_pattern"].queryset = ProcessPattern.objects.usecase_patterns(use_case) 
         if context_agent:
             self.fields["customer"].queryset = context_agent.all_customers()
@@ -3637,7 +3707,7 @@ class ResourceFlowForm(forms.ModelForm):
         #import pdb; pdb.set_trace()
         if pattern:
             self.pattern = pattern
-            et = EventType.objects.get(name="Change")
+            et = EventType.objects.cached(name="Change")
             self.fields["resource_type"].queryset = pattern.get_resource_types(event_type=et)
             
 class AllContributionsFilterForm(forms.Form):
@@ -3826,7 +3896,7 @@ class DeliveryFilterSetForm(forms.Form):
         
     def __init__(self, project, event_type, pattern, *args, **kwargs):
         super(DeliveryFilterSetForm, self).__init__(*args, **kwargs)
-        ship = EventType.objects.get(label="ships")
+        ship = EventType.objects.cached(label="ships")
         self.fields["shipment_events"].queryset = EconomicEvent.objects.filter(context_agent=project, event_type=ship)
         self.fields["process_types"].queryset = project.process_types_queryset()
         if pattern:
@@ -3893,6 +3963,15 @@ class ValueEquationBucketRuleForm(forms.ModelForm):
         model = ValueEquationBucketRule
         fields = ('event_type', 'claim_rule_type', 'claim_creation_equation') 
 
+    def clean_claim_creation_equation(self):
+        equation = self.cleaned_data["claim_creation_equation"]
+        if equation:
+            try:
+                compile_equation(equation)
+            except ValueError:
+                raise forms.ValidationError(sys.exc_info()[1])
+        return equation
+
         
 class ValueEquationSelectionForm(forms.Form):
     value_equation = ValueEquationModelChoiceField(
@@ -3923,6 +4002,8 @@ class ValueEquationSandboxForm(forms.Form):
             attrs={'class': 've-selector'}))
     amount_to_distribute = forms.DecimalField(required=False,
         widget=forms.TextInput(attrs={'value': '0.00', 'class': 'money quantity input-small'}))
+    profile = forms.BooleanField(required=False,
+        label=_("Profile the calculation (nothing is saved)"))
 
         
 class BucketRuleFilterSetForm(forms.Form):
@@ -0,0 +1,135 @@
+import csv
+import datetime
+import json
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from django_rea.valueaccounting.models import *
+
+
+FIELDS = (
+    "event_type",
+    "event_date",
+    "from_agent",
+    "to_agent",
+    "context_agent",
+    "resource_type",
+    "resource",
+    "quantity",
+    "unit_of_quantity",
+    "value",
+    "unit_of_value",
+    "process",
+    "exchange",
+    "transfer",
+    "description",
+    "url",
+    "event_reference",
+    "is_contribution",
+    "is_to_distribute",
+)
+
+
+class Command(BaseCommand):
+    help = """Import historical events from a CSV or JSONL file,
+    bypassing the per-row side effects of EconomicEvent.save().
+
+    Each row or line has the keys: %s.
+    Event types and resource types are looked up by name,
+    agents by nick, units by abbrev, everything else by id.
+    """ % ", ".join(FIELDS)
+
+    def add_arguments(self, parser):
+        parser.add_argument("path")
+        parser.add_argument("--format", choices=("csv", "jsonl"),
+            help="defaults to the file extension")
+        parser.add_argument("--batch-size", type=int, default=500)
+        parser.add_argument("--created-by",
+            help="username to record as creator of the events")
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        format = options["format"] or path.rsplit(".", 1)[-1].lower()
+        if format not in ("csv", "jsonl"):
+            raise CommandError("Cannot tell the format of %s, use --format" % path)
+        created_by = None
+        if options["created_by"]:
+            try:
+                created_by = User.objects.get(username=options["created_by"])
+            except User.DoesNotExist:
+                raise CommandError("No user named %s" % options["created_by"])
+
+        resolver = RowResolver()
+        events = []
+        with open(path, "rb") as f:
+            if format == "csv":
+                rows = csv.DictReader(f)
+            else:
+                rows = (json.loads(line) for line in f if line.strip())
+            for i, row in enumerate(rows, 1):
+                try:
+                    event = resolver.event(row)
+                except (KeyError, ValueError, ArithmeticError) as e:
+                    raise CommandError("Row %d: %s" % (i, e))
+                event.created_by = created_by
+                events.append(event)
+
+        count = EconomicEvent.objects.bulk_ingest(events, batch_size=options["batch_size"])
+        self.stdout.write("%d events imported." % count)
+
+
+class RowResolver(object):
+    """Turns import rows into unsaved EconomicEvents,
+    caching every lookup so each name is queried only once.
+    """
+
+    def __init__(self):
+        self.cache = {}
+
+    def lookup(self, model, field, value):
+        if not value:
+            return None
+        key = (model, field, value)
+        if key not in self.cache:
+            try:
+                self.cache[key] = model.objects.get(**{field: value})
+            except model.DoesNotExist:
+                raise ValueError("no %s with %s %s" % (model.__name__, field, value))
+            except model.MultipleObjectsReturned:
+                raise ValueError("more than one %s with %s %s" % (model.__name__, field, value))
+        return self.cache[key]
+
+    def event(self, row):
+        quantity = Decimal(str(row.get("quantity") or "0"))
+        event_type = self.lookup(EventType, "name", row["event_type"])
+        resource_type = self.lookup(EconomicResourceType, "name", row["resource_type"])
+        event = EconomicEvent(
+            event_type=event_type,
+            event_date=datetime.datetime.strptime(row["event_date"], "%Y-%m-%d").date(),
+            from_agent=self.lookup(EconomicAgent, "nick", row.get("from_agent")),
+            to_agent=self.lookup(EconomicAgent, "nick", row.get("to_agent")),
+            context_agent=self.lookup(EconomicAgent, "nick", row.get("context_agent")),
+            resource_type=resource_type,
+            resource=self.lookup(EconomicResource, "id", row.get("resource")),
+            quantity=quantity,
+            unit_of_quantity=self.lookup(Unit, "abbrev", row.get("unit_of_quantity")) or resource_type.unit,
+            value=Decimal(str(row.get("value") or "0")),
+            unit_of_value=self.lookup(Unit, "abbrev", row.get("unit_of_value")),
+            process=self.lookup(Process, "id", row.get("process")),
+            exchange=self.lookup(Exchange, "id", row.get("exchange")),
+            transfer=self.lookup(Transfer, "id", row.get("transfer")),
+            description=row.get("description") or "",
+            url=row.get("url") or "",
+            event_reference=row.get("event_reference") or None,
+            is_contribution=as_bool(row.get("is_contribution")),
+            is_to_distribute=as_bool(row.get("is_to_distribute")),
+        )
+        return event
+
+
+def as_bool(value):
+    if isinstance(value, bool):
+        return value
+    return str(value or "").strip().lower() in ("1", "true", "yes", "y")
@@ -0,0 +1,61 @@
+import json
+from decimal import Decimal, InvalidOperation
+
+from django.core.management.base import BaseCommand, CommandError
+
+from django_rea.valueaccounting.models import *
+
+
+class Command(BaseCommand):
+    help = """Dry run a value equation distribution and report, for each bucket
+    and bucket rule, the wall time, query count and row count of every stage.
+    Nothing is saved.
+
+    The filters file is a JSON object from bucket id to that bucket's filter,
+    as the value equation sandbox serializes it, for example
+    {"3": {"method": "Order", "orders": [12, 13]}}.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument("value_equation_id", type=int)
+        parser.add_argument("--amount", required=True,
+            help="amount to distribute")
+        parser.add_argument("--filters",
+            help="path to a JSON file of bucket filters")
+        parser.add_argument("--slowest", type=int, default=0,
+            help="also list this many of the slowest stages")
+
+    def handle(self, *args, **options):
+        try:
+            ve = ValueEquation.objects.get(id=options["value_equation_id"])
+        except ValueEquation.DoesNotExist:
+            raise CommandError("No value equation %s" % options["value_equation_id"])
+        try:
+            amount = Decimal(options["amount"])
+        except InvalidOperation:
+            raise CommandError("Amount %s is not a number" % options["amount"])
+        serialized_filters = {}
+        if options["filters"]:
+            with open(options["filters"]) as f:
+                try:
+                    filters = json.load(f)
+                except ValueError as e:
+                    raise CommandError("Cannot read %s: %s" % (options["filters"], e))
+            for bucket_id, filter in filters.items():
+                if not isinstance(filter, basestring):
+                    filter = json.dumps(filter)
+                serialized_filters[int(bucket_id)] = filter
+
+        distribution_events, contribution_events, profile = ve.profile_value_equation(
+            amount_to_distribute=amount,
+            serialized_filters=serialized_filters)
+        for line in profile.report():
+            self.stdout.write(line)
+        if options["slowest"]:
+            self.stdout.write("")
+            self.stdout.write("Slowest stages:")
+            for stage in profile.slowest(options["slowest"]):
+                self.stdout.write("%10.3f  %s" % (stage.seconds, stage.label()))
+        self.stdout.write("")
+        self.stdout.write("%d distribution events, %d contribution events." % (
+            len(distribution_events), len(contribution_events)))
@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import datetime
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('valueaccounting', '0004_auto_20160817_2119'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ValuePerUnitCache',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('version', models.IntegerField(verbose_name='version')),
+                ('value_per_unit', models.DecimalField(null=True, verbose_name='value per unit', max_digits=8, decimal_places=2, blank=True)),
+                ('computed_date', models.DateField(default=datetime.date.today, verbose_name='computed date')),
+                ('resource', models.ForeignKey(related_name='value_per_unit_cache', verbose_name='resource', to='valueaccounting.EconomicResource')),
+                ('value_equation', models.ForeignKey(related_name='value_per_unit_cache', verbose_name='value equation', blank=True, to='valueaccounting.ValueEquation', null=True)),
+            ],
+            options={
+                'ordering': ('resource', 'value_equation'),
+            },
+        ),
+        migrations.CreateModel(
+            name='ValueRollupVersion',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('version', models.IntegerField(default=0, verbose_name='version')),
+            ],
+        ),
+    ]
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from decimal import Decimal
+
+
+def summarize_months(apps, schema_editor):
+    EconomicEvent = apps.get_model("valueaccounting", "EconomicEvent")
+    MonthlyEventSummary = apps.get_model("valueaccounting", "MonthlyEventSummary")
+    totals = {}
+    events = EconomicEvent.objects.values_list(
+        "from_agent", "context_agent", "event_type", "event_date", "quantity")
+    for agent_id, context_agent_id, event_type_id, event_date, quantity in events:
+        key = (agent_id, context_agent_id, event_type_id, event_date.replace(day=1))
+        totals[key] = totals.get(key, Decimal("0")) + quantity
+    MonthlyEventSummary.objects.bulk_create([
+        MonthlyEventSummary(
+            agent_id=agent_id,
+            context_agent_id=context_agent_id,
+            event_type_id=event_type_id,
+            month=month,
+            quantity=quantity)
+        for (agent_id, context_agent_id, event_type_id, month), quantity in totals.items()
+        if quantity])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('valueaccounting', '0006_recipe_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MonthlyEventSummary',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('month', models.DateField(verbose_name='month')),
+                ('quantity', models.DecimalField(default=Decimal('0.0'), verbose_name='quantity', max_digits=8, decimal_places=2)),
+                ('agent', models.ForeignKey(related_name='monthly_events', verbose_name='agent', blank=True, to='valueaccounting.EconomicAgent', null=True)),
+                ('context_agent', models.ForeignKey(related_name='context_monthly_events', verbose_name='context agent', blank=True, to='valueaccounting.EconomicAgent', null=True)),
+                ('event_type', models.ForeignKey(related_name='monthly_events', verbose_name='event type', to='valueaccounting.EventType')),
+            ],
+            options={
+                'ordering': ('month', 'agent', 'context_agent'),
+            },
+        ),
+        migrations.RunPython(summarize_months, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('valueaccounting', '0007_monthly_event_summary'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AgentHierarchyVersion',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('version', models.IntegerField(default=0, verbose_name='version')),
+            ],
+        ),
+    ]
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from decimal import Decimal
+
+
+def summarize_account_days(apps, schema_editor):
+    EconomicEvent = apps.get_model("valueaccounting", "EconomicEvent")
+    VirtualAccountBalance = apps.get_model("valueaccounting", "VirtualAccountBalance")
+    totals = {}
+    events = EconomicEvent.objects.filter(
+        resource__resource_type__behavior="account").values_list(
+        "resource", "event_date", "event_type__resource_effect", "quantity")
+    for resource_id, event_date, resource_effect, quantity in events:
+        day = totals.setdefault((resource_id, event_date), [Decimal("0"), Decimal("0")])
+        if "+" in resource_effect and "-" not in resource_effect:
+            day[0] += quantity
+        else:
+            day[1] += quantity
+    days = []
+    balances = {}
+    for (resource_id, date), (quantity_in, quantity_out) in sorted(totals.items()):
+        if not quantity_in and not quantity_out:
+            continue
+        balance = balances.get(resource_id, Decimal("0")) + quantity_in - quantity_out
+        balances[resource_id] = balance
+        days.append(VirtualAccountBalance(
+            resource_id=resource_id,
+            date=date,
+            quantity_in=quantity_in,
+            quantity_out=quantity_out,
+            balance=balance))
+    VirtualAccountBalance.objects.bulk_create(days)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('valueaccounting', '0008_agent_hierarchy_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VirtualAccountBalance',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('date', models.DateField(verbose_name='date')),
+                ('quantity_in', models.DecimalField(default=Decimal('0.0'), verbose_name='quantity in', max_digits=8, decimal_places=2)),
+                ('quantity_out', models.DecimalField(default=Decimal('0.0'), verbose_name='quantity out', max_digits=8, decimal_places=2)),
+                ('balance', models.DecimalField(default=Decimal('0.0'), verbose_name='balance', max_digits=8, decimal_places=2)),
+                ('resource', models.ForeignKey(related_name='daily_balances', verbose_name='resource', to='valueaccounting.EconomicResource')),
+            ],
+            options={
+                'ordering': ('resource', 'date'),
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='virtualaccountbalance',
+            unique_together=set([('resource', 'date')]),
+        ),
+        migrations.RunPython(summarize_account_days, migrations.RunPython.noop),
+    ]
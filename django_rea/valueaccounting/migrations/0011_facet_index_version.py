@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('valueaccounting', '0010_event_tx_sending_state'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FacetIndexVersion',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('version', models.IntegerField(default=0, verbose_name='version')),
+            ],
+        ),
+    ]
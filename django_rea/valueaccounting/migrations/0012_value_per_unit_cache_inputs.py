@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+def clear_value_per_unit_cache(apps, schema_editor):
+    # entries have no recorded inputs, so they could never be invalidated
+    ValuePerUnitCache = apps.get_model("valueaccounting", "ValuePerUnitCache")
+    ValuePerUnitCache.objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('valueaccounting', '0011_facet_index_version'),
+    ]
+
+    operations = [
+        migrations.RunPython(clear_value_per_unit_cache, migrations.RunPython.noop),
+        migrations.CreateModel(
+            name='ValuePerUnitCacheInput',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('kind', models.CharField(max_length=16, verbose_name='kind', choices=[(b'resource', 'resource'), (b'resource_type', 'resource type'), (b'process', 'process'), (b'exchange', 'exchange')])),
+                ('object_id', models.IntegerField(verbose_name='object id')),
+            ],
+        ),
+        migrations.DeleteModel(
+            name='ValueRollupVersion',
+        ),
+        migrations.AlterUniqueTogether(
+            name='valueperunitcache',
+            unique_together=set([('resource', 'value_equation')]),
+        ),
+        migrations.AddField(
+            model_name='valueperunitcacheinput',
+            name='cache',
+            field=models.ForeignKey(related_name='inputs', verbose_name='cache', to='valueaccounting.ValuePerUnitCache'),
+        ),
+        migrations.RemoveField(
+            model_name='valueperunitcache',
+            name='version',
+        ),
+        migrations.AlterIndexTogether(
+            name='valueperunitcacheinput',
+            index_together=set([('kind', 'object_id')]),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('valueaccounting', '0012_value_per_unit_cache_inputs'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CacheVersion',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('name', models.CharField(unique=True, max_length=128, verbose_name='name')),
+                ('version', models.IntegerField(default=0, verbose_name='version')),
+            ],
+        ),
+        migrations.DeleteModel(
+            name='AgentHierarchyVersion',
+        ),
+        migrations.DeleteModel(
+            name='FacetIndexVersion',
+        ),
+        migrations.DeleteModel(
+            name='RecipeVersion',
+        ),
+    ]
@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from decimal import Decimal
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('valueaccounting', '0013_cache_version'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='virtualaccountbalance',
+            name='balance',
+            field=models.DecimalField(default=Decimal('0.0'), verbose_name='balance', max_digits=20, decimal_places=2),
+        ),
+        migrations.AlterField(
+            model_name='virtualaccountbalance',
+            name='quantity_in',
+            field=models.DecimalField(default=Decimal('0.0'), verbose_name='quantity in', max_digits=20, decimal_places=2),
+        ),
+        migrations.AlterField(
+            model_name='virtualaccountbalance',
+            name='quantity_out',
+            field=models.DecimalField(default=Decimal('0.0'), verbose_name='quantity out', max_digits=20, decimal_places=2),
+        ),
+    ]
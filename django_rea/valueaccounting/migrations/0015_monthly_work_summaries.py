@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from decimal import Decimal
+
+
+def drop_non_work_summaries(apps, schema_editor):
+    # only work events are summarized monthly from now on
+    MonthlyEventSummary = apps.get_model("valueaccounting", "MonthlyEventSummary")
+    MonthlyEventSummary.objects.exclude(event_type__relationship="work").delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('valueaccounting', '0014_widen_virtual_account_balance'),
+    ]
+
+    operations = [
+        migrations.RunPython(drop_non_work_summaries, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='monthlyeventsummary',
+            name='quantity',
+            field=models.DecimalField(default=Decimal('0.0'), verbose_name='quantity', max_digits=20, decimal_places=2),
+        ),
+    ]
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+def next_month(month):
+    if month.month == 12:
+        return month.replace(year=month.year + 1, month=1)
+    return month.replace(month=month.month + 1)
+
+
+def merge_duplicate_summaries(apps, schema_editor):
+    # concurrent saves could each create a row for the same key, and deltas
+    # then went to all of them; rebuild those keys from their events
+    EconomicEvent = apps.get_model("valueaccounting", "EconomicEvent")
+    CachedEventSummary = apps.get_model("valueaccounting", "CachedEventSummary")
+    MonthlyEventSummary = apps.get_model("valueaccounting", "MonthlyEventSummary")
+    fields = ("agent", "context_agent", "resource_type", "event_type")
+    dups = CachedEventSummary.objects.values(*fields).annotate(
+        rows=Count("id")).filter(rows__gt=1).order_by()
+    for dup in dups:
+        key = dict((field, dup[field]) for field in fields)
+        summaries = CachedEventSummary.objects.filter(**key).order_by("id")
+        keep = summaries[0]
+        summaries.exclude(pk=keep.pk).delete()
+        keep.quantity = EconomicEvent.objects.filter(
+            from_agent=key["agent"],
+            context_agent=key["context_agent"],
+            resource_type=key["resource_type"],
+            event_type=key["event_type"],
+            is_contribution=True).aggregate(total=Sum("quantity"))["total"] or 0
+        keep.save()
+    fields = ("agent", "context_agent", "event_type", "month")
+    dups = MonthlyEventSummary.objects.values(*fields).annotate(
+        rows=Count("id")).filter(rows__gt=1).order_by()
+    for dup in dups:
+        key = dict((field, dup[field]) for field in fields)
+        summaries = MonthlyEventSummary.objects.filter(**key).order_by("id")
+        keep = summaries[0]
+        summaries.exclude(pk=keep.pk).delete()
+        keep.quantity = EconomicEvent.objects.filter(
+            from_agent=key["agent"],
+            context_agent=key["context_agent"],
+            event_type=key["event_type"],
+            event_date__gte=key["month"],
+            event_date__lt=next_month(key["month"])).aggregate(total=Sum("quantity"))["total"] or 0
+        keep.save()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('valueaccounting', '0016_named_lock'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_summaries, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='cachedeventsummary',
+            unique_together=set([('agent', 'context_agent', 'resource_type', 'event_type')]),
+        ),
+        migrations.AlterUniqueTogether(
+            name='monthlyeventsummary',
+            unique_together=set([('agent', 'context_agent', 'event_type', 'month')]),
+        ),
+    ]
@@ -54,6 +54,8 @@ from django_rea.valueaccounting.models.event import (
     EconomicEvent,
     CachedEventSummary,
     EventSummary,
+    MonthlyEventSummary,
+    VirtualAccountBalance,
     AccountingReference,
 )
 
@@ -84,6 +86,12 @@ from django_rea.valueaccounting.models.distribution import (
     ClaimEvent,
 )
 
+#cached results of value rollups, also for contributory accounting
+from django_rea.valueaccounting.models.rollup import (
+    ValuePerUnitCache,
+    ValuePerUnitCacheInput,
+)
+
 #both process and exchange facet-value config
 from django_rea.valueaccounting.models.facetconfig import (
     Facet,
@@ -105,4 +113,6 @@ from django_rea.valueaccounting.models.location import (
 from django_rea.valueaccounting.models.misc import (
     HomePageLayout,
     Help,
+    CacheVersion,
+    NamedLock,
 )
\ No newline at end of file
@@ -0,0 +1,172 @@
+"""Compiler for value equation bucket rule claim creation equations.
+
+An equation like ``quantity * valuePerUnit * 1.5`` is parsed once,
+checked to contain only arithmetic on the known variables,
+and compiled to a code object with every number as a Decimal.
+Compiled equations are shared by equation text, so every
+ValueEquationBucketRule instance with the same equation reuses them.
+"""
+
+import ast
+import tokenize
+from decimal import Decimal, InvalidOperation
+
+try:
+    basestring_types = (basestring,)
+except NameError:
+    basestring_types = (str,)
+
+EQUATION_VARIABLES = (
+    'quantity',
+    'valuePerUnit',
+    'pricePerUnit',
+    'value',
+    'valuePerUnitOfUse',
+)
+
+_OPERATORS = (
+    ast.Add, ast.Sub, ast.Mult, ast.Div, ast.Mod, ast.Pow,
+    ast.UAdd, ast.USub,
+)
+
+_CACHE_LIMIT = 512
+_compiled = {}
+
+
+class CompiledEquation(object):
+    def __init__(self, source, code, names, constants):
+        self.source = source
+        self.code = code
+        self.names = names
+        self.globals = dict(constants)
+        self.globals['__builtins__'] = None
+
+    def evaluate(self, variables):
+        """Evaluates the equation with a dict of variable values."""
+        return eval(self.code, self.globals, variables)
+
+    def evaluate_batch(self, rows):
+        """Evaluates the equation once per row.
+
+        Each row is a tuple of variable values in EQUATION_VARIABLES order:
+        (quantity, valuePerUnit, pricePerUnit, value[, valuePerUnitOfUse]).
+        Returns the list of results.
+        """
+        code = self.code
+        env = self.globals
+        names = EQUATION_VARIABLES
+        return [eval(code, env, dict(zip(names, row))) for row in rows]
+
+
+def normalize_equation_source(source):
+    # underscores were always stripped from equations, see ValueEquationBucketRule
+    return (source or "").replace("_", "").strip()
+
+
+def compile_equation(source):
+    """Returns the CompiledEquation for ``source``, compiling it if needed.
+
+    Raises ValueError if the equation is not valid arithmetic
+    on EQUATION_VARIABLES.
+    """
+    try:
+        return _compiled[source]
+    except KeyError:
+        pass
+    normalized = normalize_equation_source(source)
+    if not normalized:
+        raise ValueError("The equation is empty.")
+    try:
+        tree = ast.parse(normalized, mode='eval')
+    except SyntaxError:
+        raise ValueError("The equation is not a valid arithmetic expression: %s" % source)
+    transformer = _EquationTransformer(_number_literals(normalized))
+    tree = ast.fix_missing_locations(transformer.visit(tree))
+    code = compile(tree, '<equation>', 'eval')
+    compiled = CompiledEquation(source, code, frozenset(transformer.names), transformer.constants)
+    if len(_compiled) >= _CACHE_LIMIT:
+        _compiled.clear()
+    _compiled[source] = compiled
+    return compiled
+
+
+def _number_literals(source):
+    """The source text of each number literal, by (line, column),
+
+    so they become Decimals as written, not rounded through float.
+    """
+    lines = iter(source.splitlines(True))
+    literals = {}
+    try:
+        for token_type, text, start, _, _ in tokenize.generate_tokens(lambda: next(lines, '')):
+            if token_type == tokenize.NUMBER:
+                literals[start] = text
+    except tokenize.TokenError:
+        pass
+    return literals
+
+
+def _number(node, literals):
+    if isinstance(node.n, float):
+        text = literals.get((node.lineno, node.col_offset))
+        if text is not None:
+            try:
+                return Decimal(text)
+            except InvalidOperation:
+                pass
+        return Decimal(repr(node.n))
+    return Decimal(node.n)
+
+
+class _EquationTransformer(ast.NodeTransformer):
+    """Rejects anything but arithmetic on known variables,
+    and replaces number literals by Decimal constants.
+    ``Decimal('1.5')`` calls, as older normalized equations have them,
+    are folded into constants too.
+    """
+
+    def __init__(self, literals):
+        self.literals = literals
+        self.names = set()
+        self.constants = {}
+
+    def constant(self, value, node):
+        name = '_c%d' % len(self.constants)
+        self.constants[name] = value
+        return ast.copy_location(ast.Name(id=name, ctx=ast.Load()), node)
+
+    def generic_visit(self, node):
+        if isinstance(node, (ast.Expression, ast.BinOp, ast.UnaryOp, ast.Load) + _OPERATORS):
+            return super(_EquationTransformer, self).generic_visit(node)
+        raise ValueError("Equations may only use arithmetic, not %s." % node.__class__.__name__)
+
+    def visit_Name(self, node):
+        if node.id not in EQUATION_VARIABLES:
+            raise ValueError("Unknown variable in equation: %s" % node.id)
+        self.names.add(node.id)
+        return node
+
+    def visit_Num(self, node):
+        return self.constant(_number(node, self.literals), node)
+
+    def visit_Constant(self, node):
+        if isinstance(node.value, (int, float)) and not isinstance(node.value, bool):
+            node.n = node.value
+            return self.visit_Num(node)
+        return self.generic_visit(node)
+
+    def visit_Call(self, node):
+        func = node.func
+        if (isinstance(func, ast.Name) and func.id == 'Decimal' and len(node.args) == 1
+                and not node.keywords and not getattr(node, 'starargs', None)
+                and not getattr(node, 'kwargs', None)):
+            arg = node.args[0]
+            text = getattr(arg, 's', None)
+            if text is None and hasattr(ast, 'Constant') and isinstance(arg, ast.Constant):
+                text = arg.value
+            if isinstance(text, basestring_types):
+                try:
+                    return self.constant(Decimal(text), node)
+                except InvalidOperation:
+                    pass
+        return self.generic_visit(node)
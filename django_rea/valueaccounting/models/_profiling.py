@@ -0,0 +1,145 @@
+"""Timing and query counts for profiled value equation runs.
+
+ValueEquation.profile_value_equation passes a DistributionProfile
+down through run_value_equation, and each stage of each bucket
+records its wall time, ORM query count and row count in it.
+When no profile is passed, the stages cost nothing.
+"""
+
+import time
+from contextlib import contextmanager
+
+from django.db import connection, connections
+
+
+class _CountingCursor(object):
+    def __init__(self, cursor, counter):
+        self.cursor = cursor
+        self.counter = counter
+
+    def execute(self, *args, **kwargs):
+        self.counter.count += 1
+        return self.cursor.execute(*args, **kwargs)
+
+    def executemany(self, *args, **kwargs):
+        self.counter.count += 1
+        return self.cursor.executemany(*args, **kwargs)
+
+    def __getattr__(self, attr):
+        return getattr(self.cursor, attr)
+
+    def __iter__(self):
+        return iter(self.cursor)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return self.cursor.__exit__(*exc_info)
+
+
+class QueryCounter(object):
+    """Counts the queries run on a connection's cursors while it is active.
+
+    Unlike django.test.utils.CaptureQueriesContext it keeps no SQL, and
+    does not depend on the connection's queries_log, which keeps only
+    the last 9000 queries. Counters nest.
+    """
+
+    def __init__(self, connection):
+        # the thread's own connection, not the django.db.connection proxy
+        self.connection = connections[connection.alias]
+        self.count = 0
+
+    def __enter__(self):
+        self.patched = "cursor" in vars(self.connection)
+        self.cursor = self.connection.cursor
+
+        def cursor():
+            return _CountingCursor(self.cursor(), self)
+        self.connection.cursor = cursor
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.patched:
+            self.connection.cursor = self.cursor
+        else:
+            del self.connection.cursor
+        return False
+
+
+class ProfileStage(object):
+    def __init__(self, name, bucket=None, rule=None):
+        self.name = name
+        self.bucket = bucket
+        self.rule = rule
+        self.rows = None
+        self.queries = 0
+        self.seconds = 0.0
+
+    def label(self):
+        parts = []
+        if self.bucket is not None:
+            parts.append(self.bucket.name)
+        if self.rule is not None:
+            parts.append("rule %s (%s)" % (self.rule.id, self.rule.event_type.name))
+        parts.append(self.name)
+        return " / ".join(parts)
+
+
+class DistributionProfile(object):
+    def __init__(self):
+        self.stages = []
+        self.seconds = 0.0
+        self.queries = 0
+
+    @contextmanager
+    def stage(self, name, bucket=None, rule=None):
+        entry = ProfileStage(name, bucket, rule)
+        with QueryCounter(connection) as queries:
+            start = time.time()
+            try:
+                yield entry
+            finally:
+                entry.seconds = time.time() - start
+        entry.queries = queries.count
+        self.stages.append(entry)
+
+    @contextmanager
+    def run(self):
+        with QueryCounter(connection) as queries:
+            start = time.time()
+            try:
+                yield self
+            finally:
+                self.seconds = time.time() - start
+        self.queries = queries.count
+
+    def slowest(self, count=5):
+        return sorted(self.stages, key=lambda s: s.seconds, reverse=True)[:count]
+
+    def report(self):
+        """The profile as lines of text, one per stage, then the total."""
+        lines = ["%-60s %8s %8s %10s" % ("stage", "rows", "queries", "seconds")]
+        for stage in self.stages:
+            rows = "" if stage.rows is None else stage.rows
+            lines.append("%-60s %8s %8d %10.3f" % (stage.label()[:60], rows, stage.queries, stage.seconds))
+        lines.append("%-60s %8s %8d %10.3f" % ("total", "", self.queries, self.seconds))
+        return lines
+
+
+class _NullStage(object):
+    rows = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+def profile_stage(profile, name, bucket=None, rule=None):
+    """profile.stage(...), or a stage that records nothing if profile is None."""
+    if profile is None:
+        return _NullStage()
+    return profile.stage(name, bucket=bucket, rule=rule)
@@ -1,7 +1,13 @@
 import re
+import zlib
+from contextlib import contextmanager
 
+from django.db import connection, connections, models, transaction
+from django.db.models import Q, sql
 from django.template.defaultfilters import slugify
 
+from django_rea.valueaccounting.models.misc import NamedLock, VersionedCache
+
 def unique_slugify(instance, value, slug_field_name='slug', queryset=None,
                    slug_separator='-'):
     """
@@ -12,18 +18,14 @@ def unique_slugify(instance, value, slug_field_name='slug', queryset=None,
 
     ``queryset`` usually doesn't need to be explicitly provided - it'll default
     to using the ``.all()`` queryset from the model's default manager.
+
+    Taken slugs are fetched with one query for the slug and its suffixed
+    variants, however many of them there are. Use ``unique_slug`` around
+    the save to keep concurrent saves from picking the same one.
     """
     slug_field = instance._meta.get_field(slug_field_name)
-
-    slug = getattr(instance, slug_field.attname)
     slug_len = slug_field.max_length
-
-    # Sort out the initial slug. Chop its length down if we need to.
-    slug = slugify(value)
-    if slug_len:
-        slug = slug[:slug_len]
-    slug = _slug_strip(slug, slug_separator)
-    original_slug = slug
+    original_slug = _original_slug(value, slug_len, slug_separator)
 
     # Create a queryset, excluding the current instance.
     if not queryset:
@@ -33,17 +35,302 @@ def unique_slugify(instance, value, slug_field_name='slug', queryset=None,
 
     # Find a unique slug. If one matches, at '-2' to the end and try again
     # (then '-3', etc).
+    prefix = _slug_prefix(original_slug, slug_len, slug_separator)
+    if prefix == original_slug:
+        q = Q(**{slug_field_name: original_slug})
+        q |= Q(**{'%s__startswith' % slug_field_name: original_slug + '-'})
+    else:
+        q = Q(**{'%s__startswith' % slug_field_name: prefix})
+    taken = set(queryset.filter(q).values_list(slug_field_name, flat=True))
+    slug = _next_free_slug(original_slug, taken, slug_len, slug_separator)
+
+    setattr(instance, slug_field.attname, slug)
+
+
+def hold_transaction_lock(name, group='lock'):
+    """
+    Locks ``name`` until the outermost transaction ends, at its commit or
+    rollback. Call it inside transaction.atomic.
+
+    PostgreSQL takes an advisory lock on a hash of the name. MySQL locks
+    one of 256 NamedLock rows of ``group``, so unrelated names sharing one
+    just wait. SQLite serializes writers anyway.
+    """
+    key = zlib.crc32(name.encode('utf-8'))
+    if connection.vendor == 'postgresql':
+        cursor = connection.cursor()
+        cursor.execute('SELECT pg_advisory_xact_lock(%s)', [key])
+    elif connection.vendor == 'mysql':
+        NamedLock.objects.hold('%s-%02x' % (group, key & 0xff))
+
+
+@contextmanager
+def unique_slug(instance, value, slug_field_name='slug', slug_separator='-'):
+    """
+    Gives ``instance`` a unique slug of ``value`` for the block that saves it.
+
+    The block runs in a transaction. On PostgreSQL and MySQL it holds a
+    lock on the slug prefix until the outermost transaction ends, so
+    concurrent saves with the same slug source wait for each other, and
+    for the other's row to be committed, instead of picking the same slug.
+    """
+    model = instance.__class__
+    slug_len = model._meta.get_field(slug_field_name).max_length
+    prefix = _slug_prefix(
+        _original_slug(value, slug_len, slug_separator), slug_len, slug_separator)
+    with transaction.atomic():
+        hold_transaction_lock('%s:%s' % (model._meta.db_table, prefix), 'slug')
+        unique_slugify(instance, value, slug_field_name, slug_separator=slug_separator)
+        yield
+
+
+def bulk_unique_slugify(instances, values, slug_field_name='slug',
+                        slug_separator='-', batch_size=100):
+    """
+    Assigns unique slugs to a batch of unsaved ``instances`` of one model,
+    ``values`` being the matching list of slug sources.
+
+    Same slugs as calling ``unique_slugify`` on each instance and saving it
+    in turn, but taken slugs are fetched with one ``startswith`` query per
+    ``batch_size`` distinct base slugs instead of one query per probe.
+    """
+    if not instances:
+        return
+    model = instances[0].__class__
+    slug_field = model._meta.get_field(slug_field_name)
+    slug_len = slug_field.max_length
+
+    originals = [_original_slug(value, slug_len, slug_separator) for value in values]
+
+    prefixes = set(_slug_prefix(slug, slug_len, slug_separator) for slug in originals)
+    prefixes = sorted(prefixes)
+    taken = set()
+    lookup = '%s__startswith' % slug_field_name
+    for i in range(0, len(prefixes), batch_size):
+        q = Q()
+        for prefix in prefixes[i:i + batch_size]:
+            q |= Q(**{lookup: prefix})
+        taken.update(model._default_manager.filter(q).values_list(slug_field_name, flat=True))
+
+    for instance, original_slug in zip(instances, originals):
+        slug = _next_free_slug(original_slug, taken, slug_len, slug_separator)
+        taken.add(slug)
+        setattr(instance, slug_field.attname, slug)
+
+
+def bulk_create_with_pks(instances, batch_size=500):
+    """
+    Inserts a list of unsaved ``instances`` of one model, as ``bulk_create``
+    does, without calling their save(), and sets their primary keys, which
+    ``bulk_create`` leaves unset.
+
+    On PostgreSQL each batch is one INSERT ... RETURNING the new pks, in the
+    order of the rows. Elsewhere each row is inserted on its own and gets
+    its pk back as save() does. Nothing is locked and no pk is guessed, so
+    concurrent inserts into the table neither wait nor interfere.
+    """
+    if not instances:
+        return
+    model = instances[0].__class__
+    opts = model._meta
+    manager = model._base_manager
+    db = manager.db
+    db_connection = connections[db]
+    fields = [f for f in opts.concrete_fields if not isinstance(f, models.AutoField)]
+    with transaction.atomic(using=db):
+        if db_connection.vendor == 'postgresql':
+            cursor = db_connection.cursor()
+            for i in range(0, len(instances), batch_size):
+                batch = instances[i:i + batch_size]
+                query = sql.InsertQuery(model)
+                query.insert_values(fields, batch)
+                insert, params = query.get_compiler(using=db).as_sql()[0]
+                cursor.execute('%s RETURNING %s' % (
+                    insert, db_connection.ops.quote_name(opts.pk.column)), params)
+                for instance, (pk,) in zip(batch, cursor.fetchall()):
+                    instance.pk = pk
+        else:
+            for instance in instances:
+                instance.pk = manager._insert(
+                    [instance], fields=fields, return_id=True, using=db)
+    for instance in instances:
+        instance._state.adding = False
+        instance._state.db = db
+
+
+class LookupRegistry(object):
+    """
+    All rows of a small lookup table, loaded with one query and indexed in
+    memory by whatever fields they are asked for.
+
+    Rows are shared by every caller in the process, treat them as read-only.
+    Saves and deletes of the model bump its CacheVersion (see signals.py).
+    The version is checked once per request, not per lookup: changes made
+    by other processes show from the next request on. A row missing from
+    the registry is looked for in the database, which also reloads it.
+    """
+
+    def __init__(self, model):
+        self.model = model
+        opts = model._meta
+        self.rows = VersionedCache(
+            "lookup:%s.%s" % (opts.app_label, opts.model_name), self._load)
+        # (rows, indexes) as of the last version check
+        self.state = None
+        self.hits = 0
+        self.misses = 0
+
+    def _load(self):
+        return (list(self.model._default_manager.all()), {})
+
+    def recheck(self):
+        """Check the version again at the next lookup."""
+        self.state = None
+
+    def clear(self):
+        """Drop the rows, here and in other processes."""
+        self.rows.invalidate()
+        self.state = None
+
+    def _index(self, kwargs):
+        fields = tuple(sorted(kwargs))
+        opts = self.model._meta
+        key = []
+        attnames = []
+        for name in fields:
+            field = opts.pk if name == 'pk' else opts.get_field(name)
+            value = kwargs[name]
+            if isinstance(value, models.Model):
+                value = value.pk
+            elif value is not None:
+                value = field.to_python(value)
+            attnames.append(field.attname)
+            key.append(value)
+        # rows and their indexes are swapped in together, so a clear()
+        # while indexing never mixes the old and the new rows
+        state = self.state
+        if state is None:
+            state = self.state = self.rows.get()
+        rows, indexes = state
+        index = indexes.get(fields)
+        if index is None:
+            index = {}
+            for row in rows:
+                row_key = tuple(getattr(row, attname) for attname in attnames)
+                index.setdefault(row_key, []).append(row)
+            indexes[fields] = index
+        return index.get(tuple(key))
+
+    def get(self, **kwargs):
+        """
+        Like ``objects.get(**kwargs)`` on plain field values, from memory.
+        """
+        rows = self._index(kwargs)
+        if not rows:
+            self.misses += 1
+            row = self.model._default_manager.get(**kwargs)
+            self.rows.discard()
+            self.state = None
+            return row
+        self.hits += 1
+        if len(rows) > 1:
+            raise self.model.MultipleObjectsReturned(
+                "get() returned more than one %s -- it returned %s!"
+                % (self.model._meta.object_name, len(rows)))
+        return rows[0]
+
+    def filter(self, **kwargs):
+        """
+        Like ``objects.filter(**kwargs)`` on plain field values, as a list.
+        """
+        self.hits += 1
+        return list(self._index(kwargs) or [])
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses}
+
+
+_lookup_registries = {}
+
+
+def lookup_registry(model):
+    registry = _lookup_registries.get(model)
+    if registry is None:
+        registry = _lookup_registries.setdefault(model, LookupRegistry(model))
+    return registry
+
+
+def invalidate_lookups(model):
+    lookup_registry(model).clear()
+
+
+def recheck_lookups():
+    """
+    Have every lookup registry check its version again, at request start.
+    """
+    for registry in list(_lookup_registries.values()):
+        registry.recheck()
+
+
+def lookup_stats():
+    """
+    Hits and misses of every lookup registry, by model name.
+    """
+    return dict((model.__name__, registry.stats())
+                for model, registry in _lookup_registries.items())
+
+
+class LookupManager(models.Manager):
+    """
+    Manager for lookup tables like EventType, whose rows hot code fetches
+    by name over and over: ``cached`` and ``cached_filter`` serve them
+    from the model's LookupRegistry.
+    """
+
+    def cached(self, **kwargs):
+        return lookup_registry(self.model).get(**kwargs)
+
+    def cached_filter(self, **kwargs):
+        return lookup_registry(self.model).filter(**kwargs)
+
+
+def _original_slug(value, slug_len, separator):
+    """
+    The slug of ``value`` before any suffix, chopped down to ``slug_len``.
+    """
+    slug = slugify(value)
+    if slug_len:
+        slug = slug[:slug_len]
+    return _slug_strip(slug, separator)
+
+
+def _slug_prefix(original_slug, slug_len, separator, max_suffix_len=10):
+    """
+    The longest string every candidate slug for ``original_slug`` starts with.
+    """
+    prefix = original_slug
+    if slug_len and len(original_slug) + max_suffix_len > slug_len:
+        prefix = _slug_strip(original_slug[:slug_len - max_suffix_len], separator)
+    # an empty slug is never used, its candidates are '-2', '-3'...
+    return prefix or separator or '-'
+
+
+def _next_free_slug(original_slug, taken, slug_len, separator):
+    """
+    Probes ``original_slug``, then '-2', '-3', etc against the ``taken`` set,
+    the same sequence ``unique_slugify`` probes against the database.
+    """
+    slug = original_slug
     next = 2
-    while not slug or queryset.filter(**{slug_field_name: slug}):
+    while not slug or slug in taken:
         slug = original_slug
         end = '-%s' % next
         if slug_len and len(slug) + len(end) > slug_len:
             slug = slug[:slug_len-len(end)]
-            slug = _slug_strip(slug, slug_separator)
+            slug = _slug_strip(slug, separator)
         slug = '%s%s' % (slug, end)
         next += 1
-
-    setattr(instance, slug_field.attname, slug)
+    return slug
 
 
 def _slug_strip(value, separator=None):
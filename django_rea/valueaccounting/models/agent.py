@@ -1,5 +1,6 @@
 from __future__ import print_function
 from decimal import *
+import copy
 import datetime
 import time
 
@@ -13,7 +14,9 @@ from django.utils.encoding import python_2_unicode_compatible
 
 from easy_thumbnails.fields import ThumbnailerImageField
 
-from ._utils import unique_slugify
+from django_rea.valueaccounting.models.misc import VersionedCache
+
+from ._utils import LookupManager, unique_slug
 
 
 class AgentAccount(object):
@@ -156,8 +159,8 @@ class EconomicAgent(models.Model):
         return self.nick
 
     def save(self, *args, **kwargs):
-        unique_slugify(self, self.nick)
-        super(EconomicAgent, self).save(*args, **kwargs)
+        with unique_slug(self, self.nick):
+            super(EconomicAgent, self).save(*args, **kwargs)
 
     def delete(self, *args, **kwargs):
         aus = self.users.all()
@@ -597,28 +600,34 @@ class EconomicAgent(models.Model):
         from .trade import Exchange
         return Exchange.objects.internal_exchanges().filter(context_agent=self).count()
 
+    def sub_agent_walk(self):
+        """(agent, depth) for self and, depth first, its sub agents by name."""
+        hierarchy = agent_hierarchy()
+        agents = EconomicAgent.objects.in_bulk(hierarchy.sub_agent_ids(self.id))
+        agents[self.id] = self
+        walk = hierarchy.child_walk(self.id, key=lambda id: agents[id].name)
+        return [(agents[id], depth) for id, depth in walk]
+
     def with_all_sub_agents(self):
-        from django_rea.valueaccounting.utils import flattened_children_by_association
-        aas = AgentAssociation.objects.filter(association_type__association_behavior="child").order_by(
-            "is_associate__name")
-        return flattened_children_by_association(self, aas, [])
+        return [agent for agent, depth in self.sub_agent_walk()]
 
     def with_all_associations(self):
-        from django_rea.valueaccounting.utils import group_dfs_by_has_associate, group_dfs_by_is_associate
+        hierarchy = agent_hierarchy()
         if self.is_individual():
+            ids = hierarchy.direct_associate_ids(self.id)
+            others = EconomicAgent.objects.in_bulk(ids)
             agents = [self, ]
-            agents.extend([ag.has_associate for ag in self.is_associate_of.all()])
-            agents.extend([ag.is_associate for ag in self.has_associates.all()])
+            agents.extend([others[id] for id in ids])
         else:
-            associations = AgentAssociation.objects.all().order_by("-association_type")
-            # associations = associations.exclude(is_associate__agent_type__party_type="individual")
-            # associations = associations.exclude(association_type__identifier="supplier")
-            gas = group_dfs_by_has_associate(self, self, associations, [], 1)
-            gas.extend(group_dfs_by_is_associate(self, self, associations, [], 1))
-            agents = [self, ]
-            for ga in gas:
-                if ga not in agents:
-                    agents.append(ga)
+            walk = hierarchy.association_walk(self.id)
+            others = EconomicAgent.objects.in_bulk([id for id, depth in walk])
+            others[self.id] = self
+            agents = []
+            for id, depth in walk:
+                agent = others[id]
+                if agent not in agents:
+                    agent.depth = depth
+                    agents.append(agent)
         return agents
 
     def related_contexts(self):
@@ -659,11 +668,14 @@ class EconomicAgent(models.Model):
         return answer
 
     def child_tree(self):
-        from django_rea.valueaccounting.utils import agent_dfs_by_association
-        # todo: figure out why this failed when AAs were ordered by from_agent
-        aas = AgentAssociation.objects.filter(association_type__association_behavior="child").order_by(
-            "is_associate__name")
-        return agent_dfs_by_association(self, aas, 1)
+        tree = []
+        for agent, depth in self.sub_agent_walk():
+            if agent in tree:
+                # under two parents, with a depth for each
+                agent = copy.copy(agent)
+            agent.depth = depth
+            tree.append(agent)
+        return tree
 
     def wip(self):
         return self.active_processes()
@@ -715,20 +727,14 @@ class EconomicAgent(models.Model):
     def parent(self):
         # assumes only one parent
         # import pdb; pdb.set_trace()
-        associations = self.is_associate_of.filter(association_type__association_behavior="child").filter(
-            state="active")
+        parent_id = agent_hierarchy().parent_id(self.id)
         parent = None
-        if associations.count() > 0:
-            parent = associations[0].has_associate
+        if parent_id:
+            parent = EconomicAgent.objects.get(pk=parent_id)
         return parent
 
     def all_ancestors(self):
-        parent_ids = []
-        parent_ids.append(self.id)
-        parent = self.parent()
-        while parent:
-            parent_ids.append(parent.id)
-            parent = parent.parent()
+        parent_ids = agent_hierarchy().ancestor_ids(self.id)
         parents = EconomicAgent.objects.filter(pk__in=parent_ids)
         return parents
 
@@ -742,7 +748,7 @@ class EconomicAgent(models.Model):
         return children
 
     def is_root(self):
-        if self.parent():
+        if agent_hierarchy().parent_id(self.id):
             return False
         else:
             return True
@@ -848,10 +854,8 @@ class EconomicAgent(models.Model):
     def is_manager_of(self, context):
         if self is context:
             return True
-        association = self.association_with(context)
-        if association:
-            if association.association_type.association_behavior == "manager":
-                return True
+        if agent_hierarchy().association_behavior(self.id, context.id) == "manager":
+            return True
         return False
 
     def exchange_firm(self):
@@ -1019,8 +1023,8 @@ class EconomicAgent(models.Model):
         # ship = EventType.objects.get(label="ships")
         # transfer = EventType.objects.get(name="Reciprocal Transfer")
         # qs = EconomicEvent.objects.filter(Q(event_type=ship)|Q(event_type=transfer))
-        et_give = EventType.objects.get(name="Give")
-        uc_demand = UseCase.objects.get(identifier="demand_xfer")
+        et_give = EventType.objects.cached(name="Give")
+        uc_demand = UseCase.objects.cached(identifier="demand_xfer")
         qs = EconomicEvent.objects.filter(event_type=et_give).filter(
             transfer__transfer_type__exchange_type__use_case=uc_demand)
         # todo: retest, may need production events for shipments to tell
@@ -1075,7 +1079,7 @@ class EconomicAgent(models.Model):
         from django_rea.valueaccounting.models.event import EconomicEvent
         # import pdb; pdb.set_trace()
         id_ids = []
-        et = EventType.objects.get(name="Distribution")
+        et = EventType.objects.cached(name="Distribution")
         ids = EconomicEvent.objects.filter(to_agent=self).filter(event_type=et)
         for id in ids:
             if id.is_undistributed():
@@ -1180,6 +1184,8 @@ class AgentAssociationType(models.Model):
     label = models.CharField(_('label'), max_length=32, null=True)
     inverse_label = models.CharField(_('inverse label'), max_length=40, null=True)
 
+    objects = LookupManager()
+
     def __str__(self):
         return self.name
 
@@ -1218,6 +1224,119 @@ class AgentAssociationType(models.Model):
                 print("Created %s AgentAssociationType" % name)
 
 
+class AgentHierarchy(object):
+    """Every AgentAssociation, from one query, indexed by agent.
+
+    For each agent, its associations are kept as
+    (association id, other agent id, association behavior, state),
+    in the "-association_type" order with_all_associations always used.
+    Walks guard against cycles, which the recursive helpers in utils did not.
+    """
+
+    def __init__(self):
+        self.has_associates = {}
+        self.is_associate_of = {}
+        associations = AgentAssociation.objects.order_by("-association_type", "id").values_list(
+            "id", "is_associate", "has_associate", "association_type__association_behavior", "state")
+        for id, is_id, has_id, behavior, state in associations:
+            self.has_associates.setdefault(has_id, []).append((id, is_id, behavior, state))
+            self.is_associate_of.setdefault(is_id, []).append((id, has_id, behavior, state))
+
+    def parent_id(self, agent_id):
+        """The agent's parent, as EconomicAgent.parent() picks it."""
+        parents = [
+            (id, has_id) for id, has_id, behavior, state in self.is_associate_of.get(agent_id, [])
+            if behavior == "child" and state == "active"]
+        if parents:
+            return min(parents)[1]
+        return None
+
+    def ancestor_ids(self, agent_id):
+        """The agent id, then its parent's, grandparent's and so on."""
+        ids = [agent_id]
+        parent_id = self.parent_id(agent_id)
+        while parent_id and parent_id not in ids:
+            ids.append(parent_id)
+            parent_id = self.parent_id(parent_id)
+        return ids
+
+    def child_ids(self, agent_id):
+        return [
+            is_id for id, is_id, behavior, state in self.has_associates.get(agent_id, [])
+            if behavior == "child"]
+
+    def sub_agent_ids(self, agent_id):
+        """The ids of every agent under the agent by child associations, in any state."""
+        ids = set([agent_id])
+        todo = [agent_id]
+        while todo:
+            for child_id in self.child_ids(todo.pop()):
+                if child_id not in ids:
+                    ids.add(child_id)
+                    todo.append(child_id)
+        return ids
+
+    def child_walk(self, agent_id, key, depth=1, path=()):
+        """(agent id, depth) for the agent and, depth first, its sub agents,
+
+        with the children of each agent sorted by key.
+        An agent under two parents is walked under each of them.
+        """
+        path = path + (agent_id,)
+        walk = [(agent_id, depth)]
+        for child_id in sorted(self.child_ids(agent_id), key=key):
+            if child_id not in path:
+                walk.extend(self.child_walk(child_id, key, depth + 1, path))
+        return walk
+
+    def association_walk(self, agent_id):
+        """(agent id, depth) for every agent reachable from the agent,
+
+        first down through has_associates, then up through is_associate_of,
+        each agent once per direction, as with_all_associations walked them.
+        """
+        walk = []
+        for index in (self.has_associates, self.is_associate_of):
+            visited = set()
+            todo = [(agent_id, 1)]
+            while todo:
+                node_id, depth = todo.pop()
+                if node_id in visited:
+                    continue
+                visited.add(node_id)
+                walk.append((node_id, depth))
+                others = [other_id for id, other_id, behavior, state in index.get(node_id, [])]
+                todo.extend((other_id, depth + 1) for other_id in reversed(others))
+        return walk
+
+    def direct_associate_ids(self, agent_id):
+        """The ids of the agents the agent is associated with, then those associated with it."""
+        ids = [has_id for id, has_id, behavior, state in sorted(self.is_associate_of.get(agent_id, []))]
+        ids.extend(is_id for id, is_id, behavior, state in sorted(self.has_associates.get(agent_id, [])))
+        return ids
+
+    def association_behavior(self, agent_id, context_id):
+        """The behavior of the agent's first association with context, or None."""
+        associations = [
+            (id, behavior) for id, has_id, behavior, state in self.is_associate_of.get(agent_id, [])
+            if has_id == context_id]
+        if associations:
+            return min(associations)[1]
+        return None
+
+
+_agent_hierarchy = VersionedCache("agent_hierarchy", AgentHierarchy)
+
+
+def agent_hierarchy():
+    """The AgentHierarchy, rebuilt when agent associations change."""
+    return _agent_hierarchy.get()
+
+
+def invalidate_agent_hierarchy():
+    _agent_hierarchy.invalidate()
+
+
 class AgentTypeManager(models.Manager):
     def context_agent_types(self):
         return AgentType.objects.filter(is_context=True)
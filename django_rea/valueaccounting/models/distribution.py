@@ -6,7 +6,7 @@ from decimal import *
 import simplejson
 from django.contrib.auth.models import User
 from django.core.exceptions import ValidationError
-from django.db import models
+from django.db import models, transaction
 from django.utils.encoding import python_2_unicode_compatible
 from django.utils.translation import ugettext_lazy as _
 
@@ -17,6 +17,10 @@ from django_rea.valueaccounting.models.trade import Exchange
 from django_rea.valueaccounting.models.schedule import Order
 from django_rea.valueaccounting.models.facetconfig import (ProcessPattern, UseCase)
 
+from ._equations import compile_equation
+from ._utils import bulk_create_with_pks
+from ._profiling import DistributionProfile, profile_stage
+
 
 class DistributionManager(models.Manager):
     def distributions(self, start=None, end=None):
@@ -264,8 +268,25 @@ class ValueEquation(models.Model):
         else:
             return True
 
+    def bucket_rule_index(self):
+        """The BucketRuleIndex for this value equation's rules,
+
+        built once per ValueEquation instance.
+        """
+        index = getattr(self, "_bucket_rule_index", None)
+        if index is None:
+            index = BucketRuleIndex(self)
+            self._bucket_rule_index = index
+        return index
+
+    @transaction.atomic
     def run_value_equation_and_save(self, distribution, money_resource, amount_to_distribute, serialized_filters,
                                     events_to_distribute=None):
+        """Runs the value equation and saves the distribution in one transaction.
+
+        Claims, claim events and distribution events are bulk inserted
+        by save_distribution_events.
+        """
         # import pdb; pdb.set_trace()
         distribution_events, contribution_events = self.run_value_equation(
             amount_to_distribute=amount_to_distribute,
@@ -274,6 +295,7 @@ class ValueEquation(models.Model):
         testing = False
         if context_agent.name == "test context agent":
             testing = True
+        accounts = self.owned_virtual_accounts(distribution_events)
         for dist_event in distribution_events:
             va = None
             # todo faircoin distribution
@@ -306,7 +328,7 @@ class ValueEquation(models.Model):
                 else:
                     raise ValidationError(dist_event.to_agent.nick + ' needs faircoin address, unable to create one.')
             else:
-                vas = dist_event.to_agent.virtual_accounts()
+                vas = accounts.get(dist_event.to_agent.id)
                 if vas:
                     for vacct in vas:
                         if vacct.resource_type.unit == money_resource.resource_type.unit:
@@ -320,7 +342,7 @@ class ValueEquation(models.Model):
                     dist_event.unit_of_quantity = va.resource_type.unit
                 else:
                     raise ValidationError(dist_event.to_agent.nick + ' needs a virtual account, unable to create one.')
-        et = EventType.objects.get(name='Cash Disbursement')
+        et = EventType.objects.cached(name='Cash Disbursement')
         # distribution.save() #?? used to be exchange; was anything changed?
         buckets = {}
         # import pdb; pdb.set_trace()
@@ -414,12 +436,40 @@ class ValueEquation(models.Model):
         #        )
         #        ied.save()
         # import pdb; pdb.set_trace()
+        self.save_distribution_events(distribution, distribution_events, testing)
+        return distribution
+
+    def owned_virtual_accounts(self, distribution_events):
+        """The virtual accounts of each to_agent, by agent id, in one query."""
+        from django_rea.valueaccounting.models.resource import AgentResourceRole
+        agent_ids = set(de.to_agent.id for de in distribution_events)
+        roles = AgentResourceRole.objects.filter(
+            agent__id__in=agent_ids,
+            role__is_owner=True,
+            resource__resource_type__behavior="account").select_related(
+            "resource__resource_type__unit")
+        accounts = {}
+        for role in roles:
+            accounts.setdefault(role.agent_id, []).append(role.resource)
+        return accounts
+
+    def save_distribution_events(self, distribution, distribution_events, testing=False):
+        """Writes the distribution events, the new claims they pay and all
+        their claim events with bulk inserts.
+
+        Claims that already existed are left as they were.
+        Resource balances are adjusted once per resource at the end.
+        """
+        from django_rea.valueaccounting.models.resource import EconomicResource
+        from django_rea.valueaccounting.models.rollup import bulk_add_to_field
+        distribution_date = distribution.distribution_date
+        balances = {}
         for dist_event in distribution_events:
             dist_event.distribution = distribution
-            dist_event.event_date = distribution.distribution_date
+            dist_event.event_date = distribution_date
             # todo faircoin distribution
             # import pdb; pdb.set_trace()
-            # digital_currency_resources for to_agents were created earlier in this method
+            # digital_currency_resources for to_agents were created in run_value_equation_and_save
             if dist_event.resource.is_digital_currency_resource():
                 address_origin = self.context_agent.faircoin_address()
                 address_end = dist_event.resource.digital_currency_address
@@ -428,6 +478,7 @@ class ValueEquation(models.Model):
                 quantity = dist_event.quantity
                 state = "new"
                 if testing:
+                    from django_rea.valueaccounting.faircoin_utils import send_fake_faircoins
                     tx_hash, broadcasted = send_fake_faircoins(address_origin, address_end, quantity)
                     state = "pending"
                     if broadcasted:
@@ -435,32 +486,61 @@ class ValueEquation(models.Model):
                     dist_event.digital_currency_tx_hash = tx_hash
                 dist_event.digital_currency_tx_state = state
                 dist_event.event_reference = address_end
-            dist_event.save()
-            to_resource = dist_event.resource
-            to_resource.quantity += dist_event.quantity
-            to_resource.save()
+            resource_id = dist_event.resource.id
+            balances[resource_id] = balances.get(resource_id, Decimal("0")) + dist_event.quantity
+        EconomicEvent.objects.bulk_ingest(distribution_events)
+
+        new_claims = []
+        seen = set()
+        for dist_event in distribution_events:
             for dist_claim_event in dist_event.dist_claim_events:
-                claim_from_contribution = dist_claim_event.claim
-                if claim_from_contribution.new == True:
-                    claim_from_contribution.unit_of_value = dist_event.unit_of_quantity
-                    claim_from_contribution.date = distribution.distribution_date
-                    claim_from_contribution.save()
-                    ce_for_contribution = dist_claim_event.claim.claim_event
-                    ce_for_contribution.claim = claim_from_contribution
-                    ce_for_contribution.unit_of_value = dist_event.unit_of_quantity
-                    ce_for_contribution.claim_event_date = distribution.distribution_date
-                    ce_for_contribution.save()
-                dist_claim_event.claim = claim_from_contribution
+                claim = dist_claim_event.claim
+                if claim.new and id(claim) not in seen:
+                    seen.add(id(claim))
+                    claim.unit_of_value = dist_event.unit_of_quantity
+                    new_claims.append(claim)
+        bulk_create_with_pks(new_claims)
+
+        claim_events = []
+        for claim in new_claims:
+            ce_for_contribution = claim.claim_event
+            # reassigned now the claim has a pk
+            ce_for_contribution.claim = claim
+            ce_for_contribution.unit_of_value = claim.unit_of_value
+            ce_for_contribution.claim_event_date = distribution_date
+            claim_events.append(ce_for_contribution)
+        for dist_event in distribution_events:
+            for dist_claim_event in dist_event.dist_claim_events:
+                # reassigned now the claim and the event have pks
+                dist_claim_event.claim = dist_claim_event.claim
                 dist_claim_event.event = dist_event
                 dist_claim_event.unit_of_value = dist_event.unit_of_quantity
-                dist_claim_event.claim_event_date = distribution.distribution_date
-                dist_claim_event.save()
-
-        return distribution
+                dist_claim_event.claim_event_date = distribution_date
+                claim_events.append(dist_claim_event)
+        ClaimEvent.objects.bulk_create(claim_events, batch_size=500)
 
-    def run_value_equation(self, amount_to_distribute, serialized_filters):
+        bulk_add_to_field(EconomicResource, "quantity", balances)
+        for dist_event in distribution_events:
+            dist_event.resource.quantity += dist_event.quantity
+
+    def profile_value_equation(self, amount_to_distribute, serialized_filters):
+        """Dry run of run_value_equation with a DistributionProfile.
+
+        Anything written while computing the distribution is rolled back.
+        Returns distribution_events, contribution_events, profile.
+        """
+        profile = DistributionProfile()
+        with transaction.atomic():
+            with profile.run():
+                distribution_events, contribution_events = self.run_value_equation(
+                    amount_to_distribute=amount_to_distribute,
+                    serialized_filters=serialized_filters,
+                    profile=profile)
+            transaction.set_rollback(True)
+        return distribution_events, contribution_events, profile
+
+    def run_value_equation(self, amount_to_distribute, serialized_filters, profile=None):
         # import pdb; pdb.set_trace()
-        # start_time = time.time()
         atd = amount_to_distribute
         detail_sums = []
         claim_events = []
@@ -483,7 +563,8 @@ class ValueEquation(models.Model):
                         # import pdb; pdb.set_trace()
                         ces, contributions = bucket.run_bucket_value_equation(amount_to_distribute=bucket_amount,
                                                                               context_agent=self.context_agent,
-                                                                              serialized_filter=serialized_filter)
+                                                                              serialized_filter=serialized_filter,
+                                                                              profile=profile)
                         for ce in ces:
                             detail_sums.append(str(ce.claim.has_agent.id) + "~" + str(ce.value))
                             amount_distributed += ce.value
@@ -501,25 +582,9 @@ class ValueEquation(models.Model):
             else:
                 agent_amounts[detail[0]] = Decimal(detail[1])
         # import pdb; pdb.set_trace()
-        et = EventType.objects.get(name='Distribution')
-        distribution_events = []
-        # import pdb; pdb.set_trace()
-        for agent_id in agent_amounts:
-            distribution_event = EconomicEvent(
-                event_type=et,
-                event_date=datetime.date.today(),
-                from_agent=self.context_agent,
-                to_agent=EconomicAgent.objects.get(id=int(agent_id)),
-                context_agent=self.context_agent,
-                quantity=agent_amounts[agent_id].quantize(Decimal('.01'), rounding=ROUND_HALF_UP),
-                is_contribution=False,
-                is_to_distribute=True,
-            )
-            agent_claim_events = [ce for ce in claim_events if ce.claim.has_agent.id == int(agent_id)]
-            for ce in agent_claim_events:
-                ce.event = distribution_event
-            distribution_event.dist_claim_events = agent_claim_events
-            distribution_events.append(distribution_event)
+        with profile_stage(profile, "distribution events") as stage:
+            distribution_events = self.unsaved_distribution_events(agent_amounts, claim_events)
+            stage.rows = len(distribution_events)
         # clean up rounding errors
         distributed = sum(de.quantity for de in distribution_events)
         delta = atd - distributed
@@ -541,10 +606,151 @@ class ValueEquation(models.Model):
                         if claim.value < 0:
                             claim.value = 0
                     break
-        # end_time = time.time()
-        # print("run_value_equation elapsed time was %g seconds" % (end_time - start_time))
         return distribution_events, contribution_events
 
+    def unsaved_distribution_events(self, agent_amounts, claim_events):
+        et = EventType.objects.cached(name='Distribution')
+        distribution_events = []
+        agents = EconomicAgent.objects.in_bulk([int(agent_id) for agent_id in agent_amounts])
+        claim_events_by_agent = {}
+        for ce in claim_events:
+            claim_events_by_agent.setdefault(ce.claim.has_agent.id, []).append(ce)
+        # import pdb; pdb.set_trace()
+        for agent_id in agent_amounts:
+            distribution_event = EconomicEvent(
+                event_type=et,
+                event_date=datetime.date.today(),
+                from_agent=self.context_agent,
+                to_agent=agents[int(agent_id)],
+                context_agent=self.context_agent,
+                quantity=agent_amounts[agent_id].quantize(Decimal('.01'), rounding=ROUND_HALF_UP),
+                is_contribution=False,
+                is_to_distribute=True,
+            )
+            agent_claim_events = claim_events_by_agent.get(int(agent_id), [])
+            for ce in agent_claim_events:
+                ce.event = distribution_event
+            distribution_event.dist_claim_events = agent_claim_events
+            distribution_events.append(distribution_event)
+        return distribution_events
+
+
+class BucketRuleIndex(object):
+    """In-memory index of the bucket rules of one value equation.
+
+    Rules and their filters are loaded with one query,
+    and the rule chosen for an event is remembered
+    by (event_type, process_type, resource_type).
+    """
+
+    def __init__(self, value_equation):
+        self.rules_by_event_type = {}
+        rules = ValueEquationBucketRule.objects.filter(
+            value_equation_bucket__value_equation=value_equation).order_by("id")
+        for br in rules:
+            br.filter_ids = br.filter_rule_ids()
+            self.rules_by_event_type.setdefault(br.event_type_id, []).append(br)
+        self.rules = {}
+
+    def uses_process_types(self, event_type_id):
+        for br in self.rules_by_event_type.get(event_type_id, []):
+            if br.filter_ids.get("process_types"):
+                return True
+        return False
+
+    def rule_for_event(self, event):
+        process_type_id = None
+        if event.process_id and self.uses_process_types(event.event_type_id):
+            process_type_id = event.process.process_type_id
+        return self.rule_for(event.event_type_id, process_type_id, event.resource_type_id)
+
+    def rule_for(self, event_type_id, process_type_id, resource_type_id):
+        key = (event_type_id, process_type_id, resource_type_id)
+        if key not in self.rules:
+            self.rules[key] = self.choose_rule(event_type_id, process_type_id, resource_type_id)
+        return self.rules[key]
+
+    def choose_rule(self, event_type_id, process_type_id, resource_type_id):
+        # the same choice EconomicEvent.bucket_rule always made, on ids
+        candidates = []
+        filter = None
+        for br in self.rules_by_event_type.get(event_type_id, []):
+            if br.claim_creation_equation:
+                filter = br.filter_ids
+                if filter:
+                    rts = filter.get('resource_types')
+                    if rts:
+                        if resource_type_id in rts:
+                            br.filter = filter
+                            candidates.append(br)
+                    pts = filter.get('process_types')
+                    if pts:
+                        if process_type_id in pts:
+                            br.filter = filter
+                            candidates.append(br)
+                else:
+                    br.filter = filter
+                    candidates.append(br)
+        if not candidates:
+            return None
+        candidates = list(set(candidates))
+        if len(candidates) == 1:
+            return candidates[0]
+        filtered = [c for c in candidates if c.filter]
+        if not filtered:
+            return candidates[0]
+        if len(filtered) == 1:
+            return filtered[0]
+        best_fit = []
+        for f in filtered:
+            pts = f.filter.get("process_types")
+            # todo: this is the last rule's filter, not f's, as it has always been
+            rts = filter.get('resource_types')
+            if pts and rts:
+                f.score = 2
+                best_fit.append(f)
+            elif pts:
+                f.score = 1.5
+                better = [b for b in best_fit if b.score > 1.5]
+                if not better:
+                    best_fit.append(f)
+            elif rts:
+                if not best_fit:
+                    f.score = 1
+                    best_fit.append(f)
+        if best_fit:
+            return best_fit[0]
+        return None
+
+    def claim_values(self, events):
+        """Claim values for a list of events, computed a rule at a time.
+
+        Events without a bucket rule keep their event.value.
+        Events should have resource, resource_type and process selected.
+        """
+        values = [evt.value for evt in events]
+        by_rule = {}
+        for i, evt in enumerate(events):
+            br = self.rule_for_event(evt)
+            if br:
+                by_rule.setdefault(br, []).append(i)
+        for br, indexes in by_rule.items():
+            rule_events = [events[i] for i in indexes]
+            names = br.compiled_equation().names
+            if 'valuePerUnit' in names:
+                vpus = EconomicEvent.objects.values_per_unit(rule_events)
+            else:
+                vpus = [None] * len(rule_events)
+            rows = []
+            for evt, vpu in zip(rule_events, vpus):
+                row = (evt.quantity, vpu, evt.resource_type.price_per_unit, evt.value)
+                if evt.resource_id:
+                    row += (evt.resource.value_per_unit_of_use,)
+                rows.append(row)
+            for i, value in zip(indexes, br.compute_claim_values(rows)):
+                values[i] = value
+        return values
+
 
 FILTER_METHOD_CHOICES = (
     ('order', _('Order')),
@@ -589,24 +795,29 @@ class ValueEquationBucket(models.Model):
             self.name,
         ])
 
-    def run_bucket_value_equation(self, amount_to_distribute, context_agent, serialized_filter):
+    def run_bucket_value_equation(self, amount_to_distribute, context_agent, serialized_filter, profile=None):
         # import pdb; pdb.set_trace()
-        # start_time = time.time()
         rules = self.bucket_rules.all()
         claim_events = []
         contribution_events = []
-        bucket_events = self.gather_bucket_events(context_agent=context_agent, serialized_filter=serialized_filter)
+        with profile_stage(profile, "gather_bucket_events", bucket=self) as stage:
+            bucket_events = self.gather_bucket_events(context_agent=context_agent, serialized_filter=serialized_filter)
+            stage.rows = len(bucket_events)
         # import pdb; pdb.set_trace()
         # tot = Decimal("0.0")
         for vebr in rules:
-            vebr_events = vebr.filter_events(bucket_events)
+            with profile_stage(profile, "filter_events", bucket=self, rule=vebr) as stage:
+                vebr_events = vebr.filter_events(bucket_events)
+                stage.rows = len(vebr_events)
             contribution_events.extend(vebr_events)
             # hours = sum(e.quantity for e in vebr_events)
             # print vebr.filter_rule_deserialized(), "hours:", hours
             # tot += hours
 
         # print "total vebr hours:", tot
-        claims = self.claims_from_events(contribution_events)
+        with profile_stage(profile, "claims_from_events", bucket=self) as stage:
+            claims = self.claims_from_events(contribution_events)
+            stage.rows = len(claims)
         # import pdb; pdb.set_trace()
         if claims:
             total_amount = 0
@@ -622,15 +833,14 @@ class ValueEquationBucket(models.Model):
                 if portion_of_amount > 1:
                     portion_of_amount = Decimal("1.0")
             # import pdb; pdb.set_trace()
-            ces = self.create_distribution_claim_events(claims=claims, portion_of_amount=portion_of_amount)
+            with profile_stage(profile, "create_distribution_claim_events", bucket=self) as stage:
+                ces = self.create_distribution_claim_events(claims=claims, portion_of_amount=portion_of_amount)
+                stage.rows = len(ces)
             claim_events.extend(ces)
-        # end_time = time.time()
-        # print("run_bucket_value_equation elapsed time was %g seconds" % (end_time - start_time))
         return claim_events, contribution_events
 
     def gather_bucket_events(self, context_agent, serialized_filter):
         # import pdb; pdb.set_trace()
-        # start_time = time.time()
         ve = self.value_equation
         events = []
         filter = ""
@@ -672,12 +882,10 @@ class ValueEquationBucket(models.Model):
                 events = events.filter(event_date__gte=start_date)
             elif end_date:
                 events = events.filter(event_date__gte=end_date)
-            for evt in events:
-                br = evt.bucket_rule(ve)
-                value = evt.value
-                if br:
-                    # import pdb; pdb.set_trace()
-                    value = br.compute_claim_value(evt)
+            events = list(events.select_related(
+                "event_type", "resource_type", "resource", "process", "from_agent", "context_agent"))
+            values = ve.bucket_rule_index().claim_values(events)
+            for evt, value in zip(events, values):
                 if value:
                     vpu = value / evt.quantity
                     evt.share = evt.quantity * vpu
@@ -695,14 +903,16 @@ class ValueEquationBucket(models.Model):
                 ])
             events = []
             # import pdb; pdb.set_trace()
+            exchanges_by_order = {}
+            for exchange in Exchange.objects.filter(order__in=orders):
+                exchanges_by_order.setdefault(exchange.order_id, []).append(exchange)
             for order in orders:
                 for order_item in order.order_items():
                     # todo 3d: one method to chase
                     oi_events = order_item.compute_income_fractions(ve)
                     events.extend(oi_events)
-                exchanges = Exchange.objects.filter(order=order)
                 # import pdb; pdb.set_trace()
-                for exchange in exchanges:
+                for exchange in exchanges_by_order.get(order.id, []):
                     for payment in exchange.payment_events():  # todo: fix!
                         events.append(payment)
                     for work in exchange.work_events():
@@ -762,8 +972,6 @@ class ValueEquationBucket(models.Model):
 
         for event in events:
             event.filter = filter
-        # end_time = time.time()
-        # print("gather_bucket_events elapsed time was %g seconds" % (end_time - start_time))
         return events
 
     def claims_from_events(self, events):
@@ -864,7 +1072,7 @@ class ValueEquationBucket(models.Model):
         # import pdb; pdb.set_trace()
         if self.value_equation.context_agent:
             ca = self.value_equation.context_agent
-        uc = UseCase.objects.get(identifier='val_equation')
+        uc = UseCase.objects.cached(identifier='val_equation')
         patterns = ProcessPattern.objects.usecase_patterns(use_case=uc)
         if patterns.count() > 0:
             pattern = patterns[0]
@@ -953,6 +1161,19 @@ class ValueEquationBucketRule(models.Model):
         else:
             return self.filter_rule
 
+    def filter_rule_ids(self):
+        """The filter rule as lists of ids, without querying the filtered types."""
+        if self.filter_rule:
+            json = simplejson.loads(self.filter_rule)
+            ids = {}
+            if json.get("process_types"):
+                ids["process_types"] = set(json["process_types"])
+            if json.get("resource_types"):
+                ids["resource_types"] = set(json["resource_types"])
+            return ids
+        else:
+            return self.filter_rule
+
     def filter_events(self, events):
         # import pdb; pdb.set_trace()
         json = self.filter_rule_deserialized()
@@ -974,35 +1195,46 @@ class ValueEquationBucketRule(models.Model):
             e.vebr.filter = vebr_filter + " " + e.filter
         return events
 
-    def normalize_equation(self):
-        eq = self.claim_creation_equation.split(" ")
-        for i, x in enumerate(eq):
-            eq[i] = x.replace("_", "")
-            try:
-                y = Decimal(x)
-                eq[i] = "".join(["Decimal('", x, "')"])
-            except InvalidOperation:
-                continue
-        s = " "
-        return s.join(eq)
+    def compiled_equation(self):
+        """The claim creation equation, parsed and compiled once.
+
+        Recompiled when claim_creation_equation changes.
+        """
+        compiled = getattr(self, "_compiled_equation", None)
+        if compiled is None or compiled.source != self.claim_creation_equation:
+            compiled = compile_equation(self.claim_creation_equation)
+            self._compiled_equation = compiled
+        return compiled
+
+    def equation_variables(self, event, names):
+        variables = {}
+        if 'quantity' in names:
+            variables['quantity'] = event.quantity
+        if 'valuePerUnit' in names:
+            variables['valuePerUnit'] = event.value_per_unit()
+        if 'pricePerUnit' in names:
+            variables['pricePerUnit'] = event.resource_type.price_per_unit
+        if 'valuePerUnitOfUse' in names and event.resource:
+            variables['valuePerUnitOfUse'] = event.resource.value_per_unit_of_use
+        if 'value' in names:
+            variables['value'] = event.value
+        # variables['importance'] = event.importance()
+        # variables['reputation'] = event.from_agent.reputation
+        # variables['seniority'] = Decimal(event.seniority())
+        return variables
 
     def compute_claim_value(self, event):
         # import pdb; pdb.set_trace()
-        equation = self.normalize_equation()
-        safe_list = ['math', ]
-        safe_dict = dict([(k, locals().get(k, None)) for k in safe_list])
-        safe_dict['Decimal'] = Decimal
-        safe_dict['quantity'] = event.quantity
-        safe_dict['valuePerUnit'] = event.value_per_unit()
-        safe_dict['pricePerUnit'] = event.resource_type.price_per_unit
-        if event.resource:
-            safe_dict['valuePerUnitOfUse'] = event.resource.value_per_unit_of_use
-        safe_dict['value'] = event.value
-        # safe_dict['importance'] = event.importance()
-        # safe_dict['reputation'] = event.from_agent.reputation
-        # safe_dict['seniority'] = Decimal(event.seniority())
-        value = eval(equation, {"__builtins__": None}, safe_dict)
-        return value
+        compiled = self.compiled_equation()
+        return compiled.evaluate(self.equation_variables(event, compiled.names))
+
+    def compute_claim_values(self, rows):
+        """Vectorized compute_claim_value.
+
+        rows are tuples of (quantity, valuePerUnit, pricePerUnit, value),
+        optionally followed by valuePerUnitOfUse.
+        """
+        return self.compiled_equation().evaluate_batch(rows)
 
     def default_equation(self):
         et = self.event_type
@@ -1057,7 +1289,7 @@ class ValueEquationBucketRule(models.Model):
         # import pdb; pdb.set_trace()
         if self.value_equation_bucket.value_equation.context_agent:
             ca = self.value_equation_bucket.value_equation.context_agent
-        uc = UseCase.objects.get(identifier='val_equation')
+        uc = UseCase.objects.cached(identifier='val_equation')
         patterns = ProcessPattern.objects.usecase_patterns(use_case=uc)
         if patterns.count() > 0:
             pattern = patterns[0]
@@ -5,13 +5,15 @@ from decimal import *
 
 from django.conf import settings
 from django.contrib.auth.models import User
-from django.db import models
+from django.db import IntegrityError, models, transaction
+from django.db.models import F, Max, Q, Sum
 from django.utils.encoding import python_2_unicode_compatible
 from django.utils.translation import ugettext_lazy as _
 
 from django_rea.valueaccounting.models.agent import EconomicAgent
+from django_rea.valueaccounting.models.rollup import events_inputs, invalidate_value_per_unit
 
-from ._utils import unique_slugify
+from ._utils import bulk_create_with_pks, bulk_unique_slugify, hold_transaction_lock, unique_slug
 
 
 class EconomicEventManager(models.Manager):
@@ -31,29 +33,430 @@ class EconomicEventManager(models.Manager):
     def contributions(self):
         return EconomicEvent.objects.filter(is_contribution=True)
 
+    def values_per_unit(self, events):
+        """event.value_per_unit() for each of a list of events,
+
+        with one AgentResourceType query for all of them.
+        Events should have resource and resource_type selected.
+        """
+        from django_rea.valueaccounting.models.resource import AgentResourceType
+        keys = set(
+            (e.from_agent_id, e.resource_type_id, e.event_type_id)
+            for e in events if e.from_agent_id and not e.resource_id)
+        art_values = {}
+        if keys:
+            arts = AgentResourceType.objects.filter(
+                agent__id__in=set(key[0] for key in keys),
+                resource_type__id__in=set(key[1] for key in keys),
+            ).order_by("id").values_list("agent", "resource_type", "event_type", "value_per_unit")
+            for agent_id, resource_type_id, event_type_id, value_per_unit in arts:
+                art_values.setdefault((agent_id, resource_type_id, event_type_id), value_per_unit)
+        values = []
+        for e in events:
+            if e.resource_id:
+                values.append(e.resource.value_per_unit)
+                continue
+            value = art_values.get((e.from_agent_id, e.resource_type_id, e.event_type_id))
+            values.append(value or e.resource_type.value_per_unit)
+        return values
+
+    def bulk_ingest(self, events, batch_size=500):
+        """Saves a list of new, unsaved events in one transaction.
+
+        Has the same effects as calling save() on each event,
+        but slugs are allocated in batches, and AgentResourceType scores
+        and CachedEventSummary, MonthlyEventSummary and VirtualAccountBalance
+        quantities are accumulated in memory
+        and written once per key at the end.
+        The events get their pks, as bulk_create_with_pks sets them.
+        Returns the number of events created.
+        """
+        from django_rea.valueaccounting.models.recipe import EventType
+        if not events:
+            return 0
+        event_types = EventType.objects.in_bulk(set(e.event_type_id for e in events))
+        agents = EconomicAgent.objects.in_bulk(
+            set(e.from_agent_id for e in events if e.from_agent_id))
+
+        slugs = []
+        scores = {}
+        deltas = {}
+        months = {}
+        for event in events:
+            event_type = event_types[event.event_type_id]
+            from_agt = 'Unassigned'
+            if event.from_agent_id:
+                from_agt = agents[event.from_agent_id].name
+                if event.quantity:
+                    if event_type.relationship == "work" or event_type.related_to == "agent":
+                        key = (event.from_agent_id, event.resource_type_id, event.event_type_id)
+                        scores[key] = scores.get(key, Decimal("0")) + event.quantity
+            slugs.append("-".join([
+                str(event_type.name),
+                from_agt,
+                event.event_date.strftime('%Y-%m-%d'),
+            ]))
+            summary_deltas(None, event, deltas)
+            month_deltas(None, event, months)
+        accounts = virtual_account_ids(e.resource_id for e in events)
+        days = {}
+        for event in events:
+            if event.resource_id in accounts:
+                event.event_type = event_types[event.event_type_id]
+                ledger_deltas(None, event, accounts, days)
+
+        with transaction.atomic():
+            for i in range(0, len(events), batch_size):
+                batch = events[i:i + batch_size]
+                bulk_unique_slugify(batch, slugs[i:i + batch_size])
+                bulk_create_with_pks(batch, batch_size)
+            add_agent_resource_type_scores(scores)
+            apply_summary_deltas(deltas)
+            apply_month_deltas(months)
+            apply_ledger_deltas(days)
+            invalidate_value_per_unit(events_inputs(events))
+            if any(e.process_id for e in events):
+                from django_rea.valueaccounting.models.process import invalidate_process_json
+                invalidate_process_json()
+        return len(events)
+
+
+def summary_key(event):
+    """The CachedEventSummary key of an event, as a tuple of ids."""
+    return (
+        event.from_agent_id,
+        event.context_agent_id,
+        event.resource_type_id,
+        event.event_type_id,
+    )
+
+
+def _summary_filter(key):
+    agent_id, context_agent_id, resource_type_id, event_type_id = key
+    return dict(
+        agent_id=agent_id,
+        context_agent_id=context_agent_id,
+        resource_type_id=resource_type_id,
+        event_type_id=event_type_id)
+
+
+def summary_deltas(prev, event, deltas=None):
+    """Signed quantity changes to CachedEventSummary caused by one event write.
+
+    ``prev`` is the event as stored before the write (None for a new event),
+    ``event`` the event as it will be stored (None for a delete).
+    Deltas are accumulated into ``deltas`` if given, keyed by summary_key.
+    """
+    if deltas is None:
+        deltas = {}
+    if prev is not None and prev.is_contribution:
+        key = summary_key(prev)
+        deltas[key] = deltas.get(key, Decimal("0")) - prev.quantity
+    if event is not None and event.is_contribution:
+        key = summary_key(event)
+        deltas[key] = deltas.get(key, Decimal("0")) + event.quantity
+    return deltas
+
+
+def update_or_reconcile(rows, lock_name, reconcile, **changes):
+    """Applies changes to the aggregate row selected by rows with one UPDATE,
+
+    or, if there is none, rebuilds it with reconcile. The events being
+    saved are already written, so reconcile counts them.
+    Two transactions missing the same row wait for each other on a lock
+    of lock_name, and the second then finds and updates the first's row.
+    If the row appears anyway (the unique key's IntegrityError),
+    it was built without this transaction's events, so it gets the changes.
+    Call it inside transaction.atomic.
+    """
+    if rows.update(**changes):
+        return
+    hold_transaction_lock(lock_name, "aggregate")
+    if rows.update(**changes):
+        return
+    try:
+        with transaction.atomic():
+            reconcile()
+    except IntegrityError:
+        rows.update(**changes)
+
+
+def adjust_summary(key, delta):
+    """Applies a signed quantity delta to one summary row with a single UPDATE.
+
+    Rows that reach zero are deleted, as update_summary always did.
+    If there is no row to update, falls back to reconcile_summary.
+    """
+    if not delta:
+        return
+    summaries = CachedEventSummary.objects.filter(**_summary_filter(key))
+    with transaction.atomic():
+        update_or_reconcile(
+            summaries, "summary:%s" % (key,), lambda: reconcile_summary(key),
+            quantity=F("quantity") + delta)
+        summaries.filter(quantity=Decimal("0")).delete()
+
+
+def apply_summary_deltas(deltas):
+    # in key order, so transactions lock the rows they share in the same order
+    with transaction.atomic():
+        for key, delta in sorted(deltas.items()):
+            adjust_summary(key, delta)
+
+
+def reconcile_summary(key):
+    """Rebuilds one summary row from a db-side Sum of its contribution events."""
+    agent_id, context_agent_id, resource_type_id, event_type_id = key
+    total = EconomicEvent.objects.filter(
+        from_agent_id=agent_id,
+        context_agent_id=context_agent_id,
+        resource_type_id=resource_type_id,
+        event_type_id=event_type_id,
+        is_contribution=True).aggregate(total=Sum("quantity"))["total"]
+    summaries = CachedEventSummary.objects.filter(**_summary_filter(key))
+    with transaction.atomic():
+        if not total:
+            summaries.delete()
+            return
+        summary = summaries.first()
+        if summary:
+            summaries.exclude(pk=summary.pk).delete()
+            summary.quantity = total
+            summary.save()
+        else:
+            CachedEventSummary.objects.create(quantity=total, **_summary_filter(key))
+
+
+def month_start(date):
+    return date.replace(day=1)
+
+
+def next_month(month):
+    if month.month == 12:
+        return month.replace(year=month.year + 1, month=1)
+    return month.replace(month=month.month + 1)
+
+
+def month_key(event):
+    """The MonthlyEventSummary key of an event, as a tuple."""
+    return (
+        event.from_agent_id,
+        event.context_agent_id,
+        event.event_type_id,
+        month_start(event.event_date),
+    )
+
+
+def _month_filter(key):
+    agent_id, context_agent_id, event_type_id, month = key
+    return dict(
+        agent_id=agent_id,
+        context_agent_id=context_agent_id,
+        event_type_id=event_type_id,
+        month=month)
+
+
+def summarized_monthly(event):
+    """Whether MonthlyEventSummary keeps the event: work events,
+
+    the only ones recent_stats reads, are.
+    """
+    from django_rea.valueaccounting.models.recipe import EventType
+    return EventType.objects.cached(pk=event.event_type_id).relationship == "work"
+
+
+def month_deltas(prev, event, deltas=None):
+    """Signed quantity changes to MonthlyEventSummary caused by one event write,
+
+    like summary_deltas, but for every work event, not only contributions.
+    """
+    if deltas is None:
+        deltas = {}
+    if prev is not None and summarized_monthly(prev):
+        key = month_key(prev)
+        deltas[key] = deltas.get(key, Decimal("0")) - prev.quantity
+    if event is not None and summarized_monthly(event):
+        key = month_key(event)
+        deltas[key] = deltas.get(key, Decimal("0")) + event.quantity
+    return deltas
+
+
+def adjust_month_summary(key, delta):
+    if not delta:
+        return
+    summaries = MonthlyEventSummary.objects.filter(**_month_filter(key))
+    with transaction.atomic():
+        update_or_reconcile(
+            summaries, "month:%s" % (key,), lambda: reconcile_month_summary(key),
+            quantity=F("quantity") + delta)
+        summaries.filter(quantity=Decimal("0")).delete()
+
+
+def apply_month_deltas(deltas):
+    with transaction.atomic():
+        for key, delta in sorted(deltas.items()):
+            adjust_month_summary(key, delta)
+
+
+def reconcile_month_summary(key):
+    """Rebuilds one monthly summary row from a db-side Sum of its events."""
+    agent_id, context_agent_id, event_type_id, month = key
+    total = EconomicEvent.objects.filter(
+        from_agent_id=agent_id,
+        context_agent_id=context_agent_id,
+        event_type_id=event_type_id,
+        event_date__gte=month,
+        event_date__lt=next_month(month)).aggregate(total=Sum("quantity"))["total"]
+    summaries = MonthlyEventSummary.objects.filter(**_month_filter(key))
+    with transaction.atomic():
+        if not total:
+            summaries.delete()
+            return
+        summary = summaries.first()
+        if summary:
+            summaries.exclude(pk=summary.pk).delete()
+            summary.quantity = total
+            summary.save()
+        else:
+            MonthlyEventSummary.objects.create(quantity=total, **_month_filter(key))
+
+
+def virtual_account_ids(resource_ids):
+    """The ones of resource_ids that are virtual accounts."""
+    from django_rea.valueaccounting.models.resource import EconomicResource
+    resource_ids = set(id for id in resource_ids if id)
+    if not resource_ids:
+        return set()
+    return set(EconomicResource.objects.filter(
+        id__in=resource_ids,
+        resource_type__behavior="account").values_list("id", flat=True))
+
+
+def cash_in_q(prefix=""):
+    """Q for events that put money in an account, as EventType.creates_resources reads them."""
+    effect = prefix + "event_type__resource_effect__contains"
+    return Q(**{effect: "+"}) & ~Q(**{effect: "-"})
+
+
+def ledger_deltas(prev, event, accounts, deltas=None):
+    """Changes to VirtualAccountBalance days caused by one event write,
+
+    as (in, out) quantities keyed by (resource id, date).
+    accounts are the ids of the virtual accounts among the events' resources.
+    """
+    if deltas is None:
+        deltas = {}
+    for e, sign in ((prev, -1), (event, 1)):
+        if e is None or e.resource_id not in accounts:
+            continue
+        if event is not None and e.event_type_id == event.event_type_id:
+            event_type = event.event_type
+        else:
+            event_type = e.event_type
+        key = (e.resource_id, e.event_date)
+        cash_in, cash_out = deltas.get(key, (Decimal("0"), Decimal("0")))
+        if event_type.creates_resources():
+            cash_in += sign * e.quantity
+        else:
+            cash_out += sign * e.quantity
+        deltas[key] = (cash_in, cash_out)
+    return deltas
+
+
+def apply_ledger_deltas(deltas):
+    with transaction.atomic():
+        for key, (cash_in, cash_out) in sorted(deltas.items()):
+            adjust_account_day(key, cash_in, cash_out)
+
+
+def adjust_account_day(key, cash_in, cash_out):
+    """Applies in and out deltas to one account day and the balances after it."""
+    if not cash_in and not cash_out:
+        return
+    resource_id, date = key
+    net = cash_in - cash_out
+    days = VirtualAccountBalance.objects.filter(resource_id=resource_id, date=date)
+    with transaction.atomic():
+        update_or_reconcile(
+            days, "account:%s" % (key,), lambda: reconcile_account_day(key),
+            quantity_in=F("quantity_in") + cash_in,
+            quantity_out=F("quantity_out") + cash_out,
+            balance=F("balance") + net)
+        days.filter(quantity_in=Decimal("0"), quantity_out=Decimal("0")).delete()
+        VirtualAccountBalance.objects.filter(
+            resource_id=resource_id,
+            date__gt=date).update(balance=F("balance") + net)
+
+
+def reconcile_account_day(key):
+    """Rebuilds one account day from db-side Sums of its events,
+
+    and its balance from the day before it.
+    Later days are not touched.
+    """
+    resource_id, date = key
+    events = EconomicEvent.objects.filter(resource_id=resource_id, event_date=date)
+    cash_in = events.filter(cash_in_q()).aggregate(total=Sum("quantity"))["total"] or Decimal("0")
+    cash_out = events.exclude(cash_in_q()).aggregate(total=Sum("quantity"))["total"] or Decimal("0")
+    days = VirtualAccountBalance.objects.filter(resource_id=resource_id, date=date)
+    with transaction.atomic():
+        days.delete()
+        if not cash_in and not cash_out:
+            return
+        before = VirtualAccountBalance.objects.filter(
+            resource_id=resource_id,
+            date__lt=date).order_by("-date").values_list("balance", flat=True).first()
+        VirtualAccountBalance.objects.create(
+            resource_id=resource_id,
+            date=date,
+            quantity_in=cash_in,
+            quantity_out=cash_out,
+            balance=(before or Decimal("0")) + cash_in - cash_out)
+
+
+def add_agent_resource_type_scores(scores):
+    """Adds accumulated quantities to AgentResourceType scores.
+
+    ``scores`` maps (agent_id, resource_type_id, event_type_id) to a quantity.
+    Existing rows get one UPDATE each, missing rows are bulk created.
+    """
+    from django_rea.valueaccounting.models.resource import AgentResourceType
+    if not scores:
+        return
+    existing = {}
+    arts = AgentResourceType.objects.filter(
+        agent__id__in=set(key[0] for key in scores),
+        resource_type__id__in=set(key[1] for key in scores),
+    ).order_by("id").values_list("id", "agent", "resource_type", "event_type")
+    for art_id, agent_id, resource_type_id, event_type_id in arts:
+        # todo: dup records shd not happen, but they do; save() also scores only the first
+        existing.setdefault((agent_id, resource_type_id, event_type_id), art_id)
+    new_arts = []
+    for key, score in scores.items():
+        if key in existing:
+            AgentResourceType.objects.filter(id=existing[key]).update(score=F("score") + score)
+        else:
+            agent_id, resource_type_id, event_type_id = key
+            new_arts.append(AgentResourceType(
+                agent_id=agent_id,
+                resource_type_id=resource_type_id,
+                event_type_id=event_type_id,
+                score=score))
+    AgentResourceType.objects.bulk_create(new_arts)
+
 
 def update_summary(agent, context_agent, resource_type, event_type):
-    events = EconomicEvent.objects.filter(
-        from_agent=agent,
-        context_agent=context_agent,
-        resource_type=resource_type,
-        event_type=event_type,
-        is_contribution=True)
-    total = sum(event.quantity for event in events)
-    summary, created = CachedEventSummary.objects.get_or_create(
-        agent=agent,
-        context_agent=context_agent,
-        resource_type=resource_type,
-        event_type=event_type)
-    summary.quantity = total
-    if summary.quantity:
-        summary.save()
-    else:
-        summary.delete()
+    reconcile_summary((
+        agent.id if agent else None,
+        context_agent.id if context_agent else None,
+        resource_type.id if resource_type else None,
+        event_type.id,
+    ))
 
 
 TX_STATE_CHOICES = (
     ('new', _('New')),
+    ('sending', _('Sending')),
     ('pending', _('Pending')),
     ('broadcast', _('Broadcast')),
     ('confirmed', _('Confirmed')),
@@ -192,6 +595,8 @@ class EconomicEvent(models.Model):
             resource_string,
         ])
 
+    # the row and the aggregates kept from it are written together or not at all
+    @transaction.atomic
     def save(self, *args, **kwargs):
         from django_rea.valueaccounting.models.resource import AgentResourceType
         # import pdb; pdb.set_trace()
@@ -203,32 +608,11 @@ class EconomicEvent(models.Model):
         event_type = self.event_type
         delta = self.quantity
 
-        agent_change = False
-        project_change = False
-        resource_type_change = False
-        context_agent_change = False
-        event_type_change = False
-
+        prev = None
         if self.pk:
-            prev_agent = self.from_agent
-            prev_context_agent = self.context_agent
-            prev_resource_type = self.resource_type
-            prev_event_type = self.event_type
             prev = EconomicEvent.objects.get(pk=self.pk)
             if prev.quantity != self.quantity:
                 delta = self.quantity - prev.quantity
-            if prev.from_agent != self.from_agent:
-                agent_change = True
-                prev_agent = prev.from_agent
-            if prev.context_agent != self.context_agent:
-                context_agent_change = True
-                prev_context_agent = prev.context_agent
-            if prev.resource_type != self.resource_type:
-                resource_type_change = True
-                prev_resource_type = prev.resource_type
-            if prev.event_type != self.event_type:
-                event_type_change = True
-                prev_event_type = prev.event_type
         if agent:
             from_agt = agent.name
             if delta:
@@ -247,45 +631,47 @@ class EconomicEvent(models.Model):
                             event_type=event_type)
                         art = arts[0]
                     art.score += delta
-                    art.save()
+                    art.save(update_fields=["score"])
 
         slug = "-".join([
             str(self.event_type.name),
             from_agt,
             self.event_date.strftime('%Y-%m-%d'),
         ])
-        unique_slugify(self, slug)
-        super(EconomicEvent, self).save(*args, **kwargs)
-        update_summary(agent, context_agent, resource_type, event_type)
-        if agent_change or resource_type_change or context_agent_change or event_type_change:
-            update_summary(prev_agent, prev_context_agent, prev_resource_type, prev_event_type)
+        with unique_slug(self, slug):
+            super(EconomicEvent, self).save(*args, **kwargs)
+        apply_summary_deltas(summary_deltas(prev, self))
+        apply_month_deltas(month_deltas(prev, self))
+        resource_ids = [self.resource_id, prev.resource_id if prev else None]
+        if any(resource_ids):
+            accounts = virtual_account_ids(resource_ids)
+            apply_ledger_deltas(ledger_deltas(prev, self, accounts))
+        invalidate_value_per_unit(events_inputs([prev, self]))
+        if self.process_id or (prev and prev.process_id):
+            from django_rea.valueaccounting.models.process import invalidate_process_json
+            invalidate_process_json()
 
             # for handling faircoin
             # if self.resource:
             #    if self.resource.resource_type.is_virtual_account():
             # call the faircoin method here, pass the event info needed
 
+    @transaction.atomic
     def delete(self, *args, **kwargs):
-        if self.is_contribution:
-            agent = self.from_agent
-            context_agent = self.context_agent
-            resource_type = self.resource_type
-            event_type = self.event_type
-            if agent and context_agent and resource_type:
-                try:
-                    summary = CachedEventSummary.objects.get(
-                        agent=agent,
-                        context_agent=context_agent,
-                        resource_type=resource_type,
-                        event_type=event_type)
-                    summary.quantity -= self.quantity
-                    if summary.quantity:
-                        summary.save()
-                    else:
-                        summary.delete()
-                except CachedEventSummary.DoesNotExist:
-                    pass
+        deltas = summary_deltas(self, None)
+        months = month_deltas(self, None)
+        days = {}
+        if self.resource_id:
+            days = ledger_deltas(self, None, virtual_account_ids([self.resource_id]))
+        inputs = events_inputs([self])
         super(EconomicEvent, self).delete(*args, **kwargs)
+        apply_summary_deltas(deltas)
+        apply_month_deltas(months)
+        apply_ledger_deltas(days)
+        invalidate_value_per_unit(inputs)
+        if self.process_id:
+            from django_rea.valueaccounting.models.process import invalidate_process_json
+            invalidate_process_json()
 
     def previous_events(self):
         """ Experimental method:
@@ -302,9 +688,9 @@ class EconomicEvent(models.Model):
         # import pdb; pdb.set_trace()
         prevs = []
         # todo exchange redesign fallout
-        give = EventType.objects.get(name="Give")
-        ret = EventType.objects.get(name="Receive")
-        cet = EventType.objects.get(name="Resource Consumption")
+        give = EventType.objects.cached(name="Give")
+        ret = EventType.objects.cached(name="Receive")
+        cet = EventType.objects.cached(name="Resource Consumption")
         if self.event_type == ret:
             if self.transfer:
                 give_evt = self.transfer.give_event()
@@ -498,7 +884,7 @@ class EconomicEvent(models.Model):
                     flows.append(prev)
                     prev.incoming_value_flows_dfs(flows, visited, depth)
 
-    def roll_up_value(self, path, depth, visited, value_equation):
+    def roll_up_value(self, path, depth, visited, value_equation, rollup=None):
         # EconomicEvent method
         # rollup stage change
         stage = None
@@ -508,84 +894,16 @@ class EconomicEvent(models.Model):
         if stage:
             self.resource.historical_stage = stage
         # todo 3d:
-        return self.resource.roll_up_value(path, depth, visited, value_equation)
+        return self.resource.roll_up_value(path, depth, visited, value_equation, rollup)
 
     def compute_income_shares(self, value_equation, d_qty, events, visited):
         # EconomicEvent method
         # income_shares stage change
-        stage = None
-        # what is no commitment? Can that happen with staged events?
-        if self.commitment:
-            stage = self.commitment.stage
-        if stage:
-            self.resource.historical_stage = stage
-        # todo 3d:
-        return self.resource.compute_income_shares(value_equation, d_qty, events, visited)
+        from django_rea.valueaccounting.models.income import IncomeShares
+        IncomeShares(value_equation, events, visited).for_event(self, d_qty)
 
     def bucket_rule(self, value_equation):
-        from django_rea.valueaccounting.models.distribution import ValueEquationBucketRule
-        brs = ValueEquationBucketRule.objects.filter(
-            value_equation_bucket__value_equation=value_equation,
-            event_type=self.event_type)
-        # import pdb; pdb.set_trace()
-        candidates = []
-        for br in brs:
-            if br.claim_creation_equation:
-                filter = br.filter_rule_deserialized()
-                if filter:
-                    rts = filter.get('resource_types')
-                    if rts:
-                        if self.resource_type in rts:
-                            br.filter = filter
-                            candidates.append(br)
-                    pts = filter.get('process_types')
-                    if pts:
-                        if self.process:
-                            if self.process.process_type:
-                                if self.process.process_type in pts:
-                                    br.filter = filter
-                                    candidates.append(br)
-                else:
-                    br.filter = filter
-                    candidates.append(br)
-        if not candidates:
-            return None
-        candidates = list(set(candidates))
-        # import pdb; pdb.set_trace()
-        if len(candidates) == 1:
-            return candidates[0]
-        filtered = [c for c in candidates if c.filter]
-        if not filtered:
-            return candidates[0]
-        best_fit = []
-        if filtered:
-            if len(filtered) == 1:
-                return filtered[0]
-            for f in filtered:
-                pts = f.filter.get("process_types")
-                rts = filter.get('resource_types')
-                if pts and rts:
-                    f.score = 2
-                    best_fit.append(f)
-                elif pts:
-                    f.score = 1.5
-                    better = [b for b in best_fit if b.score > 1.5]
-                    if not better:
-                        best_fit.append(f)
-                elif rts:
-                    if not best_fit:
-                        f.score = 1
-                        best_fit.append(f)
-        if best_fit:
-            # todo: necessary? I doubt it...
-            # best_fit = list(set(best_fit))
-            # todo: this (below) must be mediated by which VE
-            # if len(best_fit) > 1:
-            #    import pdb; pdb.set_trace()
-            if len(best_fit) == 1:
-                return best_fit[0]
-            return best_fit[0]
-        return None
+        return value_equation.bucket_rule_index().rule_for_event(self)
 
     def bucket_rule_for_context_agent(self):
         bucket_rule = None
@@ -1191,6 +1509,7 @@ class CachedEventSummary(models.Model):
 
     class Meta:
         ordering = ('agent', 'context_agent', 'resource_type')
+        unique_together = ('agent', 'context_agent', 'resource_type', 'event_type')
 
     def __str__(self):
         agent_name = "Unknown"
@@ -1239,47 +1558,34 @@ class CachedEventSummary(models.Model):
 
     @classmethod
     def summarize_all_events(cls):
+        """Rebuilds every summary from db-side Sums over contribution events."""
+        from django_rea.valueaccounting.models.recipe import EconomicResourceType
         # import pdb; pdb.set_trace()
-        old_summaries = CachedEventSummary.objects.all()
-        old_summaries.delete()
-        event_list = EconomicEvent.objects.filter(is_contribution="true")
-        summaries = {}
         # todo: very temporary hack
         context_agent = EconomicAgent.objects.get(name="Not defined")
-        for event in event_list:
-            # todo: very temporary hack
-            if not event.context_agent:
-                event.context_agent = context_agent
-                event.save()
-            try:
-                key = "-".join([
-                    str(event.from_agent.id),
-                    str(event.context_agent.id),
-                    str(event.resource_type.id),
-                    str(event.event_type.id)
-                ])
-                if not key in summaries:
-                    summaries[key] = EventSummary(
-                        event.from_agent,
-                        event.context_agent,
-                        event.resource_type,
-                        event.event_type,
-                        Decimal('0.0'))
-                summaries[key].quantity += event.quantity
-            except AttributeError:
-                msg = " ".join(["invalid summary key:", key])
+        EconomicEvent.objects.filter(
+            is_contribution=True,
+            context_agent=None).update(context_agent=context_agent)
+        old_summaries = CachedEventSummary.objects.all()
+        old_summaries.delete()
+        totals = EconomicEvent.objects.filter(is_contribution=True).values(
+            "from_agent", "context_agent", "resource_type", "event_type").annotate(
+            total=Sum("quantity")).order_by()
+        rates = dict(EconomicResourceType.objects.values_list("id", "value_per_unit"))
+        summaries = []
+        for row in totals:
+            if not row["from_agent"]:
+                msg = " ".join(["invalid summary key:", str(row)])
                 assert False, msg
-        summaries = summaries.values()
-        for summary in summaries:
-            ces = cls(
-                agent=summary.agent,
-                context_agent=summary.context_agent,
-                resource_type=summary.resource_type,
-                event_type=summary.event_type,
-                resource_type_rate=summary.resource_type.value_per_unit,
-                quantity=summary.quantity,
-            )
-            ces.save()
+            summaries.append(cls(
+                agent_id=row["from_agent"],
+                context_agent_id=row["context_agent"],
+                resource_type_id=row["resource_type"],
+                event_type_id=row["event_type"],
+                resource_type_rate=rates[row["resource_type"]],
+                quantity=row["total"],
+            ))
+        cls.objects.bulk_create(summaries)
         return cls.objects.all()
 
     def quantity_formatted(self):
@@ -1293,6 +1599,161 @@ class CachedEventSummary(models.Model):
         return self.resource_type.name
 
 
+class MonthlyEventSummaryManager(models.Manager):
+    def agent_totals(self, start, end, **filters):
+        """Event quantities per from_agent for the dates start to end, inclusive,
+
+        as a list of (agent id, quantity), largest first.
+        Whole months in the range are read from the monthly summaries,
+        only the partial months at its ends from the events themselves.
+        Only work events are summarized, so only work events are counted.
+        filters are lookups that EconomicEvent and MonthlyEventSummary share,
+        like context_agent__in.
+        """
+        first = month_start(start)
+        if first < start:
+            first = next_month(first)
+        last = month_start(end + datetime.timedelta(days=1))
+        events = EconomicEvent.objects.filter(**filters).filter(event_type__relationship="work")
+        totals = {}
+        if first < last:
+            months = self.filter(month__gte=first, month__lt=last, **filters)
+            for agent_id, quantity in months.values_list("agent").annotate(
+                    total=Sum("quantity")).order_by():
+                totals[agent_id] = totals.get(agent_id, Decimal("0")) + quantity
+            events = events.filter(
+                Q(event_date__gte=start, event_date__lt=first) |
+                Q(event_date__gte=last, event_date__lte=end))
+        else:
+            events = events.filter(event_date__range=(start, end))
+        for agent_id, quantity in events.values_list("from_agent").annotate(
+                total=Sum("quantity")).order_by():
+            totals[agent_id] = totals.get(agent_id, Decimal("0")) + quantity
+        return sorted(totals.items(), key=lambda total: total[1], reverse=True)
+
+
+class MonthlyEventSummary(models.Model):
+    """The quantity of the work events of one agent, context agent and event type
+
+    in one month, kept up to date by EconomicEvent save and delete.
+    """
+    agent = models.ForeignKey(EconomicAgent,
+                              blank=True, null=True,
+                              related_name="monthly_events", verbose_name=_('agent'))
+    context_agent = models.ForeignKey("EconomicAgent",
+                                      blank=True, null=True,
+                                      verbose_name=_('context agent'), related_name='context_monthly_events')
+    event_type = models.ForeignKey("EventType",
+                                   verbose_name=_('event type'), related_name='monthly_events')
+    month = models.DateField(_('month'))
+    # a month of event quantities, so wider than EconomicEvent.quantity
+    quantity = models.DecimalField(_('quantity'), max_digits=20, decimal_places=2,
+                                   default=Decimal("0.0"))
+
+    objects = MonthlyEventSummaryManager()
+
+    class Meta:
+        ordering = ('month', 'agent', 'context_agent')
+        unique_together = ('agent', 'context_agent', 'event_type', 'month')
+
+    @classmethod
+    def summarize_all_events(cls):
+        """Rebuilds every monthly summary from the work events."""
+        totals = {}
+        events = EconomicEvent.objects.filter(event_type__relationship="work").values_list(
+            "from_agent", "context_agent", "event_type", "event_date", "quantity")
+        for agent_id, context_agent_id, event_type_id, event_date, quantity in events:
+            key = (agent_id, context_agent_id, event_type_id, month_start(event_date))
+            totals[key] = totals.get(key, Decimal("0")) + quantity
+        cls.objects.all().delete()
+        cls.objects.bulk_create([
+            cls(quantity=quantity, **_month_filter(key))
+            for key, quantity in totals.items() if quantity])
+        return cls.objects.all()
+
+
+class VirtualAccountBalanceManager(models.Manager):
+    def balances(self, date, accounts=None):
+        """Virtual account balances at the end of date, by resource id.
+
+        Accounts with no events by then are left out.
+        """
+        days = self.filter(date__lte=date)
+        if accounts is not None:
+            days = days.filter(resource__in=accounts)
+        latest = Q(pk__in=[])
+        for row in days.values("resource").annotate(last=Max("date")).order_by():
+            latest |= Q(resource_id=row["resource"], date=row["last"])
+        return dict(self.filter(latest).values_list("resource", "balance"))
+
+    def flows(self, start=None, end=None, accounts=None):
+        """Total in and out of virtual accounts from start to end, inclusive."""
+        days = self.all()
+        if start:
+            days = days.filter(date__gte=start)
+        if end:
+            days = days.filter(date__lte=end)
+        if accounts is not None:
+            days = days.filter(resource__in=accounts)
+        totals = days.aggregate(cash_in=Sum("quantity_in"), cash_out=Sum("quantity_out"))
+        return totals["cash_in"] or Decimal("0"), totals["cash_out"] or Decimal("0")
+
+
+class VirtualAccountBalance(models.Model):
+    """What went in and out of one virtual account on one day,
+
+    and its balance at the end of that day,
+    kept up to date by EconomicEvent save and delete.
+    Days without events have no row.
+    """
+    resource = models.ForeignKey("EconomicResource",
+                                 verbose_name=_('resource'), related_name='daily_balances')
+    date = models.DateField(_('date'))
+    # sums of many event quantities, so wider than EconomicEvent.quantity
+    quantity_in = models.DecimalField(_('quantity in'), max_digits=20, decimal_places=2,
+                                      default=Decimal("0.0"))
+    quantity_out = models.DecimalField(_('quantity out'), max_digits=20, decimal_places=2,
+                                       default=Decimal("0.0"))
+    balance = models.DecimalField(_('balance'), max_digits=20, decimal_places=2,
+                                  default=Decimal("0.0"))
+
+    objects = VirtualAccountBalanceManager()
+
+    class Meta:
+        ordering = ('resource', 'date')
+        unique_together = ('resource', 'date')
+
+    @classmethod
+    def summarize_all_events(cls):
+        """Rebuilds every account day from the events."""
+        totals = {}
+        events = EconomicEvent.objects.filter(
+            resource__resource_type__behavior="account").values_list(
+            "resource", "event_date", "event_type__resource_effect", "quantity")
+        for resource_id, date, resource_effect, quantity in events:
+            day = totals.setdefault((resource_id, date), [Decimal("0"), Decimal("0")])
+            if "+" in resource_effect and "-" not in resource_effect:
+                day[0] += quantity
+            else:
+                day[1] += quantity
+        cls.objects.all().delete()
+        days = []
+        balances = {}
+        for (resource_id, date), (quantity_in, quantity_out) in sorted(totals.items()):
+            if not quantity_in and not quantity_out:
+                continue
+            balance = balances.get(resource_id, Decimal("0")) + quantity_in - quantity_out
+            balances[resource_id] = balance
+            days.append(cls(
+                resource_id=resource_id,
+                date=date,
+                quantity_in=quantity_in,
+                quantity_out=quantity_out,
+                balance=balance))
+        cls.objects.bulk_create(days)
+        return cls.objects.all()
+
+
 @python_2_unicode_compatible
 class AccountingReference(models.Model):
     code = models.CharField(_('code'), max_length=128, unique=True)
@@ -9,6 +9,10 @@ from django.utils.encoding import python_2_unicode_compatible
 
 from django_rea.valueaccounting.models.resource import EconomicResource
 
+from django_rea.valueaccounting.models.misc import VersionedCache
+
+from ._utils import LookupManager
+
 
 @python_2_unicode_compatible
 class Facet(models.Model):
@@ -25,6 +29,20 @@ class Facet(models.Model):
         return ", ".join([fv.value for fv in self.values.all()])
 
 
+class FacetValueManager(models.Manager):
+    def from_filter(self, vals):
+        """ The FacetValues named by a facet filter, in one query.
+
+            vals are "facet name: value" strings as the facet
+            filter posts them.
+        """
+        q = Q(pk__in=[])
+        for val in vals:
+            fname, fvalue = val.split(":", 1)
+            q |= Q(facet__name=fname, value=fvalue.strip())
+        return list(self.filter(q).select_related("facet"))
+
+
 @python_2_unicode_compatible
 class FacetValue(models.Model):
     facet = models.ForeignKey(Facet,
@@ -32,6 +50,8 @@ class FacetValue(models.Model):
     value = models.CharField(_('value'), max_length=32)
     description = models.TextField(_('description'), blank=True, null=True)
 
+    objects = FacetValueManager()
+
     class Meta:
         unique_together = ('facet', 'value')
         ordering = ('facet', 'value')
@@ -145,68 +165,24 @@ class ProcessPattern(models.Model):
         """
         # import pdb; pdb.set_trace()
         from django_rea.valueaccounting.models.recipe import EconomicResourceType
-        pattern_facet_values = self.facets_for_event_type(event_type)
-        facet_values = [pfv.facet_value for pfv in pattern_facet_values]
-        facets = {}
-        for fv in facet_values:
-            if fv.facet not in facets:
-                facets[fv.facet] = []
-            facets[fv.facet].append(fv.value)
-
-        fv_ids = [fv.id for fv in facet_values]
-        rt_facet_values = ResourceTypeFacetValue.objects.filter(facet_value__id__in=fv_ids)
-
-        rts = {}
-        for rtfv in rt_facet_values:
-            rt = rtfv.resource_type
-            if rt not in rts:
-                rts[rt] = []
-            rts[rt].append(rtfv.facet_value)
-
-        # import pdb; pdb.set_trace()
-        matches = []
-
-        for rt, facet_values in rts.iteritems():
-            match = True
-            for facet, values in facets.iteritems():
-                rt_fv = [fv for fv in facet_values if fv.facet == facet]
-                if rt_fv:
-                    rt_fv = rt_fv[0]
-                    if rt_fv.value not in values:
-                        match = False
-                else:
-                    match = False
-            if match:
-                matches.append(rt)
-
-        answer_ids = [a.id for a in matches]
-        answer = EconomicResourceType.objects.filter(id__in=answer_ids)
-        return answer
+        rt_ids = facet_index().pattern_resource_type_ids(self.id, [event_type.id])
+        return EconomicResourceType.objects.filter(id__in=rt_ids)
 
     def resource_types_for_relationship(self, relationship):
         from django_rea.valueaccounting.models.recipe import EconomicResourceType
         # import pdb; pdb.set_trace()
-        ets = [f.event_type for f in self.facets.filter(event_type__relationship=relationship)]
+        index = facet_index()
+        ets = index.pattern_event_type_ids(self.id, relationship)
         if ets:
-            ets = list(set(ets))
-            if len(ets) == 1:
-                return self.get_resource_types(ets[0])
-            else:
-                rts = []
-                for et in ets:
-                    rts.extend(list(self.get_resource_types(et)))
-                rt_ids = [rt.id for rt in rts]
-                return EconomicResourceType.objects.filter(id__in=rt_ids)
+            rt_ids = index.pattern_resource_type_ids(self.id, ets)
+            return EconomicResourceType.objects.filter(id__in=rt_ids)
         else:
             return EconomicResourceType.objects.none()
 
     def all_resource_types(self):
         from django_rea.valueaccounting.models.recipe import EconomicResourceType
-        rts = []
-        ets = self.event_types()
-        for et in ets:
-            rts.extend(self.get_resource_types(et))
-        rt_ids = [rt.id for rt in rts]
+        index = facet_index()
+        rt_ids = index.pattern_resource_type_ids(self.id, index.pattern_event_type_ids(self.id))
         return EconomicResourceType.objects.filter(id__in=rt_ids)
 
     def work_resource_types(self):
@@ -418,6 +394,101 @@ class ProcessPattern(models.Model):
         return fvs_for_facet
 
 
+def bitset_ids(bits):
+    """The ids set in a bitset, in ascending order."""
+    ids = []
+    while bits:
+        low = bits & -bits
+        ids.append(low.bit_length() - 1)
+        bits ^= low
+    return ids
+
+
+class FacetIndex(object):
+    """Which resource types have which facet values, from two queries,
+
+    as a bitset of resource type ids for each facet value.
+    A filter of facet values matches the resource types that have,
+    for every facet in the filter, at least one of its values:
+    bitsets are ORed within a facet and ANDed across facets.
+    Filter and pattern results are kept until the index goes stale.
+    """
+
+    def __init__(self):
+        self.facets = dict(FacetValue.objects.values_list("id", "facet"))
+        self.bits = {}
+        for rt_id, fv_id in ResourceTypeFacetValue.objects.values_list("resource_type", "facet_value"):
+            self.bits[fv_id] = self.bits.get(fv_id, 0) | (1 << rt_id)
+        self.patterns = {}
+        pfvs = PatternFacetValue.objects.values_list(
+            "pattern", "event_type", "event_type__relationship", "facet_value")
+        for pattern_id, et_id, relationship, fv_id in pfvs:
+            event_types = self.patterns.setdefault(pattern_id, {})
+            event_types.setdefault((et_id, relationship), []).append(fv_id)
+        self.filters = {}
+        self.pattern_filters = {}
+
+    def matching(self, facet_value_ids):
+        """The bitset of resource types matching a filter of facet value ids.
+
+        An empty filter matches nothing.
+        """
+        key = frozenset(facet_value_ids)
+        if key not in self.filters:
+            by_facet = {}
+            for fv_id in key:
+                facet_id = self.facets.get(fv_id)
+                by_facet[facet_id] = by_facet.get(facet_id, 0) | self.bits.get(fv_id, 0)
+            bits = 0
+            if by_facet:
+                bits = -1
+                for facet_bits in by_facet.values():
+                    bits &= facet_bits
+            self.filters[key] = bits
+        return self.filters[key]
+
+    def resource_type_ids(self, facet_value_ids):
+        return bitset_ids(self.matching(facet_value_ids))
+
+    def matches(self, resource_type_id, facet_value_ids):
+        return bool(self.matching(facet_value_ids) & (1 << resource_type_id))
+
+    def pattern_event_type_ids(self, pattern_id, relationship=None):
+        """The event types a pattern has facet values for,
+
+        optionally only those with the relationship.
+        """
+        return [et_id for et_id, et_relationship in self.patterns.get(pattern_id, {})
+                if relationship is None or et_relationship == relationship]
+
+    def pattern_resource_type_ids(self, pattern_id, event_type_ids):
+        """The resource types matching any of the pattern's facet value filters
+
+        for the event types.
+        """
+        key = (pattern_id, frozenset(event_type_ids))
+        if key not in self.pattern_filters:
+            bits = 0
+            for (et_id, relationship), fv_ids in self.patterns.get(pattern_id, {}).items():
+                if et_id in key[1]:
+                    bits |= self.matching(fv_ids)
+            self.pattern_filters[key] = bitset_ids(bits)
+        return self.pattern_filters[key]
+
+
+_facet_index = VersionedCache("facet_index", FacetIndex)
+
+
+def facet_index():
+    """The FacetIndex, rebuilt when facet values, resource type facets
+    or pattern facets change."""
+    return _facet_index.get()
+
+
+def invalidate_facet_index():
+    _facet_index.invalidate()
+
+
 @python_2_unicode_compatible
 class PatternUseCase(models.Model):
     pattern = models.ForeignKey(ProcessPattern,
@@ -448,7 +519,7 @@ class TransferTypeFacetValue(models.Model):
         return ": ".join([self.transfer_type.name, self.facet_value.facet.name, self.facet_value.value])
 
 
-class UseCaseManager(models.Manager):
+class UseCaseManager(LookupManager):
     def get_by_natural_key(self, identifier):
         # import pdb; pdb.set_trace()
         return self.get(identifier=identifier)
@@ -0,0 +1,718 @@
+"""Income shares computed over a flow graph loaded ahead of time.
+
+The value flows behind a shipment or order item run backwards from the
+resource or process through producing processes, their inputs, and the
+exchanges that bought resources and were paid with contributed cash.
+FlowGraph loads all of that a level at a time, with a few queries per
+level instead of a few per resource, process and exchange.
+
+IncomeShares walks the graph exactly as the compute_income_shares
+methods of EconomicResource, Process, Exchange and EconomicEvent always
+did, producing the same events in the same order with the same shares,
+but iteratively: each step is a generator that yields the steps it
+depends on, so long supply chains cannot hit the recursion limit.
+"""
+
+from decimal import *
+
+from django.db.models import Q
+
+
+EVENT_RELATED = (
+    "event_type",
+    "resource_type",
+    "process",
+    "from_agent",
+    "transfer__transfer_type",
+    "commitment__stage",
+)
+
+# the related objects of EVENT_RELATED kept on event copies
+EVENT_RELATED_FIELDS = (
+    "event_type",
+    "resource_type",
+    "process",
+    "from_agent",
+    "transfer",
+    "commitment",
+)
+
+INPUT_RELATIONSHIPS = ("use", "consume", "cite")
+
+
+def fresh_copy(obj, related=()):
+    """A copy of a model instance, as Model.from_db would make it
+
+    from a new query, with the related objects named in related.
+    """
+    fields = obj._meta.concrete_fields
+    clone = obj.__class__.from_db(
+        obj._state.db,
+        [field.attname for field in fields],
+        [getattr(obj, field.attname) for field in fields])
+    for name in related:
+        setattr(clone, name, getattr(obj, name))
+    return clone
+
+
+def as_stored(obj, field_name, value):
+    """A decimal value as it would be read back from the database."""
+    field = obj._meta.get_field(field_name)
+    return Decimal(value).quantize(Decimal(".1") ** field.decimal_places)
+
+
+def is_producing_event(resource, event):
+    # the same choice as EconomicResource.producing_events
+    if resource.quality and resource.quality < 0:
+        return event.event_type.resource_effect == '<'
+    return event.event_type.relationship == 'out'
+
+
+def is_purchase_event(event):
+    # the same choice as EconomicResource.purchase_events
+    return event.event_type.name == "Receive" and not event.is_contribution
+
+
+class FlowGraph(object):
+    """Resources, processes, exchanges, transfers and events
+    reachable from the starting points, in adjacency maps.
+
+    Every event and resource is handed out as a fresh copy,
+    as a new query would return it, because the income share
+    computation sets share and value on the objects it is given.
+    Anything not loaded yet is loaded on demand.
+    """
+
+    def __init__(self):
+        self.events = {}
+        self.resources = {}
+        self.processes = {}
+        self.exchanges = {}
+        self.transfers = {}
+        self.resource_event_ids = {}
+        self.process_event_ids = {}
+        self.exchange_transfer_ids = {}
+        self.exchange_work_event_ids = {}
+        self.transfer_event_ids = {}
+        self.expanded = set()
+
+    def load(self, resources=(), processes=(), exchanges=(), cash_resources=()):
+        """Loads everything reachable from the given ids, a level at a time.
+
+        Cash resources only need their own events,
+        for their cash contributions.
+        """
+        todo_resources = set(resources) - self.expanded
+        todo_cash = set(cash_resources) - set(self.resource_event_ids)
+        todo_processes = set(processes) - set(self.process_event_ids)
+        todo_exchanges = set(exchanges) - set(self.exchange_transfer_ids)
+        while todo_resources or todo_cash or todo_processes or todo_exchanges:
+            next_resources = set()
+            next_cash = set()
+            next_processes = set()
+            next_exchanges = set()
+            self._load_resources((todo_resources | todo_cash) - set(self.resource_event_ids))
+            for resource_id in todo_resources:
+                self.expanded.add(resource_id)
+                resource = self.resources.get(resource_id)
+                if resource is None:
+                    continue
+                for event_id in self.resource_event_ids[resource_id]:
+                    event = self.events[event_id]
+                    if event.process_id and is_producing_event(resource, event):
+                        next_processes.add(event.process_id)
+                    if event.exchange_id and is_purchase_event(event):
+                        next_exchanges.add(event.exchange_id)
+            for event in self._load_processes(todo_processes):
+                if event.resource_id and event.event_type.relationship != 'out':
+                    if (event.event_type.relationship in INPUT_RELATIONSHIPS
+                            or event.event_type.name == "To Be Changed"):
+                        next_resources.add(event.resource_id)
+            for event in self._load_exchanges(todo_exchanges):
+                if event.resource_id and event.event_type.name == "Give":
+                    next_cash.add(event.resource_id)
+            todo_resources = next_resources - self.expanded
+            todo_cash = next_cash - set(self.resource_event_ids)
+            todo_processes = next_processes - set(self.process_event_ids)
+            todo_exchanges = next_exchanges - set(self.exchange_transfer_ids)
+
+    def _add_events(self, events, index, key):
+        added = []
+        for event in events:
+            event = self.events.setdefault(event.id, event)
+            index[key(event)].append(event.id)
+            added.append(event)
+        return added
+
+    def _load_resources(self, ids):
+        from django_rea.valueaccounting.models.event import EconomicEvent
+        from django_rea.valueaccounting.models.resource import EconomicResource
+        if not ids:
+            return []
+        for resource in EconomicResource.objects.filter(id__in=ids):
+            self.resources[resource.id] = resource
+        for id in ids:
+            self.resource_event_ids[id] = []
+        events = EconomicEvent.objects.filter(resource__id__in=ids).select_related(*EVENT_RELATED)
+        return self._add_events(events, self.resource_event_ids, lambda e: e.resource_id)
+
+    def _load_processes(self, ids):
+        from django_rea.valueaccounting.models.event import EconomicEvent
+        from django_rea.valueaccounting.models.process import Process
+        if not ids:
+            return []
+        for process in Process.objects.filter(id__in=ids).select_related("context_agent"):
+            self.processes[process.id] = process
+        for id in ids:
+            self.process_event_ids[id] = []
+        events = EconomicEvent.objects.filter(process__id__in=ids).select_related(*EVENT_RELATED)
+        return self._add_events(events, self.process_event_ids, lambda e: e.process_id)
+
+    def _load_exchanges(self, ids):
+        from django_rea.valueaccounting.models.event import EconomicEvent
+        from django_rea.valueaccounting.models.trade import Exchange, Transfer
+        if not ids:
+            return []
+        for exchange in Exchange.objects.filter(id__in=ids).select_related("use_case"):
+            self.exchanges[exchange.id] = exchange
+        for id in ids:
+            self.exchange_transfer_ids[id] = []
+            self.exchange_work_event_ids[id] = []
+        transfers = Transfer.objects.filter(
+            exchange__id__in=ids).select_related("transfer_type").order_by("transfer_date", "id")
+        transfer_ids = []
+        for transfer in transfers:
+            self.transfers[transfer.id] = transfer
+            self.exchange_transfer_ids[transfer.exchange_id].append(transfer.id)
+            self.transfer_event_ids[transfer.id] = []
+            transfer_ids.append(transfer.id)
+        events = EconomicEvent.objects.filter(
+            Q(transfer__id__in=transfer_ids) |
+            Q(exchange__id__in=ids, event_type__relationship="work")
+        ).select_related(*EVENT_RELATED)
+        added = []
+        for event in events:
+            event = self.events.setdefault(event.id, event)
+            if event.transfer_id in self.transfer_event_ids:
+                self.transfer_event_ids[event.transfer_id].append(event.id)
+            if event.exchange_id in self.exchange_work_event_ids and event.event_type.relationship == "work":
+                self.exchange_work_event_ids[event.exchange_id].append(event.id)
+            added.append(event)
+        return added
+
+    def event(self, event):
+        """A fresh copy of a loaded event, with a fresh copy of its resource."""
+        copy = fresh_copy(event, EVENT_RELATED_FIELDS)
+        if event.resource_id in self.resources:
+            copy.resource = fresh_copy(self.resources[event.resource_id])
+        return copy
+
+    def resource_events(self, resource_id):
+        if resource_id not in self.resource_event_ids:
+            self.load(cash_resources=[resource_id])
+        return [self.event(self.events[id]) for id in self.resource_event_ids[resource_id]]
+
+    def process_events(self, process_id):
+        if process_id not in self.process_event_ids:
+            self.load(processes=[process_id])
+        return [self.event(self.events[id]) for id in self.process_event_ids[process_id]]
+
+    def exchange_transfers(self, exchange_id):
+        if exchange_id not in self.exchange_transfer_ids:
+            self.load(exchanges=[exchange_id])
+        return [self.transfers[id] for id in self.exchange_transfer_ids[exchange_id]]
+
+    def transfer_events(self, transfer_id):
+        return [self.event(self.events[id]) for id in self.transfer_event_ids[transfer_id]]
+
+    def exchange_work_events(self, exchange_id):
+        if exchange_id not in self.exchange_work_event_ids:
+            self.load(exchanges=[exchange_id])
+        return [self.event(self.events[id]) for id in self.exchange_work_event_ids[exchange_id]]
+
+    def process(self, process_id):
+        if process_id not in self.processes:
+            self.load(processes=[process_id])
+        return self.processes[process_id]
+
+    def exchange(self, exchange_id):
+        if exchange_id not in self.exchanges:
+            self.load(exchanges=[exchange_id])
+        return self.exchanges[exchange_id]
+
+    def set_event_value(self, event_id, value):
+        # keep loaded events as the database now has them
+        if event_id in self.events:
+            event = self.events[event_id]
+            event.value = as_stored(event, "value", value)
+
+    def set_value_per_unit(self, resource_id, value_per_unit):
+        if resource_id in self.resources:
+            resource = self.resources[resource_id]
+            resource.value_per_unit = as_stored(resource, "value_per_unit", value_per_unit)
+
+
+class IncomeShares(object):
+    """One income share computation for a value equation.
+
+    Shares are set on the events appended to ``events``;
+    ``visited`` holds the processes, exchanges and trigger events
+    already credited, and may be shared between computations.
+    """
+
+    def __init__(self, value_equation, events, visited, graph=None):
+        self.value_equation = value_equation
+        self.events = events
+        self.visited = visited
+        self.graph = graph or FlowGraph()
+        self.compatible_agents = {}
+
+    def run(self, steps):
+        stack = [steps]
+        while stack:
+            try:
+                stack.append(next(stack[-1]))
+            except StopIteration:
+                stack.pop()
+
+    def for_resource(self, resource, quantity):
+        self.graph.load(resources=[resource.id])
+        self.run(self.resource_shares(resource, quantity))
+
+    def for_resource_use(self, resource, use_event, use_value, resource_value):
+        self.graph.load(resources=[resource.id])
+        self.run(self.resource_use_shares(resource, use_event, use_value, resource_value))
+
+    def for_process(self, process, quantity):
+        self.graph.load(processes=[process.id])
+        self.run(self.process_shares(process, quantity))
+
+    def for_exchange(self, exchange, trigger_event, quantity):
+        self.graph.load(exchanges=[exchange.id])
+        self.run(self.exchange_shares(exchange, trigger_event, quantity))
+
+    def for_exchange_use(self, exchange, use_event, use_value, resource_value):
+        self.graph.load(exchanges=[exchange.id])
+        self.run(self.exchange_use_shares(exchange, use_event, use_value, resource_value))
+
+    def for_event(self, event, quantity):
+        if event.resource_id:
+            self.graph.load(resources=[event.resource_id])
+        self.run(self.event_shares(event, quantity))
+
+    # helpers
+
+    def claim_value(self, event, value):
+        br = event.bucket_rule(self.value_equation)
+        if br:
+            return br, br.compute_claim_value(event)
+        return br, value
+
+    def compatible(self, process):
+        agent_id = process.context_agent_id
+        if agent_id not in self.compatible_agents:
+            self.compatible_agents[agent_id] = process.context_agent.compatible_value_equation(self.value_equation)
+        return self.compatible_agents[agent_id]
+
+    def save_event(self, event):
+        event.save()
+        self.graph.set_event_value(event.id, event.value)
+
+    def roll_up(self, target):
+        """Value per unit of a resource, or of an event's resource at its stage,
+        rolled up from scratch as a separate run, as before.
+        """
+        from django_rea.valueaccounting.models.rollup import ValueRollup
+        rollup = ValueRollup()
+        value_per_unit = target.roll_up_value([], 0, set(), self.value_equation, rollup)
+        for event_id, value in rollup.event_values.items():
+            self.graph.set_event_value(event_id, value)
+        for resource_id, vpu in rollup.resource_values.items():
+            self.graph.set_value_per_unit(resource_id, vpu)
+        rollup.flush()
+        return value_per_unit
+
+    def producing_processes(self, resource, for_stage):
+        graph = self.graph
+        processes = [graph.process(pe.process_id) for pe in graph.resource_events(resource.id)
+                     if pe.process_id and is_producing_event(resource, pe)]
+        processes = list(set(processes))
+        if for_stage and resource.stage_id:
+            try:
+                stage = resource.historical_stage
+                stage_id = stage.id if stage is not None else None
+            except AttributeError:
+                stage_id = resource.stage_id
+            processes = [p for p in processes if p.process_type_id == stage_id]
+        return processes
+
+    def transfer_events(self, exchange, reciprocal, event_type_name):
+        events = []
+        for transfer in self.graph.exchange_transfers(exchange.id):
+            if bool(transfer.transfer_type.is_reciprocal) == reciprocal:
+                for event in self.graph.transfer_events(transfer.id):
+                    if event.event_type.name == event_type_name:
+                        events.append(event)
+        return events
+
+    def resource_receive_events(self, exchange):
+        if exchange.use_case.name == "Incoming Exchange":
+            return [evt for evt in self.transfer_events(exchange, False, "Receive") if evt.resource_id]
+        return []
+
+    def expense_events(self, exchange):
+        if exchange.use_case.name == "Incoming Exchange":
+            return [evt for evt in self.transfer_events(exchange, False, "Receive") if not evt.resource_id]
+        return []
+
+    def payment_events(self, exchange):
+        events = self.transfer_events(exchange, True, "Give")
+        return [evt for evt in events if evt.transfer.transfer_type.is_currency]
+
+    def cash_contribution_events(self, resource):
+        return [evt for evt in self.graph.resource_events(resource.id)
+                if evt.transfer_id and evt.event_type.name == "Receive"
+                and evt.is_contribution and evt.transfer.transfer_type.is_currency]
+
+    def distribution(self, production_events, quantity):
+        produced_qty = sum(pe.quantity for pe in production_events)
+        distro_fraction = 1
+        distro_qty = quantity
+        if produced_qty > quantity:
+            distro_fraction = quantity / produced_qty
+            quantity = Decimal("0.0")
+        elif produced_qty <= quantity:
+            distro_qty = produced_qty
+            quantity -= produced_qty
+        return distro_fraction, distro_qty, quantity
+
+    # steps
+
+    def event_shares(self, event, quantity):
+        # EconomicEvent.compute_income_shares
+        stage = None
+        if event.commitment:
+            stage = event.commitment.stage
+        if stage:
+            event.resource.historical_stage = stage
+        yield self.resource_shares(event.resource, quantity)
+
+    def resource_shares(self, resource, quantity):
+        # EconomicResource.compute_income_shares
+        graph = self.graph
+        events = self.events
+        visited = self.visited
+        for evt in graph.resource_events(resource.id):
+            if not evt.is_contribution:
+                continue
+            br, value = self.claim_value(evt, evt.value)
+            if value:
+                vpu = value / evt.quantity
+                evt.share = quantity * vpu
+                events.append(evt)
+        for evt in graph.resource_events(resource.id):
+            if is_purchase_event(evt) and evt.exchange_id:
+                yield self.exchange_shares(graph.exchange(evt.exchange_id), evt, quantity)
+        citations = []
+        for process in self.producing_processes(resource, for_stage=True):
+            if process in visited:
+                continue
+            visited.add(process)
+            if not quantity:
+                continue
+            production_events = [e for e in graph.process_events(process.id)
+                                 if e.event_type.relationship == 'out' and e.resource_id == resource.id]
+            distro_fraction, distro_qty, quantity = self.distribution(production_events, quantity)
+            for pe in production_events:
+                br, value = self.claim_value(pe, pe.quantity)
+                pe.share = value * distro_fraction
+                pe.value = value
+                events.append(pe)
+            if not self.compatible(process):
+                continue
+            for ip in graph.process_events(process.id):
+                relationship = ip.event_type.relationship
+                if relationship == 'out':
+                    continue
+                if relationship == "work":
+                    if ip.is_contribution:
+                        br, value = self.claim_value(ip, ip.value)
+                        if br:
+                            ip.value = value
+                        ip.share = value * distro_fraction
+                        events.append(ip)
+                elif relationship == "use":
+                    if ip.resource:
+                        if ip.price:
+                            ip.value = ip.price
+                        else:
+                            ip.value = ip.quantity * ip.resource.value_per_unit_of_use
+                        self.save_event(ip)
+                        ip_value = ip.value * distro_fraction
+                        resource_value = self.roll_up(ip.resource)
+                        yield self.resource_use_shares(ip.resource, ip, ip_value, resource_value)
+                elif relationship == "consume" or ip.event_type.name == "To Be Changed":
+                    value_per_unit = self.roll_up(ip)
+                    ip.value = ip.quantity * value_per_unit
+                    self.save_event(ip)
+                    d_qty = ip.quantity * distro_fraction
+                    if ip.resource:
+                        yield self.event_shares(ip, d_qty)
+                elif relationship == "cite":
+                    if ip.resource:
+                        if ip.resource_type.unit_of_use:
+                            if ip.resource_type.unit_of_use.unit_type == "percent":
+                                citations.append(ip)
+                        else:
+                            ip.value = ip.quantity
+                        self.save_event(ip)
+                        ip_value = ip.value * distro_fraction
+                        resource_value = self.roll_up(ip.resource)
+                        yield self.resource_use_shares(ip.resource, ip, ip_value, resource_value)
+
+    def resource_use_shares(self, resource, use_event, use_value, resource_value):
+        # EconomicResource.compute_income_shares_for_use
+        graph = self.graph
+        events = self.events
+        visited = self.visited
+        for evt in graph.resource_events(resource.id):
+            if not evt.is_contribution:
+                continue
+            br, value = self.claim_value(evt, evt.value)
+            if value:
+                vpu = value / evt.quantity
+                evt.share = min(vpu, use_value)
+                events.append(evt)
+        for evt in graph.resource_events(resource.id):
+            # purchase_events will duplicate resource_contribution_events
+            if is_purchase_event(evt) and evt not in events and evt.exchange_id:
+                yield self.exchange_use_shares(graph.exchange(evt.exchange_id), use_event, use_value,
+                                               resource_value)
+        quantity = resource.quantity
+        for process in self.producing_processes(resource, for_stage=False):
+            if process in visited:
+                continue
+            visited.add(process)
+            if not quantity:
+                continue
+            production_events = [e for e in graph.process_events(process.id)
+                                 if e.event_type.relationship == 'out']
+            distro_fraction, distro_qty, quantity = self.distribution(production_events, quantity)
+            for pe in production_events:
+                br, value = self.claim_value(pe, pe.quantity)
+                pe.share = value * distro_fraction
+                events.append(pe)
+            if not self.compatible(process):
+                continue
+            for ip in graph.process_events(process.id):
+                relationship = ip.event_type.relationship
+                if relationship == 'out':
+                    continue
+                if relationship == "work":
+                    if ip.is_contribution:
+                        br, value = self.claim_value(ip, ip.value)
+                        if br:
+                            ip.value = value
+                        fraction = ip.value / resource_value
+                        ip.share = use_value * fraction
+                        events.append(ip)
+                elif relationship == "use":
+                    if ip.resource:
+                        if ip.price:
+                            ip.value = ip.price
+                        else:
+                            ip.value = ip.quantity * ip.resource.value_per_unit_of_use
+                        ip_value = ip.value * distro_fraction
+                        yield self.resource_use_shares(ip.resource, ip, ip_value, resource_value)
+                elif relationship == "consume" or ip.event_type.name == "To Be Changed":
+                    d_qty = ip.quantity * distro_fraction
+                    if ip.resource:
+                        yield self.resource_shares(ip.resource, d_qty)
+                elif relationship == "cite":
+                    if ip.resource:
+                        ip_value = ip.value * distro_fraction
+                        # as before, this value is used for the rest of the inputs
+                        resource_value = self.roll_up(ip.resource)
+                        yield self.resource_use_shares(ip.resource, ip, ip_value, resource_value)
+
+    def process_shares(self, process, quantity):
+        # Process.compute_income_shares
+        graph = self.graph
+        events = self.events
+        if process in self.visited:
+            return
+        self.visited.add(process)
+        if not quantity:
+            return
+        production_events = [e for e in graph.process_events(process.id)
+                             if e.event_type.relationship == 'out']
+        distro_fraction, distro_qty, quantity = self.distribution(production_events, quantity)
+        for pe in production_events:
+            br, value = self.claim_value(pe, pe.quantity)
+            pe.share = value * distro_fraction
+            events.append(pe)
+        if not self.compatible(process):
+            return
+        for ip in graph.process_events(process.id):
+            relationship = ip.event_type.relationship
+            if relationship == 'out':
+                continue
+            if relationship == "work":
+                if ip.is_contribution:
+                    br, value = self.claim_value(ip, ip.value)
+                    if br:
+                        ip.value = value
+                    ip.share = value * distro_fraction
+                    events.append(ip)
+            elif relationship == "use":
+                if ip.resource:
+                    if ip.price:
+                        ip.value = ip.price
+                    else:
+                        ip.value = ip.quantity * ip.resource.value_per_unit_of_use
+                    ip_value = ip.value * distro_fraction
+                    resource_value = self.roll_up(ip.resource)
+                    yield self.resource_use_shares(ip.resource, ip, ip_value, resource_value)
+            elif relationship == "consume" or ip.event_type.name == "To Be Changed":
+                d_qty = ip.quantity * distro_fraction
+                if d_qty:
+                    if ip.resource:
+                        yield self.resource_shares(ip.resource, d_qty)
+            elif relationship == "cite":
+                if ip.resource:
+                    ip_value = ip.value * distro_fraction
+                    resource_value = self.roll_up(ip.resource)
+                    yield self.resource_use_shares(ip.resource, ip, ip_value, resource_value)
+
+    def exchange_shares(self, exchange, trigger_event, quantity):
+        # Exchange.compute_income_shares
+        events = self.events
+        if trigger_event in self.visited:
+            return
+        self.visited.add(trigger_event)
+        trigger_fraction = 1
+        share = quantity / trigger_event.quantity
+        receipts = self.resource_receive_events(exchange)
+        if len(receipts) > 1:
+            rsum = sum(r.value for r in receipts)
+            trigger_fraction = trigger_event.value / rsum
+        payments = [evt for evt in self.payment_events(exchange)
+                    if evt.to_agent_id == trigger_event.from_agent_id]
+        if len(payments) == 1:
+            evt = payments[0]
+            value = evt.quantity
+            contributions = []
+            if evt.resource:
+                for cand in self.cash_contribution_events(evt.resource):
+                    br = cand.bucket_rule(self.value_equation)
+                    if br:
+                        cand.value = br.compute_claim_value(cand)
+                        if cand.value:
+                            contributions.append(cand)
+                for ct in contributions:
+                    fraction = ct.quantity / value
+                    ct.share = ct.value * share * fraction * trigger_fraction
+                    events.append(ct)
+            if not contributions:
+                # if contributions were credited,
+                # do not give credit for payment.
+                br, value = self.claim_value(evt, value)
+                evt.value = value
+                self.save_event(evt)
+                evt.share = value * share * trigger_fraction
+                events.append(evt)
+        elif len(payments) > 1:
+            total = sum(p.quantity for p in payments)
+            for evt in payments:
+                fraction = evt.quantity / total
+                if evt.resource:
+                    evt.share = evt.quantity * share * fraction * trigger_fraction
+                    events.append(evt)
+                else:
+                    br, value = self.claim_value(evt, evt.quantity)
+                    evt.value = value
+                    self.save_event(evt)
+                    evt.share = value * share * fraction * trigger_fraction
+                    events.append(evt)
+        for ex in self.expense_events(exchange):
+            for exp in self.payment_events(exchange):
+                if exp.to_agent_id != ex.from_agent_id:
+                    continue
+                br, value = self.claim_value(exp, exp.quantity)
+                exp.value = value
+                self.save_event(exp)
+                exp.share = value * share * trigger_fraction
+                events.append(exp)
+        for evt in self.graph.exchange_work_events(exchange.id):
+            if evt.is_contribution:
+                br, value = self.claim_value(evt, evt.quantity)
+                evt.value = value
+                self.save_event(evt)
+                evt.share = value * share * trigger_fraction
+                events.append(evt)
+        return
+        yield
+
+    def exchange_use_shares(self, exchange, use_event, use_value, resource_value):
+        # Exchange.compute_income_shares_for_use
+        events = self.events
+        locals = []
+        if exchange in self.visited:
+            return
+        self.visited.add(exchange)
+        payments = self.payment_events(exchange)
+        if len(payments) == 1:
+            evt = payments[0]
+            contributions = []
+            if evt.resource:
+                contributions = self.cash_contribution_events(evt.resource)
+                for ct in contributions:
+                    fraction = ct.quantity / resource_value
+                    ct.share = use_value * fraction
+                    events.append(ct)
+            if not contributions:
+                # if contributions were credited,
+                # do not give credit for payment.
+                self.claim_value(evt, evt.quantity)
+                evt.share = use_value
+                events.append(evt)
+        elif len(payments) > 1:
+            total = sum(p.quantity for p in payments)
+            # as before, a payment without a resource is judged
+            # by the contributions of the payment before it
+            contributions = []
+            for evt in payments:
+                payment_fraction = evt.quantity / total
+                self.claim_value(evt, evt.quantity)
+                if evt.resource:
+                    contributions = self.cash_contribution_events(evt.resource)
+                    for ct in contributions:
+                        resource_fraction = ct.quantity / resource_value
+                        share_addition = use_value * resource_fraction * payment_fraction
+                        existing_ct = next((e for e in events if e == ct), 0)
+                        if existing_ct:
+                            existing_ct.share += share_addition
+                        else:
+                            ct.share = share_addition
+                            events.append(ct)
+                            locals.append(ct)
+                if not contributions:
+                    evt.share = use_value * payment_fraction
+                    events.append(evt)
+        for evt in self.graph.exchange_work_events(exchange.id):
+            br, value = self.claim_value(evt, evt.quantity)
+            evt.value = value
+            fraction = value / resource_value
+            evt.share = use_value * fraction
+            events.append(evt)
+        if locals:
+            local_total = sum(lo.share for lo in locals)
+            delta = use_value - local_total
+            if delta:
+                max_share = locals[0]
+                for lo in locals:
+                    if lo.share > max_share.share:
+                        max_share = lo
+                max_share.share = (max_share.share + delta)
+        return
+        yield
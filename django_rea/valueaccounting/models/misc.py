@@ -1,6 +1,7 @@
 from __future__ import print_function
 
-from django.db import models
+from django.db import IntegrityError, models, transaction
+from django.db.models import F
 from django.utils.encoding import python_2_unicode_compatible
 from django.utils.translation import ugettext_lazy as _
 
@@ -79,3 +80,86 @@ class Help(models.Model):
 
     def __str__(self):
         return self.get_page_display()
+
+
+class CacheVersionManager(models.Manager):
+    def current(self, name):
+        versions = self.filter(name=name).values_list("version", flat=True)
+        if versions:
+            return versions[0]
+        return 0
+
+    def bump(self, name):
+        if self.filter(name=name).update(version=F("version") + 1):
+            return
+        try:
+            with transaction.atomic():
+                self.create(name=name, version=1)
+        except IntegrityError:
+            # another process created it first
+            self.filter(name=name).update(version=F("version") + 1)
+
+
+@python_2_unicode_compatible
+class CacheVersion(models.Model):
+    """A counter per process cache, bumped by every change to what it holds.
+
+    A cache built under an older version is stale, in every process.
+    """
+    name = models.CharField(_('name'), max_length=128, unique=True)
+    version = models.IntegerField(_('version'), default=0)
+
+    objects = CacheVersionManager()
+
+    def __str__(self):
+        return ": ".join([self.name, str(self.version)])
+
+
+class NamedLockManager(models.Manager):
+    def hold(self, name):
+        """Locks the row named name until the transaction ends,
+
+        at its commit or rollback. Call it inside transaction.atomic.
+        """
+        self.get_or_create(name=name)
+        self.select_for_update().get(name=name)
+
+
+class NamedLock(models.Model):
+    """Rows locked for update, where the database has no transaction-scoped
+
+    advisory locks (MySQL's GET_LOCK outlives the transaction).
+    """
+    name = models.CharField(_('name'), max_length=64, unique=True)
+
+    objects = NamedLockManager()
+
+
+class VersionedCache(object):
+    """An object built once per process and rebuilt when its CacheVersion changes.
+
+    ``build`` makes the object. It is kept with the version it was built
+    under as one (version, object) tuple, swapped in with one assignment,
+    so a thread never sees a half-built object or one from another version.
+    """
+
+    def __init__(self, name, build):
+        self.name = name
+        self.build = build
+        self.cached = None
+
+    def get(self):
+        version = CacheVersion.objects.current(self.name)
+        cached = self.cached
+        if cached is None or cached[0] != version:
+            cached = self.cached = (version, self.build())
+        return cached[1]
+
+    def discard(self):
+        """Drop the object here only, the next get() rebuilds it."""
+        self.cached = None
+
+    def invalidate(self):
+        """Drop the object, here and, by its CacheVersion, in other processes."""
+        CacheVersion.objects.bump(self.name)
+        self.discard()
@@ -0,0 +1,666 @@
+"""Recipe explosions planned in memory.
+
+Process.explode_demands used to save every process and commitment
+as it walked the recipe, and netted each new input commitment
+against onhand resources and scheduled commitments with fresh queries.
+ExplosionPlan walks the recipe in the same order, but nets against
+a NettingIndex that holds the database rows for each resource type
+plus everything the plan has added so far, then saves the planned
+processes and commitments with bulk inserts.
+
+ProcessGraph does the same for walking the processes a plan made:
+it answers previous and next processes from rows loaded in batches.
+"""
+
+import datetime
+from bisect import bisect_left, bisect_right
+from decimal import *
+
+from django.db import transaction
+from django.db.models import Q, Sum
+
+from ._utils import bulk_create_with_pks, bulk_unique_slugify
+
+
+class DueDateSeries(object):
+    """Commitment quantities sorted by due date, with running totals,
+
+    so the quantity due before or through a date is a bisect
+    and one lookup.
+    """
+
+    def __init__(self):
+        self.dates = []
+        self.quantities = []
+        self._totals = None
+
+    def extend(self, pairs):
+        pairs = sorted(list(zip(self.dates, self.quantities)) + list(pairs), key=lambda p: p[0])
+        self.dates = [date for date, qty in pairs]
+        self.quantities = [qty for date, qty in pairs]
+        self._totals = None
+
+    def add(self, due_date, quantity):
+        i = bisect_right(self.dates, due_date)
+        self.dates.insert(i, due_date)
+        self.quantities.insert(i, quantity)
+        self._totals = None
+
+    def totals(self):
+        if self._totals is None:
+            running = 0
+            totals = [running]
+            for qty in self.quantities:
+                running += qty
+                totals.append(running)
+            self._totals = totals
+        return self._totals
+
+    def total_before(self, due_date):
+        return self.totals()[bisect_left(self.dates, due_date)]
+
+    def total_through(self, due_date):
+        return self.totals()[bisect_right(self.dates, due_date)]
+
+
+def netting_key(commitment):
+    if commitment.id:
+        return commitment.id
+    return ("planned", id(commitment))
+
+
+class NettingIndex(object):
+    """Onhand quantities and commitments by resource type, for Commitment.net.
+
+    Holds onhand quantities by (resource type, stage) and DueDateSeries
+    of consuming and of unfulfilled producing commitments,
+    so netting a commitment needs no queries.
+    Resource types are loaded from the database on first use,
+    or together with load(), and commitments planned in the same session
+    are added with add() so later netting sees them.
+    The index is a snapshot: use one per planning session or request.
+    """
+
+    def __init__(self):
+        self.loaded = set()
+        self.onhand = {}
+        self.consuming = {}
+        self.producing = {}
+        self.producing_keys = {}
+
+    def series(self, table, key):
+        series = table.get(key)
+        if series is None:
+            series = DueDateSeries()
+            table[key] = series
+        return series
+
+    def load(self, resource_type_ids):
+        from django_rea.valueaccounting.models.event import EconomicEvent
+        from django_rea.valueaccounting.models.resource import EconomicResource
+        from django_rea.valueaccounting.models.schedule import Commitment
+        ids = [rt_id for rt_id in set(resource_type_ids) if rt_id not in self.loaded]
+        if not ids:
+            return
+        self.loaded.update(ids)
+        goods = EconomicResource.goods.filter(
+            resource_type__id__in=ids,
+            quantity__gt=0).values_list("resource_type", "stage", "quantity")
+        for rt_id, stage_id, quantity in goods:
+            self.add_onhand(rt_id, stage_id, quantity)
+        fulfilled = EconomicEvent.objects.filter(
+            commitment__resource_type__id__in=ids).values("commitment").annotate(
+            total=Sum("quantity"))
+        fulfilled = dict((f["commitment"], f["total"]) for f in fulfilled)
+        commitments = Commitment.objects.filter(resource_type__id__in=ids).values_list(
+            "id", "resource_type", "due_date", "quantity", "stage", "finished",
+            "event_type__relationship", "event_type__resource_effect", "event_type__name",
+            "process__finished")
+        rows = {}
+        for (ct_id, rt_id, due_date, quantity, stage_id, finished,
+             relationship, resource_effect, et_name, process_finished) in commitments:
+            produces = False
+            if relationship == "out" or et_name == "Receipt":
+                # process__finished=False leaves out commitments without a process
+                if process_finished is False:
+                    produces = bool(quantity - fulfilled.get(ct_id, 0))
+            for table, key in self.row_keys(
+                    rt_id, stage_id, relationship == "consume",
+                    not finished and resource_effect == ">~", produces):
+                rows.setdefault((id(table), key), (table, key, []))[2].append((due_date, quantity))
+            if produces:
+                self.producing_keys[ct_id] = (due_date, quantity, stage_id)
+        for table, key, pairs in rows.values():
+            self.series(table, key).extend(pairs)
+
+    def row_keys(self, rt_id, stage_id, consumes, consumes_stage, produces):
+        """The series a commitment belongs in.
+
+        consumes: in EconomicResourceType.consuming_commitments,
+        consumes_stage: in consuming_commitments_for_stage,
+        produces: in active_producing_commitments and not fulfilled.
+        """
+        keys = []
+        if consumes:
+            keys.append((self.consuming, (rt_id, "all")))
+        if consumes_stage:
+            keys.append((self.consuming, (rt_id, stage_id)))
+        if produces:
+            keys.append((self.producing, (rt_id, "all")))
+            keys.append((self.producing, (rt_id, stage_id)))
+        return keys
+
+    def add_onhand(self, rt_id, stage_id, quantity):
+        for key in ((rt_id, "all"), (rt_id, stage_id)):
+            self.onhand[key] = self.onhand.get(key, 0) + quantity
+
+    def add(self, commitment):
+        """Adds a planned, unsaved commitment."""
+        rt_id = commitment.resource_type.id
+        self.load([rt_id])
+        et = commitment.event_type
+        stage_id = commitment.stage.id if commitment.stage else None
+        produces = False
+        if et.relationship == "out" or et.name == "Receipt":
+            process = commitment.process
+            if process and not process.finished:
+                produces = bool(commitment.quantity)
+        for table, key in self.row_keys(
+                rt_id, stage_id, et.relationship == "consume",
+                not commitment.finished and et.resource_effect == ">~", produces):
+            self.series(table, key).add(commitment.due_date, commitment.quantity)
+        if produces:
+            self.producing_keys[netting_key(commitment)] = (
+                commitment.due_date, commitment.quantity, stage_id)
+
+    def attach(self, commitments):
+        """Loads the resource types of these commitments with one set of queries
+
+        and makes their net() and quantity_to_buy() use this index.
+        """
+        self.load(set(ct.resource_type_id for ct in commitments))
+        for ct in commitments:
+            ct.netting_index = self
+
+    def stage_key(self, commitment):
+        if commitment.stage:
+            return (commitment.resource_type.id, commitment.stage.id)
+        return (commitment.resource_type.id, "all")
+
+    def priors_qty(self, commitment):
+        self.load([commitment.resource_type.id])
+        series = self.consuming.get(self.stage_key(commitment))
+        if series is None:
+            return 0
+        return series.total_before(commitment.due_date)
+
+    def onhand_qty_for_commitment(self, commitment):
+        """EconomicResourceType.onhand_qty_for_commitment, from the index."""
+        self.load([commitment.resource_type.id])
+        oh_qty = self.onhand.get(self.stage_key(commitment), 0)
+        remainder = oh_qty - self.priors_qty(commitment)
+        if remainder > 0:
+            return remainder
+        else:
+            return Decimal("0")
+
+    def scheduled_qty_for_commitment(self, commitment):
+        """EconomicResourceType.scheduled_qty_for_commitment, from the index."""
+        self.load([commitment.resource_type.id])
+        due_date = commitment.due_date
+        series = self.producing.get(self.stage_key(commitment))
+        sked_qty = 0
+        if series is not None:
+            sked_qty = series.total_through(due_date)
+        # the commitment itself is not scheduled for itself
+        own = self.producing_keys.get(netting_key(commitment))
+        if own:
+            own_due, own_qty, own_stage_id = own
+            if own_due <= due_date and (not commitment.stage or own_stage_id == commitment.stage.id):
+                sked_qty -= own_qty
+        if not sked_qty:
+            return Decimal("0")
+        remainder = sked_qty - self.priors_qty(commitment)
+        if remainder > 0:
+            return remainder
+        else:
+            return Decimal("0")
+
+    def net(self, commitment):
+        """Commitment.net, from the index."""
+        rt = commitment.resource_type
+        if not rt.substitutable:
+            return commitment.quantity
+        oh_qty = self.onhand_qty_for_commitment(commitment)
+        if oh_qty >= commitment.quantity:
+            return 0
+        sked_qty = self.scheduled_qty_for_commitment(commitment)
+        if commitment.event_type.resource_effect == "-":
+            remainder = commitment.quantity - oh_qty
+            if sked_qty >= remainder:
+                return Decimal("0")
+            return remainder - sked_qty
+        else:
+            if oh_qty + sked_qty:
+                return Decimal("0")
+            elif commitment.event_type.resource_effect == "=":
+                return Decimal("1")
+            else:
+                return commitment.quantity
+
+
+class ExplosionPlan(object):
+    """The processes and commitments of one recipe explosion.
+
+    explode() plans them in memory, in the order Process.explode_demands
+    always created them, and save() writes them all.
+    Recipe lookups are remembered by process type and resource type,
+    and visited cycle ids are kept in a set.
+    """
+
+    def __init__(self, demand, user, visited=None):
+        self.demand = demand
+        self.user = user
+        self.visited = set(visited or [])
+        self.processes = []
+        self.commitments = []
+        self.netting = NettingIndex()
+        self._inputs = {}
+        self._producing = {}
+        self._main_produced = {}
+        self._children = {}
+
+    def input_relationships(self, process_type):
+        inputs = self._inputs.get(process_type.id)
+        if inputs is None:
+            inputs = list(process_type.all_input_resource_type_relationships().select_related(
+                "resource_type__unit", "resource_type__unit_of_use",
+                "event_type", "stage", "state"))
+            self._inputs[process_type.id] = inputs
+        return inputs
+
+    def producing_relationship(self, resource_type, stage, state):
+        key = (resource_type.id, stage.id if stage else None, state.id if state else None)
+        if key not in self._producing:
+            self._producing[key] = resource_type.main_producing_process_type_relationship(
+                stage=stage, state=state)
+        return self._producing[key]
+
+    def main_produced_relationship(self, process_type):
+        if process_type.id not in self._main_produced:
+            self._main_produced[process_type.id] = process_type.main_produced_resource_type_relationship()
+        return self._main_produced[process_type.id]
+
+    def child_of_class(self, resource_type, resource_class):
+        key = (resource_type.id, resource_class.id if resource_class else None)
+        if key not in self._children:
+            self._children[key] = resource_type.child_of_class(resource_class)
+        return self._children[key]
+
+    def input_resource_type(self, ptrt, output, inheritance):
+        resource_type = ptrt.resource_type
+        # todo dhen: this is where species would be used
+        if inheritance:
+            if resource_type == inheritance.parent:
+                resource_type = inheritance.substitute(resource_type)
+            else:
+                resource_class = output.resource_type.resource_class
+                candidate = self.child_of_class(resource_type, resource_class)
+                if candidate:
+                    resource_type = candidate
+        return resource_type
+
+    def preload(self, process_type, output, inheritance):
+        """Loads netting data for every resource type the explosion can reach,
+
+        walking the recipe without netting.
+        """
+        rt_ids = set()
+        seen = set()
+        stack = [(process_type, output.resource_type, inheritance)]
+        while stack:
+            pt, output_rt, inheritance = stack.pop()
+            if pt.id in seen:
+                continue
+            seen.add(pt.id)
+            for ptrt in self.input_relationships(pt):
+                resource_type = ptrt.resource_type
+                if inheritance and resource_type == inheritance.parent:
+                    resource_type = inheritance.substitute(resource_type)
+                rt_ids.add(resource_type.id)
+                pptr, next_inheritance = self.producing_relationship(
+                    resource_type, ptrt.stage, ptrt.state)
+                if pptr:
+                    stack.append((pptr.process_type, pptr.resource_type, next_inheritance))
+        self.netting.load(rt_ids)
+
+    def explode(self, process, inheritance=None, output=None):
+        """Plans the inputs of a process whose output commitment exists,
+
+        and the processes that will produce them, depth first.
+        """
+        if output is None:
+            output = process.main_outgoing_commitment()
+        self.preload(process.process_type, output, inheritance)
+        self.visited.add(output.cycle_id())
+        # a frame is [process, output, inheritance, remaining input relationships]
+        stack = [[process, output, inheritance, iter(self.input_relationships(process.process_type))]]
+        while stack:
+            frame = stack[-1]
+            ptrt = next(frame[3], None)
+            if ptrt is None:
+                stack.pop()
+                continue
+            planned = self.plan_input(frame, ptrt)
+            if planned:
+                next_process, next_output, next_inheritance = planned
+                self.visited.add(next_output.cycle_id())
+                stack.append([next_process, next_output, next_inheritance,
+                              iter(self.input_relationships(next_process.process_type))])
+
+    def plan_input(self, frame, ptrt):
+        """Plans one input commitment and, if it nets to a shortage,
+
+        the process that will produce it with its output commitment.
+        Returns (next process, its output, its inheritance) or None.
+        """
+        process, output, inheritance = frame[:3]
+        if output.stage:
+            qty = output.quantity
+        else:
+            multiplier = output.quantity
+            if output.process:
+                if output.process.process_type:
+                    main_ptr = self.main_produced_relationship(output.process.process_type)
+                    if main_ptr:
+                        if main_ptr.quantity:
+                            multiplier = output.quantity / main_ptr.quantity
+            qty = (multiplier * ptrt.quantity).quantize(Decimal('.01'), rounding=ROUND_HALF_UP)
+        resource_type = self.input_resource_type(ptrt, output, inheritance)
+        commitment = process.unsaved_commitment(
+            resource_type=resource_type,
+            demand=self.demand,
+            description=ptrt.description or "",
+            order_item=output.order_item,
+            stage=ptrt.stage,
+            state=ptrt.state,
+            quantity=qty,
+            event_type=ptrt.event_type,
+            unit=resource_type.directional_unit(ptrt.event_type.relationship),
+            user=self.user,
+        )
+        self.add_commitment(commitment)
+        # cycles broken here
+        visited_id = ptrt.cycle_id()
+        if visited_id in self.visited:
+            return None
+        self.visited.add(visited_id)
+        qty_to_explode = self.netting.net(commitment)
+        if not qty_to_explode:
+            return None
+        pptr, inheritance = self.producing_relationship(
+            resource_type, commitment.stage, commitment.state)
+        # as explode_demands always did, the inheritance found here
+        # also applies to the inputs of this process planned after this one
+        frame[2] = inheritance
+        if not pptr:
+            return None
+        resource_type = pptr.resource_type
+        if inheritance:
+            if resource_type == inheritance.parent:
+                resource_type = inheritance.substitute(resource_type)
+        next_pt = pptr.process_type
+        start_date = process.start_date - datetime.timedelta(minutes=next_pt.estimated_duration)
+        next_process = next_pt.unsaved_process(
+            start_date=start_date,
+            end_date=process.start_date)
+        self.processes.append(next_process)
+        if output.stage:
+            qty = output.quantity
+        else:
+            qty = qty_to_explode
+        next_commitment = next_process.unsaved_commitment(
+            resource_type=resource_type,
+            stage=pptr.stage,
+            state=pptr.state,
+            demand=self.demand,
+            order_item=output.order_item,
+            quantity=qty,
+            event_type=pptr.event_type,
+            unit=resource_type.directional_unit(pptr.event_type.relationship),
+            description=pptr.description or "",
+            user=self.user,
+        )
+        self.add_commitment(next_commitment)
+        return next_process, next_commitment, inheritance
+
+    def add_commitment(self, commitment):
+        self.commitments.append(commitment)
+        self.netting.add(commitment)
+
+    @transaction.atomic
+    def save(self):
+        from django_rea.valueaccounting.models.schedule import Commitment
+        bulk_unique_slugify(self.processes, [p.slug_source() for p in self.processes])
+        bulk_create_with_pks(self.processes)
+        for commitment in self.commitments:
+            # reassigned now the process has a pk
+            commitment.process = commitment.process
+        bulk_unique_slugify(self.commitments, [c.slug_source() for c in self.commitments])
+        bulk_create_with_pks(self.commitments)
+
+
+class ProcessGraph(object):
+    """Previous and next processes for a set of processes, from batched queries.
+
+    Process.previous_processes and next_processes query the commitments
+    and events of the process, then the producing or wanting commitments
+    of every resource type it uses or makes, then the events of every
+    resource it used or made. The graph loads those rows for a whole
+    frontier of processes at once, indexes commitments by
+    (resource type, stage, state, order item), and gives the same
+    answers as the Process methods, in the same order.
+    Each process is kept as one instance, starting with the ones
+    passed in. Like NettingIndex, the graph is a snapshot:
+    do not keep it across changes to the processes it has loaded.
+    """
+
+    def __init__(self, processes=()):
+        self.processes = {}
+        self.pending = set()
+        self.commitments = {}
+        self.events = {}
+        self.producing = {}
+        self.producing_rts = set()
+        self.wanting = {}
+        self.wanting_rts = set()
+        self.resource_events = {}
+        for process in processes:
+            self.add_process(process)
+
+    def add_process(self, process):
+        if process.id not in self.processes:
+            self.processes[process.id] = process
+            self.pending.add(process.id)
+        return self.processes[process.id]
+
+    def resolve(self, process_ids):
+        from django_rea.valueaccounting.models.process import Process
+        missing = set(pid for pid in process_ids if pid is not None and pid not in self.processes)
+        if missing:
+            for process in Process.objects.filter(id__in=missing):
+                self.add_process(process)
+        return [self.processes.get(pid) for pid in process_ids]
+
+    def load(self, process):
+        """Load process, and every other process not loaded yet."""
+        from django_rea.valueaccounting.models.event import EconomicEvent
+        from django_rea.valueaccounting.models.schedule import Commitment
+        self.add_process(process)
+        if process.id not in self.pending:
+            return
+        ids = list(self.pending)
+        self.pending = set()
+        for pid in ids:
+            self.commitments[pid] = []
+            self.events[pid] = []
+        commitments = Commitment.objects.filter(process__id__in=ids).select_related(
+            "event_type", "resource_type", "stage", "state",
+            "unit_of_quantity", "from_agent").order_by("due_date", "id")
+        input_rts = set()
+        output_rts = set()
+        for ct in commitments:
+            self.commitments[ct.process_id].append(ct)
+            if ct.event_type.relationship == "out":
+                output_rts.add(ct.resource_type_id)
+            else:
+                input_rts.add(ct.resource_type_id)
+        events = EconomicEvent.objects.filter(process__id__in=ids).select_related(
+            "event_type", "resource_type", "resource__stage", "resource__state")
+        resource_ids = set()
+        for event in events:
+            self.events[event.process_id].append(event)
+            if event.resource_id and not event.commitment_id:
+                resource_ids.add(event.resource_id)
+        self.load_commitments(input_rts - self.producing_rts, output_rts - self.wanting_rts)
+        self.load_resource_events(resource_ids - set(self.resource_events))
+
+    def load_commitments(self, producing_rts, wanting_rts):
+        from django_rea.valueaccounting.models.schedule import Commitment
+        # ResourceType.producing_commitments and wanting_commitments
+        if producing_rts:
+            self.producing_rts.update(producing_rts)
+            cts = Commitment.objects.filter(resource_type__id__in=producing_rts).filter(
+                Q(event_type__relationship='out') |
+                Q(event_type__name='Receipt')).order_by("due_date", "id")
+            for ct in cts:
+                self.producing.setdefault(self.commitment_key(ct), []).append(ct)
+        if wanting_rts:
+            self.wanting_rts.update(wanting_rts)
+            cts = Commitment.objects.filter(resource_type__id__in=wanting_rts).filter(
+                finished=False).exclude(event_type__relationship='out').order_by("due_date", "id")
+            for ct in cts:
+                self.wanting.setdefault(self.commitment_key(ct), []).append(ct)
+
+    def load_resource_events(self, resource_ids):
+        from django_rea.valueaccounting.models.event import EconomicEvent
+        for rid in resource_ids:
+            self.resource_events[rid] = []
+        if resource_ids:
+            for event in EconomicEvent.objects.filter(
+                    resource__id__in=resource_ids).select_related("event_type"):
+                self.resource_events[event.resource_id].append(event)
+
+    def commitment_key(self, commitment):
+        return (commitment.resource_type_id, commitment.stage_id,
+                commitment.state_id, commitment.order_item_id)
+
+    def incoming_commitments(self, process):
+        self.load(process)
+        return [ct for ct in self.commitments[process.id] if ct.event_type.relationship != "out"]
+
+    def outgoing_commitments(self, process):
+        self.load(process)
+        return [ct for ct in self.commitments[process.id] if ct.event_type.relationship == "out"]
+
+    def main_outgoing_commitment(self, process):
+        cts = self.outgoing_commitments(process)
+        for ct in cts:
+            if ct.order_item_id:
+                return ct
+        if cts:
+            return cts[0]
+        return None
+
+    def wanting_commitments(self, resource_type_id):
+        """ResourceType.wanting_commitments, for a resource type made by a loaded process."""
+        cts = [ct for key, cts in self.wanting.items() if key[0] == resource_type_id for ct in cts]
+        return sorted(cts, key=lambda ct: (ct.due_date, ct.id))
+
+    def independent_demand_id(self, process):
+        # Process.independent_demand
+        moc = self.main_outgoing_commitment(process)
+        if moc:
+            return moc.independent_demand_id
+        ics = self.incoming_commitments(process)
+        if ics:
+            return ics[0].independent_demand_id
+        return None
+
+    def producing_events(self, resource):
+        # EconomicResource.producing_events
+        events = self.resource_events[resource.id]
+        if resource.quality and resource.quality < 0:
+            return [e for e in events if e.event_type.resource_effect == "<"]
+        return [e for e in events if e.event_type.relationship == "out"]
+
+    def usage_events(self, resource):
+        # EconomicResource.all_usage_events
+        events = self.resource_events[resource.id]
+        return [e for e in events if e.event_type.relationship not in ("out", "receive", "resource", "cash")]
+
+    def previous_processes(self, process, for_order=False):
+        """Process.previous_processes, or previous_processes_for_order if for_order."""
+        return self.resolve(self.previous_process_ids(process, for_order))
+
+    def next_processes(self, process, for_order=False):
+        """Process.next_processes, or next_processes_for_order if for_order."""
+        return self.resolve(self.next_process_ids(process, for_order))
+
+    def previous_process_ids(self, process, for_order=False):
+        self.load(process)
+        answer = []
+        dmnd_id = None
+        moc = self.main_outgoing_commitment(process)
+        if moc:
+            dmnd_id = moc.order_item_id
+        for ic in self.incoming_commitments(process):
+            key = (ic.resource_type_id, ic.stage_id, ic.state_id)
+            if dmnd_id:
+                for pc in self.producing.get(key + (dmnd_id,), []):
+                    if pc.process_id != process.id:
+                        answer.append(pc.process_id)
+            elif not for_order:
+                for pc in self.producing.get(key + (None,), []):
+                    if pc.process_id != process.id:
+                        if pc.quantity >= ic.quantity:
+                            if pc.due_date <= process.start_date:
+                                answer.append(pc.process_id)
+        if not for_order:
+            for ie in self.events[process.id]:
+                if ie.event_type.relationship != "out":
+                    if not ie.commitment_id and ie.resource_id:
+                        for evt in self.producing_events(ie.resource):
+                            if evt.process_id and evt.process_id != process.id:
+                                if evt.process_id not in answer:
+                                    answer.append(evt.process_id)
+        return answer
+
+    def next_process_ids(self, process, for_order=False):
+        self.load(process)
+        answer = []
+        input_ids = [ic.cycle_id() for ic in self.incoming_commitments(process)]
+        for oc in self.outgoing_commitments(process):
+            if oc.cycle_id() in input_ids:
+                continue
+            key = (oc.resource_type_id, oc.stage_id, oc.state_id)
+            if oc.order_item_id:
+                for cc in self.wanting.get(key + (oc.order_item_id,), []):
+                    if cc.process_id and cc.process_id not in answer:
+                        answer.append(cc.process_id)
+            elif not for_order:
+                compare_date = process.end_date or process.start_date
+                for cc in self.wanting.get(key + (None,), []):
+                    if cc.quantity >= oc.quantity and cc.due_date >= compare_date:
+                        if cc.process_id and cc.process_id not in answer:
+                            answer.append(cc.process_id)
+        if not for_order:
+            for oe in self.events[process.id]:
+                if oe.event_type.relationship == "out":
+                    if not oe.commitment_id and oe.resource_id:
+                        if oe.cycle_id() not in input_ids:
+                            for evt in self.usage_events(oe.resource):
+                                if evt.process_id and evt.process_id != process.id:
+                                    if evt.process_id not in answer:
+                                        answer.append(evt.process_id)
+        return answer
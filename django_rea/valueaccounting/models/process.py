@@ -7,8 +7,9 @@ from django.contrib.auth.models import User
 from django.db import models
 from django.utils.translation import ugettext_lazy as _
 
-from _utils import unique_slugify
+from _utils import unique_slug
 
+from django_rea.valueaccounting.models.misc import CacheVersion
 from django_rea.valueaccounting.models.recipe import EventType
 
 
@@ -30,7 +31,7 @@ class ProcessManager(models.Manager):
         # import pdb; pdb.set_trace()
         processes = Process.objects.current_or_future()
         ids = []
-        use_et = EventType.objects.get(name="Resource use")
+        use_et = EventType.objects.cached(name="Resource use")
         for process in processes:
             if process.process_pattern:
                 if use_et in process.process_pattern.event_types():
@@ -114,17 +115,19 @@ class Process(models.Model):
         return ('process_details', (),
                 {'process_id': str(self.id), })
 
-    def save(self, *args, **kwargs):
+    def slug_source(self):
         pt_name = ""
         if self.process_type:
             pt_name = self.process_type.name
-        slug = "-".join([
+        return "-".join([
             pt_name,
             self.name,
             self.start_date.strftime('%Y-%m-%d'),
         ])
-        unique_slugify(self, slug)
-        super(Process, self).save(*args, **kwargs)
+
+    def save(self, *args, **kwargs):
+        with unique_slug(self, self.slug_source()):
+            super(Process, self).save(*args, **kwargs)
         # import pdb; pdb.set_trace()
         for commit in self.commitments.all():
             if commit.context_agent != self.context_agent:
@@ -298,7 +301,9 @@ class Process(models.Model):
                 break
         return answer
 
-    def previous_processes(self):
+    def previous_processes(self, graph=None):
+        if graph is not None:
+            return graph.previous_processes(self)
         answer = []
         dmnd = None
         moc = self.main_outgoing_commitment()
@@ -333,8 +338,10 @@ class Process(models.Model):
                                     answer.append(evt.process)
         return answer
 
-    def previous_processes_for_order(self, order):
+    def previous_processes_for_order(self, order, graph=None):
         # this is actually previous_processes_for_order_item
+        if graph is not None:
+            return graph.previous_processes(self, for_order=True)
         answer = []
         dmnd = None
         moc = self.main_outgoing_commitment()
@@ -355,34 +362,42 @@ class Process(models.Model):
                                 answer.append(pc.process)
         return answer
 
-    def all_previous_processes(self, ordered_processes, visited, depth):
+    def all_previous_processes(self, ordered_processes, visited, depth, graph=None):
         # import pdb; pdb.set_trace()
         self.depth = depth * 2
         ordered_processes.append(self)
-        output = self.main_outgoing_commitment()
+        if graph is not None:
+            output = graph.main_outgoing_commitment(self)
+        else:
+            output = self.main_outgoing_commitment()
         if not output:
             return []
         depth = depth + 1
         if output.cycle_id() not in visited:
             visited.append(output.cycle_id())
-            for process in self.previous_processes():
-                process.all_previous_processes(ordered_processes, visited, depth)
+            for process in self.previous_processes(graph):
+                process.all_previous_processes(ordered_processes, visited, depth, graph)
 
-    def all_previous_processes_for_order(self, order, ordered_processes, visited, depth):
+    def all_previous_processes_for_order(self, order, ordered_processes, visited, depth, graph=None):
         # this is actually all_previous_processes_for_order_item
         # import pdb; pdb.set_trace()
         self.depth = depth * 2
         ordered_processes.append(self)
-        output = self.main_outgoing_commitment()
+        if graph is not None:
+            output = graph.main_outgoing_commitment(self)
+        else:
+            output = self.main_outgoing_commitment()
         if not output:
             return []
         depth = depth + 1
         if output.cycle_id() not in visited:
             visited.append(output.cycle_id())
-            for process in self.previous_processes_for_order(order):
-                process.all_previous_processes_for_order(order, ordered_processes, visited, depth)
+            for process in self.previous_processes_for_order(order, graph):
+                process.all_previous_processes_for_order(order, ordered_processes, visited, depth, graph)
 
-    def next_processes(self):
+    def next_processes(self, graph=None):
+        if graph is not None:
+            return graph.next_processes(self)
         answer = []
         # import pdb; pdb.set_trace()
         input_ids = [ic.cycle_id() for ic in self.incoming_commitments()]
@@ -421,7 +436,9 @@ class Process(models.Model):
                                         answer.append(evt.process)
         return answer
 
-    def next_processes_for_order(self, order):
+    def next_processes_for_order(self, order, graph=None):
+        if graph is not None:
+            return graph.next_processes(self, for_order=True)
         answer = []
         # import pdb; pdb.set_trace()
         input_ids = [ic.cycle_id() for ic in self.incoming_commitments()]
@@ -591,12 +608,44 @@ class Process(models.Model):
                        to_agent=None,
                        order=None,
                        ):
+        ct = self.unsaved_commitment(
+            resource_type=resource_type,
+            demand=demand,
+            quantity=quantity,
+            event_type=event_type,
+            unit=unit,
+            user=user,
+            description=description,
+            order_item=order_item,
+            stage=stage,
+            state=state,
+            from_agent=from_agent,
+            to_agent=to_agent,
+            order=order)
+        ct.save()
+        return ct
+
+    def unsaved_commitment(self,
+                           resource_type,
+                           demand,
+                           quantity,
+                           event_type,
+                           unit,
+                           user,
+                           description,
+                           order_item=None,
+                           stage=None,
+                           state=None,
+                           from_agent=None,
+                           to_agent=None,
+                           order=None,
+                           ):
         from django_rea.valueaccounting.models.schedule import Commitment
         if event_type.relationship == "out":
             due_date = self.end_date
         else:
             due_date = self.start_date
-        ct = Commitment(
+        return Commitment(
             independent_demand=demand,
             order=order,
             order_item=order_item,
@@ -615,8 +664,6 @@ class Process(models.Model):
             from_agent=from_agent,
             to_agent=to_agent,
             created_by=user)
-        ct.save()
-        return ct
 
     def add_stream_commitments(self, last_process, user):  # for adding to the end of the order
         last_commitment = last_process.main_outgoing_commitment()
@@ -692,136 +739,27 @@ class Process(models.Model):
             event.context_agent = context_agent
             event.save()
 
-    def explode_demands(self, demand, user, visited, inheritance):
+    def explode_demands(self, demand, user, visited, inheritance=None, output=None):
         """This method assumes the output commitment from this process
 
             has already been created.
+            The explosion is planned in memory and saved in bulk,
+            see models.planning.ExplosionPlan.
 
         """
         # import pdb; pdb.set_trace()
         # todo pr: may need get and use RecipeInheritance object
-        pt = self.process_type
-        output = self.main_outgoing_commitment()
-        order_item = output.order_item
-        # if not output:
-        # import pdb; pdb.set_trace()
-        visited_id = output.cycle_id()
-        if visited_id not in visited:
-            visited.append(visited_id)
-        for ptrt in pt.all_input_resource_type_relationships():
-            # import pdb; pdb.set_trace()
-            if output.stage:
-                # if output.resource_type == ptrt.resource_type:
-                qty = output.quantity
-            else:
-                multiplier = output.quantity
-                if output.process:
-                    if output.process.process_type:
-                        main_ptr = output.process.process_type.main_produced_resource_type_relationship()
-                        if main_ptr:
-                            if main_ptr.quantity:
-                                multiplier = output.quantity / main_ptr.quantity
-                qty = (multiplier * ptrt.quantity).quantize(Decimal('.01'), rounding=ROUND_HALF_UP)
-                # todo: must consider ratio of PT output qty to PT input qty
-            # pr changed
-            resource_type = ptrt.resource_type
-            # todo dhen: this is where species would be used
-            if inheritance:
-                if resource_type == inheritance.parent:
-                    resource_type = inheritance.substitute(resource_type)
-                else:
-                    resource_class = output.resource_type.resource_class
-                    candidate = resource_type.child_of_class(resource_class)
-                    if candidate:
-                        resource_type = candidate
-            # Todo: apply selected_context_agent here? Dnly if inheritance?
-            # import pdb; pdb.set_trace()
-            commitment = self.add_commitment(
-                resource_type=resource_type,
-                demand=demand,
-                description=ptrt.description or "",
-                order_item=order_item,
-                stage=ptrt.stage,
-                state=ptrt.state,
-                quantity=qty,
-                event_type=ptrt.event_type,
-                unit=resource_type.directional_unit(ptrt.event_type.relationship),
-                user=user,
-            )
-            # cycles broken here
-            # flow todo: consider order_item for non-substitutables?
-            # seemed to work without doing that...?
-            # import pdb; pdb.set_trace()
-            visited_id = ptrt.cycle_id()
-            if visited_id not in visited:
-                visited.append(visited_id)
-                qty_to_explode = commitment.net()
-                if qty_to_explode:
-                    # todo: shd commitment.generate_producing_process?
-                    # no, this an input commitment
-                    # shd pt create process?
-                    # shd pptr create next_commitment, and then
-                    # shd next_commitment.generate_producing_process?
-                    # import pdb; pdb.set_trace()
-                    # pr changed
-                    stage = commitment.stage
-                    state = commitment.state
-                    pptr, inheritance = resource_type.main_producing_process_type_relationship(stage=stage, state=state)
-                    if pptr:
-                        resource_type = pptr.resource_type
-                        # todo dhen: this is where species would be used? Or not?
-                        if inheritance:
-                            if resource_type == inheritance.parent:
-                                resource_type = inheritance.substitute(resource_type)
-                        next_pt = pptr.process_type
-                        start_date = self.start_date - datetime.timedelta(minutes=next_pt.estimated_duration)
-                        next_process = Process(
-                            name=next_pt.name,
-                            notes=next_pt.description or "",
-                            process_type=next_pt,
-                            process_pattern=next_pt.process_pattern,
-                            # Todo: apply selected_context_agent here? Dnly if inheritance?
-                            context_agent=next_pt.context_agent,
-                            url=next_pt.url,
-                            end_date=self.start_date,
-                            start_date=start_date,
-                        )
-                        next_process.save()
-                        # this is the output commitment
-                        # import pdb; pdb.set_trace()
-                        if output.stage:
-                            qty = output.quantity
-                        else:
-                            # todo: this makes no sense, why did I do that?
-                            # temporary insanity or some reason that escapes me now?
-                            # ps. prior to this commented-out code, it was
-                            # qty = qty_to_explode * pptr.quantity
-                            # I did this when making that salsa recipe work.
-                            # 2014-11-05
-                            # if not multiplier:
-                            #    multiplier = pptr.quantity
-                            # qty = (qty_to_explode * multiplier).quantize(Decimal('.01'), rounding=ROUND_HALF_UP)
-                            qty = qty_to_explode
-                        # todo: must consider ratio of PT output qty to PT input qty
-                        # Todo: apply selected_context_agent here? Dnly if inheritance?
-                        # import pdb; pdb.set_trace()
-                        next_commitment = next_process.add_commitment(
-                            resource_type=resource_type,
-                            stage=pptr.stage,
-                            state=pptr.state,
-                            demand=demand,
-                            order_item=order_item,
-                            quantity=qty,
-                            event_type=pptr.event_type,
-                            unit=resource_type.directional_unit(pptr.event_type.relationship),
-                            description=pptr.description or "",
-                            user=user,
-                        )
-                        # todo pr: may need pass RecipeInheritance object
-                        next_process.explode_demands(demand, user, visited, inheritance)
+        from django_rea.valueaccounting.models.planning import ExplosionPlan
+        plan = ExplosionPlan(demand, user, visited)
+        plan.explode(self, inheritance, output)
+        plan.save()
+        if isinstance(visited, list):
+            visited.extend(plan.visited.difference(visited))
+        return plan
 
     def reschedule_forward(self, delta_days, user):
         # import pdb; pdb.set_trace()
+        # no ProcessGraph here: each step moves dates the next one compares
         if not self.started:
             fps = self.previous_processes()
             if fps:
@@ -960,102 +898,18 @@ class Process(models.Model):
 
     def compute_income_shares(self, value_equation, order_item, quantity, events, visited):
         # Process method
-        # print "running quantity:", quantity, "running value:", value
-        # import pdb; pdb.set_trace()
-        if self not in visited:
-            visited.add(self)
-            if quantity:
-                # todo: how will this work for >1 processes producing the same resource?
-                # what will happen to the shares of the inputs of the later processes?
-                production_events = self.production_events()
-                produced_qty = sum(pe.quantity for pe in production_events)
-                distro_fraction = 1
-                distro_qty = quantity
-                if produced_qty > quantity:
-                    distro_fraction = quantity / produced_qty
-                    quantity = Decimal("0.0")
-                elif produced_qty <= quantity:
-                    distro_qty = produced_qty
-                    quantity -= produced_qty
-                for pe in production_events:
-                    # todo br
-                    # import pdb; pdb.set_trace()
-                    value = pe.quantity
-                    br = pe.bucket_rule(value_equation)
-                    if br:
-                        # import pdb; pdb.set_trace()
-                        value = br.compute_claim_value(pe)
-                    pe.share = value * distro_fraction
-                    events.append(pe)
-                if self.context_agent.compatible_value_equation(value_equation):
-                    inputs = self.incoming_events()
-                    for ip in inputs:
-                        # we assume here that work events are contributions
-                        if ip.event_type.relationship == "work":
-                            if ip.is_contribution:
-                                # todo br
-                                # import pdb; pdb.set_trace()
-                                value = ip.value
-                                br = ip.bucket_rule(value_equation)
-                                if br:
-                                    # import pdb; pdb.set_trace()
-                                    value = br.compute_claim_value(ip)
-                                    ip.value = value
-                                ip.share = value * distro_fraction
-                                events.append(ip)
-                                # print ip.id, ip, ip.share
-                                # print "----Event.share:", ip.share, "= Event.value:", ip.value, "* distro_fraction:", distro_fraction
-                        elif ip.event_type.relationship == "use":
-                            # use events are not contributions, but their resources may have contributions
-                            if ip.resource:
-                                # price changes
-                                if ip.price:
-                                    ip.value = ip.price
-                                else:
-                                    ip.value = ip.quantity * ip.resource.value_per_unit_of_use
-                                value = ip.value
-                                ip_value = value * distro_fraction
-                                d_qty = distro_qty
-                                if ip_value and value:
-                                    d_qty = ip_value / value
-                                new_visited = set()
-                                path = []
-                                depth = 0
-                                # import pdb; pdb.set_trace()
-                                # todo exchange redesign fallout
-                                # resource_value was 0
-                                resource_value = ip.resource.roll_up_value(path, depth, new_visited, value_equation)
-                                ip.resource.compute_income_shares_for_use(value_equation, ip, ip_value, resource_value,
-                                                                          events, visited)
-                        elif ip.event_type.relationship == "consume" or ip.event_type.name == "To Be Changed":
-                            # consume events are not contributions, but their resources may have contributions
-                            ##todo ve test: is this a bug? how does consumption event value get set?
-                            # ip_value = ip.value * distro_fraction
-                            # if ip_value:
-                            d_qty = ip.quantity * distro_fraction
-                            # import pdb; pdb.set_trace()
-                            if d_qty:
-                                # print "consumption:", ip.id, ip, "ip.value:", ip.value
-                                # print "----value:", ip_value, "d_qty:", d_qty, "distro_fraction:", distro_fraction
-                                if ip.resource:
-                                    ip.resource.compute_income_shares(value_equation, d_qty, events, visited)
-                        elif ip.event_type.relationship == "cite":
-                            # import pdb; pdb.set_trace()
-                            # citation events are not contributions, but their resources may have contributions
-                            # ip_value = ip.value * distro_fraction
-                            # if ip_value:
-                            #    d_qty = ip_value / value
-                            #    if ip.resource:
-                            #        ip.resource.compute_income_shares(value_equation, d_qty, events, visited)
-                            if ip.resource:
-                                value = ip.value
-                                ip_value = value * distro_fraction
-                                d_qty = distro_qty
-                                if ip_value and value:
-                                    d_qty = ip_value / value
-                                new_visited = set()
-                                path = []
-                                depth = 0
-                                resource_value = ip.resource.roll_up_value(path, depth, new_visited, value_equation)
-                                ip.resource.compute_income_shares_for_use(value_equation, ip, ip_value, resource_value,
-                                                                          events, visited)
+        from django_rea.valueaccounting.models.income import IncomeShares
+        IncomeShares(value_equation, events, visited).for_process(self, quantity)
+
+
+def process_json_version():
+    """A counter bumped by every change to what the process timelines
+
+    and graphs show: processes, commitments, orders, events in processes,
+    and the names of agents and resource types.
+    """
+    return CacheVersion.objects.current("process_json")
+
+
+def invalidate_process_json():
+    CacheVersion.objects.bump("process_json")
@@ -5,17 +5,19 @@ import datetime
 from django.core.exceptions import ValidationError
 from django.db import models
 from django.contrib.auth.models import User
-from django.db.models import Q
+from django.db.models import Prefetch, Q, Sum
 from django.utils.translation import ugettext_lazy as _
 from django.utils.encoding import python_2_unicode_compatible
 
 from easy_thumbnails.fields import ThumbnailerImageField
 
 from django_rea.valueaccounting.models.agent import EconomicAgent
-from django_rea.valueaccounting.models.resource import EconomicResource
-from django_rea.valueaccounting.models.facetconfig import Facet, ResourceTypeFacetValue
+from django_rea.valueaccounting.models.resource import (
+    AgentResourceRole, EconomicResource, WHERE_FROM_RELATIONSHIPS)
+from django_rea.valueaccounting.models.facetconfig import (
+    Facet, ResourceTypeFacetValue, facet_index)
 
-from ._utils import unique_slugify
+from ._utils import LookupManager, unique_slug, unique_slugify
 
 
 class RecipeInheritance(object):
@@ -38,6 +40,100 @@ class EconomicResourceTypeManager(models.Manager):
             raise ValidationError("Membership Share does not exist by that name")
         return share
 
+    def with_facet_values(self, facet_values):
+        """ Resource types having the facet_values, as select_resource_types
+            reads them: values in different Facets are ANDed,
+            values in the same Facet are ORed.
+            Matched in the FacetIndex instead of joined per Facet.
+        """
+        if not facet_values:
+            return self.none()
+        rt_ids = facet_index().resource_type_ids([fv.id for fv in facet_values])
+        return self.get_queryset().filter(id__in=rt_ids)
+
+    def onhand_quantities(self, resource_types=None):
+        """ A dict of resource type id to onhand_qty,
+            for every resource type with something on hand,
+            from one grouped aggregate.
+        """
+        onhand = EconomicResource.goods.filter(quantity__gt=0)
+        if resource_types is not None:
+            onhand = onhand.filter(resource_type__in=resource_types)
+        totals = onhand.values("resource_type").annotate(qty=Sum("quantity"))
+        return {total["resource_type"]: total["qty"] for total in totals}
+
+    def inventory(self, facet_values=None):
+        """ The resource types with something on hand, for the inventory board.
+
+            Each one gets onhand_quantity and onhand_resources,
+            and the resources come with their stage, location
+            and agent roles, so the board costs the same few queries
+            however many resource types there are.
+        """
+        rts = self.get_queryset()
+        if facet_values is not None:
+            rts = self.with_facet_values(facet_values)
+        quantities = self.onhand_quantities(rts)
+        onhand = EconomicResource.goods.filter(quantity__gt=0)
+        rts = rts.filter(id__in=onhand.values("resource_type"))
+        onhand = onhand.select_related("stage", "current_location")
+        rts = rts.select_related("unit").prefetch_related(
+            Prefetch("facets", queryset=ResourceTypeFacetValue.objects.select_related(
+                "facet_value__facet")),
+            Prefetch("resources", queryset=onhand, to_attr="onhand_resources"),
+            Prefetch("onhand_resources__agent_resource_roles",
+                queryset=AgentResourceRole.objects.select_related("role", "agent")),
+        )
+        rts = [rt for rt in rts if rt.id in quantities]
+        for rt in rts:
+            rt.onhand_quantity = quantities[rt.id]
+        return rts
+
+    def exchange_stages(self, resource_types, commitment_stage, resource_stages):
+        """ The resource types with their work at exchange stages, for the DHen board.
+
+            Each one gets stage_commits, its unfinished commitments
+            at commitment_stage with something left to fill,
+            and stage_resources, its onhand resources by stage id.
+            Commitments come with their fulfilling events, resources
+            with exchange_owner, the agent they were last exchanged to,
+            so the board costs the same few queries
+            however many resource types and lots there are.
+        """
+        from .event import EconomicEvent
+        from .schedule import Commitment
+        rts = list(resource_types)
+        commits = Commitment.objects.filter(
+            exchange_stage=commitment_stage,
+            resource_type__in=rts,
+            finished=False,
+        ).select_related("from_agent", "resource_type", "unit_of_quantity").prefetch_related(
+            "fulfillment_events")
+        where_from = EconomicEvent.objects.filter(
+            event_type__relationship__in=WHERE_FROM_RELATIONSHIPS).select_related("to_agent")
+        onhand = EconomicResource.goods.filter(
+            resource_type__in=rts,
+            exchange_stage__in=resource_stages,
+            quantity__gt=0,
+        ).select_related("resource_type__unit", "stage").prefetch_related(
+            Prefetch("events", queryset=where_from, to_attr="where_from_event_list"))
+        by_rt = {}
+        for com in commits:
+            if com.unfilled_quantity() > 0:
+                by_rt.setdefault(com.resource_type_id, []).append(com)
+        for rt in rts:
+            rt.stage_commits = by_rt.get(rt.id, [])
+            rt.stage_resources = {}
+        stage_resources = dict((rt.id, rt.stage_resources) for rt in rts)
+        for res in onhand:
+            res.exchange_owner = None
+            for event in res.where_from_event_list:
+                if event.exchange_stage_id == res.exchange_stage_id:
+                    res.exchange_owner = event.to_agent
+                    break
+            stage_resources[res.resource_type_id].setdefault(res.exchange_stage_id, []).append(res)
+        return rts
+
 
 INVENTORY_RULE_CHOICES = (
     ('yes', _('Keep inventory')),
@@ -125,8 +221,8 @@ class EconomicResourceType(models.Model):
         return self.__str__()
 
     def save(self, *args, **kwargs):
-        # unique_slugify(self, self.name)
-        super(EconomicResourceType, self).save(*args, **kwargs)
+        with unique_slug(self, self.name):
+            super(EconomicResourceType, self).save(*args, **kwargs)
 
     def is_virtual_account(self):
         if self.behavior == "account":
@@ -196,7 +292,7 @@ class EconomicResourceType(models.Model):
             resource_type=self,
             finished=False)
         for com in commits:
-            if com.unfilled_quantity > 0:
+            if com.unfilled_quantity() > 0:
                 cfes.append(com)
         return cfes
 
@@ -362,7 +458,7 @@ class EconomicResourceType(models.Model):
                     parent = parent.parent
         if not staged_commitments:
             return [], None
-        creation_et = EventType.objects.get(name='Create Changeable')
+        creation_et = EventType.objects.cached(name='Create Changeable')
         chain = []
         creation = None
         try:
@@ -407,7 +503,7 @@ class EconomicResourceType(models.Model):
                     parent = parent.parent
         if not staged_commitments:
             return [], None
-        creation_et = EventType.objects.get(name='Create Changeable')
+        creation_et = EventType.objects.cached(name='Create Changeable')
         chain = []
         creation = None
         try:
@@ -760,19 +856,9 @@ class EconomicResourceType(models.Model):
         return ""
 
     def generate_xbill(self):
-        from django_rea.valueaccounting.utils import explode_xbill_children, xbill_dfs, annotate_tree_properties
-        nodes = []
-        exploded = []
-        # import pdb; pdb.set_trace()
-        for kid in self.xbill_children():
-            explode_xbill_children(kid, nodes, exploded)
-        nodes = list(set(nodes))
-        # import pdb; pdb.set_trace()
-        to_return = []
-        visited = []
-        for kid in self.xbill_children():
-            to_return.extend(xbill_dfs(kid, nodes, visited, 1))
+        from django_rea.valueaccounting.utils import XbillNode, annotate_tree_properties, xbill_tree
         # import pdb; pdb.set_trace()
+        to_return = [XbillNode(node, depth) for node, depth in xbill_tree(self)]
         annotate_tree_properties(to_return)
         return to_return
 
@@ -865,29 +951,10 @@ class EconomicResourceType(models.Model):
 
     def matches_filter(self, facet_values):
         # import pdb; pdb.set_trace()
-        answer = True
-        incoming_facets = []
-        for fv in facet_values:
-            incoming_facets.append(fv.facet)
-        filter_facets = set(incoming_facets)
-        filter_facet_value_collections = []
-        for f in filter_facets:
-            fv_collection = []
-            for fv in facet_values:
-                if fv.facet == f:
-                    fv_collection.append(fv)
-            filter_facet_value_collections.append(fv_collection)
-        filter_matches = []
-        for (i, fac) in enumerate(filter_facets):
-            fm = False
-            for fv in filter_facet_value_collections[i]:
-                if self.has_facet_value(fv):
-                    fm = True
-                    break
-            filter_matches.append(fm)
-        if False in filter_matches:
-            answer = False
-        return answer
+        from django_rea.valueaccounting.models.facetconfig import facet_index
+        if not facet_values:
+            return True
+        return facet_index().matches(self.id, [fv.id for fv in facet_values])
 
     def uninventoried(self):
         if self.inventory_rule == "yes":
@@ -1181,7 +1248,7 @@ UNIT_TYPE_CHOICES = (
 )
 
 
-class EventTypeManager(models.Manager):
+class EventTypeManager(LookupManager):
     def get_by_natural_key(self, name):
         return self.get(name=name)
 
@@ -1401,18 +1468,8 @@ class ProcessType(models.Model):
 
     def create_process(self, start_date, user, inheritance=None):
         # pr changed
-        from django_rea.valueaccounting.models.process import Process
         end_date = start_date + datetime.timedelta(minutes=self.estimated_duration)
-        process = Process(
-            name=self.name,
-            notes=self.description or "",
-            process_type=self,
-            process_pattern=self.process_pattern,
-            context_agent=self.context_agent,
-            url=self.url,
-            start_date=start_date,
-            end_date=end_date,
-        )
+        process = self.unsaved_process(start_date, end_date)
         process.save()
         input_ctypes = self.all_input_resource_type_relationships()
         for ic in input_ctypes:
@@ -1425,6 +1482,19 @@ class ProcessType(models.Model):
         # process.save()
         return process
 
+    def unsaved_process(self, start_date, end_date):
+        from django_rea.valueaccounting.models.process import Process
+        return Process(
+            name=self.name,
+            notes=self.description or "",
+            process_type=self,
+            process_pattern=self.process_pattern,
+            context_agent=self.context_agent,
+            url=self.url,
+            start_date=start_date,
+            end_date=end_date,
+        )
+
     def produced_resource_type_relationships(self):
         # todo pr: needs own_or_parent_recipes
         return self.resource_types.filter(event_type__relationship='out')
@@ -1925,7 +1995,7 @@ class Unit(models.Model):
         return self.name
 
 
-class ExchangeTypeManager(models.Manager):
+class ExchangeTypeManager(LookupManager):
     # before deleting this, track down the connections
     def sale_exchange_types(self):
         return ExchangeType.objects.filter(use_case__identifier='sale')
@@ -1941,7 +2011,7 @@ class ExchangeTypeManager(models.Manager):
 
     def membership_share_exchange_type(self):
         try:
-            xt = ExchangeType.objects.get(name='Membership Contribution')
+            xt = ExchangeType.objects.cached(name='Membership Contribution')
         except ExchangeType.DoesNotExist:
             raise ValidationError("Membership Contribution does not exist by that name")
         return xt
@@ -20,6 +20,13 @@ from django_rea.valueaccounting.models.event import EconomicEvent
 FAIRCOIN_DIVISOR = Decimal("1000000.00")
 
 
+# todo exchange redesign fallout
+# these are all obsolete
+WHERE_FROM_RELATIONSHIPS = (
+    'out', 'receive', 'receivecash', 'cash', 'resource', 'change',
+    'distribute', 'available', 'transfer')
+
+
 class GoodResourceManager(models.Manager):
     def get_queryset(self):
         return super(GoodResourceManager, self).get_queryset().exclude(quality__lt=0)
@@ -33,12 +40,8 @@ class FailedResourceManager(models.Manager):
 class EconomicResourceManager(models.Manager):
     def virtual_accounts(self):
         # import pdb; pdb.set_trace()
-        resources = EconomicResource.objects.all()
-        vas = []
-        for resource in resources:
-            if resource.resource_type.is_virtual_account():
-                vas.append(resource)
-        return vas
+        return list(EconomicResource.objects.filter(
+            resource_type__behavior="account").select_related("resource_type"))
 
     def context_agent_virtual_accounts(self):
         vas = self.virtual_accounts()
@@ -223,7 +226,7 @@ class EconomicResource(models.Model):
         orders = []
         # this is insufficient to select shipments
         # sales below is better
-        et = EventType.objects.get(name="Give")  # was shipment
+        et = EventType.objects.cached(name="Give")  # was shipment
         shipments = EconomicEvent.objects.filter(resource=self).filter(event_type=et)
         for ship in shipments:
             if ship.exchange.order:
@@ -234,8 +237,8 @@ class EconomicResource(models.Model):
         from django_rea.valueaccounting.models.facetconfig import UseCase
         from django_rea.valueaccounting.models.recipe import EventType
         sales = []
-        use_case = UseCase.objects.get(identifier="demand_xfer")
-        et = EventType.objects.get(name="Give")
+        use_case = UseCase.objects.cached(identifier="demand_xfer")
+        et = EventType.objects.cached(name="Give")
         events = EconomicEvent.objects.filter(resource=self).filter(event_type=et)
         for event in events:
             if event.transfer:
@@ -346,19 +349,43 @@ class EconomicResource(models.Model):
 
     def compute_value_per_unit(self, value_equation=None):
         # import pdb; pdb.set_trace()
+        # results are cached until something the rollup read changes,
+        # except for rollups of a historical stage
+        cacheable = not hasattr(self, "historical_stage")
+        if cacheable:
+            from django_rea.valueaccounting.models.rollup import ValuePerUnitCache, rollup_inputs
+            cached = ValuePerUnitCache.objects.lookup(self, value_equation)
+            if cached:
+                self.value_per_unit = cached.value_per_unit
+                return self.value_per_unit
         visited = set()
         path = []
         depth = 0
-        return self.roll_up_value(path, depth, visited, value_equation)
+        value_per_unit = self.roll_up_value(path, depth, visited, value_equation)
+        if cacheable:
+            ValuePerUnitCache.objects.store(self, value_equation, value_per_unit, rollup_inputs(path))
+        return value_per_unit
 
-    def roll_up_value(self, path, depth, visited, value_equation=None):
+    def roll_up_value(self, path, depth, visited, value_equation=None, rollup=None):
         # EconomicResource method
         # import pdb; pdb.set_trace()
         # Value_per_unit will be the result of this method.
+        # The rollup remembers the resources already valued in this run,
+        # and collects the event values and values per unit to be saved.
+        if rollup is None:
+            from django_rea.valueaccounting.models.rollup import ValueRollup
+            rollup = ValueRollup()
+            value_per_unit = self.roll_up_value(path, depth, visited, value_equation, rollup)
+            rollup.flush()
+            return value_per_unit
         depth += 1
         self.depth = depth
         # self.explanation = "Value per unit consists of all the input values on the next level"
         path.append(self)
+        key = rollup.key(self)
+        if key in rollup.values_per_unit:
+            self.value_per_unit = rollup.values_per_unit[key]
+            return self.value_per_unit
         value_per_unit = Decimal("0.0")
         # Values of all of the inputs will be added to this list.
         values = []
@@ -468,8 +495,7 @@ class EconomicResource(models.Model):
                                     # print br.id, br
                                     # print ip
                                     # print "--- value b4:", value_b4, "value after:", value
-                            ip.value = value
-                            ip.save()
+                            rollup.set_event_value(ip, value)
                             pe_value += value
                             # padding = ""
                             # for x in range(0,depth):
@@ -485,10 +511,9 @@ class EconomicResource(models.Model):
                             if ip.resource:
                                 # price changes
                                 if ip.price:
-                                    ip.value = ip.price
+                                    rollup.set_event_value(ip, ip.price)
                                 else:
-                                    ip.value = ip.quantity * ip.resource.value_per_unit_of_use
-                                ip.save()
+                                    rollup.set_event_value(ip, ip.quantity * ip.resource.value_per_unit_of_use)
                                 pe_value += ip.value
                                 # padding = ""
                                 # for x in range(0,depth):
@@ -498,7 +523,7 @@ class EconomicResource(models.Model):
                                 # print padding, "--- pe_value:", pe_value
                                 ip.depth = depth
                                 path.append(ip)
-                                ip.resource.roll_up_value(path, depth, visited, value_equation)
+                                ip.resource.roll_up_value(path, depth, visited, value_equation, rollup)
                                 # br = ip.bucket_rule(value_equation)
                         # Consume contributions use resource rolled up value_per_unit
                         elif ip.event_type.relationship == "consume" or ip.event_type.name == "To Be Changed":
@@ -506,9 +531,8 @@ class EconomicResource(models.Model):
                             path.append(ip)
                             # rollup stage change
                             # this is where it starts (I think)
-                            value_per_unit = ip.roll_up_value(path, depth, visited, value_equation)
-                            ip.value = ip.quantity * value_per_unit
-                            ip.save()
+                            value_per_unit = ip.roll_up_value(path, depth, visited, value_equation, rollup)
+                            rollup.set_event_value(ip, ip.quantity * value_per_unit)
                             pe_value += ip.value
                             # padding = ""
                             # for x in range(0,depth):
@@ -534,14 +558,13 @@ class EconomicResource(models.Model):
                                 # print padding, "--- ip.value: ", ip.value
                                 # print padding, "--- pe_value:", pe_value
                             if ip.resource:
-                                ip.resource.roll_up_value(path, depth, visited, value_equation)
+                                ip.resource.roll_up_value(path, depth, visited, value_equation, rollup)
             production_value += pe_value
         if production_value:
             # Citations use percentage of the sum of other input values.
             for c in citations:
                 percentage = c.quantity / 100
-                c.value = production_value * percentage
-                c.save()
+                rollup.set_event_value(c, production_value * percentage)
             for c in citations:
                 production_value += c.value
                 # padding = ""
@@ -566,8 +589,7 @@ class EconomicResource(models.Model):
                 weights = sum(v[1] for v in values)
                 if weighted_values and weights:
                     value_per_unit = weighted_values / weights
-        self.value_per_unit = value_per_unit.quantize(Decimal('.01'), rounding=ROUND_UP)
-        self.save()
+        rollup.set_value_per_unit(self, value_per_unit.quantize(Decimal('.01'), rounding=ROUND_UP))
         # padding = ""
         # for x in range(0,depth):
         #    padding += "."
@@ -710,280 +732,14 @@ class EconomicResource(models.Model):
 
     def compute_income_shares(self, value_equation, quantity, events, visited):
         # Resource method
-        # print "Resource:", self.id, self
-        # print "running quantity:", quantity, "running value:", value
         # import pdb; pdb.set_trace()
-        contributions = self.resource_contribution_events()
-        for evt in contributions:
-            br = evt.bucket_rule(value_equation)
-            value = evt.value
-            if br:
-                # import pdb; pdb.set_trace()
-                value = br.compute_claim_value(evt)
-            if value:
-                vpu = value / evt.quantity
-                evt.share = quantity * vpu
-                events.append(evt)
-                # print evt.id, evt, evt.share
-                # print "----Event.share:", evt.share, "= evt.value:", evt.value
-        # import pdb; pdb.set_trace()
-        # purchases of resources in value flow can be contributions
-        buys = self.purchase_events()
-        for evt in buys:
-            # import pdb; pdb.set_trace()
-            # if evt.value:
-            #    vpu = evt.value / evt.quantity
-            #    evt.share = quantity * vpu
-            #    events.append(evt)
-            if evt.exchange:
-                evt.exchange.compute_income_shares(value_equation, evt, quantity, events, visited)
-        # todo exchange redesign fallout
-        # change transfer_events, that method is obsolete
-        # import pdb; pdb.set_trace()
-        # xfers = self.transfer_events()
-        # for evt in xfers:
-        #    if evt.exchange:
-        #       evt.exchange.compute_income_shares(value_equation, evt, quantity, events, visited)
-        # import pdb; pdb.set_trace()
-        # income_shares stage change
-        processes = self.producing_processes_for_historical_stage()
-        try:
-            stage = self.historical_stage
-        except AttributeError:
-            if self.stage:
-                processes = [p for p in processes if p.process_type == self.stage]
-        for process in processes:
-            if process not in visited:
-                visited.add(process)
-                if quantity:
-                    # todo: how will this work for >1 processes producing the same resource?
-                    # what will happen to the shares of the inputs of the later processes?
-                    production_events = [e for e in process.production_events() if e.resource == self]
-                    produced_qty = sum(pe.quantity for pe in production_events)
-                    distro_fraction = 1
-                    distro_qty = quantity
-                    if produced_qty > quantity:
-                        distro_fraction = quantity / produced_qty
-                        quantity = Decimal("0.0")
-                    elif produced_qty <= quantity:
-                        distro_qty = produced_qty
-                        quantity -= produced_qty
-                    for pe in production_events:
-                        # todo br
-                        # import pdb; pdb.set_trace()
-                        value = pe.quantity
-                        br = pe.bucket_rule(value_equation)
-                        if br:
-                            # import pdb; pdb.set_trace()
-                            value = br.compute_claim_value(pe)
-                        pe.share = value * distro_fraction
-                        pe.value = value
-                        events.append(pe)
-                    # import pdb; pdb.set_trace()
-                    if process.context_agent.compatible_value_equation(value_equation):
-                        inputs = process.incoming_events()
-                        for ip in inputs:
-                            # we assume here that work events are contributions
-                            if ip.event_type.relationship == "work":
-                                # import pdb; pdb.set_trace()
-                                if ip.is_contribution:
-                                    value = ip.value
-                                    br = ip.bucket_rule(value_equation)
-                                    if br:
-                                        # import pdb; pdb.set_trace()
-                                        value = br.compute_claim_value(ip)
-                                        ip.value = value
-                                    ip.share = value * distro_fraction
-                                    events.append(ip)
-                                    # print ip.id, ip, ip.share
-                                    # print "----Event.share:", ip.share, "= Event.value:", ip.value, "* distro_fraction:", distro_fraction
-                            elif ip.event_type.relationship == "use":
-                                # use events are not contributions, but their resources may have contributions
-                                # equip logging changes
-                                # import pdb; pdb.set_trace()
-                                if ip.resource:
-                                    # price changes
-                                    if ip.price:
-                                        ip.value = ip.price
-                                    else:
-                                        ip.value = ip.quantity * ip.resource.value_per_unit_of_use
-                                    ip.save()
-
-                                    # experiment for equipment maintenance fee
-                                    # ip.share = ip.value
-                                    # events.append(ip)
-
-                                    value = ip.value
-                                    ip_value = value * distro_fraction
-                                    d_qty = distro_qty
-                                    if ip_value and value:
-                                        d_qty = ip_value / value
-                                    # d_qty may be the wrong qty to pass into compute_income_shares
-                                    # and compute_income_shares may be the wrong method anyway
-                                    # Maybe a use event method?
-                                    # What we want to do is pass the ip_value down to the exchange...
-                                    # Conceptually, we are distributing ip_value to the contributors to the resource!
-                                    new_visited = set()
-                                    path = []
-                                    depth = 0
-                                    resource_value = ip.resource.roll_up_value(path, depth, new_visited, value_equation)
-                                    ip.resource.compute_income_shares_for_use(value_equation, ip, ip_value,
-                                                                              resource_value, events, visited)
-                            elif ip.event_type.relationship == "consume" or ip.event_type.name == "To Be Changed":
-                                # consume events are not contributions, but their resources may have contributions
-                                # equip logging changes
-                                new_visited = set()
-                                path = []
-                                depth = 0
-
-                                value_per_unit = ip.roll_up_value(path, depth, new_visited, value_equation)
-                                ip.value = ip.quantity * value_per_unit
-                                ip.save()
-                                ip_value = ip.value * distro_fraction
-                                d_qty = ip.quantity * distro_fraction
-                                # if ip_value:
-                                # print "consumption:", ip.id, ip, "ip.value:", ip.value
-                                # print "----value:", ip_value, "d_qty:", d_qty, "distro_fraction:", distro_fraction
-                                if ip.resource:
-                                    # income_shares stage change
-                                    ip.compute_income_shares(value_equation, d_qty, events, visited)
-                            elif ip.event_type.relationship == "cite":
-                                # import pdb; pdb.set_trace()
-                                # citation events are not contributions, but their resources may have contributions
-                                if ip.resource:
-                                    # equip logging changes
-                                    if ip.resource_type.unit_of_use:
-                                        if ip.resource_type.unit_of_use.unit_type == "percent":
-                                            citations.append(ip)
-                                    else:
-                                        ip.value = ip.quantity
-                                    ip.save()
-                                    value = ip.value
-                                    ip_value = value * distro_fraction
-                                    d_qty = distro_qty
-                                    if ip_value and value:
-                                        d_qty = ip_value / value
-                                    # if ip.resource:
-                                    #    ip.resource.compute_income_shares(value_equation, d_qty, events, visited)
-                                    new_visited = set()
-                                    path = []
-                                    depth = 0
-                                    resource_value = ip.resource.roll_up_value(path, depth, new_visited, value_equation)
-                                    ip.resource.compute_income_shares_for_use(value_equation, ip, ip_value,
-                                                                              resource_value, events, visited)
+        from django_rea.valueaccounting.models.income import IncomeShares
+        IncomeShares(value_equation, events, visited).for_resource(self, quantity)
 
     def compute_income_shares_for_use(self, value_equation, use_event, use_value, resource_value, events, visited):
         # Resource method
-        # import pdb; pdb.set_trace()
-        contributions = self.resource_contribution_events()
-        for evt in contributions:
-            # todo exchange redesign fallout
-            # import pdb; pdb.set_trace()
-            br = evt.bucket_rule(value_equation)
-            value = evt.value
-            if br:
-                value = br.compute_claim_value(evt)
-            if value:
-                vpu = value / evt.quantity
-                evt.share = min(vpu, use_value)
-                events.append(evt)
-        buys = self.purchase_events()
-        for evt in buys:
-            # this is because purchase_events will duplicate resource_contribution_events
-            if evt not in events:
-                if evt.exchange:
-                    evt.exchange.compute_income_shares_for_use(value_equation, use_event, use_value, resource_value,
-                                                               events, visited)
-        processes = self.producing_processes()
-        # shd only be one producing process for a used resource..right?
-        quantity = self.quantity
-        for process in processes:
-            if process not in visited:
-                visited.add(process)
-                if quantity:
-                    # todo: how will this work for >1 processes producing the same resource?
-                    # what will happen to the shares of the inputs of the later processes?
-                    production_events = process.production_events()
-                    produced_qty = sum(pe.quantity for pe in production_events)
-                    # todo 3d: how to compute?
-                    # this fraction stuff only applies to shipped qties
-                    # which do not apply here...
-                    distro_fraction = 1
-                    distro_qty = quantity
-                    if produced_qty > quantity:
-                        distro_fraction = quantity / produced_qty
-                        quantity = Decimal("0.0")
-                    elif produced_qty <= quantity:
-                        distro_qty = produced_qty
-                        quantity -= produced_qty
-                    for pe in production_events:
-                        value = pe.quantity
-                        br = pe.bucket_rule(value_equation)
-                        if br:
-                            value = br.compute_claim_value(pe)
-                        # todo 3d: how to compute?
-                        pe.share = value * distro_fraction
-                        events.append(pe)
-                    if process.context_agent.compatible_value_equation(value_equation):
-                        inputs = process.incoming_events()
-                        for ip in inputs:
-                            # we assume here that work events are contributions
-                            if ip.event_type.relationship == "work":
-                                if ip.is_contribution:
-                                    value = ip.value
-                                    br = ip.bucket_rule(value_equation)
-                                    if br:
-                                        value = br.compute_claim_value(ip)
-                                        ip.value = value
-                                    # todo 3d: changed
-                                    # import pdb; pdb.set_trace()
-                                    fraction = ip.value / resource_value
-                                    ip.share = use_value * fraction
-                                    # ip.share = value * distro_fraction
-                                    events.append(ip)
-                            elif ip.event_type.relationship == "use":
-                                # use events are not contributions, but their resources may have contributions
-                                if ip.resource:
-                                    # price changes
-                                    if ip.price:
-                                        ip.value = ip.price
-                                    else:
-                                        ip.value = ip.quantity * ip.resource.value_per_unit_of_use
-                                    value = ip.value
-                                    ip_value = value * distro_fraction
-                                    d_qty = distro_qty
-                                    if ip_value and value:
-                                        d_qty = ip_value / value
-                                    ip.resource.compute_income_shares_for_use(value_equation, ip, ip_value,
-                                                                              resource_value, events, visited)
-                            elif ip.event_type.relationship == "consume" or ip.event_type.name == "To Be Changed":
-                                # consume events are not contributions, but their resources may have contributions
-                                ip_value = ip.value * distro_fraction
-                                d_qty = ip.quantity * distro_fraction
-                                if ip.resource:
-                                    ip.resource.compute_income_shares(value_equation, d_qty, events, visited)
-                            elif ip.event_type.relationship == "cite":
-                                # citation events are not contributions, but their resources may have contributions
-                                # todo: use percent or compute_income_shares_for_use?
-                                # value = ip.value
-                                # ip_value = value * distro_fraction
-                                # d_qty = distro_qty
-                                # if ip_value and value:
-                                #    d_qty = ip_value / value
-                                # if ip.resource:
-                                #    ip.resource.compute_income_shares(value_equation, d_qty, events, visited)
-                                if ip.resource:
-                                    value = ip.value
-                                    ip_value = value * distro_fraction
-                                    d_qty = distro_qty
-                                    if ip_value and value:
-                                        d_qty = ip_value / value
-                                    new_visited = set()
-                                    path = []
-                                    depth = 0
-                                    resource_value = ip.resource.roll_up_value(path, depth, new_visited, value_equation)
-                                    ip.resource.compute_income_shares_for_use(value_equation, ip, ip_value,
-                                                                              resource_value, events, visited)
+        from django_rea.valueaccounting.models.income import IncomeShares
+        IncomeShares(value_equation, events, visited).for_resource_use(self, use_event, use_value, resource_value)
 
     def direct_share_components(self, components, visited, depth):
         depth += 1
@@ -1067,15 +823,7 @@ class EconomicResource(models.Model):
         return pes
 
     def where_from_events(self):
-        # todo exchange redesign fallout
-        # these are all obsolete
-        return self.events.filter(
-            Q(event_type__relationship='out') | Q(event_type__relationship='receive') | Q(
-                event_type__relationship='receivecash')
-            | Q(event_type__relationship='cash') | Q(event_type__relationship='resource') | Q(
-                event_type__relationship='change')
-            | Q(event_type__relationship='distribute') | Q(event_type__relationship='available') | Q(
-                event_type__relationship='transfer'))
+        return self.events.filter(event_type__relationship__in=WHERE_FROM_RELATIONSHIPS)
 
     # todo: add transfer?
     def where_to_events(self):
@@ -1115,7 +863,7 @@ class EconomicResource(models.Model):
     def cash_events(self):  # includes cash contributions, donations and loans
         # todo exchange redesign fallout
         from django_rea.valueaccounting.models.recipe import EventType
-        rct_et = EventType.objects.get(name="Receive")
+        rct_et = EventType.objects.cached(name="Receive")
         with_xfer = [event for event in self.events.all() if event.transfer and event.event_type == rct_et]
         currencies = [event for event in with_xfer if event.transfer.transfer_type.is_currency]
         return currencies
@@ -1124,7 +872,7 @@ class EconomicResource(models.Model):
         # todo exchange redesign fallout
         from django_rea.valueaccounting.models.recipe import EventType
         # import pdb; pdb.set_trace()
-        rct_et = EventType.objects.get(name="Receive")
+        rct_et = EventType.objects.cached(name="Receive")
         with_xfer = [event for event in self.events.all() if event.transfer and event.event_type == rct_et]
         contributions = [event for event in with_xfer if event.is_contribution]
         currencies = [event for event in contributions if event.transfer.transfer_type.is_currency]
@@ -1134,7 +882,7 @@ class EconomicResource(models.Model):
         # todo exchange redesign fallout
         from django_rea.valueaccounting.models.recipe import EventType
         # is this correct?
-        rct_et = EventType.objects.get(name="Receive")
+        rct_et = EventType.objects.cached(name="Receive")
         return self.events.filter(event_type=rct_et, is_contribution=False)
 
     def purchase_events_for_exchange_stage(self):
@@ -1150,7 +898,7 @@ class EconomicResource(models.Model):
         from django_rea.valueaccounting.models.recipe import EventType
         print("obsolete resource.transfer_event")
         # import pdb; pdb.set_trace()
-        tx_et = EventType.objects.get(name="Receive")
+        tx_et = EventType.objects.cached(name="Receive")
         return self.events.filter(event_type=tx_et)
 
     def transfer_events_for_exchange_stage(self):
@@ -1163,7 +911,7 @@ class EconomicResource(models.Model):
 
     def available_events(self):
         from django_rea.valueaccounting.models.recipe import EventType
-        av_et = EventType.objects.get(name="Make Available")
+        av_et = EventType.objects.cached(name="Make Available")
         return self.events.filter(event_type=av_et)
 
     def all_usage_events(self):
@@ -1265,12 +1013,12 @@ class EconomicResource(models.Model):
             resources = []
             events = self.event_sequence()
             events.reverse()
-            pet = EventType.objects.get(name="Resource Production")
+            pet = EventType.objects.cached(name="Resource Production")
             # todo exchange redesign fallout
             # xet = EventType.objects.get(name="Transfer")
             # xfer events no longer exist
             # rcpt = EventType.objects.get(name="Receipt")
-            rcpt = EventType.objects.get(name="Receive")
+            rcpt = EventType.objects.cached(name="Receive")
 
             for event in events:
                 if event not in visited:
@@ -1461,7 +1209,7 @@ class EconomicResource(models.Model):
         from django_rea.valueaccounting.models.recipe import EventType
         in_out = self.value_flow_going_forward()
         receipt = None
-        et = EventType.objects.get(name='Receive')
+        et = EventType.objects.cached(name='Receive')
         for index, io in enumerate(in_out):
             if type(io) is EconomicEvent:
                 if io.event_type == et:
@@ -1683,7 +1431,8 @@ class AgentResourceType(models.Model):
     def total_required(self):
         from .schedule import Commitment
         commitments = Commitment.objects.unfinished().filter(resource_type=self.resource_type)
-        return sum(req.quantity_to_buy() for req in commitments)
+        netting = getattr(self, "netting_index", None)
+        return sum(req.quantity_to_buy(netting) for req in commitments)
 
     def comparative_scores(self):
         scores = AgentResourceType.objects.filter(resource_type=self.resource_type).values_list('score', flat=True)
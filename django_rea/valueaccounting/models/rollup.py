@@ -0,0 +1,223 @@
+import datetime
+
+from django.db import IntegrityError, models, transaction
+from django.db.models import Case, F, Q, Value, When
+from django.utils.translation import ugettext_lazy as _
+
+
+def bulk_update_field(model, field_name, values, batch_size=500):
+    """Writes {pk: value} to one field of many rows with one UPDATE per batch,
+    bypassing save() and its side effects.
+    """
+    field = model._meta.get_field(field_name)
+    pks = list(values.keys())
+    for i in range(0, len(pks), batch_size):
+        batch = pks[i:i + batch_size]
+        whens = [When(pk=pk, then=Value(values[pk])) for pk in batch]
+        model.objects.filter(pk__in=batch).update(
+            **{field_name: Case(*whens, output_field=field)})
+
+
+def bulk_add_to_field(model, field_name, deltas, batch_size=500):
+    """Adds {pk: delta} to one numeric field of many rows with one UPDATE
+    per batch, in the database, so concurrent changes are not lost.
+    """
+    field = model._meta.get_field(field_name)
+    pks = [pk for pk in deltas.keys() if deltas[pk]]
+    for i in range(0, len(pks), batch_size):
+        batch = pks[i:i + batch_size]
+        whens = [When(pk=pk, then=Value(deltas[pk])) for pk in batch]
+        model.objects.filter(pk__in=batch).update(
+            **{field_name: F(field_name) + Case(*whens, output_field=field)})
+
+
+class ValueRollup(object):
+    """One run of EconomicResource.roll_up_value.
+
+    Remembers each resource's value per unit, by resource and historical stage,
+    so a resource reached again in the same run is not rolled up again.
+    The input event values and resource values per unit the run computes
+    are collected and written with bulk updates by flush(),
+    instead of a save() per event.
+    """
+
+    def __init__(self):
+        self.values_per_unit = {}
+        self.event_values = {}
+        self.resource_values = {}
+
+    def key(self, resource):
+        # the same resource can be rolled up at different stages
+        try:
+            stage = resource.historical_stage
+        except AttributeError:
+            stage = resource.stage
+        stage_id = stage.id if stage else None
+        return (resource.id, stage_id)
+
+    def set_event_value(self, event, value):
+        event.value = value
+        self.event_values[event.id] = value
+
+    def set_value_per_unit(self, resource, value_per_unit):
+        resource.value_per_unit = value_per_unit
+        self.values_per_unit[self.key(resource)] = value_per_unit
+        self.resource_values[resource.id] = value_per_unit
+
+    def flush(self):
+        from django_rea.valueaccounting.models.event import EconomicEvent
+        from django_rea.valueaccounting.models.resource import EconomicResource
+        bulk_update_field(EconomicEvent, "value", self.event_values)
+        bulk_update_field(EconomicResource, "value_per_unit", self.resource_values)
+        self.event_values = {}
+        self.resource_values = {}
+
+
+def rollup_inputs(path):
+    """The (kind, id) pairs of everything a rollup path read its values from:
+    resources, resource types, processes and exchanges.
+    """
+    from django_rea.valueaccounting.models.event import EconomicEvent
+    from django_rea.valueaccounting.models.process import Process
+    from django_rea.valueaccounting.models.resource import EconomicResource
+    from django_rea.valueaccounting.models.trade import Exchange
+    inputs = events_inputs([obj for obj in path if isinstance(obj, EconomicEvent)])
+    for obj in path:
+        if isinstance(obj, EconomicResource):
+            inputs.add(("resource", obj.id))
+            inputs.add(("resource_type", obj.resource_type_id))
+        elif isinstance(obj, Process):
+            inputs.add(("process", obj.id))
+        elif isinstance(obj, Exchange):
+            inputs.add(("exchange", obj.id))
+    return inputs
+
+
+def event_inputs(event, transfer_exchanges=None):
+    """The rollup inputs an event feeds, see rollup_inputs.
+
+    transfer_exchanges, {transfer id: exchange id}, saves a query
+    for events that belong to an exchange through their transfer.
+    """
+    inputs = set([("resource_type", event.resource_type_id)])
+    if event.resource_id:
+        inputs.add(("resource", event.resource_id))
+    if event.process_id:
+        inputs.add(("process", event.process_id))
+    if event.exchange_id:
+        inputs.add(("exchange", event.exchange_id))
+    if event.transfer_id:
+        if transfer_exchanges is None:
+            transfer_exchanges = transfer_exchange_ids([event.transfer_id])
+        if transfer_exchanges.get(event.transfer_id):
+            inputs.add(("exchange", transfer_exchanges[event.transfer_id]))
+    return inputs
+
+
+def events_inputs(events):
+    """The rollup inputs of some events, None for no event,
+    with one query for the exchanges of their transfers.
+    """
+    events = [event for event in events if event is not None]
+    transfer_exchanges = transfer_exchange_ids(event.transfer_id for event in events)
+    inputs = set()
+    for event in events:
+        inputs.update(event_inputs(event, transfer_exchanges))
+    return inputs
+
+
+def transfer_exchange_ids(transfer_ids):
+    from django_rea.valueaccounting.models.trade import Transfer
+    transfer_ids = set(transfer_ids)
+    transfer_ids.discard(None)
+    if not transfer_ids:
+        return {}
+    return dict(Transfer.objects.filter(pk__in=transfer_ids).values_list("id", "exchange_id"))
+
+
+def invalidate_value_per_unit(inputs):
+    """Drops the cached values per unit that read any of the inputs."""
+    by_kind = {}
+    for kind, id in inputs:
+        if id is not None:
+            by_kind.setdefault(kind, set()).add(id)
+    if not by_kind:
+        return
+    q = Q()
+    for kind, ids in by_kind.items():
+        q |= Q(kind=kind, object_id__in=ids)
+    cache_ids = set(ValuePerUnitCacheInput.objects.filter(q).values_list("cache", flat=True))
+    if cache_ids:
+        ValuePerUnitCache.objects.filter(id__in=cache_ids).delete()
+
+
+class ValuePerUnitCacheManager(models.Manager):
+    def lookup(self, resource, value_equation):
+        return self.filter(
+            resource=resource,
+            value_equation=value_equation).first()
+
+    def store(self, resource, value_equation, value_per_unit, inputs):
+        """Replaces the cached value per unit, with the inputs it was computed from.
+
+        When a concurrent rollup stores the same entry first, its entry is kept.
+        """
+        try:
+            with transaction.atomic():
+                self.filter(resource=resource, value_equation=value_equation).delete()
+                entry = self.create(
+                    resource=resource,
+                    value_equation=value_equation,
+                    value_per_unit=value_per_unit)
+                ValuePerUnitCacheInput.objects.bulk_create([
+                    ValuePerUnitCacheInput(cache=entry, kind=kind, object_id=id)
+                    for kind, id in inputs if id is not None])
+        except IntegrityError:
+            pass
+
+    def invalidate_value_equation(self, value_equation_id):
+        self.filter(value_equation_id=value_equation_id).delete()
+
+
+class ValuePerUnitCache(models.Model):
+    """The last result of EconomicResource.compute_value_per_unit
+    for a resource and value equation.
+
+    Entries are deleted when anything they were computed from changes,
+    see ValuePerUnitCacheInput.
+    """
+    resource = models.ForeignKey("EconomicResource",
+                                 verbose_name=_('resource'), related_name='value_per_unit_cache')
+    value_equation = models.ForeignKey("ValueEquation",
+                                       blank=True, null=True,
+                                       verbose_name=_('value equation'), related_name='value_per_unit_cache')
+    value_per_unit = models.DecimalField(_('value per unit'), max_digits=8, decimal_places=2,
+                                         blank=True, null=True)
+    computed_date = models.DateField(_('computed date'), default=datetime.date.today)
+
+    objects = ValuePerUnitCacheManager()
+
+    class Meta:
+        ordering = ('resource', 'value_equation',)
+        unique_together = ('resource', 'value_equation')
+
+
+INPUT_KIND_CHOICES = (
+    ('resource', _('resource')),
+    ('resource_type', _('resource type')),
+    ('process', _('process')),
+    ('exchange', _('exchange')),
+)
+
+
+class ValuePerUnitCacheInput(models.Model):
+    """Something a ValuePerUnitCache entry was computed from,
+    so changing it finds the entries to drop.
+    """
+    cache = models.ForeignKey(ValuePerUnitCache,
+                              verbose_name=_('cache'), related_name='inputs')
+    kind = models.CharField(_('kind'), max_length=16, choices=INPUT_KIND_CHOICES)
+    object_id = models.IntegerField(_('object id'))
+
+    class Meta:
+        index_together = ('kind', 'object_id')
@@ -20,6 +20,7 @@ from django_rea.valueaccounting.models.facetconfig import (
     UseCase
 )
 from django_rea.valueaccounting.models.recipe import ProcessType
+from django_rea.valueaccounting.models.planning import NettingIndex, ProcessGraph
 
 from ._utils import (
     unique_slugify,
@@ -50,6 +51,8 @@ class CommitmentManager(models.Manager):
         cts = self.unfinished()
         reqs = cts.filter(
             Q(event_type__relationship='consume') | Q(event_type__relationship='use')).order_by("resource_type__name")
+        reqs = list(reqs.select_related("resource_type", "event_type", "stage"))
+        NettingIndex().attach(reqs)
         rts = all_purchased_resource_types()
         answer = []
         for req in reqs:
@@ -198,16 +201,18 @@ class Commitment(models.Model):
             resource_name,
         ])
 
-    def save(self, *args, **kwargs):
+    def slug_source(self):
         from_id = "Unassigned"
         if self.from_agent:
             from_id = str(self.from_agent.id)
-        slug = "-".join([
+        return "-".join([
             str(self.event_type.id),
             from_id,
             self.due_date.strftime('%Y-%m-%d'),
         ])
-        unique_slugify(self, slug)
+
+    def save(self, *args, **kwargs):
+        unique_slugify(self, self.slug_source())
         # notify_here?
         super(Commitment, self).save(*args, **kwargs)
 
@@ -322,13 +327,13 @@ class Commitment(models.Model):
         prefix = self.form_prefix()
         return ProcessForm(initial=init, prefix=prefix)
 
-    def change_work_form(self):
+    def change_work_form(self, choices=None):
         from django_rea.valueaccounting.forms import WorkCommitmentForm
         prefix = self.form_prefix()
         pattern = None
         if self.process:
             pattern = self.process.process_pattern
-        return WorkCommitmentForm(instance=self, pattern=pattern, prefix=prefix)
+        return WorkCommitmentForm(instance=self, pattern=pattern, prefix=prefix, choices=choices)
 
     def invite_collaborator_form(self):
         from django_rea.valueaccounting.forms import InviteCollaboratorForm
@@ -457,7 +462,7 @@ class Commitment(models.Model):
         qty_help = " ".join(["unit:", self.unit_of_quantity.abbrev, ", up to 2 decimal places"])
         return InputEventForm(qty_help=qty_help, prefix=prefix, data=data)
 
-    def input_event_form_init(self, init=None, data=None):
+    def input_event_form_init(self, init=None, data=None, choices=None):
         # import pdb; pdb.set_trace()
         from django_rea.valueaccounting.forms import InputEventAgentForm
         prefix = self.form_prefix()
@@ -470,9 +475,9 @@ class Commitment(models.Model):
                 unit_string = unit.name
             qty_help = " ".join(["unit:", unit_string, ", up to 2 decimal places"])
         if init:
-            return InputEventAgentForm(qty_help=qty_help, prefix=prefix, initial=init, data=data)
+            return InputEventAgentForm(qty_help=qty_help, prefix=prefix, initial=init, data=data, choices=choices)
         else:
-            return InputEventAgentForm(qty_help=qty_help, prefix=prefix, data=data)
+            return InputEventAgentForm(qty_help=qty_help, prefix=prefix, data=data, choices=choices)
 
     def consumption_event_form(self):
         from django_rea.valueaccounting.forms import InputEventForm
@@ -657,11 +662,20 @@ class Commitment(models.Model):
                         answer.append(r)
         return answer
 
-    def quantity_to_buy(self):
-        return self.net()
+    def quantity_to_buy(self, netting=None):
+        return self.net(netting)
 
-    def net(self):
+    def net(self, netting=None):
+        """Quantity still needed after onhand and scheduled quantities.
+
+        netting is an optional NettingIndex (see models.planning)
+        that answers without queries; NettingIndex.attach sets one
+        on commitments for the template calls.
+        """
         # import pdb; pdb.set_trace()
+        netting = netting or getattr(self, "netting_index", None)
+        if netting is not None:
+            return netting.net(self)
         rt = self.resource_type
         if not rt.substitutable:
             return self.quantity
@@ -933,7 +947,7 @@ class Commitment(models.Model):
     def process_chain(self):
         # import pdb; pdb.set_trace()
         processes = []
-        self.process.all_previous_processes(processes, [], 0)
+        self.process.all_previous_processes(processes, [], 0, ProcessGraph([self.process]))
         return processes
 
     def find_order_item(self):
@@ -1227,11 +1241,11 @@ class Reciprocity(models.Model):
 
 
 def all_purchased_resource_types():
-    uc = UseCase.objects.get(name="Purchasing")
+    uc = UseCase.objects.cached(name="Purchasing")
     pats = ProcessPattern.objects.usecase_patterns(uc)
     # todo exchange redesign fallout
     # et = EventType.objects.get(name="Receipt")
-    et = EventType.objects.get(name="Receive")
+    et = EventType.objects.cached(name="Receive")
     rts = []
     for pat in pats:
         rts.extend(pat.get_resource_types(et))
@@ -1449,7 +1463,7 @@ class Order(models.Model):
         else:
             if self.order_type == "customer":
                 # todo exchange redesign fallout
-                event_type = EventType.objects.get(name="Give")
+                event_type = EventType.objects.cached(name="Give")
                 ois = self.order_items()
                 if ois:
                     context_agent = ois[0].context_agent
@@ -1480,7 +1494,7 @@ class Order(models.Model):
         # import pdb; pdb.set_trace()
         if not due:
             due = self.due_date
-        event_type = EventType.objects.get(name="Give")  # (relationship="shipment")
+        event_type = EventType.objects.cached(name="Give")  # (relationship="shipment")
         ct = Commitment(
             order=self,
             independent_demand=self,
@@ -1516,14 +1530,15 @@ class Order(models.Model):
                     processes.append(c.process)
             processes = list(set(processes))
         ends = []
+        graph = ProcessGraph(processes)
         # import pdb; pdb.set_trace()
         for proc in processes:
-            if not proc.next_processes_for_order(self):
+            if not proc.next_processes_for_order(self, graph):
                 ends.append(proc)
         ordered_processes = []
         for end in ends:
             visited = []
-            end.all_previous_processes_for_order(self, ordered_processes, visited, 0)
+            end.all_previous_processes_for_order(self, ordered_processes, visited, 0, graph)
         ordered_processes.reverse()
         # todo: review bug fixes
         # this code might need more testing for orders with more than one end process
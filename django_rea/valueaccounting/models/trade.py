@@ -7,7 +7,7 @@ from django.contrib.auth.models import User
 from django.utils.translation import ugettext_lazy as _
 from django.utils.encoding import python_2_unicode_compatible
 
-from ._utils import unique_slugify
+from ._utils import unique_slug
 
 from django_rea.valueaccounting.models.event import EconomicEvent
 from django_rea.valueaccounting.models.recipe import EventType
@@ -121,8 +121,8 @@ class Exchange(models.Model):
             self.name,
             self.start_date.strftime('%Y-%m-%d'),
         ])
-        unique_slugify(self, slug)
-        super(Exchange, self).save(*args, **kwargs)
+        with unique_slug(self, slug):
+            super(Exchange, self).save(*args, **kwargs)
 
     def class_label(self):
         return "Exchange"
@@ -176,7 +176,7 @@ class Exchange(models.Model):
             else:
                 slot.default_from_agent = default_from_agent
                 slot.default_to_agent = default_to_agent
-            if slot.is_currency and self.exchange_type.use_case != UseCase.objects.get(identifier="intrnl_xfer"):
+            if slot.is_currency and self.exchange_type.use_case != UseCase.objects.cached(identifier="intrnl_xfer"):
                 if not slot.give_agent_is_context:
                     slot.default_from_agent = None  # logged on agent
                 if not slot.receive_agent_is_context:
@@ -226,7 +226,7 @@ class Exchange(models.Model):
     def transfer_give_events(self):
         # not reciprocal
         events = []
-        et_give = EventType.objects.get(name="Give")
+        et_give = EventType.objects.cached(name="Give")
         for transfer in self.transfers.all():
             if not transfer.is_reciprocal():
                 for event in transfer.events.all():
@@ -238,7 +238,7 @@ class Exchange(models.Model):
     def transfer_receive_events(self):
         # not reciprocal
         events = []
-        et_receive = EventType.objects.get(name="Receive")
+        et_receive = EventType.objects.cached(name="Receive")
         for transfer in self.transfers.all():
             if not transfer.is_reciprocal():
                 for event in transfer.events.all():
@@ -249,7 +249,7 @@ class Exchange(models.Model):
     # todo:not tested
     def reciprocal_transfer_give_events(self):
         events = []
-        et_give = EventType.objects.get(name="Give")
+        et_give = EventType.objects.cached(name="Give")
         for transfer in self.transfers.all():
             if transfer.is_reciprocal():
                 for event in transfer.events.all():
@@ -264,7 +264,7 @@ class Exchange(models.Model):
     # todo:not tested
     def reciprocal_transfer_receive_events(self):
         events = []
-        et_receive = EventType.objects.get(name="Receive")
+        et_receive = EventType.objects.cached(name="Receive")
         for transfer in self.transfers.all():
             if transfer.is_reciprocal():
                 for event in transfer.events.all():
@@ -416,229 +416,13 @@ class Exchange(models.Model):
 
     def compute_income_shares(self, value_equation, trigger_event, quantity, events, visited):
         # exchange method
-        # import pdb; pdb.set_trace()
-        if trigger_event not in visited:
-            visited.add(trigger_event)
-
-            trigger_fraction = 1
-            share = quantity / trigger_event.quantity
-            # todo exchange redesign fallout
-            receipts = self.resource_receive_events()
-            if receipts:
-                if len(receipts) > 1:
-                    rsum = sum(r.value for r in receipts)
-                    trigger_fraction = trigger_event.value / rsum
-            payments = [evt for evt in self.payment_events() if evt.to_agent == trigger_event.from_agent]
-            """
-            else:
-                #todo exchange redesign fallout
-                #change transfer_events, that method is obsolete
-                xfers = self.transfer_events()
-                if xfers:
-                    payments = self.cash_receipt_events().filter(from_agent=trigger_event.to_agent)
-            """
-            if len(payments) == 1:
-                evt = payments[0]
-                value = evt.quantity
-                contributions = []
-                # import pdb; pdb.set_trace()
-                if evt.resource:
-                    # todo exchange redesign fallout
-                    # do cash_contribution_events work?
-                    candidates = evt.resource.cash_contribution_events()
-                    for cand in candidates:
-                        br = cand.bucket_rule(value_equation)
-                        if br:
-                            cand.value = br.compute_claim_value(cand)
-                            if cand.value:
-                                contributions.append(cand)
-                    for ct in contributions:
-                        fraction = ct.quantity / value
-                        ct.share = ct.value * share * fraction * trigger_fraction
-                        # ct.share = ct.value * fraction * trigger_fraction
-                        events.append(ct)
-                if not contributions:
-                    # if contributions were credited,
-                    # do not give credit for payment.
-                    # import pdb; pdb.set_trace()
-                    br = evt.bucket_rule(value_equation)
-                    if br:
-                        value = br.compute_claim_value(evt)
-                    evt.value = value
-                    evt.save()
-                    evt.share = value * share * trigger_fraction
-                    events.append(evt)
-
-            elif len(payments) > 1:
-                total = sum(p.quantity for p in payments)
-                for evt in payments:
-                    fraction = evt.quantity / total
-                    # if evt.resource:
-                    if evt.resource and not xfers:
-                        contributions = evt.resource.cash_contribution_events()
-                        evt.share = evt.quantity * share * fraction * trigger_fraction
-                        # evt.share = evt.quantity * fraction * trigger_fraction
-                        events.append(evt)
-                        # todo 3d: do multiple payments make sense for cash contributions?
-                        # equip logging changes
-                        # apparently: see treatment in compute_income_shares_for_use below
-                    else:
-                        value = evt.quantity
-                        br = evt.bucket_rule(value_equation)
-                        if br:
-                            # import pdb; pdb.set_trace()
-                            value = br.compute_claim_value(evt)
-                        evt.value = value
-                        evt.save()
-                        evt.share = value * share * fraction * trigger_fraction
-                        # evt.share = value * fraction * trigger_fraction
-                        events.append(evt)
-
-            expenses = self.expense_events()
-            for ex in expenses:
-                exp_payments = [evt for evt in self.payment_events() if evt.to_agent == ex.from_agent]
-                for exp in exp_payments:
-                    value = exp.quantity
-                    br = exp.bucket_rule(value_equation)
-                    if br:
-                        # import pdb; pdb.set_trace()
-                        value = br.compute_claim_value(exp)
-                    exp.value = value
-                    exp.save()
-                    exp.share = value * share * trigger_fraction
-                    events.append(exp)
-
-            for evt in self.work_events():
-                # import pdb; pdb.set_trace()
-                if evt.is_contribution:
-                    value = evt.quantity
-                    br = evt.bucket_rule(value_equation)
-                    if br:
-                        # import pdb; pdb.set_trace()
-                        value = br.compute_claim_value(evt)
-                    # evt.share = value * share * trigger_fraction
-                    evt.value = value
-                    evt.save()
-                    evt.share = value * share * trigger_fraction
-                    # evt.share = value * trigger_fraction
-                    events.append(evt)
+        from django_rea.valueaccounting.models.income import IncomeShares
+        IncomeShares(value_equation, events, visited).for_exchange(self, trigger_event, quantity)
 
     def compute_income_shares_for_use(self, value_equation, use_event, use_value, resource_value, events, visited):
         # exchange method
-        # import pdb; pdb.set_trace()
-        locals = []
-        if self not in visited:
-            visited.add(self)
-            resource = use_event.resource
-            trigger_fraction = 1
-            # equip logging changes
-            # todo exchange redesign fallout
-            receipts = self.resource_receive_events()
-            # needed?
-            # payments = [evt for evt in self.payment_events() if evt.to_agent==trigger_event.from_agent]
-            payments = self.payment_events()
-            if receipts:
-                if len(receipts) > 1:
-                    rsum = sum(r.value for r in receipts)
-                    # trigger_fraction = use_event.value / rsum
-                    # payments = self.payment_events().filter(to_agent=trigger_event.from_agent)
-                    # share =  quantity / trigger_event.quantity
-            """
-            else:
-                #todo exchange redesign fallout
-                xfers = self.transfers.all()
-                if xfers:
-                    #payments = self.cash_receipt_events().filter(from_agent=trigger_event.to_agent)
-                    payments = self.reciprocal_transfer_receive_events()
-            """
-            cost = Decimal("0")
-            if payments:
-                cost = sum(p.quantity for p in payments)
-            # equip logging changes
-            # does this make any sense for use events?
-            use_share = use_value
-            if cost:
-                use_share = use_value / cost
-            if len(payments) == 1:
-                evt = payments[0]
-                contributions = []
-                if evt.resource:
-                    contributions = evt.resource.cash_contribution_events()
-                    # import pdb; pdb.set_trace()
-                    for ct in contributions:
-                        fraction = ct.quantity / resource_value
-                        # todo 3d: changed
-                        ct.share = use_value * fraction
-                        events.append(ct)
-                if not contributions:
-                    # if contributions were credited,
-                    # do not give credit for payment.
-                    value = evt.quantity
-                    br = evt.bucket_rule(value_equation)
-                    if br:
-                        value = br.compute_claim_value(evt)
-                    # evt.share = value * use_share?
-                    evt.share = use_value
-                    events.append(evt)
-            elif len(payments) > 1:
-                total = sum(p.quantity for p in payments)
-                for evt in payments:
-                    # equip logging changes
-                    # import pdb; pdb.set_trace()
-                    payment_fraction = evt.quantity / total
-                    value = evt.quantity
-                    br = evt.bucket_rule(value_equation)
-                    if br:
-                        value = br.compute_claim_value(evt)
-                    if evt.resource:
-                        contributions = evt.resource.cash_contribution_events()
-                        for ct in contributions:
-                            # shd this be based on resource_value or cost/total?
-                            resource_fraction = ct.quantity / resource_value
-                            # is use_value relevant here? Or use_share (use_value / cost)?
-                            # and since we have multiple payments, must consider total!
-                            # share_addition = use_value * use_share * resource_fraction * payment_fraction
-                            share_addition = use_value * resource_fraction * payment_fraction
-                            existing_ct = next((evt for evt in events if evt == ct), 0)
-                            # import pdb; pdb.set_trace()
-                            if existing_ct:
-                                # import pdb; pdb.set_trace()
-                                existing_ct.share += share_addition
-
-                            else:
-                                ct.share = share_addition
-                                events.append(ct)
-                                locals.append(ct)
-                    if not contributions:
-                        # if contributions were credited,
-                        # do not give credit for payment.
-                        # evt.share = value * use_share * payment_fraction
-                        evt.share = use_value * payment_fraction
-                        events.append(evt)
-            # import pdb; pdb.set_trace()
-            for evt in self.work_events():
-                # import pdb; pdb.set_trace()
-                value = evt.quantity
-                br = evt.bucket_rule(value_equation)
-                if br:
-                    # import pdb; pdb.set_trace()
-                    value = br.compute_claim_value(evt)
-                evt.value = value
-                # todo 3d: changed
-                fraction = value / resource_value
-                evt.share = use_value * fraction
-                events.append(evt)
-            if locals:
-                local_total = sum(lo.share for lo in locals)
-                delta = use_value - local_total
-                if delta:
-                    max_share = locals[0]
-                    for lo in locals:
-                        if lo.share > max_share.share:
-                            max_share = lo
-                max_share.share = (max_share.share + delta)
-                # local_total = sum(lo.share for lo in locals)
-                # print "local_total:", local_total
+        from django_rea.valueaccounting.models.income import IncomeShares
+        IncomeShares(value_equation, events, visited).for_exchange_use(self, use_event, use_value, resource_value)
 
 
 @python_2_unicode_compatible
@@ -733,8 +517,8 @@ class Transfer(models.Model):
         receive_text = ""
         commits = self.commitments.all()
         if commits:
-            et_give = EventType.objects.get(name="Give")
-            et_receive = EventType.objects.get(name="Receive")
+            et_give = EventType.objects.cached(name="Give")
+            et_receive = EventType.objects.cached(name="Receive")
             for commit in commits:
                 if commit.event_type == et_give:
                     give = commit
@@ -779,8 +563,8 @@ class Transfer(models.Model):
         receive_text = ""
         events = self.events.all()
         if events:
-            et_give = EventType.objects.get(name="Give")
-            et_receive = EventType.objects.get(name="Receive")
+            et_give = EventType.objects.cached(name="Give")
+            et_receive = EventType.objects.cached(name="Receive")
             for event in events:
                 if event.event_type == et_give:
                     give = event
@@ -827,8 +611,8 @@ class Transfer(models.Model):
         receive_text = ""
         events = self.events.all()
         if events:
-            et_give = EventType.objects.get(name="Give")
-            et_receive = EventType.objects.get(name="Receive")
+            et_give = EventType.objects.cached(name="Give")
+            et_receive = EventType.objects.cached(name="Receive")
             for event in events:
                 if event.event_type == et_give:
                     give = event
@@ -1018,7 +802,7 @@ class Transfer(models.Model):
         events = self.events.all()
         give_resource = None
         receive_resource = None
-        et_give = EventType.objects.get(name="Give")
+        et_give = EventType.objects.cached(name="Give")
         if events:
             for ev in events:
                 if ev.event_type == et_give:
@@ -2,6 +2,8 @@ import sys
 import time
 import logging
 from decimal import *
+from functools import partial
+from multiprocessing.pool import ThreadPool
 
 logger = logging.getLogger("faircoins")
 
@@ -179,3 +181,241 @@ def broadcast_tx():
     else:
         msg = "No new faircoin tx to process."
     return msg
+
+
+def with_retries(call, attempts=3, backoff=1.0):
+    """Calls call() until it gives a result that is not an error,
+
+    sleeping backoff, 2 * backoff, 4 * backoff... seconds between attempts.
+    Returns None if every attempt failed.
+    Only for calls that are safe to repeat, never for sending coins.
+    """
+    for attempt in range(attempts):
+        if attempt:
+            time.sleep(backoff * 2 ** (attempt - 1))
+        try:
+            result = call()
+        except Exception:
+            _, e, _ = sys.exc_info()
+            logger.warning("attempt {0} of {1} failed: {2}".format(attempt + 1, attempts, e))
+            continue
+        if result and result != "ERROR":
+            return result
+        logger.warning("attempt {0} of {1} failed without raising Exception".format(attempt + 1, attempts))
+    return None
+
+
+# what send_once returns when a send failed without telling whether it went out
+SEND_UNKNOWN = object()
+
+
+def send_once(call):
+    """Calls call() once, for daemon calls that must not be repeated.
+
+    Returns the result, None if the daemon reported an error,
+    or SEND_UNKNOWN if the call raised: the daemon may or may not
+    have sent the transaction before the call failed.
+    """
+    try:
+        result = call()
+    except Exception:
+        _, e, _ = sys.exc_info()
+        logger.critical("an exception occurred in make_transaction_from_address: {0}".format(e))
+        return SEND_UNKNOWN
+    if result and result != "ERROR":
+        return result
+    logger.warning("ERROR tx_hash, make tx failed without raising Exception")
+    return None
+
+
+def resolve_sending(event, tx_hash=None):
+    """Settles an event left "sending", after checking the address history by hand.
+
+    With the tx_hash of the transaction that went out, the event is broadcast;
+    without one, nothing was sent and the event is requested again.
+    """
+    if event.digital_currency_tx_state != "sending":
+        raise ValueError("event %s is not sending" % event.pk)
+    if tx_hash:
+        mark_broadcast(event, tx_hash)
+    else:
+        event.digital_currency_tx_state = "new"
+        event.save()
+
+
+def mark_broadcast(event, tx_hash):
+    event.digital_currency_tx_state = "broadcast"
+    event.digital_currency_tx_hash = tx_hash
+    event.save()
+    transfer = event.transfer
+    if transfer:
+        revent = transfer.receive_event()
+        if revent:
+            revent.digital_currency_tx_state = "broadcast"
+            revent.digital_currency_tx_hash = tx_hash
+            revent.save()
+
+
+class BroadcastWorker(object):
+    """Sends FairCoin address and transaction requests in batches.
+
+    Each batch is claimed with a row-level state change, new events
+    become "sending". Transactions are sent once: an event goes back
+    to "new" only when the daemon reports an error, and stays "sending"
+    when the call fails in a way that leaves its outcome unknown.
+    Those are never sent again by the worker; they are reported on
+    every run until someone checks the address history and settles
+    them with resolve_sending.
+    Address requests are safe to repeat and are retried.
+    Only the electrum daemon calls run in the thread pool,
+    all database work stays in the calling thread.
+    """
+
+    def __init__(self, batch_size=50, threads=4, attempts=3, backoff=1.0):
+        self.batch_size = batch_size
+        self.threads = threads
+        self.attempts = attempts
+        self.backoff = backoff
+        self.daemon_checked = False
+
+    def send(self, calls, retry=False):
+        """Runs the daemon calls concurrently, returning their results in order."""
+        if not calls:
+            return []
+        if not self.daemon_checked:
+            init_electrum_fair()
+            self.daemon_checked = True
+        if retry:
+            call = partial(with_retries, attempts=self.attempts, backoff=self.backoff)
+        else:
+            call = send_once
+        pool = ThreadPool(min(self.threads, len(calls)))
+        try:
+            return pool.map(call, calls)
+        finally:
+            pool.close()
+            pool.join()
+
+    def unresolved(self):
+        """Events whose transaction may or may not have been sent.
+
+        Left "sending" by a failed call or by a run that died,
+        they wait for resolve_sending.
+        """
+        events = list(EconomicEvent.objects.filter(
+            digital_currency_tx_state="sending").order_by("pk"))
+        if events:
+            logger.critical("{0} FairCoin events need their address history checked: {1}".format(
+                len(events), ", ".join(str(event.pk) for event in events)))
+        return events
+
+    def create_addresses(self):
+        created = 0
+        failed = 0
+        last_pk = 0
+        while True:
+            resources = list(EconomicResource.objects.filter(
+                digital_currency_address="address_requested",
+                pk__gt=last_pk).order_by("pk")[:self.batch_size])
+            if not resources:
+                break
+            last_pk = resources[-1].pk
+            calls = []
+            for resource in resources:
+                agent = resource.owner()
+                calls.append(partial(efn.new_fair_address,
+                    entity_id=agent.nick,
+                    entity=agent.agent_type.name))
+            for resource, address in zip(resources, self.send(calls, retry=True)):
+                # only fill in requests nobody else has answered meanwhile
+                if address and EconomicResource.objects.filter(
+                        pk=resource.pk,
+                        digital_currency_address="address_requested").update(
+                        digital_currency_address=address):
+                    created += 1
+                else:
+                    failed += 1
+                    logger.warning(" ".join(["Failed to get a FairCoin address for resource", str(resource.pk)]))
+        return created, failed
+
+    def claim_events(self, last_pk):
+        events = EconomicEvent.objects.filter(
+            digital_currency_tx_state="new",
+            event_type__name__in=["Give", "Distribution"],
+            pk__gt=last_pk).order_by("pk")
+        ids = list(events.values_list("pk", flat=True)[:self.batch_size])
+        if not ids:
+            return []
+        EconomicEvent.objects.filter(
+            pk__in=ids,
+            digital_currency_tx_state="new").update(digital_currency_tx_state="sending")
+        return list(EconomicEvent.objects.filter(
+            pk__in=ids,
+            digital_currency_tx_state="sending").select_related(
+            "event_type", "resource", "from_agent", "transfer").order_by("pk"))
+
+    def release(self, events):
+        EconomicEvent.objects.filter(
+            pk__in=[event.pk for event in events],
+            digital_currency_tx_state="sending").update(digital_currency_tx_state="new")
+
+    def broadcast(self):
+        successful = 0
+        failed = 0
+        last_pk = 0
+        while True:
+            events = self.claim_events(last_pk)
+            if not events:
+                break
+            last_pk = events[-1].pk
+            sends = []
+            calls = []
+            skipped = []
+            for event in events:
+                if not event.resource:
+                    skipped.append(event)
+                    continue
+                if event.event_type.name == "Give":
+                    address_origin = event.resource.digital_currency_address
+                    address_end = event.event_reference
+                else:
+                    address_origin = event.from_agent.faircoin_address()
+                    address_end = event.resource.digital_currency_address
+                amount = float(event.quantity) * 1.e6 # In satoshis
+                if amount < 1001:
+                    event.digital_currency_tx_state = "broadcast"
+                    event.digital_currency_tx_hash = "Null"
+                    event.save()
+                    continue
+                sends.append(event)
+                calls.append(partial(efn.make_transaction_from_address,
+                    address_origin, address_end, int(amount)))
+            self.release(skipped)
+            unsent = []
+            for event, tx_hash in zip(sends, self.send(calls)):
+                if tx_hash is SEND_UNKNOWN:
+                    # left sending: it may have gone out, so it is never resent
+                    failed += 1
+                    continue
+                if not tx_hash:
+                    unsent.append(event)
+                    continue
+                successful += 1
+                mark_broadcast(event, tx_hash)
+                logger.debug(" ".join(["**** sent tx", tx_hash, "for event", str(event.pk)]))
+            failed += len(unsent)
+            self.release(unsent)
+        return successful, failed
+
+    def run(self):
+        created, failed_addresses = self.create_addresses()
+        successful, failed_events = self.broadcast()
+        unresolved = self.unresolved()
+        msg = " ".join(["created", str(created), "new faircoin addresses,",
+            "broadcast", str(successful), "new faircoin tx."])
+        if failed_addresses or failed_events:
+            msg += " ".join([" failed:", str(failed_addresses), "addresses,",
+                str(failed_events), "events."])
+        if unresolved:
+            msg += " ".join([" unresolved:", str(len(unresolved)), "events."])
+        return msg
@@ -1,8 +1,15 @@
 from django.utils.translation import ugettext_noop as _
-from django.db.models.signals import post_migrate
+from django.core.signals import request_started
+from django.db.models.signals import post_delete, post_migrate, post_save
 from django.conf import settings
 
 from .models import *
+from .models.agent import invalidate_agent_hierarchy
+from .models.facetconfig import invalidate_facet_index
+from .models.process import invalidate_process_json
+from .models.rollup import invalidate_value_per_unit
+from .models._utils import invalidate_lookups, recheck_lookups
+from .utils import invalidate_recipe_cache
 
 
 if "pinax.notifications" in settings.INSTALLED_APPS:
@@ -195,4 +202,90 @@ def create_usecase_eventtypes(**kwargs):
     print "created use case event type associations"
 
 
-post_migrate.connect(create_usecase_eventtypes)
\ No newline at end of file
+post_migrate.connect(create_usecase_eventtypes)
+
+
+# events invalidate the value rollups they feed in EconomicEvent.save and delete
+
+def invalidate_value_rollups_by_equation(sender, instance, **kwargs):
+    if sender is ValueEquation:
+        ve_id = instance.id
+    elif sender is ValueEquationBucket:
+        ve_id = instance.value_equation_id
+    else:
+        ve_id = ValueEquationBucket.objects.filter(
+            id=instance.value_equation_bucket_id).values_list("value_equation_id", flat=True).first()
+    if ve_id:
+        ValuePerUnitCache.objects.invalidate_value_equation(ve_id)
+
+for model in (ValueEquation, ValueEquationBucket, ValueEquationBucketRule):
+    post_save.connect(invalidate_value_rollups_by_equation, sender=model, dispatch_uid="invalidate_value_rollups_save_%s" % model.__name__)
+    post_delete.connect(invalidate_value_rollups_by_equation, sender=model, dispatch_uid="invalidate_value_rollups_delete_%s" % model.__name__)
+
+
+def invalidate_value_rollups_by_input(sender, instance, **kwargs):
+    update_fields = kwargs.get("update_fields")
+    if sender is AgentResourceType:
+        if update_fields and set(update_fields) == set(["score"]):
+            return
+        inputs = [("resource_type", instance.resource_type_id)]
+    elif sender is EconomicResourceType:
+        inputs = [("resource_type", instance.id)]
+    else:
+        inputs = [("resource", instance.id)]
+    invalidate_value_per_unit(inputs)
+
+for model in (AgentResourceType, EconomicResourceType, EconomicResource):
+    post_save.connect(invalidate_value_rollups_by_input, sender=model, dispatch_uid="invalidate_value_rollups_save_%s" % model.__name__)
+    post_delete.connect(invalidate_value_rollups_by_input, sender=model, dispatch_uid="invalidate_value_rollups_delete_%s" % model.__name__)
+
+
+def invalidate_recipes(sender, **kwargs):
+    # event saves bump AgentResourceType scores, which recipes do not read
+    update_fields = kwargs.get("update_fields")
+    if sender is AgentResourceType and update_fields and set(update_fields) == set(["score"]):
+        return
+    invalidate_recipe_cache()
+
+for model in (CommitmentType, AgentResourceType, Feature, Option, ProcessType, EconomicResourceType, Unit):
+    post_save.connect(invalidate_recipes, sender=model, dispatch_uid="invalidate_recipes_save_%s" % model.__name__)
+    post_delete.connect(invalidate_recipes, sender=model, dispatch_uid="invalidate_recipes_delete_%s" % model.__name__)
+
+
+def invalidate_agent_associations(**kwargs):
+    invalidate_agent_hierarchy()
+
+for model in (AgentAssociation, AgentAssociationType):
+    post_save.connect(invalidate_agent_associations, sender=model, dispatch_uid="invalidate_agent_associations_save_%s" % model.__name__)
+    post_delete.connect(invalidate_agent_associations, sender=model, dispatch_uid="invalidate_agent_associations_delete_%s" % model.__name__)
+
+
+def invalidate_facets(**kwargs):
+    invalidate_facet_index()
+
+for model in (FacetValue, ResourceTypeFacetValue, PatternFacetValue, ProcessPattern, EventType):
+    post_save.connect(invalidate_facets, sender=model, dispatch_uid="invalidate_facets_save_%s" % model.__name__)
+    post_delete.connect(invalidate_facets, sender=model, dispatch_uid="invalidate_facets_delete_%s" % model.__name__)
+
+
+def invalidate_lookup_registry(sender, **kwargs):
+    invalidate_lookups(sender)
+
+for model in (EventType, ExchangeType, UseCase, AgentAssociationType):
+    post_save.connect(invalidate_lookup_registry, sender=model, dispatch_uid="invalidate_lookup_registry_save_%s" % model.__name__)
+    post_delete.connect(invalidate_lookup_registry, sender=model, dispatch_uid="invalidate_lookup_registry_delete_%s" % model.__name__)
+
+
+def recheck_lookup_registries(**kwargs):
+    recheck_lookups()
+
+request_started.connect(recheck_lookup_registries, dispatch_uid="recheck_lookup_registries")
+
+
+def invalidate_process_json_etags(**kwargs):
+    # events bump it in EconomicEvent.save, only when they are in a process
+    invalidate_process_json()
+
+for model in (Process, Commitment, Order, EconomicAgent, EconomicResourceType):
+    post_save.connect(invalidate_process_json_etags, sender=model, dispatch_uid="invalidate_process_json_save_%s" % model.__name__)
+    post_delete.connect(invalidate_process_json_etags, sender=model, dispatch_uid="invalidate_process_json_delete_%s" % model.__name__)
@@ -0,0 +1,86 @@
+"""A local stand-in for faircoin_nrp.electrum_fair_nrp,
+
+recording what would have been sent to the electrum daemon.
+Call install() before importing process_faircoin_requests or faircoin_utils.
+"""
+import sys
+import threading
+import types
+
+_lock = threading.Lock()
+
+addresses = []
+transactions = []
+# number of calls to fail before succeeding, by function name
+failures = {}
+# number of transactions to send and then raise on, as a lost answer would
+lost_answers = {}
+calls = {}
+up = True
+
+
+def reset():
+    global up
+    del addresses[:]
+    del transactions[:]
+    failures.clear()
+    lost_answers.clear()
+    calls.clear()
+    up = True
+
+
+def _call(name):
+    with _lock:
+        calls[name] = calls.get(name, 0) + 1
+        if failures.get(name):
+            failures[name] -= 1
+            return False
+    return True
+
+
+def daemon_is_up():
+    return up
+
+
+def new_fair_address(entity_id, entity):
+    if not _call("new_fair_address"):
+        raise IOError("daemon did not answer")
+    with _lock:
+        address = "fake-address-%d" % (len(addresses) + 1)
+        addresses.append((entity_id, entity, address))
+    return address
+
+
+def make_transaction_from_address(address_origin, address_end, amount):
+    if not _call("make_transaction_from_address"):
+        return "ERROR"
+    with _lock:
+        tx_hash = "fake-tx-%d" % (len(transactions) + 1)
+        transactions.append((address_origin, address_end, amount, tx_hash))
+        if lost_answers.get("make_transaction_from_address"):
+            lost_answers["make_transaction_from_address"] -= 1
+            raise IOError("timed out waiting for the daemon")
+    return tx_hash
+
+
+def network_fee():
+    return 1000
+
+
+def get_address_history(address):
+    return []
+
+
+def get_address_balance(address):
+    return (0, 0)
+
+
+def install():
+    module = sys.modules[__name__]
+    package = sys.modules.get("faircoin_nrp")
+    if package is None:
+        package = types.ModuleType("faircoin_nrp")
+        sys.modules["faircoin_nrp"] = package
+    package.electrum_fair_nrp = module
+    sys.modules["faircoin_nrp.electrum_fair_nrp"] = module
+    return module
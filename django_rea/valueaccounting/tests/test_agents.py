@@ -0,0 +1,114 @@
+from django.test import TestCase
+
+from django_rea.valueaccounting.models import *
+from django_rea.valueaccounting.models.agent import agent_hierarchy
+from django_rea.valueaccounting.utils import (
+    agent_dfs_by_association,
+    flattened_children_by_association,
+    group_dfs_by_has_associate,
+    group_dfs_by_is_associate,
+)
+
+
+class AgentHierarchyTest(TestCase):
+
+    """Testing the AgentHierarchy index
+
+        against the recursive helpers in utils it replaced.
+
+    """
+
+    def setUp(self):
+        project_type = AgentType(name="Project", party_type="team", is_context=True)
+        project_type.save()
+        person_type = AgentType(name="Person", party_type="individual")
+        person_type.save()
+        self.child = AgentAssociationType.objects.get(identifier="child")
+        self.member = AgentAssociationType.objects.get(identifier="member")
+        self.manager = AgentAssociationType(
+            identifier="manager", name="Manager", association_behavior="manager")
+        self.manager.save()
+
+        def agent(name, agent_type=project_type):
+            a = EconomicAgent(name=name, nick=name, agent_type=agent_type)
+            a.save()
+            return a
+
+        self.root = agent("Root")
+        self.zeta = agent("Zeta")
+        self.alpha = agent("Alpha")
+        self.leaf = agent("Leaf")
+        self.person = agent("Person", person_type)
+        self.associate(self.zeta, self.root, self.child)
+        self.associate(self.alpha, self.root, self.child)
+        self.associate(self.leaf, self.alpha, self.child)
+        self.associate(self.person, self.alpha, self.manager)
+        self.associate(self.person, self.zeta, self.member)
+
+    def associate(self, is_associate, has_associate, association_type, state="active"):
+        AgentAssociation(
+            is_associate=is_associate,
+            has_associate=has_associate,
+            association_type=association_type,
+            state=state,
+        ).save()
+
+    def test_sub_agents(self):
+        children = AgentAssociation.objects.filter(
+            association_type__association_behavior="child").order_by("is_associate__name")
+        self.assertEqual(
+            self.root.with_all_sub_agents(),
+            flattened_children_by_association(self.root, children, []))
+        self.assertEqual(
+            self.root.with_all_sub_agents(),
+            [self.root, self.alpha, self.leaf, self.zeta])
+        tree = self.root.child_tree()
+        expected = agent_dfs_by_association(self.root, children, 1)
+        self.assertEqual(tree, expected)
+        self.assertEqual([a.depth for a in tree], [a.depth for a in expected])
+        with self.assertNumQueries(2):
+            self.root.with_all_sub_agents()
+
+    def test_associations(self):
+        associations = AgentAssociation.objects.all().order_by("-association_type")
+        for agent in (self.root, self.alpha, self.zeta):
+            gas = group_dfs_by_has_associate(agent, agent, associations, [], 1)
+            gas.extend(group_dfs_by_is_associate(agent, agent, associations, [], 1))
+            expected = [agent]
+            for ga in gas:
+                if ga not in expected:
+                    expected.append(ga)
+            found = agent.with_all_associations()
+            # associations of the same type come in no particular order
+            self.assertEqual(
+                dict((a, a.depth) for a in found),
+                dict((a, a.depth) for a in expected))
+        self.assertEqual(
+            self.person.with_all_associations(),
+            [self.person, self.alpha, self.zeta])
+
+    def test_ancestors_and_managers(self):
+        self.assertEqual(self.leaf.parent(), self.alpha)
+        self.assertEqual(
+            set(self.leaf.all_ancestors()),
+            set([self.leaf, self.alpha, self.root]))
+        self.assertTrue(self.root.is_root())
+        self.assertFalse(self.leaf.is_root())
+        self.assertTrue(self.person.is_manager_of(self.alpha))
+        self.assertFalse(self.person.is_manager_of(self.zeta))
+        agent_hierarchy()
+        with self.assertNumQueries(1):
+            self.assertFalse(self.leaf.is_root())
+
+    def test_refreshed_by_association_changes(self):
+        self.assertEqual(len(self.zeta.with_all_sub_agents()), 1)
+        self.associate(self.leaf, self.zeta, self.child, state="inactive")
+        # sub agents follow child associations in any state, parents only active ones
+        self.assertEqual(self.zeta.with_all_sub_agents(), [self.zeta, self.leaf])
+        self.assertEqual(self.leaf.parent(), self.alpha)
+        AgentAssociation.objects.filter(is_associate=self.leaf, has_associate=self.alpha).delete()
+        self.assertEqual(self.alpha.with_all_sub_agents(), [self.alpha])
+        self.assertEqual(self.leaf.parent(), None)
+        self.manager.association_behavior = "member"
+        self.manager.save()
+        self.assertFalse(self.person.is_manager_of(self.alpha))
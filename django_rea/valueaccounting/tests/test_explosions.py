@@ -91,6 +91,178 @@ class ExplosionTest(TestCase):
         self.assertEqual(child_process.next_processes()[0], process)
         self.assertEqual(process.previous_processes()[0], child_process)
 
+    def test_explosion_plan(self):
+        """The explosion is planned in memory and saved at the end
+
+            with the same netting as test_explosion.
+        """
+        from django_rea.valueaccounting.models.planning import ExplosionPlan
+        commitment = self.order.order_items()[0]
+        process = commitment.generate_producing_process(self.user, [])
+        processes_before = Process.objects.count()
+        commitments_before = Commitment.objects.count()
+        plan = ExplosionPlan(self.order, self.user)
+        plan.explode(process)
+        self.assertEqual(Process.objects.count(), processes_before)
+        self.assertEqual(Commitment.objects.count(), commitments_before)
+        self.assertEqual(len(plan.processes), 1)
+        quantities = [ct.quantity for ct in plan.commitments]
+        self.assertEqual(quantities, [Decimal("8"), Decimal("5"), Decimal("15")])
+        self.assertTrue(commitment.cycle_id() in plan.visited)
+        plan.save()
+        self.assertEqual(Process.objects.count(), processes_before + 1)
+        self.assertEqual(Commitment.objects.count(), commitments_before + 3)
+        child_process = plan.processes[0]
+        self.assertEqual(child_process.next_processes()[0], process)
+        for ct in plan.commitments:
+            self.assertTrue(ct.slug)
+            self.assertEqual(Commitment.objects.get(id=ct.id).process_id, ct.process.id)
+
+    def test_netting_index(self):
+        """NettingIndex nets every commitment the way Commitment.net does
+
+            from the database.
+        """
+        from django_rea.valueaccounting.models.planning import DueDateSeries, NettingIndex
+        commitment = self.order.order_items()[0]
+        commitment.generate_producing_process(self.user, [], explode=True)
+        later = Commitment(
+            resource_type=self.child,
+            due_date=self.order.due_date + datetime.timedelta(weeks=1),
+            quantity=Decimal(4),
+            event_type=self.consumption_event_type,
+            unit_of_quantity=self.unit,
+        )
+        later.save()
+        commitments = list(Commitment.objects.select_related("resource_type", "event_type", "stage"))
+        netting = NettingIndex()
+        netting.attach(commitments)
+        with self.assertNumQueries(0):
+            netted = [ct.net() for ct in commitments]
+        for ct, qty in zip(commitments, netted):
+            del ct.netting_index
+            self.assertEqual(qty, ct.net())
+
+        today = datetime.date.today()
+        series = DueDateSeries()
+        series.extend([(today, Decimal("2")), (today - datetime.timedelta(days=1), Decimal("1"))])
+        series.add(today + datetime.timedelta(days=1), Decimal("4"))
+        self.assertEqual(series.total_before(today), Decimal("1"))
+        self.assertEqual(series.total_through(today), Decimal("3"))
+        self.assertEqual(series.total_through(today + datetime.timedelta(days=5)), Decimal("7"))
+
+    def test_xbill(self):
+        """ the xbill is the tree xbill_dfs builds, cached until the recipe changes
+        """
+        parent_pt = self.parent.main_producing_process_type()
+        feature = Feature(
+            name="size",
+            product=self.parent,
+            process_type=parent_pt,
+            event_type=self.consumption_event_type,
+            quantity=Decimal("1"),
+        )
+        feature.save()
+        for component in (self.grandchild, self.child):
+            Option(feature=feature, component=component).save()
+        CommitmentType(
+            process_type=parent_pt,
+            resource_type=self.grandchild,
+            event_type=self.consumption_event_type,
+            quantity=Decimal("1"),
+            unit_of_quantity=self.unit,
+        ).save()
+
+        def dfs_xbill(rt):
+            nodes = []
+            exploded = []
+            for kid in rt.xbill_children():
+                explode_xbill_children(kid, nodes, exploded)
+            nodes = list(set(nodes))
+            to_return = []
+            visited = []
+            for kid in rt.xbill_children():
+                to_return.extend(xbill_dfs(kid, nodes, visited, 1))
+            return [(n.node, n.depth) for n in to_return]
+
+        expected = dfs_xbill(self.parent)
+        xbill = self.parent.generate_xbill()
+        self.assertEqual([(n.node, n.depth) for n in xbill], expected)
+        self.assertEqual(len(xbill), 8)
+        with self.assertNumQueries(1):
+            self.parent.generate_xbill()
+
+        CommitmentType(
+            process_type=parent_pt,
+            resource_type=self.child,
+            event_type=EventType.objects.get(relationship="work"),
+            quantity=Decimal("1"),
+            unit_of_quantity=self.unit,
+        ).save()
+        xbill = self.parent.generate_xbill()
+        self.assertEqual([(n.node, n.depth) for n in xbill], dfs_xbill(self.parent))
+        self.assertEqual(len(xbill), 9)
+
+        # a change swaps in a new cache, leaving the old one whole for
+        # whoever is still reading it
+        cache = recipe_cache()
+        self.assertIn("xbill_trees", cache)
+        invalidate_recipe_cache()
+        self.assertIn("xbill_trees", cache)
+        self.assertNotIn("xbill_trees", recipe_cache())
+
+    def test_recipe_network(self):
+        """ graphify and the project network list each node and edge once
+        """
+        parent_pt = self.parent.main_producing_process_type()
+        child_pt = self.child.main_producing_process_type()
+        # the child recipe is reached twice
+        CommitmentType(
+            process_type=parent_pt,
+            resource_type=self.child,
+            event_type=EventType.objects.get(relationship="use"),
+            quantity=Decimal("1"),
+            unit_of_quantity=self.unit,
+        ).save()
+        team = AgentType(name="Team", party_type="team")
+        team.save()
+        for pt, name in ((parent_pt, "Assembly"), (child_pt, "Parts")):
+            project = EconomicAgent(name=name, nick=name, agent_type=team, is_context=True)
+            project.save()
+            pt.context_agent = project
+            pt.save()
+
+        def unique(nodes, edges):
+            node_ids = set(n.node_id() for n in nodes)
+            edge_keys = set((e.from_node.node_id(), e.to_node.node_id(), e.dictify()["label"]) for e in edges)
+            return node_ids, edge_keys
+
+        def dictified(edges):
+            for e in edges:
+                if callable(e.label):
+                    e.label = e.label()
+            return edges
+
+        old_nodes = [self.parent]
+        old_edges = []
+        for ptr in self.parent.producing_process_type_relationships():
+            explode(ptr, old_nodes, old_edges, 0, 3)
+        self.assertTrue(len(old_nodes) > len(set(old_nodes)))
+        nodes, edges = graphify(self.parent, 3)
+        self.assertEqual(len(nodes), len(set(n.node_id() for n in nodes)))
+        self.assertEqual(unique(nodes, edges), unique(old_nodes, dictified(old_edges)))
+        with self.assertNumQueries(1):
+            graphify(self.parent, 3)
+        nodes, edges = graphify(self.parent, 0)
+        self.assertEqual(set(n.node_id() for n in nodes), set([
+            self.parent.node_id(), parent_pt.node_id(), self.child.node_id()]))
+
+        producers = [p for p in ProcessType.objects.all() if p.produced_resource_types()]
+        old_nodes, old_edges = project_graph(producers)
+        nodes, edges = recipe_graph().project_network()
+        self.assertEqual(len(nodes), 3)
+        self.assertEqual(unique(nodes, edges), unique(old_nodes, dictified(old_edges)))
+
     def test_cycle(self):
         """ cycles occur when an explosion repeats itself:
 
@@ -142,7 +142,229 @@ class FacetTest(TestCase):
             self.other_product)
         self.assertEqual(et, self.event_type)
 
+    def test_facet_index(self):
+        """Patterns, select_resource_types and matches_filter share one FacetIndex,
+
+            which is rebuilt when facet values are assigned.
+
+        """
+        from django_rea.valueaccounting.models.facetconfig import facet_index
+        from django_rea.valueaccounting.views import select_resource_types
+        pattern = self.full_pattern
+        all_rts = set()
+        for et in pattern.event_types():
+            all_rts.update(pattern.get_resource_types(et))
+        self.assertEqual(set(pattern.all_resource_types()), all_rts)
+        self.assertEqual(list(pattern.output_resource_types()), [self.twofacet_product])
+        self.assertEqual(list(pattern.distribution_resource_types()), [])
+        with self.assertNumQueries(2):
+            # the version check and the resource types
+            list(pattern.get_resource_types(self.event_type_use))
+
+        fvs = FacetValue.objects.from_filter(
+            ["Domain: Optical", "Domain: Electronical", "Source: Us", "Source: Them"])
+        self.assertEqual(select_resource_types(fvs), [self.twofacet_product])
+        self.assertTrue(self.twofacet_product.matches_filter(fvs))
+        self.assertFalse(self.optical_product.matches_filter(fvs))
+        self.assertTrue(self.optical_product.matches_filter([]))
+        self.assertEqual(select_resource_types([]), [])
+
+        index = facet_index()
+        recipe_version = CacheVersion.objects.current("recipes")
+        electronical = FacetValue.objects.get(facet=self.domain, value="Electronical")
+        ResourceTypeFacetValue(resource_type=self.other_product, facet_value=electronical).save()
+        self.assertNotEqual(facet_index(), index)
+        # each cache has its own version
+        self.assertEqual(CacheVersion.objects.current("recipes"), recipe_version)
+        self.assertEqual(
+            set(self.electronic_pattern.get_resource_types(self.event_type)),
+            set([self.electronic_product, self.twofacet_product, self.other_product]))
+
         
         
         
 
+    def test_form_choices(self):
+        """Forms sharing a FormChoices render the same choices
+
+            with queries that do not grow with the number of forms.
+
+        """
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        from django_rea.valueaccounting.forms import FormChoices, WorkCommitmentForm
+
+        def render(count, choices=None):
+            with CaptureQueriesContext(connection) as ctx:
+                html = [str(WorkCommitmentForm(pattern=self.full_pattern, choices=choices, prefix=str(i)))
+                        for i in range(count)]
+            return html, len(ctx.captured_queries)
+
+        unshared, queries = render(1)
+        shared, one_form = render(1, FormChoices())
+        self.assertEqual(shared, unshared)
+        work = list(self.full_pattern.work_resource_types())
+        self.assertEqual(len(work), 1)
+        self.assertIn(work[0].name, shared[0])
+        shared, ten_forms = render(10, FormChoices())
+        self.assertEqual(ten_forms, one_form)
+        unshared, queries = render(10)
+        self.assertEqual(shared, unshared)
+
+    def test_inventory(self):
+        """The inventory board totals onhand quantities in one aggregate
+
+            and filters resource types by facets with joins,
+            agreeing with onhand_qty and select_resource_types.
+
+        """
+        from django_rea.valueaccounting.views import select_resource_types
+        for rt, qty in (
+            (self.optical_product, "3"),
+            (self.optical_product, "4"),
+            (self.electronic_product, "0"),
+            (self.twofacet_product, "5"),
+            (self.other_product, "2"),
+        ):
+            EconomicResource(resource_type=rt, quantity=Decimal(qty)).save()
+        EconomicResource(
+            resource_type=self.twofacet_product,
+            quantity=Decimal("10"),
+            quality=Decimal("-1"),
+        ).save()
+        agent_type = AgentType(name="Active")
+        agent_type.save()
+        agent = EconomicAgent(name="Keeper", nick="Keeper", agent_type=agent_type)
+        agent.save()
+        role = AgentResourceRoleType(name="Keeper")
+        role.save()
+        AgentResourceRole(
+            agent=agent,
+            role=role,
+            resource=self.twofacet_product.onhand()[0],
+        ).save()
+
+        with self.assertNumQueries(5):
+            rts = EconomicResourceType.objects.inventory()
+            for rt in rts:
+                rt.facet_list()
+                for resource in rt.onhand_resources:
+                    resource.unit_of_quantity()
+                    list(resource.agent_resource_roles.all())
+        onhand = [rt for rt in EconomicResourceType.objects.all() if rt.onhand_qty() > 0]
+        self.assertEqual(rts, onhand)
+        for rt in rts:
+            self.assertEqual(rt.onhand_quantity, rt.onhand_qty())
+            self.assertEqual(rt.onhand_resources, list(rt.onhand()))
+        self.assertEqual(self.optical_product.onhand_qty(), Decimal("7"))
+
+        fvs = FacetValue.objects.from_filter(["Domain: Electronical", "Domain: Optical"])
+        self.assertEqual(len(fvs), 2)
+        self.assertEqual(
+            set(EconomicResourceType.objects.with_facet_values(fvs)),
+            set(select_resource_types(fvs)))
+        rts = EconomicResourceType.objects.inventory(fvs)
+        self.assertEqual(set(rts), set([self.optical_product, self.twofacet_product]))
+
+        fvs = FacetValue.objects.from_filter(["Domain: Electronical", "Source: Us"])
+        self.assertEqual(
+            list(EconomicResourceType.objects.with_facet_values(fvs)),
+            [self.twofacet_product])
+        rts = EconomicResourceType.objects.inventory(fvs)
+        self.assertEqual(rts, [self.twofacet_product])
+        self.assertEqual(rts[0].onhand_quantity, Decimal("5"))
+        self.assertEqual(EconomicResourceType.objects.inventory([]), [])
+
+    def test_dhen_board(self):
+        """The DHen board loads its commitments, lots and form choices
+
+            in queries that do not grow with the number of herbs and lots.
+
+        """
+        from django.contrib.auth.models import User
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+
+        User.objects.create_user("alice", "alice@whatever.com", "password")
+        self.client.login(username="alice", password="password")
+        agent_type = AgentType(name="Coop", party_type="team", is_context=True)
+        agent_type.save()
+        context_agent = EconomicAgent(id=3, name="DHen", nick="DHen", agent_type=agent_type)
+        context_agent.save()
+        EconomicAgent(id=4, name="Market", nick="Market", agent_type=agent_type).save()
+        agents = {}
+        for identifier in ("HarvestSite", "Harvester", "DryingSite", "Seller"):
+            aat = AgentAssociationType(identifier=identifier, name=identifier)
+            aat.save()
+            agent = EconomicAgent(name=identifier, nick=identifier, agent_type=agent_type)
+            agent.save()
+            AgentAssociation(is_associate=agent, has_associate=context_agent,
+                association_type=aat, state="active").save()
+            agents[identifier] = agent
+        stages = {}
+        for name in ("Make Available", "Purchase to Drying Site",
+                     "Harvester to Drying Site", "Drying Site to Seller"):
+            xt = ExchangeType(name=name)
+            xt.save()
+            TransferType(name=name, exchange_type=xt).save()
+            stages[name] = xt
+        Unit(unit_type="value", abbrev="$", name="dollar").save()
+        pound = Unit(unit_type="quantity", abbrev="lb", name="pound")
+        pound.save()
+        herb = FacetValue(facet=self.domain, value="Herb")
+        herb.save()
+        pattern = ProcessPattern(name="Herbs")
+        pattern.save()
+        production = EventType.objects.cached(name="Resource Production")
+        PatternFacetValue(pattern=pattern, facet_value=herb, event_type=production).save()
+        give = EventType.objects.cached(name="Give")
+        receive = EventType.objects.cached(name="Receive")
+        today = datetime.date.today()
+
+        def add_herb(name):
+            rt = EconomicResourceType(name=name, unit=pound)
+            rt.save()
+            ResourceTypeFacetValue(resource_type=rt, facet_value=herb).save()
+            for qty in ("5", "3"):
+                com = Commitment(event_type=give, from_agent=agents["HarvestSite"],
+                    resource_type=rt, quantity=Decimal(qty), unit_of_quantity=pound,
+                    start_date=today, due_date=today)
+                com.save()
+            EconomicEvent(event_type=give, from_agent=agents["HarvestSite"], resource_type=rt,
+                quantity=Decimal("3"), event_date=today, commitment=com).save()
+            for stage, owner in (("Harvester to Drying Site", "DryingSite"),
+                                 ("Drying Site to Seller", "Seller")):
+                for i in range(2):
+                    res = EconomicResource(resource_type=rt, identifier="%s %s %s" % (name, stage, i),
+                        quantity=Decimal("2"), exchange_stage=stages[stage])
+                    res.save()
+                    EconomicEvent(event_type=receive, to_agent=agents[owner], resource=res,
+                        resource_type=rt, quantity=Decimal("2"), event_date=today,
+                        exchange_stage=stages[stage]).save()
+            return rt
+
+        def board():
+            with CaptureQueriesContext(connection) as ctx:
+                response = self.client.get("/board/dhen-board/3/")
+            self.assertEqual(response.status_code, 200)
+            return response, len(ctx.captured_queries)
+
+        add_herb("Chamomile")
+        # the first request after a change also reloads the facet index
+        board()
+        response, one_herb = board()
+        for rt in response.context["resource_types"]:
+            self.assertEqual(rt.farm_commits, rt.commits_for_exchange_stage(stage=None))
+            self.assertEqual(len(rt.farm_commits), 1)
+            for stage, resources in ((stages["Harvester to Drying Site"], rt.dryer_resources),
+                                     (stages["Drying Site to Seller"], rt.seller_resources)):
+                self.assertEqual(resources, list(rt.onhand_for_exchange_stage(stage=stage)))
+                for res in resources:
+                    self.assertEqual(res.exchange_owner, res.owner_based_on_exchange())
+        self.assertContains(response, "Seller ~")
+        add_herb("Lavender")
+        add_herb("Mint")
+        board()
+        response, three_herbs = board()
+        self.assertEqual(len(response.context["resource_types"]), 3)
+        self.assertEqual(three_herbs, one_herb)
@@ -0,0 +1,129 @@
+import datetime
+from decimal import Decimal
+
+from django.test import TestCase
+from django.test.utils import override_settings
+
+from django_rea.valueaccounting.models import *
+from django_rea.valueaccounting.tests import fake_electrum_fair_nrp
+
+efn = fake_electrum_fair_nrp.install()
+
+from django_rea.valueaccounting.process_faircoin_requests import BroadcastWorker, resolve_sending
+
+
+@override_settings(use_faircoins=True)
+class BroadcastWorkerTest(TestCase):
+
+    """Testing the batched FairCoin broadcast worker
+
+        against a fake electrum daemon.
+
+    """
+
+    def setUp(self):
+        efn.reset()
+        agent_type = AgentType(name="Active individual")
+        agent_type.save()
+        self.owner_role = AgentResourceRoleType(name="Owner", is_owner=True)
+        self.owner_role.save()
+        self.faircoin = EconomicResourceType(name="FairCoin", behavior="dig_acct")
+        self.faircoin.save()
+        self.give = EventType(name="Give", label="gives", relationship="out", resource_effect="-")
+        self.give.save()
+        self.alice = EconomicAgent(name="Alice", nick="alice", agent_type=agent_type)
+        self.alice.save()
+        self.bob = EconomicAgent(name="Bob", nick="bob", agent_type=agent_type)
+        self.bob.save()
+        self.wallet = self.account(self.alice, "alice-address")
+
+    def account(self, agent, address):
+        resource = EconomicResource(
+            resource_type=self.faircoin,
+            identifier="Faircoin address for " + agent.nick,
+            digital_currency_address=address,
+        )
+        resource.save()
+        AgentResourceRole(agent=agent, role=self.owner_role, resource=resource).save()
+        return resource
+
+    def gift(self, quantity, to_address="bob-address"):
+        event = EconomicEvent(
+            event_type=self.give,
+            event_date=datetime.date(2016, 1, 1),
+            from_agent=self.alice,
+            resource=self.wallet,
+            resource_type=self.faircoin,
+            quantity=Decimal(quantity),
+            event_reference=to_address,
+            digital_currency_tx_state="new",
+        )
+        event.save()
+        return event
+
+    def states(self):
+        return list(EconomicEvent.objects.order_by("pk").values_list(
+            "digital_currency_tx_state", "digital_currency_tx_hash"))
+
+    def test_create_addresses(self):
+        self.account(self.bob, "address_requested")
+        carol_type = AgentType.objects.get(name="Active individual")
+        carol = EconomicAgent(name="Carol", nick="carol", agent_type=carol_type)
+        carol.save()
+        self.account(carol, "address_requested")
+        efn.failures["new_fair_address"] = 1
+
+        worker = BroadcastWorker(batch_size=1, threads=2, attempts=2, backoff=0)
+        self.assertEqual(worker.create_addresses(), (2, 0))
+        self.assertEqual(efn.calls["new_fair_address"], 3)
+        self.assertEqual(
+            sorted((entity_id, entity) for entity_id, entity, address in efn.addresses),
+            [("bob", "Active individual"), ("carol", "Active individual")])
+        self.assertEqual(self.bob.faircoin_address()[:13], "fake-address-")
+        self.assertFalse(EconomicResource.objects.filter(
+            digital_currency_address="address_requested").exists())
+
+    def test_broadcast_in_batches(self):
+        for quantity in ("1", "2", "0.0005", "3", "4"):
+            self.gift(quantity)
+        # the daemon reports an error for the first event, which is not retried
+        efn.failures["make_transaction_from_address"] = 1
+        worker = BroadcastWorker(batch_size=2, threads=1, attempts=3, backoff=0)
+        self.assertEqual(worker.broadcast(), (3, 1))
+        self.assertEqual(efn.calls["make_transaction_from_address"], 4)
+        self.assertEqual(self.states(), [
+            ("new", None),
+            ("broadcast", "fake-tx-1"),
+            ("broadcast", "Null"),
+            ("broadcast", "fake-tx-2"),
+            ("broadcast", "fake-tx-3"),
+        ])
+        self.assertEqual(efn.transactions[0], ("alice-address", "bob-address", 2000000, "fake-tx-1"))
+
+        # the next run resumes with what is left
+        self.assertEqual(worker.broadcast(), (1, 0))
+        self.assertEqual(self.states()[0], ("broadcast", "fake-tx-4"))
+        self.assertEqual(worker.broadcast(), (0, 0))
+
+    def test_unknown_outcome_is_never_resent(self):
+        first = self.gift("1")
+        self.gift("2")
+        # the first send goes out but its answer is lost
+        efn.lost_answers["make_transaction_from_address"] = 1
+        worker = BroadcastWorker(threads=1, attempts=3, backoff=0)
+        msg = worker.run()
+        self.assertEqual(msg, "created 0 new faircoin addresses, broadcast 1 new faircoin tx."
+            " failed: 0 addresses, 1 events. unresolved: 1 events.")
+        self.assertEqual(self.states(), [("sending", None), ("broadcast", "fake-tx-2")])
+        # later runs, and runs after a crash, leave it alone
+        worker.run()
+        BroadcastWorker(threads=1, backoff=0).run()
+        self.assertEqual(len(efn.transactions), 2)
+        self.assertEqual(efn.calls["make_transaction_from_address"], 2)
+        self.assertEqual([event.pk for event in worker.unresolved()], [first.pk])
+
+        # the address history shows it was sent
+        resolve_sending(EconomicEvent.objects.get(pk=first.pk), "fake-tx-1")
+        self.assertEqual(self.states()[0], ("broadcast", "fake-tx-1"))
+        self.assertEqual(worker.unresolved(), [])
+        self.assertRaises(ValueError, resolve_sending, EconomicEvent.objects.get(pk=first.pk))
@@ -230,6 +230,92 @@ class StageTest(TestCase):
         self.assertEqual(prev_prev_next, prev)
         #import pdb; pdb.set_trace()
         
+    def test_process_graph(self):
+        """ProcessGraph finds the same previous and next processes as Process.
+        """
+        from django_rea.valueaccounting.models.planning import ProcessGraph
+        due_date = datetime.date.today()
+        commitment = self.ct3_change.create_commitment(due_date, self.user)
+        process = commitment.generate_producing_process(self.user, [], explode=True)
+        ordered_processes = []
+        process.all_previous_processes(ordered_processes, [], 0)
+        self.assertEqual(len(ordered_processes), 3)
+        graph = ProcessGraph([process])
+        graph_processes = []
+        # commitments, events, producing commitments and processes per step
+        with self.assertNumQueries(10):
+            process.all_previous_processes(graph_processes, [], 0, graph)
+        self.assertEqual(graph_processes, ordered_processes)
+        with self.assertNumQueries(0):
+            outputs = [graph.main_outgoing_commitment(p) for p in graph_processes]
+        self.assertEqual(outputs, [p.main_outgoing_commitment() for p in ordered_processes])
+        for p in ordered_processes:
+            self.assertEqual(p.previous_processes(graph), p.previous_processes())
+            self.assertEqual(p.next_processes(graph), p.next_processes())
+        from django_rea.valueaccounting.utils import process_graph
+        d = process_graph(ordered_processes)
+        self.assertEqual(len(d["nodes"]), 3)
+        self.assertEqual(len(d["edges"]), 2)
+
+    def test_json_order_timeline(self):
+        """The streamed order timeline matches create_events, and pages and tags.
+        """
+        import json
+        from django.test import RequestFactory
+        from django_rea.valueaccounting.utils import create_events
+        from django_rea.valueaccounting.views import json_order_timeline
+        start = datetime.date.today()
+        order = self.sow.generate_staged_work_order("test order", start, self.user)
+        unit = Unit(unit_type="quantity", abbrev="EA", name="each")
+        unit.save()
+        Commitment.objects.filter(independent_demand=order).update(unit_of_quantity=unit)
+        processes = order.all_processes()
+        events = {'dateTimeFormat': 'Gregorian','events':[]}
+        create_events([order,], processes, events)
+        factory = RequestFactory()
+
+        response = json_order_timeline(factory.get("/"), order.id)
+        streamed = json.loads("".join(response.streaming_content))
+        key = lambda e: (e["start"], e["title"])
+        self.assertEqual(sorted(streamed["events"], key=key), sorted(events["events"], key=key))
+        etag = response["ETag"]
+
+        response = json_order_timeline(factory.get("/", HTTP_IF_NONE_MATCH=etag), order.id)
+        self.assertEqual(response.status_code, 304)
+        processes[0].notes = "changed"
+        processes[0].save()
+        response = json_order_timeline(factory.get("/", HTTP_IF_NONE_MATCH=etag), order.id)
+        self.assertEqual(response.status_code, 200)
+        etag = response["ETag"]
+        ct = processes[1].commitments.all()[0]
+        ct.quantity += 1
+        ct.save()
+        response = json_order_timeline(factory.get("/", HTTP_IF_NONE_MATCH=etag), order.id)
+        self.assertEqual(response.status_code, 200)
+        with self.assertNumQueries(1):
+            # only the version, to answer a conditional request
+            response = json_order_timeline(
+                factory.get("/", HTTP_IF_NONE_MATCH=response["ETag"]), order.id)
+        self.assertEqual(response.status_code, 304)
+        response = json_order_timeline(factory.get(u"/timeline/\xf1/"), order.id)
+        self.assertNotEqual(response["ETag"], etag)
+
+        window = (start + datetime.timedelta(days=4)).strftime("%Y_%m_%d")
+        response = json_order_timeline(factory.get("/", {"from": window, "to": window}), order.id)
+        streamed = json.loads("".join(response.streaming_content))
+        titles = [e["title"] for e in streamed["events"]]
+        self.assertEqual(titles, [order.timeline_title(), processes[1].timeline_title()])
+
+        from django_rea.valueaccounting.views import json_processes, json_project_processes
+        response = json_processes(factory.get("/"), order.id)
+        graph = json.loads("".join(response.streaming_content))
+        self.assertEqual(len(graph["nodes"]), 3)
+        self.assertEqual(len(graph["edges"]), 2)
+        response = json_project_processes(factory.get("/"), "O", order.id)
+        graph = json.loads("".join(response.streaming_content))
+        self.assertEqual(len(graph["processes"]), 3)
+        self.assertFalse(any(p["orphan"] for p in graph["processes"].values()))
+
     def test_staged_schedule_using_inherited_recipe(self):
         heir = EconomicResourceType(
             name="heir",
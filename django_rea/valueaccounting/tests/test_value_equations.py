@@ -4,6 +4,7 @@ from decimal import *
 from django.conf import settings
 from django.test import TestCase
 from django.test import Client
+from django.test.utils import override_settings
 
 from django_rea.valueaccounting.models import *
 from django_rea.valueaccounting.views import *
@@ -300,9 +301,72 @@ class ValueEquationTest(TestCase):
         #import pdb; pdb.set_trace()
         value_per_unit = parent_resource.roll_up_value(path, depth, visited, ve)
         self.assertEqual(value_per_unit, Decimal("145.0"))
+        # values are saved at the end of the rollup
+        self.assertEqual(EconomicResource.objects.get(id=parent_resource.id).value_per_unit, Decimal("145.0"))
 
         #import pdb; pdb.set_trace()
-        
+
+    def test_value_per_unit_cache(self):
+        parent_resource = EconomicResource.objects.get(id=self.parent_resource.id)
+        ve = self.recipe.value_equation
+        self.assertEqual(parent_resource.compute_value_per_unit(ve), Decimal("145.0"))
+        with self.assertNumQueries(1):
+            value_per_unit = parent_resource.compute_value_per_unit(ve)
+        self.assertEqual(value_per_unit, Decimal("145.0"))
+
+        # changes to anything else leave the entry alone
+        other = EconomicResourceType(name="unrelated")
+        other.save()
+        EconomicResource(resource_type=other, quantity=Decimal("1")).save()
+        self.assertTrue(ValuePerUnitCache.objects.filter(resource=parent_resource).exists())
+
+        work = EconomicEvent.objects.filter(event_type__relationship="work")[0]
+        work.quantity += Decimal("1.0")
+        work.save()
+        self.assertFalse(ValuePerUnitCache.objects.filter(resource=parent_resource).exists())
+        value_per_unit = parent_resource.compute_value_per_unit(ve)
+        self.assertNotEqual(value_per_unit, Decimal("145.0"))
+
+        # so do the resource type values and bucket rules the rollup reads
+        work.resource_type.value_per_unit += Decimal("1.0")
+        work.resource_type.save()
+        self.assertFalse(ValuePerUnitCache.objects.filter(resource=parent_resource).exists())
+        parent_resource.compute_value_per_unit(ve)
+        self.assertTrue(ValuePerUnitCache.objects.filter(resource=parent_resource).exists())
+        rule = ValueEquationBucketRule.objects.filter(value_equation_bucket__value_equation=ve)[0]
+        rule.save()
+        self.assertFalse(ValuePerUnitCache.objects.filter(resource=parent_resource).exists())
+
+    def test_flow_graph(self):
+        from django_rea.valueaccounting.models.income import FlowGraph, IncomeShares
+        ve = self.recipe.value_equation
+        process = self.order_item.process
+        graph = FlowGraph()
+        graph.load(processes=[process.id])
+        # the whole flow is loaded up front
+        self.assertIn(EconomicResource.objects.get(identifier="child1").id, graph.resources)
+        self.assertTrue(len(graph.processes) > 1)
+        self.assertTrue(graph.exchanges)
+        with self.assertNumQueries(0):
+            graph.load(processes=list(graph.processes.keys()), exchanges=list(graph.exchanges.keys()))
+
+        shares = []
+        IncomeShares(ve, shares, set(), graph).for_process(process, self.order_item.quantity)
+        # the fractions test_contribution_shares expects, in visiting order
+        self.assertEqual(
+            [(s.event_type.name, s.transfer.name if s.transfer else None, s.share) for s in shares], [
+                ("Resource Production", None, Decimal("50")),
+                ("Resource Production", None, Decimal("0")),
+                ("Give", "consumable payment", Decimal("50")),
+                ("Give", "expense payment", Decimal("10")),
+                ("Time Contribution", None, Decimal("25")),
+                ("Receive", "financial contribution 2", Decimal("20")),
+                ("Receive", "financial contribution 1", Decimal("30")),
+                ("Receive", "resource contribution", Decimal("10")),
+            ])
+        # shares are set on copies, not on the loaded events
+        self.assertFalse(any(hasattr(e, "share") for e in graph.events.values()))
+
     def test_contribution_shares(self):
         ve = self.recipe.value_equation
         #import pdb; pdb.set_trace()
@@ -350,9 +414,95 @@ class ValueEquationTest(TestCase):
                 self.assertEqual(at.quantity, Decimal("30.0"))
             elif at.to_agent.name == "vacontributor2":
                 self.assertEqual(at.quantity, Decimal("20.0"))
-                
+
         #import pdb; pdb.set_trace()
-           
+
+    def test_profile_distribution(self):
+        ve = self.recipe.value_equation
+        serialized_filter = serialize_filter([self.order,])
+        serialized_filters = {}
+        for bucket in ve.buckets.all():
+            serialized_filters[bucket.id] = serialized_filter
+        values_before = list(EconomicEvent.objects.order_by("id").values_list("value", flat=True))
+        agent_totals, details, profile = ve.profile_value_equation(
+            amount_to_distribute=Decimal("195"), serialized_filters=serialized_filters)
+        totals = dict((at.to_agent.name, at.quantity) for at in agent_totals)
+        self.assertEqual(totals["worker"], Decimal("75.0"))
+        self.assertEqual(totals["contributor"], Decimal("70.0"))
+
+        names = [stage.name for stage in profile.stages]
+        for name in ("gather_bucket_events", "filter_events", "claims_from_events",
+                     "create_distribution_claim_events", "distribution events"):
+            self.assertIn(name, names)
+        gather = [stage for stage in profile.stages if stage.name == "gather_bucket_events"][0]
+        self.assertTrue(gather.rows)
+        self.assertTrue(gather.queries)
+        self.assertTrue(profile.queries >= sum(stage.queries for stage in profile.stages))
+        self.assertEqual(len(profile.report()), len(profile.stages) + 2)
+        # queries are counted without the connection's queries_log
+        from django.db import connection
+        from django_rea.valueaccounting.models._profiling import QueryCounter
+        with QueryCounter(connection) as outer:
+            with QueryCounter(connection) as inner:
+                list(EconomicEvent.objects.all())
+            EconomicEvent.objects.count()
+        self.assertEqual((outer.count, inner.count), (2, 1))
+        self.assertNotIn("cursor", vars(outer.connection))
+        # a dry run saves nothing
+        values_after = list(EconomicEvent.objects.order_by("id").values_list("value", flat=True))
+        self.assertEqual(values_before, values_after)
+
+    @override_settings(use_faircoins=False)
+    def test_distribution_save(self):
+        ve = self.recipe.value_equation
+        context_agent = ve.context_agent
+        serialized_filter = serialize_filter([self.order,])
+        serialized_filters = {}
+        for bucket in ve.buckets.all():
+            serialized_filters[bucket.id] = serialized_filter
+        AgentResourceRoleType(name="owner", is_owner=True).save()
+        cash_rt = EconomicResourceType(name="Cash", unit=self.unit, behavior="account")
+        cash_rt.save()
+        money_resource = EconomicResource(resource_type=cash_rt,
+            identifier="project cash", quantity=Decimal("1000"))
+        money_resource.save()
+        distribution = Distribution(
+            name="Distribution for " + context_agent.nick,
+            process_pattern=self.pattern,
+            distribution_date=datetime.date.today(),
+            context_agent=context_agent,
+            created_by=self.user,
+        )
+        distribution = ve.run_value_equation_and_save(
+            distribution=distribution,
+            money_resource=money_resource,
+            amount_to_distribute=Decimal("195"),
+            serialized_filters=serialized_filters)
+
+        money_resource = EconomicResource.objects.get(id=money_resource.id)
+        self.assertEqual(money_resource.quantity, Decimal("805"))
+        distribution_events = distribution.distribution_events()
+        totals = dict((de.to_agent.name, de.quantity) for de in distribution_events)
+        self.assertEqual(totals["worker"], Decimal("75.0"))
+        self.assertEqual(totals["contributor"], Decimal("70.0"))
+        self.assertEqual(totals["va contributor1"], Decimal("30.0"))
+        self.assertEqual(totals["va contributor2"], Decimal("20.0"))
+        for de in distribution_events:
+            self.assertTrue(de.slug)
+            self.assertEqual(de.resource.quantity, de.quantity)
+            self.assertEqual(de.resource.resource_type, cash_rt)
+            claim_events = de.claim_events.all()
+            self.assertEqual(sum(ce.value for ce in claim_events), de.quantity)
+            for ce in claim_events:
+                self.assertEqual(ce.event_effect, "-")
+                self.assertEqual(ce.claim.has_agent, de.to_agent)
+                creating = ce.claim.claim_events.get(event_effect="+")
+                self.assertEqual(creating.event.from_agent, de.to_agent)
+                self.assertEqual(creating.value, ce.claim.original_value)
+        claims = Claim.objects.all()
+        self.assertTrue(claims)
+        self.assertEqual(ClaimEvent.objects.filter(event_effect="+").count(), claims.count())
+
     def test_faircoin_distribution(self):
         if settings.USE_FAIRCOINS:
             ve = self.recipe.value_equation
@@ -433,3 +583,125 @@ class ValueEquationTest(TestCase):
                     self.assertEqual(at.quantity, Decimal("20.0"))
 
             #import pdb; pdb.set_trace()
+
+
+class ClaimCreationEquationTest(TestCase):
+
+    """Testing compiled ValueEquationBucketRule claim creation equations."""
+
+    def test_numbers_are_decimals(self):
+        rule = ValueEquationBucketRule(claim_creation_equation="quantity * 1.5 + value")
+        value = rule.compiled_equation().evaluate({
+            "quantity": Decimal("2"),
+            "value": Decimal("1"),
+        })
+        self.assertEqual(value, Decimal("4.0"))
+        rule.claim_creation_equation = "quantity * Decimal('25')"
+        value = rule.compiled_equation().evaluate({"quantity": Decimal("2")})
+        self.assertEqual(value, Decimal("50"))
+        # literals are read as written, not rounded through float
+        rule.claim_creation_equation = "quantity * 0.12345678901234567891"
+        value = rule.compiled_equation().evaluate({"quantity": Decimal("1")})
+        self.assertEqual(value, Decimal("0.12345678901234567891"))
+
+    def test_recompiled_when_equation_changes(self):
+        rule = ValueEquationBucketRule(claim_creation_equation="quantity * 25")
+        compiled = rule.compiled_equation()
+        self.assertIs(rule.compiled_equation(), compiled)
+        self.assertEqual(compiled.names, frozenset(["quantity"]))
+        rule.claim_creation_equation = "value"
+        self.assertEqual(rule.compiled_equation().names, frozenset(["value"]))
+
+    def test_batch(self):
+        rule = ValueEquationBucketRule(claim_creation_equation="quantity * valuePerUnit - pricePerUnit")
+        values = rule.compute_claim_values([
+            (Decimal("2"), Decimal("3"), Decimal("1"), Decimal("0")),
+            (Decimal("1"), Decimal("5"), Decimal("0"), Decimal("0")),
+        ])
+        self.assertEqual(values, [Decimal("5"), Decimal("5")])
+
+    def test_invalid_equations(self):
+        for equation in ("", "quantity *", "hours * 2", "__import__('os')", "quantity.real", "[quantity]"):
+            rule = ValueEquationBucketRule(claim_creation_equation=equation)
+            self.assertRaises(ValueError, rule.compiled_equation)
+
+
+class DateRangeBucketTest(TestCase):
+
+    """Testing gather_bucket_events for the date range filter method."""
+
+    def setUp(self):
+        agent_type = AgentType(name="Active individual")
+        agent_type.save()
+        project_type = AgentType(name="Project", party_type="team", is_context=True)
+        project_type.save()
+        self.project = EconomicAgent(name="Project", nick="Project",
+            agent_type=project_type, is_context=True)
+        self.project.save()
+        self.workers = []
+        for name in ("WOne", "WTwo"):
+            worker = EconomicAgent(name=name, nick=name, agent_type=agent_type)
+            worker.save()
+            self.workers.append(worker)
+        self.work_type = EventType.objects.get(name="Time Contribution")
+        self.work = EconomicResourceType(name="Work", value_per_unit=Decimal("10"))
+        self.work.save()
+        AgentResourceType(
+            agent=self.workers[1],
+            resource_type=self.work,
+            event_type=self.work_type,
+            value_per_unit=Decimal("20"),
+        ).save()
+        self.ve = ValueEquation(name="VE", context_agent=self.project)
+        self.ve.save()
+        self.bucket = ValueEquationBucket(
+            name="dates",
+            value_equation=self.ve,
+            filter_method="dates",
+            percentage=Decimal("100"),
+        )
+        self.bucket.save()
+        ValueEquationBucketRule(
+            value_equation_bucket=self.bucket,
+            event_type=self.work_type,
+            filter_rule="{}",
+            division_rule="percentage",
+            claim_rule_type="debt-like",
+            claim_creation_equation="quantity * valuePerUnit",
+        ).save()
+        self.serialized_filter = simplejson.dumps({"method": "DateRange"})
+
+    def log_work(self, count):
+        for i in range(count):
+            EconomicEvent(
+                event_type=self.work_type,
+                event_date=datetime.date(2016, 1, 1) + datetime.timedelta(days=len(self.workers) * i),
+                from_agent=self.workers[i % 2],
+                context_agent=self.project,
+                resource_type=self.work,
+                quantity=Decimal("2"),
+                is_contribution=True,
+            ).save()
+
+    def gather(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        ve = ValueEquation.objects.get(id=self.ve.id)
+        bucket = ve.buckets.all()[0]
+        with CaptureQueriesContext(connection) as ctx:
+            events = bucket.gather_bucket_events(self.project, self.serialized_filter)
+        return events, len(ctx.captured_queries)
+
+    def test_shares(self):
+        self.log_work(2)
+        events, queries = self.gather()
+        shares = sorted(e.share for e in events)
+        self.assertEqual(shares, [Decimal("20"), Decimal("40")])
+
+    def test_query_count_independent_of_event_count(self):
+        self.log_work(2)
+        few_events, few_queries = self.gather()
+        self.log_work(20)
+        many_events, many_queries = self.gather()
+        self.assertEqual(len(many_events), 22)
+        self.assertEqual(few_queries, many_queries)
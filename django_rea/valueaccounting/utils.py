@@ -1,7 +1,12 @@
+import csv
 import datetime
+import json
 
 from django.utils.html import linebreaks
 from django.contrib.sites.models import Site
+from django.db.models.query import QuerySet
+
+from django_rea.valueaccounting.models.misc import VersionedCache
 
 def camelcase(name):
      return ''.join(x.capitalize() or ' ' for x in name.split(' '))
@@ -102,14 +107,21 @@ class Edge(object):
         }
         return d
 
-def process_link_label(from_process, to_process):
-    outputs = [oc.resource_type for oc in from_process.outgoing_commitments()]
-    inputs = [ic.resource_type for ic in to_process.incoming_commitments()]
+def process_link_label(from_process, to_process, graph=None):
+    if graph is not None:
+        outputs = [oc.resource_type for oc in graph.outgoing_commitments(from_process)]
+        inputs = [ic.resource_type for ic in graph.incoming_commitments(to_process)]
+    else:
+        outputs = [oc.resource_type for oc in from_process.outgoing_commitments()]
+        inputs = [ic.resource_type for ic in to_process.incoming_commitments()]
     intersect = set(outputs) & set(inputs)
     label = ", ".join(rt.name for rt in intersect)
     return label
 
 def process_graph(processes):
+    from django_rea.valueaccounting.models.planning import ProcessGraph
+    processes = list(processes)
+    graph = ProcessGraph(processes)
     nodes = []
     visited = set()
     connections = set()
@@ -128,7 +140,7 @@ def process_graph(processes):
                 "end": p.end_date.strftime('%Y-%m-%d'),
                 }
             nodes.append(d)
-        next = p.next_processes()
+        next = p.next_processes(graph)
         for n in next:
             if n not in visited:
                 visited.add(n)
@@ -146,10 +158,10 @@ def process_graph(processes):
             c = "-".join([str(p.id), str(n.id)])
             if c not in connections:
                 connections.add(c)
-                label = process_link_label(p, n)
+                label = process_link_label(p, n, graph)
                 edge = Edge(p, n, label)
                 edges.append(edge.dictify())
-        prev = p.previous_processes()
+        prev = p.previous_processes(graph)
         for n in prev:
             if n not in visited:
                 visited.add(n)
@@ -167,7 +179,7 @@ def process_graph(processes):
             c = "-".join([str(n.id), str(p.id)])
             if c not in connections:
                 connections.add(c)
-                label = process_link_label(n, p)
+                label = process_link_label(n, p, graph)
                 edge = Edge(n, p, label)
                 edges.append(edge.dictify())
     big_d = {
@@ -177,11 +189,17 @@ def process_graph(processes):
     return big_d
 
 def project_process_resource_agent_graph(project_list, process_list):
+    from django_rea.valueaccounting.models import Order
+    from django_rea.valueaccounting.models.planning import ProcessGraph
     processes = {}
     rt_set = set()
     orders = {}
     agents = {}
     agent_dict = {}
+    graph = ProcessGraph(process_list)
+    order_ids = set(graph.independent_demand_id(p) for p in process_list)
+    order_ids.discard(None)
+    order_map = Order.objects.select_related("receiver").in_bulk(list(order_ids))
 
     for p in process_list:
         dp = {
@@ -189,28 +207,29 @@ def project_process_resource_agent_graph(project_list, process_list):
             "type": "process",
             "url": "".join([get_url_starter(), p.get_absolute_url()]),
             "project-id": get_project_id(p),
-            "order-id": get_order_id(p),
+            "order-id": get_order_id(p, graph, order_map),
             "start": p.start_date.strftime('%Y-%m-%d'),
             "end": p.end_date.strftime('%Y-%m-%d'),
-            "orphan": p.is_orphan(),
+            "orphan": process_is_orphan(p, graph),
             "next": []
             }
         processes[p.node_id()] = dp
 
     for p in process_list:
-        order = p.independent_demand()
+        order = order_map.get(graph.independent_demand_id(p))
         if order:
             orders[order.node_id()] = get_order_details(order, get_url_starter(), processes)
 
-        orts = p.outgoing_commitments()
+        orts = graph.outgoing_commitments(p)
 
         for ort in orts:
             if ort not in rt_set:
                 rt_set.add(ort)
 
-        next_ids = [ort.resource_type_node_id() for ort in p.outgoing_commitments()]
+        next_ids = [ort.resource_type_node_id() for ort in orts]
         processes[p.node_id()]["next"].extend(next_ids)
-        agnts = p.working_agents()
+        reqs = [r for r in graph.incoming_commitments(p) if r.event_type.relationship == "work"]
+        agnts = [req.from_agent for req in reqs if req.from_agent]
         for a in agnts:
             if a not in agent_dict:
                 agent_dict[a] = []
@@ -230,21 +249,33 @@ def project_process_resource_agent_graph(project_list, process_list):
         "projects": get_projects(project_list),
         "processes": processes,
         "agents": agents,
-        "resource_types": get_resource_types(rt_set, processes),
+        "resource_types": get_resource_types(rt_set, processes, graph),
         "orders": orders,
     }
 
     return big_d
 
-def get_order_id(p):
-    order = p.independent_demand()
+def get_order_id(p, graph=None, order_map=None):
+    if graph is not None:
+        order = order_map.get(graph.independent_demand_id(p))
+    else:
+        order = p.independent_demand()
     order_id = ''
     if order:
         order_id = order.node_id()
 
     return order_id
 
-def get_resource_types(rt_set, processes):
+def process_is_orphan(p, graph):
+    # Process.is_orphan
+    for ct in graph.commitments[p.id]:
+        if ct.event_type.relationship != 'work':
+            return False
+    if graph.events[p.id]:
+        return False
+    return True
+
+def get_resource_types(rt_set, processes, graph=None):
     resource_types = {}
 
     for ort in rt_set:
@@ -260,16 +291,20 @@ def get_resource_types(rt_set, processes):
             "next": []
             }
 
-        for wct in rt.wanting_commitments():
+        if graph is not None:
+            wanting = graph.wanting_commitments(rt.id)
+        else:
+            wanting = rt.wanting_commitments()
+        for wct in wanting:
             match = False
             if ort.stage:
-                if wct.stage == ort.stage:
+                if wct.stage_id == ort.stage_id:
                     match = True
             else:
                 match = True
             if match:
-                if wct.process:
-                    p_id = wct.process.node_id()
+                if wct.process_id:
+                    p_id = "-".join(["Process", str(wct.process_id)])
                     if p_id in processes:
                         drt["next"].append(p_id)
         resource_types[ort.resource_type_node_id()] = drt
@@ -313,6 +348,7 @@ def get_order_details(order, url_starter, processes):
     return dord
 
 def project_process_graph(project_list, process_list):
+    from django_rea.valueaccounting.models.planning import ProcessGraph
     projects = {}
     processes = {}
     agents = {}
@@ -340,8 +376,9 @@ def project_process_graph(project_list, process_list):
             if a not in agent_dict:
                 agent_dict[a] = []
             agent_dict[a].append(p)
+    graph = ProcessGraph(process_list)
     for p in process_list:
-        next_ids = [n.node_id() for n in p.next_processes()]
+        next_ids = [n.node_id() for n in p.next_processes(graph)]
         p.dp["next"].extend(next_ids)
     for agnt, procs in agent_dict.items():
         da = {
@@ -395,15 +432,128 @@ def explode(process_type_relationship, nodes, edges, depth, depth_limit):
             explode(pt, nodes, edges, depth+1, depth_limit)
 
 def graphify(focus, depth_limit):
-    nodes = [focus]
-    edges = []
-    for art in focus.consuming_agent_relationships():
-        nodes.append(art.agent)
-        edges.append(Edge(focus, art.agent, art.event_type.label))
-    #todo pr: shd this use own or own_or_parent_recipes?
-    for ptr in focus.producing_process_type_relationships():
-        explode(ptr, nodes, edges, 0, depth_limit)
-    return [nodes, edges]
+    return recipe_graph().neighborhood(focus, depth_limit)
+
+class NetworkBuilder(object):
+    """Nodes and edges of a network diagram, each added once."""
+
+    def __init__(self):
+        self.nodes = []
+        self.edges = []
+        self.node_ids = set()
+        self.edge_keys = set()
+
+    def add_node(self, node):
+        node_id = node.node_id()
+        if node_id not in self.node_ids:
+            self.node_ids.add(node_id)
+            self.nodes.append(node)
+
+    def add_edge(self, from_node, to_node, label):
+        if callable(label):
+            label = label()
+        key = (from_node.node_id(), to_node.node_id(), label)
+        if key not in self.edge_keys:
+            self.edge_keys.add(key)
+            self.edges.append(Edge(from_node, to_node, label))
+
+class RecipeGraph(object):
+    """Process types, resource types and agents with the relationships
+    between them, for network diagrams.
+
+    graphify and project_graph walked the relationships with queries
+    at every step, and repeated nodes and edges each time a recipe
+    was reached again. Here all relationships are read with
+    a fixed number of queries, and neighborhoods are answered
+    from memory with each node and edge once.
+    recipe_graph() keeps one in the recipe cache.
+    """
+
+    def __init__(self):
+        from django_rea.valueaccounting.models import AgentResourceType, CommitmentType, ProcessType
+        self.producing = {}
+        self.produced = {}
+        self.consuming = {}
+        self.inputs = {}
+        self.producing_agents = {}
+        self.consuming_agents = {}
+        cts = CommitmentType.objects.select_related(
+            "event_type", "resource_type", "process_type",
+            "process_type__context_agent__agent_type").order_by("resource_type", "id")
+        for ct in cts:
+            et = ct.event_type
+            if et.relationship == "out":
+                self.producing.setdefault(ct.resource_type_id, []).append(ct)
+                self.produced.setdefault(ct.process_type_id, []).append(ct)
+            elif et.relationship in ("consume", "use"):
+                self.inputs.setdefault(ct.process_type_id, []).append(ct)
+            if et.resource_effect == "-":
+                self.consuming.setdefault(ct.resource_type_id, []).append(ct)
+        arts = AgentResourceType.objects.select_related(
+            "event_type", "resource_type", "agent__agent_type").order_by("id")
+        for art in arts:
+            if art.event_type.relationship == "out":
+                self.producing_agents.setdefault(art.resource_type_id, []).append(art)
+            elif art.event_type.relationship == "in":
+                self.consuming_agents.setdefault(art.resource_type_id, []).append(art)
+        self.producers = [pt for pt in ProcessType.objects.select_related("context_agent__agent_type")
+                          if pt.id in self.produced]
+
+    def neighborhood(self, focus, depth_limit):
+        """The nodes and edges graphify makes for resource type focus.
+
+        Its consuming agents, then the recipes that make it, their inputs,
+        and the agents and recipes that make those, depth_limit recipes down.
+        """
+        network = NetworkBuilder()
+        network.add_node(focus)
+        for art in self.consuming_agents.get(focus.id, []):
+            network.add_node(art.agent)
+            network.add_edge(focus, art.agent, art.event_type.label)
+        # the shallowest depth each recipe was exploded at
+        explored = {}
+        stack = [(ptr, 0) for ptr in reversed(self.producing.get(focus.id, []))]
+        while stack:
+            ptr, depth = stack.pop()
+            if depth > depth_limit or explored.get(ptr.id, depth_limit + 1) <= depth:
+                continue
+            explored[ptr.id] = depth
+            pt = ptr.process_type
+            network.add_node(pt)
+            network.add_edge(pt, ptr.resource_type, ptr.event_type.label)
+            next_ptrs = []
+            for rtr in self.inputs.get(pt.id, []):
+                rt = rtr.resource_type
+                network.add_node(rt)
+                network.add_edge(rt, pt, rtr.inverse_label())
+                for art in self.producing_agents.get(rt.id, []):
+                    network.add_node(art.agent)
+                    network.add_edge(art.agent, rt, art.event_type.label)
+                next_ptrs.extend((next_ptr, depth + 1) for next_ptr in self.producing.get(rt.id, []))
+            stack.extend(reversed(next_ptrs))
+        return [network.nodes, network.edges]
+
+    def project_network(self):
+        """The nodes and edges project_graph makes for all producing process types."""
+        network = NetworkBuilder()
+        for p in self.producers:
+            for rt in self.produced[p.id]:
+                for pt in self.consuming.get(rt.resource_type_id, []):
+                    if p.context_agent and pt.process_type.context_agent:
+                        if p.context_agent != pt.process_type.context_agent:
+                            for node in (p.context_agent, pt.process_type.context_agent, rt.resource_type):
+                                network.add_node(node)
+                            network.add_edge(p.context_agent, rt.resource_type, rt.event_type.label)
+                            network.add_edge(rt.resource_type, pt.process_type.context_agent, pt.inverse_label())
+        return [network.nodes, network.edges]
+
+def recipe_graph():
+    """The RecipeGraph in the recipe cache."""
+    cache = recipe_cache()
+    graph = cache.get("recipe_graph")
+    if graph is None:
+        graph = cache.setdefault("recipe_graph", RecipeGraph())
+    return graph
 
 def project_network():
     producers = [p for p in ProcessType.objects.all() if p.produced_resource_types()]
@@ -427,7 +577,8 @@ class TimelineEvent(object):
          self.link = link
          self.description = description
 
-    def dictify(self):
+    def dictify(self, graph=None):
+        # graph: a ProcessGraph holding self.node, if the node is a process
         descrip = ""
         if self.description:
             descrip = self.description
@@ -443,8 +594,17 @@ class TimelineEvent(object):
             d["durationEvent"] = False
         if self.link:
             d["link"] = self.link
+        if graph is not None:
+            requirements = graph.incoming_commitments(self.node)
+            consumed = [r for r in requirements if r.event_type.relationship == "consume"]
+            used = [r for r in requirements if r.event_type.relationship == "use"]
+            work = [r for r in requirements if r.event_type.relationship == "work"]
+        else:
+            consumed = self.node.consumed_input_requirements()
+            used = self.node.used_input_requirements()
+            work = self.node.work_requirements()
         mrq = []
-        for mreq in self.node.consumed_input_requirements():
+        for mreq in consumed:
             abbrev = mreq.unit_of_quantity.abbrev or ""
             label = " ".join([
                 str(mreq.quantity),
@@ -453,7 +613,7 @@ class TimelineEvent(object):
             mrq.append(label)
         d["consumableReqmts"] = mrq
         trq = []
-        for treq in self.node.used_input_requirements():
+        for treq in used:
             abbrev = treq.unit_of_quantity.abbrev or ""
             label = " ".join([
                 str(treq.quantity),
@@ -462,7 +622,7 @@ class TimelineEvent(object):
             trq.append(label)
         d["usableReqmts"] = trq
         wrq = []
-        for wreq in self.node.work_requirements():
+        for wreq in work:
             abbrev = wreq.unit_of_quantity.abbrev or ""
             label = " ".join([
                 str(wreq.quantity),
@@ -481,7 +641,11 @@ class TimelineEvent(object):
         d["orderItems"] = items
         prevs = []
         try:
-            for p in self.node.previous_processes():
+            if graph is not None:
+                previous = graph.previous_processes(self.node)
+            else:
+                previous = self.node.previous_processes()
+            for p in previous:
                 label = "~".join([
                     p.get_absolute_url(),
                     p.name])
@@ -491,7 +655,11 @@ class TimelineEvent(object):
         d["previous"] = prevs
         next = []
         try:
-            for p in self.node.next_processes():
+            if graph is not None:
+                next_processes = graph.next_processes(self.node)
+            else:
+                next_processes = self.node.next_processes()
+            for p in next_processes:
                 label = "~".join([
                     p.get_absolute_url(),
                     p.name])
@@ -503,14 +671,7 @@ class TimelineEvent(object):
 
 def create_events(orders, processes, events):
     for order in orders:
-        te = TimelineEvent(
-            order,
-            order.due_date,
-            "",
-            order.timeline_title(),
-            order.get_absolute_url(),
-            order.timeline_description(),
-        )
+        te = order_timeline_event(order)
         events['events'].append(te.dictify())
     for process in processes:
         te = TimelineEvent(
@@ -523,6 +684,128 @@ def create_events(orders, processes, events):
         )
         events['events'].append(te.dictify())
 
+def timeline_event_stream(processes, orders=None, batch_size=200):
+    """The dicts create_events makes, one at a time.
+
+    Processes are read batch_size at a time, each batch with a
+    ProcessGraph, so their requirements and previous and next processes
+    come from a few queries per batch.
+    If orders is None, the orders are the independent demands
+    of the processes, and follow them.
+    """
+    from django_rea.valueaccounting.models import Order, Process
+    from django_rea.valueaccounting.models.planning import ProcessGraph
+    if orders is not None:
+        for order in orders:
+            yield order_timeline_event(order).dictify()
+    order_ids = []
+    if isinstance(processes, QuerySet):
+        process_ids = list(processes.values_list("id", flat=True))
+    else:
+        process_ids = [p.id for p in processes]
+    for i in range(0, len(process_ids), batch_size):
+        batch_ids = process_ids[i:i + batch_size]
+        batch = Process.objects.select_related("process_type").in_bulk(batch_ids)
+        batch = [batch[pid] for pid in batch_ids if pid in batch]
+        graph = ProcessGraph(batch)
+        neighbour_ids = []
+        for process in batch:
+            neighbour_ids.extend(graph.previous_process_ids(process))
+            neighbour_ids.extend(graph.next_process_ids(process))
+            if orders is None:
+                order_id = graph.independent_demand_id(process)
+                if order_id and order_id not in order_ids:
+                    order_ids.append(order_id)
+        graph.resolve(neighbour_ids)
+        for process in batch:
+            te = TimelineEvent(
+                process,
+                process.start_date,
+                process.end_date,
+                process.timeline_title(),
+                process.get_absolute_url(),
+                process.timeline_description(),
+            )
+            yield te.dictify(graph)
+    if orders is None:
+        for i in range(0, len(order_ids), batch_size):
+            batch = Order.objects.in_bulk(order_ids[i:i + batch_size])
+            for order_id in order_ids[i:i + batch_size]:
+                yield order_timeline_event(batch[order_id]).dictify()
+
+def order_timeline_event(order):
+    return TimelineEvent(
+        order,
+        order.due_date,
+        "",
+        order.timeline_title(),
+        order.get_absolute_url(),
+        order.timeline_description(),
+    )
+
+def stream_json(head, key, items, **kwargs):
+    """The JSON of head plus key: the list of items, in chunks,
+
+    encoding one item at a time so the list is never held whole.
+    kwargs go to the json encoder.
+    """
+    encoder = json.JSONEncoder(**kwargs)
+    yield "{"
+    for k, v in head.items():
+        yield "%s: %s, " % (encoder.encode(k), encoder.encode(v))
+    yield "%s: [" % encoder.encode(key)
+    separator = ""
+    for item in items:
+        yield separator
+        for chunk in encoder.iterencode(item):
+            yield chunk
+        separator = ", "
+    yield "]}"
+
+class CsvEcho(object):
+    """A file for csv.writer that hands each row back instead of storing it."""
+
+    def write(self, value):
+        return value
+
+def stream_csv(header, rows):
+    """The CSV of header and rows, a row at a time.
+
+    Unicode values are written as utf-8.
+    """
+    writer = csv.writer(CsvEcho())
+    yield writer.writerow(header)
+    for row in rows:
+        yield writer.writerow([
+            value.encode("utf-8") if isinstance(value, unicode) else value
+            for value in row])
+
+class RelatedLabels(object):
+    """The str() of the objects foreign keys point to, for rows of ids.
+
+    Objects are fetched with one in_bulk per foreign key per batch of rows,
+    and each is labelled once, however many rows point to it.
+    """
+
+    def __init__(self, model, field_names):
+        self.fields = dict(
+            (model._meta.get_field(name).attname, model._meta.get_field(name).rel.to)
+            for name in field_names)
+        self.labels = dict((attname, {}) for attname in self.fields)
+
+    def load(self, rows):
+        """Labels the objects the rows, dicts by attname, point to."""
+        for attname, related_model in self.fields.items():
+            labels = self.labels[attname]
+            ids = set(row[attname] for row in rows) - set(labels) - set([None])
+            for id, obj in related_model.objects.in_bulk(list(ids)).items():
+                labels[id] = str(obj)
+
+    def label(self, attname, id):
+        if id is None:
+            return None
+        return self.labels[attname].get(id)
+
 def explode_events(resource_type, backsked_date, events):
     for art in resource_type.producing_agent_relationships():
         order_date = backsked_date - datetime.timedelta(days=art.lead_time)
@@ -689,18 +972,150 @@ def explode_xbill_children(node, nodes, exploded):
             for kid in node.xbill_child_object().xbill_children():
                 explode_xbill_children(kid, nodes, exploded)
 
+def node_key(node):
+    return (node.__class__.__name__, node.id)
+
+class XbillGraph(object):
+    """The recipe relationships of every xbill, loaded once.
+
+    explode_xbill_children and xbill_dfs query the children of every
+    node, and xbill_dfs looks up the parents of every node again
+    for every other node. Here CommitmentTypes, Features and Options
+    are read with one query each, and the parents become
+    a parent-to-children map walked by a single depth-first search.
+    The tree is the one xbill_dfs makes, in the same order.
+    """
+
+    def __init__(self):
+        from django_rea.valueaccounting.models import CommitmentType, Feature, Option
+        self.producing = {}
+        self.inputs = {}
+        self.features = {}
+        self.options = {}
+        cts = CommitmentType.objects.select_related(
+            "event_type", "process_type", "resource_type", "stage", "state",
+            "unit_of_quantity").order_by("resource_type", "id")
+        for ct in cts:
+            if ct.event_type.relationship == "out":
+                if ct.stage_id is None:
+                    # EconomicResourceType.xbill_children
+                    self.producing.setdefault(ct.resource_type_id, []).append(ct)
+            else:
+                self.inputs.setdefault(ct.process_type_id, []).append(ct)
+        for feature in Feature.objects.select_related("process_type", "unit_of_quantity"):
+            self.features.setdefault(feature.process_type_id, []).append(feature)
+        for option in Option.objects.select_related("feature", "component").order_by("component", "id"):
+            self.options.setdefault(option.feature_id, []).append(option)
+
+    def children(self, node):
+        # node.xbill_child_object().xbill_children()
+        xclass = node.__class__.__name__
+        if xclass == "Feature":
+            return self.options.get(node.id, [])
+        if xclass == "Option":
+            return self.producing.get(node.component_id, [])
+        if node.event_type.relationship != "out":
+            return self.producing.get(node.resource_type_id, [])
+        inputs = self.inputs.get(node.process_type_id, [])
+        kids = [ct for ct in inputs if ct.event_type.relationship in ("consume", "use")]
+        kids.extend(ct for ct in inputs if ct.event_type.relationship == "cite")
+        kids.extend(ct for ct in inputs if ct.event_type.relationship == "work")
+        kids.extend(self.features.get(node.process_type_id, []))
+        return kids
+
+    def explode(self, resource_type):
+        # explode_xbill_children, without recursion
+        nodes = []
+        seen = set()
+        exploded = set()
+        stack = list(reversed(self.producing.get(resource_type.id, [])))
+        while stack:
+            node = stack.pop()
+            key = node_key(node)
+            if key in seen:
+                continue
+            seen.add(key)
+            nodes.append(node)
+            if node.xbill_class() == 'process-type':
+                if node.process_type_id in exploded:
+                    continue
+                exploded.add(node.process_type_id)
+            stack.extend(reversed(self.children(node)))
+        return nodes
+
+    def tree(self, resource_type):
+        """The (node, depth) pairs of the xbill of resource_type."""
+        # the order xbill_dfs sees nodes in
+        nodes = list(set(self.explode(resource_type)))
+        inputs_by_rt = {}
+        options_by_component = {}
+        outputs_by_pt = {}
+        keys = set()
+        for node in nodes:
+            key = node_key(node)
+            keys.add(key)
+            xclass = node.__class__.__name__
+            if xclass == "Option":
+                options_by_component.setdefault(node.component_id, []).append(key)
+            elif xclass == "CommitmentType":
+                if node.event_type.relationship == "out":
+                    outputs_by_pt.setdefault(node.process_type_id, []).append(key)
+                else:
+                    inputs_by_rt.setdefault(node.resource_type_id, []).append(key)
+        # node.xbill_parent_object().xbill_parents(), as far as they are nodes
+        kids = {}
+        for node in nodes:
+            xclass = node.__class__.__name__
+            if xclass == "Option":
+                parents = [("Feature", node.feature_id)]
+            elif xclass == "Feature" or node.event_type.relationship != "out":
+                parents = outputs_by_pt.get(node.process_type_id, [])
+            else:
+                parents = inputs_by_rt.get(node.resource_type_id, []) + options_by_component.get(
+                    node.resource_type_id, [])
+            key = node_key(node)
+            for parent in parents:
+                if parent != key and parent in keys:
+                    kids.setdefault(parent, []).append(node)
+        to_return = []
+        visited = set()
+        stack = [(kid, 1) for kid in reversed(self.producing.get(resource_type.id, []))]
+        while stack:
+            node, depth = stack.pop()
+            key = node_key(node)
+            if key in visited:
+                continue
+            visited.add(key)
+            to_return.append((node, depth))
+            stack.extend((kid, depth + 1) for kid in reversed(kids.get(key, [])))
+        return to_return
+
+# a stale dict is dropped, never cleared, so a thread still reading it
+# is not disturbed
+_recipe_cache = VersionedCache("recipes", dict)
+
+def recipe_cache():
+    """Things built from recipes, kept until recipes change."""
+    return _recipe_cache.get()
+
+def invalidate_recipe_cache():
+    _recipe_cache.invalidate()
+
+def xbill_tree(resource_type):
+    """XbillGraph.tree(resource_type), from the recipe cache."""
+    cache = recipe_cache()
+    trees = cache.setdefault("xbill_trees", {})
+    tree = trees.get(resource_type.id)
+    if tree is None:
+        graph = cache.get("xbill_graph")
+        if graph is None:
+            graph = cache.setdefault("xbill_graph", XbillGraph())
+        tree = trees.setdefault(resource_type.id, graph.tree(resource_type))
+    return tree
+
 #todo: obsolete
 def generate_xbill(resource_type):
-    nodes = []
-    exploded = []
-    for kid in resource_type.xbill_children():
-        explode_xbill_children(kid, nodes, exploded)
-    nodes = list(set(nodes))
-    #import pdb; pdb.set_trace()
-    to_return = []
-    visited = []
-    for kid in resource_type.xbill_children():
-        to_return.extend(xbill_dfs(kid, nodes, visited, 1))
+    to_return = [XbillNode(node, depth) for node, depth in xbill_tree(resource_type)]
     annotate_tree_properties(to_return)
     #to_return.sort(lambda x, y: cmp(x.xbill_object().name,
     #                                y.xbill_object().name))
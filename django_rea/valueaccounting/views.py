@@ -2,10 +2,13 @@ import datetime
 import time
 import csv
 import copy
+import hashlib
 from operator import itemgetter, attrgetter, methodcaller
 
-from django.db.models import Q
-from django.http import HttpResponse, HttpResponseServerError, Http404, HttpResponseNotFound, HttpResponseRedirect
+from django.db.models import Count, Max, Q, Sum
+from django.db.models.query import QuerySet
+from django.http import HttpResponse, HttpResponseBadRequest, HttpResponseServerError, Http404, HttpResponseNotFound, HttpResponseRedirect
+from django.http import StreamingHttpResponse
 from django.shortcuts import render_to_response, get_object_or_404
 from django.core.urlresolvers import reverse
 from django.contrib.auth.models import User
@@ -19,12 +22,16 @@ from django.forms.models import formset_factory, modelformset_factory, inlinefor
 from django.forms import ValidationError
 import json as simplejson
 from django.utils.datastructures import SortedDict
+from django.views.decorators.http import condition
 from django.contrib.auth.forms import UserCreationForm
 from django.conf import settings
 from django.contrib.sites.models import Site
 from django_comments.models import Comment, CommentFlag
 
 from django_rea.valueaccounting.models import *
+from django_rea.valueaccounting.models.facetconfig import facet_index
+from django_rea.valueaccounting.models.planning import NettingIndex
+from django_rea.valueaccounting.models.process import process_json_version
 from django_rea.valueaccounting.forms import *
 from django_rea.valueaccounting.utils import *
 from ocp.work.models import MembershipRequest, SkillSuggestion
@@ -907,38 +914,8 @@ def select_resource_types(facet_values):
         Ie, a resource type must have at least one of those facet values.
     """
     #import pdb; pdb.set_trace()
-    fv_ids = [fv.id for fv in facet_values]
-    rt_facet_values = ResourceTypeFacetValue.objects.filter(facet_value__id__in=fv_ids)
-    rts = [rtfv.resource_type for rtfv in rt_facet_values]
-    answer = []
-    singles = [] #Facets with only one facet_value in the Pattern
-    multis = []  #Facets with more than one facet_value in the Pattern
-    aspects = {}
-    for fv in facet_values:
-        if fv.facet not in aspects:
-            aspects[fv.facet] = []
-        aspects[fv.facet].append(fv)
-    for facet, facet_values in aspects.items():
-        if len(facet_values) > 1:
-            for fv in facet_values:
-                multis.append(fv)
-        else:
-            singles.append(facet_values[0])
-    single_ids = [s.id for s in singles]
-    #import pdb; pdb.set_trace()
-    for rt in rts:
-        rt_singles = [rtfv.facet_value for rtfv in rt.facets.filter(facet_value_id__in=single_ids)]
-        rt_multis = [rtfv.facet_value for rtfv in rt.facets.exclude(facet_value_id__in=single_ids)]
-        if set(rt_singles) == set(singles):
-            if not rt in answer:
-                if multis:
-                    # if multis intersect
-                    if set(rt_multis) & set(multis):
-                        answer.append(rt)
-                else:
-                    answer.append(rt)
-    answer_ids = [a.id for a in answer]
-    return list(EconomicResourceType.objects.filter(id__in=answer_ids))
+    rt_ids = facet_index().resource_type_ids([fv.id for fv in facet_values])
+    return list(EconomicResourceType.objects.filter(id__in=rt_ids))
 
 def resource_types(request):
     roots = EconomicResourceType.objects.all()
@@ -1032,39 +1009,20 @@ def resource_type(request, resource_type_id):
 def inventory(request):
     #import pdb; pdb.set_trace()
     #resources = EconomicResource.objects.select_related().filter(quantity__gt=0).order_by('resource_type')
-    rts = EconomicResourceType.objects.all()
-    resource_types = []
     facets = Facet.objects.all()
     select_all = True
     selected_values = "all"
+    facet_values = None
     if request.method == "POST":
         selected_values = request.POST["categories"]
         if selected_values:
             vals = selected_values.split(",")
-            if vals[0] == "all":
-                select_all = True
-                #resources = EconomicResource.objects.select_related().filter(quantity__gt=0).order_by('resource_type')
-                for rt in rts:
-                    if rt.onhand_qty()>0:
-                        resource_types.append(rt)
-            else:
+            if vals[0] != "all":
                 select_all = False
-                #resources = EconomicResource.objects.select_related().filter(quantity__gt=0, resource_type__category__name__in=vals).order_by('resource_type')
-                fvs = []
-                for val in vals:
-                    val_split = val.split(":")
-                    fname = val_split[0]
-                    fvalue = val_split[1].strip()
-                    fvs.append(FacetValue.objects.get(facet__name=fname,value=fvalue))
-                rts = select_resource_types(fvs)
-                for rt in rts:
-                    if rt.onhand_qty()>0:
-                        resource_types.append(rt)
-                resource_types.sort(key=lambda rt: rt.label())
-    else:
-        for rt in rts:
-            if rt.onhand_qty()>0:
-                resource_types.append(rt)
+                facet_values = FacetValue.objects.from_filter(vals)
+    resource_types = EconomicResourceType.objects.inventory(facet_values)
+    if not select_all:
+        resource_types.sort(key=lambda rt: rt.label())
     return render_to_response("valueaccounting/inventory.html", {
         #"resources": resources,
         "resource_types": resource_types,
@@ -1100,10 +1058,10 @@ def resource_flow_report(request, resource_type_id):
     #would be better to figure out how to insert in the correct place
     stages = []
     #import pdb; pdb.set_trace() 
-    stages.append(ExchangeType.objects.get(id=3))
-    stages.append(ExchangeType.objects.get(id=2))
+    stages.append(ExchangeType.objects.cached(id=3))
+    stages.append(ExchangeType.objects.cached(id=2))
     stages.append(ProcessType.objects.get(id=4))
-    stages.append(ExchangeType.objects.get(id=1))
+    stages.append(ExchangeType.objects.cached(id=1))
     stages.append(ProcessType.objects.get(id=5))
     sales = []
     for lot in lot_list:
@@ -1187,7 +1145,7 @@ def adjust_resource(request, resource_id):
         if event.quantity != resource.quantity:
             new_quantity = event.quantity
             event.resource = resource
-            et = EventType.objects.get(relationship="adjust")
+            et = EventType.objects.cached(relationship="adjust")
             event.event_type = et
             event.quantity = event.quantity - resource.quantity
             event.from_agent = agent
@@ -1231,7 +1189,7 @@ def event_history(request, resource_id):
     }, context_instance=RequestContext(request))
     
 def faircoin_outgoing_exchange_type():
-    use_case = UseCase.objects.get(name="Outgoing Exchange")
+    use_case = UseCase.objects.cached(name="Outgoing Exchange")
     xt = ExchangeType.objects.filter(
         use_case=use_case,
         name="Send FairCoins")
@@ -1262,7 +1220,7 @@ def faircoin_outgoing_transfer_type():
     return tt
     
 def faircoin_internal_exchange_type():
-    use_case = UseCase.objects.get(name="Internal Exchange")
+    use_case = UseCase.objects.cached(name="Internal Exchange")
     xt = ExchangeType.objects.filter(
         use_case=use_case,
         name="Transfer FairCoins")
@@ -1310,7 +1268,7 @@ def send_faircoins(request, resource_id):
                 if to_resources:
                     to_resource = to_resources[0] #shd be only one
                     to_agent = to_resource.owner()
-                et_give = EventType.objects.get(name="Give")
+                et_give = EventType.objects.cached(name="Give")
                 if to_agent:
                     tt = faircoin_internal_transfer_type()
                     xt = tt.exchange_type
@@ -1368,7 +1326,7 @@ def send_faircoins(request, resource_id):
                     # but receiving event will get quantity - network_fee
                     from django_rea.valueaccounting.faircoin_utils import network_fee
                     quantity = quantity - Decimal(float(network_fee()) / 1.e6)
-                    et_receive = EventType.objects.get(name="Receive")
+                    et_receive = EventType.objects.cached(name="Receive")
                     event = EconomicEvent(
                         event_type = et_receive,
                         event_date = date,
@@ -1576,7 +1534,7 @@ def agent_value_accounting(request, agent_id):
             for de in claim.distribution_events():
                 claim_distributions += de.value
                 claim_distro_events.append(de.event)
-    et = EventType.objects.get(name="Distribution")
+    et = EventType.objects.cached(name="Distribution")
     all_distro_evts = EconomicEvent.objects.filter(to_agent=agent, event_type=et)
     other_distro_evts = [d for d in all_distro_evts if d not in claim_distro_events]
     other_distributions = sum(de.quantity for de in other_distro_evts)
@@ -2818,7 +2776,11 @@ def create_process_type_for_streaming(request, resource_type_id, process_type_id
 def network(request, resource_type_id):
     #import pdb; pdb.set_trace()
     rt = get_object_or_404(EconomicResourceType, pk=resource_type_id)
-    nodes, edges = graphify(rt, 3)
+    try:
+        depth = min(max(int(request.GET.get("depth", 3)), 0), 10)
+    except ValueError:
+        depth = 3
+    nodes, edges = graphify(rt, depth)
     return render_to_response("valueaccounting/network.html", {
         "resource_type": rt,
         "photo_size": (128, 128),
@@ -2828,8 +2790,7 @@ def network(request, resource_type_id):
 
 def project_network(request):
     #import pdb; pdb.set_trace()
-    producers = [p for p in ProcessType.objects.all() if p.produced_resource_types()]
-    nodes, edges = project_graph(producers)
+    nodes, edges = recipe_graph().project_network()
     return render_to_response("valueaccounting/network.html", {
         "photo_size": (128, 128),
         "nodes": nodes,
@@ -2859,6 +2820,68 @@ def timeline(request, from_date, to_date, context_id):
         "unassigned": unassigned,
     }, context_instance=RequestContext(request))
 
+def json_date_window(request):
+    """The optional from and to GET parameters of the json timelines and graphs.
+
+    Dates are in the %Y_%m_%d form of the timeline urls;
+    either may be left out.
+    """
+    window = []
+    for param in ("from", "to"):
+        value = request.GET.get(param)
+        if value:
+            try:
+                window.append(datetime.datetime(*time.strptime(value, '%Y_%m_%d')[0:5]).date())
+            except ValueError:
+                raise Http404
+        else:
+            window.append(None)
+    return window
+
+def processes_in_window(processes, start, end):
+    """The processes that overlap start to end, selected as json_timeline does."""
+    if start is None and end is None:
+        return processes
+    start = start or datetime.date.min
+    end = end or datetime.date.max
+    if isinstance(processes, QuerySet):
+        return processes.filter(
+            Q(start_date__range=(start, end)) | Q(end_date__range=(start, end)) |
+            Q(start_date__lt=start, end_date__gt=end))
+    answer = []
+    for p in processes:
+        if start <= p.start_date <= end:
+            answer.append(p)
+        elif p.end_date:
+            if start <= p.end_date <= end or (p.start_date < start and p.end_date > end):
+                answer.append(p)
+    return answer
+
+def process_json_etag(request, *args, **kwargs):
+    """An ETag for json built from processes.
+
+    The request path and the process_json_version, so one query answers
+    a conditional request, and any change to what the json shows
+    gives a new ETag.
+    """
+    digest = hashlib.md5(request.get_full_path().encode("utf-8"))
+    digest.update(":%s" % process_json_version())
+    return digest.hexdigest()
+
+def streaming_json_response(chunks):
+    return StreamingHttpResponse(chunks, content_type="text/json-comment-filtered")
+
+def timeline_json_response(request, processes, orders=None):
+    events = timeline_event_stream(processes, orders)
+    chunks = stream_json({'dateTimeFormat': 'Gregorian'}, 'events', events, ensure_ascii=False)
+    return streaming_json_response(chunks)
+
+def graph_json_chunks(build, *args):
+    # builds the graph when the response is read, not when it is made
+    for chunk in simplejson.JSONEncoder().iterencode(build(*args)):
+        yield chunk
+
+@condition(etag_func=process_json_etag)
 def json_timeline(request, from_date, to_date, context_id):
     try:
         start = datetime.datetime(*time.strptime(from_date, '%Y_%m_%d')[0:5]).date()
@@ -2869,18 +2892,11 @@ def json_timeline(request, from_date, to_date, context_id):
     context_agent = None
     if context_id:
         context_agent = get_object_or_404(EconomicAgent, pk=context_id)
-    events = {'dateTimeFormat': 'Gregorian','events':[]}
-    processes = Process.objects.unfinished().filter(
-        Q(start_date__range=(start, end)) | Q(end_date__range=(start, end)) |
-        Q(start_date__lt=start, end_date__gt=end))      
+    processes = processes_in_window(Process.objects.unfinished(), start, end)
     if context_agent:
         processes = processes.filter(context_agent=context_agent)
-    orders = [p.independent_demand() for p in processes if p.independent_demand()]
-    orders = list(set(orders))
-    create_events(orders, processes, events)
-    data = simplejson.dumps(events, ensure_ascii=False)
     #import pdb; pdb.set_trace()
-    return HttpResponse(data, content_type="text/json-comment-filtered")
+    return timeline_json_response(request, processes)
     
 def context_timeline(request, context_id):
     context_agent = get_object_or_404(EconomicAgent, pk=context_id)
@@ -2898,17 +2914,14 @@ def context_timeline(request, context_id):
         "unassigned": unassigned,
     }, context_instance=RequestContext(request))
 
+@condition(etag_func=process_json_etag)
 def json_context_timeline(request, context_id):
     #import pdb; pdb.set_trace()
-    events = {'dateTimeFormat': 'Gregorian','events':[]}
     context_agent = get_object_or_404(EconomicAgent, pk=context_id)
+    start, end = json_date_window(request)
     processes = Process.objects.unfinished().filter(context_agent=context_agent)
-    orders = [p.independent_demand() for p in processes if p.independent_demand()]
-    orders = list(set(orders))
-    create_events(orders, processes, events)
-    data = simplejson.dumps(events, ensure_ascii=False)
-    #import pdb; pdb.set_trace()
-    return HttpResponse(data, content_type="text/json-comment-filtered")
+    processes = processes_in_window(processes, start, end)
+    return timeline_json_response(request, processes)
 
 def order_timeline(request, order_id):
     order = get_object_or_404(Order, pk=order_id)
@@ -2929,56 +2942,58 @@ def order_timeline(request, order_id):
         "unassigned": unassigned,
     }, context_instance=RequestContext(request))
 
+@condition(etag_func=process_json_etag)
 def json_order_timeline(request, order_id):
-    events = {'dateTimeFormat': 'Gregorian','events':[]}
     order = get_object_or_404(Order, pk=order_id)
-    processes = order.all_processes()
+    start, end = json_date_window(request)
+    processes = processes_in_window(order.all_processes(), start, end)
     orders = [order,]
-    create_events(orders, processes, events)
-    data = simplejson.dumps(events, ensure_ascii=False)
     #import pdb; pdb.set_trace()
-    return HttpResponse(data, content_type="text/json-comment-filtered")
+    return timeline_json_response(request, processes, orders)
     
 
+@condition(etag_func=process_json_etag)
 def json_processes(request, order_id=None):
     #import pdb; pdb.set_trace()
+    start, end = json_date_window(request)
     if order_id:
         order = get_object_or_404(Order, pk=order_id)
         processes = order.all_processes()
     else:
-        processes = Process.objects.unfinished()
-    graph = process_graph(processes)
-    data = simplejson.dumps(graph)
-    return HttpResponse(data, content_type="text/json-comment-filtered")
+        processes = Process.objects.unfinished().select_related("context_agent")
+    processes = processes_in_window(processes, start, end)
+    return streaming_json_response(graph_json_chunks(process_graph, processes))
 
+@condition(etag_func=process_json_etag)
 def json_project_processes(request, object_type=None, object_id=None):
     #import pdb; pdb.set_trace()
     #todo: needs to change
     # project and agent are now both agents
     # active_processes has been fixed, though...
+    start, end = json_date_window(request)
     if object_type:
         if object_type == "P":
             project = get_object_or_404(EconomicAgent, pk=object_id)
-            processes = project.active_processes()
+            processes = processes_in_window(project.active_processes(), start, end)
             projects = [project,]
         elif object_type == "O":
             order = get_object_or_404(Order, pk=object_id)
-            processes = order.all_processes()
+            processes = processes_in_window(order.all_processes(), start, end)
             projects = [p.context_agent for p in processes if p.context_agent]
             projects = list(set(projects))
         elif object_type == "A":
             agent = get_object_or_404(EconomicAgent, pk=object_id)
-            processes = agent.active_processes()
+            processes = processes_in_window(agent.active_processes(), start, end)
             projects = [p.context_agent for p in processes if p.context_agent]
             projects = list(set(projects))
     else:
-        processes = Process.objects.unfinished()
+        processes = Process.objects.unfinished().select_related("context_agent")
+        processes = processes_in_window(processes, start, end)
         projects = [p.context_agent for p in processes if p.context_agent]
         projects = list(set(projects))
     #import pdb; pdb.set_trace()
-    graph = project_process_resource_agent_graph(projects, processes)
-    data = simplejson.dumps(graph)
-    return HttpResponse(data, content_type="text/json-comment-filtered")
+    chunks = graph_json_chunks(project_process_resource_agent_graph, projects, processes)
+    return streaming_json_response(chunks)
 
 
 def json_resource_type_unit(request, resource_type_id):
@@ -3231,9 +3246,9 @@ def create_order(request):
             order.created_by=request.user
             order.order_type = "customer"
             order.save()
-            uc = UseCase.objects.get(identifier="demand_xfer")
+            uc = UseCase.objects.cached(identifier="demand_xfer")
             ext_id = request.POST["exchange_type"]
-            exchange_type = ExchangeType.objects.get(id=ext_id)         
+            exchange_type = ExchangeType.objects.cached(id=ext_id)         
             exchange = Exchange(
                 name=exchange_type.name + " for customer order " + str(order.id),
                 exchange_type=exchange_type,
@@ -3327,7 +3342,7 @@ def create_order(request):
             )
             cr_xfer.save()
             cr_commit = Commitment(
-                event_type=EventType.objects.get(name="Receive"),
+                event_type=EventType.objects.cached(name="Receive"),
                 exchange=exchange,
                 transfer=cr_xfer,
                 due_date=exchange.start_date,
@@ -3824,14 +3839,18 @@ def supply(request):
     agent = get_agent(request)
     mrqs = Commitment.objects.filter(
         Q(event_type__relationship='consume')|Q(event_type__relationship='use')).order_by("resource_type__name")
+    mrqs = list(mrqs.select_related("resource_type", "event_type", "stage"))
+    netting = NettingIndex()
+    netting.attach(mrqs)
     suppliers = SortedDict()
-    supply = EventType.objects.get(name="Supply")
+    supply = EventType.objects.cached(name="Supply")
     mreqs = [ct for ct in mrqs if ct.quantity_to_buy()]
     for commitment in mreqs:
         sources = AgentResourceType.objects.filter(
             event_type=supply,
             resource_type=commitment.resource_type)
         for source in sources:
+            source.netting_index = netting
             agent = source.agent
             if agent not in suppliers:
                 suppliers[agent] = SortedDict()
@@ -4335,19 +4354,17 @@ def start(request):
     }, context_instance=RequestContext(request))
 
 
+def agents_with_totals(totals):
+    """(agent, quantity) for each (agent id, quantity), with one agent query."""
+    agents = EconomicAgent.objects.in_bulk([agent_id for agent_id, quantity in totals if agent_id])
+    return [(agents.get(agent_id), quantity) for agent_id, quantity in totals]
+
 def agent_stats(request, agent_id):
     agent = get_object_or_404(EconomicAgent, id=agent_id)
     scores = agent.resource_types.all()
-    agents = {}
-    contributions = EconomicEvent.objects.filter(is_contribution=True)
-    for c in contributions:
-        if c.from_agent not in agents:
-            agents[c.from_agent] = Decimal("0")
-        agents[c.from_agent] += c.quantity
-    member_hours = []
-    for key, value in agents.iteritems():
-        member_hours.append((key, value))
-    member_hours.sort(lambda x, y: cmp(y[1], x[1]))
+    totals = EconomicEvent.objects.filter(is_contribution=True).values_list(
+        "from_agent").annotate(hours=Sum("quantity")).order_by("-hours")
+    member_hours = agents_with_totals(totals)
     return render_to_response("valueaccounting/agent_stats.html", {
         "agent": agent,
         "scores": scores,
@@ -4362,17 +4379,11 @@ def project_stats(request, context_agent_slug):
         project = get_object_or_404(EconomicAgent, slug=context_agent_slug)
     if project:
         subs = project.with_all_sub_agents()
-        ces = CachedEventSummary.objects.filter(
+        totals = CachedEventSummary.objects.filter(
             event_type__relationship="work",
-            context_agent__in=subs)
-        if ces.count():
-            agents = {}
-            for ce in ces:
-                agents.setdefault(ce.agent, Decimal("0"))
-                agents[ce.agent] += ce.quantity
-            for key, value in agents.items():
-                member_hours.append((key, value))
-            member_hours.sort(lambda x, y: cmp(y[1], x[1]))
+            context_agent__in=subs).values_list(
+            "agent").annotate(hours=Sum("quantity")).order_by("-hours")
+        member_hours = agents_with_totals(totals)
     return render_to_response("valueaccounting/project_stats.html", {
         "member_hours": member_hours,
         "page_title": "All-time project stats",
@@ -4389,17 +4400,11 @@ def recent_stats(request, context_agent_slug):
         end = datetime.date.today()
         #end = end - datetime.timedelta(days=77)
         start =  end - datetime.timedelta(days=60)
-        events = EconomicEvent.objects.filter(
+        totals = MonthlyEventSummary.objects.agent_totals(
+            start, end,
             event_type__relationship="work",
-            context_agent__in=subs,
-            event_date__range=(start, end))
-        agents_stats = {}
-        for event in events:
-            agents_stats.setdefault(event.from_agent, Decimal("0"))
-            agents_stats[event.from_agent] += event.quantity
-        for key, value in agents_stats.items():
-            member_hours.append((key, value))
-        member_hours.sort(lambda x, y: cmp(y[1], x[1]))
+            context_agent__in=subs)
+        member_hours = agents_with_totals(totals)
     return render_to_response("valueaccounting/project_stats.html", {
         "member_hours": member_hours,
         "page_title": "Last 2 months project stats",
@@ -5440,7 +5445,7 @@ def add_cash_contribution(request, exchange_id):
                     va.quantity = va.quantity - value
                     va.save()
                     from_event = EconomicEvent(
-                        event_type = EventType.objects.get(name="Cash Disbursement"),
+                        event_type = EventType.objects.cached(name="Cash Disbursement"),
                         event_date = event.event_date,
                         resource = va,
                         resource_type = va.resource_type,
@@ -5664,7 +5669,7 @@ def create_production_process(request, commitment_id):
         if form.is_valid():
             process = form.save()
             qty = commitment.net_for_order()
-            et = EventType.objects.get(name="Resource Production")
+            et = EventType.objects.cached(name="Resource Production")
             rt = commitment.resource_type
             production_ct = process.add_commitment(
                 resource_type=rt,
@@ -5688,7 +5693,7 @@ def log_shipment(request, commitment_id, resource_id):
     ct = get_object_or_404(Commitment, pk=commitment_id)
     resource = get_object_or_404(EconomicResource, pk=resource_id)
     if request.method == "POST":
-        et_ship = EventType.objects.get(name="Shipment")
+        et_ship = EventType.objects.cached(name="Shipment")
         event = EconomicEvent(
             resource = resource,
             commitment = ct,
@@ -5716,7 +5721,7 @@ def log_shipment(request, commitment_id, resource_id):
 def log_uninventoried_shipment(request, commitment_id):
     ct = get_object_or_404(Commitment, pk=commitment_id)
     if request.method == "POST":
-        et_ship = EventType.objects.get(name="Shipment")
+        et_ship = EventType.objects.cached(name="Shipment")
         event = EconomicEvent(
             commitment = ct,
             event_date = datetime.date.today(),
@@ -5761,7 +5766,7 @@ def add_distribution(request, distribution_id):
             if qty:
                 event = form.save(commit=False)
                 rt = data["resource_type"]
-                event_type = EventType.objects.get(relationship="distribute")
+                event_type = EventType.objects.cached(relationship="distribute")
                 event.event_type = event_type
                 event.context_agent = context_agent
                 event.distribution = distribution
@@ -5793,7 +5798,7 @@ def add_disbursement(request, distribution_id):
             if qty:
                 event = form.save(commit=False)
                 rt = data["resource_type"]
-                event_type = EventType.objects.get(relationship="disburse")
+                event_type = EventType.objects.cached(relationship="disburse")
                 fa = distribution.context_agent
                 if event.resource:
                     if event.resource.owner():
@@ -5832,8 +5837,8 @@ def add_transfer(request, exchange_id, transfer_type_id):
             et2 = None
             res_identifier = None
             if qty:
-                et_give = EventType.objects.get(name="Give")
-                et_receive = EventType.objects.get(name="Receive")
+                et_give = EventType.objects.cached(name="Give")
+                et_receive = EventType.objects.cached(name="Receive")
                 event_date = data["event_date"]
                 if transfer_type.give_agent_is_context:
                     from_agent = context_agent
@@ -5884,7 +5889,7 @@ def add_transfer(request, exchange_id, transfer_type_id):
                                 quantity=0,
                                 created_by=request.user,
                                 )
-                if exchange.exchange_type.use_case == UseCase.objects.get(identifier="supply_xfer"):
+                if exchange.exchange_type.use_case == UseCase.objects.cached(identifier="supply_xfer"):
                     if transfer_type.is_reciprocal:
                         if res:
                             res.quantity -= qty
@@ -5893,7 +5898,7 @@ def add_transfer(request, exchange_id, transfer_type_id):
                         if res:
                             res.quantity += qty
                         et = et_receive
-                elif exchange.exchange_type.use_case == UseCase.objects.get(identifier="demand_xfer"):
+                elif exchange.exchange_type.use_case == UseCase.objects.cached(identifier="demand_xfer"):
                     if transfer_type.is_reciprocal:
                         if res:
                             res.quantity += qty
@@ -6028,8 +6033,8 @@ def transfer_from_commitment(request, transfer_id):
         form = TransferForm(data=request.POST, transfer_type=transfer.transfer_type, context_agent=transfer.context_agent, posting=True, prefix=transfer.form_prefix())
         if form.is_valid():
             data = form.cleaned_data
-            et_give = EventType.objects.get(name="Give")
-            et_receive = EventType.objects.get(name="Receive")
+            et_give = EventType.objects.cached(name="Give")
+            et_receive = EventType.objects.cached(name="Receive")
             qty = data["quantity"]
             event_date = data["event_date"]
             if transfer_type.give_agent_is_context:
@@ -6181,23 +6186,23 @@ def add_transfer_commitment(request, exchange_id, transfer_type_id):
                     )
                 xfer.save()
                 
-                if exchange.exchange_type.use_case == UseCase.objects.get(identifier="supply_xfer"):
+                if exchange.exchange_type.use_case == UseCase.objects.cached(identifier="supply_xfer"):
                     if transfer_type.is_reciprocal:
-                        et = EventType.objects.get(name="Give")
+                        et = EventType.objects.cached(name="Give")
                     else:
-                        et = EventType.objects.get(name="Receive")
-                elif exchange.exchange_type.use_case == UseCase.objects.get(identifier="demand_xfer"):
+                        et = EventType.objects.cached(name="Receive")
+                elif exchange.exchange_type.use_case == UseCase.objects.cached(identifier="demand_xfer"):
                     if transfer_type.is_reciprocal:
-                        et = EventType.objects.get(name="Receive")
+                        et = EventType.objects.cached(name="Receive")
                     else:
-                        et = EventType.objects.get(name="Give")
+                        et = EventType.objects.cached(name="Give")
                 else: #internal xfer use case
                     if transfer_type.is_reciprocal:
-                        et = EventType.objects.get(name="Receive")
-                        et2 = EventType.objects.get(name="Give")
+                        et = EventType.objects.cached(name="Receive")
+                        et2 = EventType.objects.cached(name="Give")
                     else:
-                        et = EventType.objects.get(name="Give")
-                        et2 = EventType.objects.get(name="Receive")
+                        et = EventType.objects.cached(name="Give")
+                        et2 = EventType.objects.cached(name="Receive")
                 commit = Commitment(
                     event_type = et,
                     commitment_date=commitment_date,
@@ -6252,8 +6257,8 @@ def change_transfer_events(request, transfer_id):
         form = TransferForm(data=request.POST, transfer_type=transfer_type, context_agent=context_agent, posting=True, prefix=transfer.form_prefix() + "E")
         if form.is_valid():
             data = form.cleaned_data
-            et_give = EventType.objects.get(name="Give")
-            et_receive = EventType.objects.get(name="Receive")
+            et_give = EventType.objects.cached(name="Give")
+            et_receive = EventType.objects.cached(name="Receive")
             qty = data["quantity"]
             if qty:
                 event_date = data["event_date"]
@@ -6364,8 +6369,8 @@ def change_transfer_commitments(request, transfer_id):
         form = TransferCommitmentForm(data=request.POST, transfer_type=transfer_type, context_agent=context_agent, posting=True, prefix=transfer.form_prefix() + "C")
         if form.is_valid():
             data = form.cleaned_data
-            et_give = EventType.objects.get(name="Give")
-            et_receive = EventType.objects.get(name="Receive")
+            et_give = EventType.objects.cached(name="Give")
+            et_receive = EventType.objects.cached(name="Receive")
             qty = data["quantity"]
             if qty:
                 commitment_date = data["commitment_date"]
@@ -6427,7 +6432,7 @@ def delete_transfer_events(request, transfer_id):
     if request.method == "POST":
         res = None
         events = transfer.events.all()
-        et_give = EventType.objects.get(name="Give")
+        et_give = EventType.objects.cached(name="Give")
         give_res = None
         receive_res = None
         if events:
@@ -7429,6 +7434,8 @@ def process_oriented_logging(request, process_id):
     event_types = []
     work_now = settings.USE_WORK_NOW
     to_be_changed_requirement = None
+    # the requirement and event forms share their choices
+    choices = FormChoices()
     changeable_requirement = None
     
     work_reqs = process.work_requirements()
@@ -7445,14 +7452,14 @@ def process_oriented_logging(request, process_id):
             super_logger = True
         #import pdb; pdb.set_trace()
         for req in work_reqs:
-            req.changeform = req.change_work_form()
+            req.changeform = req.change_work_form(choices=choices)
             if agent == req.from_agent:
                 logger = True
                 worker = True  
             init = {"from_agent": agent, 
                 "event_date": todays_date,
                 "is_contribution": True,}
-            req.input_work_form_init = req.input_event_form_init(init=init)
+            req.input_work_form_init = req.input_event_form_init(init=init, choices=choices)
         for req in consume_reqs:
             req.changeform = req.change_form()
         for req in use_reqs:
@@ -7461,14 +7468,15 @@ def process_oriented_logging(request, process_id):
             event.changeform = UnplannedWorkEventForm(
                 pattern=pattern,
                 context_agent=context_agent,
+                choices=choices,
                 instance=event, 
                 prefix=str(event.id))
         output_resource_types = pattern.output_resource_types()        
         unplanned_output_form = UnplannedOutputForm(prefix='unplannedoutput')
         unplanned_output_form.fields["resource_type"].queryset = output_resource_types
         role_formset = resource_role_agent_formset(prefix="resource")
-        produce_et = EventType.objects.get(name="Resource Production")
-        change_et = EventType.objects.get(name="Change")
+        produce_et = EventType.objects.cached(name="Resource Production")
+        change_et = EventType.objects.cached(name="Change")
         #import pdb; pdb.set_trace()
         if "out" in slots:
             if logger:
@@ -7497,16 +7505,16 @@ def process_oriented_logging(request, process_id):
                         "unit_of_quantity": work_unit,
                         "is_contribution": True,
                     } 
-                    unplanned_work_form = UnplannedWorkEventForm(prefix="unplanned", context_agent=context_agent, initial=work_init)
+                    unplanned_work_form = UnplannedWorkEventForm(prefix="unplanned", context_agent=context_agent, choices=choices, initial=work_init)
                     unplanned_work_form.fields["resource_type"].queryset = work_resource_types
                     #if logger:
                     #    add_work_form = WorkCommitmentForm(initial=work_init, prefix='work', pattern=pattern)
                 else:
-                    unplanned_work_form = UnplannedWorkEventForm(prefix="unplanned", pattern=pattern, context_agent=context_agent, initial=work_init)
+                    unplanned_work_form = UnplannedWorkEventForm(prefix="unplanned", pattern=pattern, context_agent=context_agent, choices=choices, initial=work_init)
                     #is this correct? see commented-out lines above
                 if logger:
                     date_init = {"due_date": process.end_date,}
-                    add_work_form = WorkCommitmentForm(prefix='work', pattern=pattern, initial=date_init)
+                    add_work_form = WorkCommitmentForm(prefix='work', pattern=pattern, choices=choices, initial=date_init)
 
         if "cite" in slots:
             unplanned_cite_form = UnplannedCiteEventForm(prefix='unplannedcite', pattern=pattern)
@@ -7958,7 +7966,7 @@ def add_work_for_exchange(request, exchange_id):
     if form.is_valid():
         event = form.save(commit=False)
         rt = event.resource_type
-        event.event_type = EventType.objects.get(name="Time Contribution")
+        event.event_type = EventType.objects.cached(name="Time Contribution")
         event.exchange = exchange
         event.context_agent = context_agent
         event.to_agent = context_agent
@@ -9904,7 +9912,7 @@ def process_selections(request, rand=0):
                 try:
                     #import pdb; pdb.set_trace()
                     et_name = key.split("~")[0]
-                    et = EventType.objects.get(name=et_name)
+                    et = EventType.objects.cached(name=et_name)
                     action = et.relationship
                 except EventType.DoesNotExist:
                     pass
@@ -10541,8 +10549,8 @@ def exchanges(request, agent_id=None):
     #et_pay = EventType.objects.get(name="Payment")   
     #et_receive = EventType.objects.get(name="Receipt")
     #et_expense = EventType.objects.get(name="Expense")
-    et_give = EventType.objects.get(name="Give")
-    et_receive = EventType.objects.get(name="Receive")
+    et_give = EventType.objects.cached(name="Give")
+    et_receive = EventType.objects.cached(name="Receive")
     #references = AccountingReference.objects.all()
     ets = ExchangeType.objects.supply_exchange_types()
     event_ids = ""
@@ -10653,11 +10661,11 @@ def exchanges_old(request):
     start = datetime.date(end.year, 1, 1)
     init = {"start_date": start, "end_date": end}
     dt_selection_form = DateSelectionForm(initial=init, data=request.POST or None)
-    et_donation = EventType.objects.get(name="Donation")
-    et_cash = EventType.objects.get(name="Cash Contribution")
-    et_pay = EventType.objects.get(name="Payment")   
-    et_receive = EventType.objects.get(name="Receipt")
-    et_expense = EventType.objects.get(name="Expense")
+    et_donation = EventType.objects.cached(name="Donation")
+    et_cash = EventType.objects.cached(name="Cash Contribution")
+    et_pay = EventType.objects.cached(name="Payment")   
+    et_receive = EventType.objects.cached(name="Receipt")
+    et_expense = EventType.objects.cached(name="Expense")
     #et_process_expense = EventType.objects.get(name="Process Expense")
     references = AccountingReference.objects.all()
     event_ids = ""
@@ -10762,8 +10770,8 @@ def internal_exchanges(request, agent_id=None):
     start = today - datetime.timedelta(days=365)
     init = {"start_date": start, "end_date": end}
     dt_selection_form = DateSelectionForm(initial=init, data=request.POST or None)
-    et_give = EventType.objects.get(name="Give")
-    et_receive = EventType.objects.get(name="Receive")
+    et_give = EventType.objects.cached(name="Give")
+    et_receive = EventType.objects.cached(name="Receive")
     #references = AccountingReference.objects.all()
     ets = ExchangeType.objects.internal_exchange_types()
     event_ids = ""
@@ -10848,7 +10856,7 @@ def material_contributions(request):
     start = datetime.date(end.year, 1, 1)
     init = {"start_date": start, "end_date": end}
     dt_selection_form = DateSelectionForm(initial=init, data=request.POST or None)
-    et_matl = EventType.objects.get(name="Resource Contribution")
+    et_matl = EventType.objects.cached(name="Resource Contribution")
     event_ids = ""
     if request.method == "POST":
         #import pdb; pdb.set_trace()
@@ -10890,8 +10898,8 @@ def demand_exchanges(request, agent_id=None):
     start = today - datetime.timedelta(days=365)
     init = {"start_date": start, "end_date": end}
     dt_selection_form = DateSelectionForm(initial=init, data=request.POST or None)
-    et_give = EventType.objects.get(name="Give")
-    et_receive = EventType.objects.get(name="Receive")
+    et_give = EventType.objects.cached(name="Give")
+    et_receive = EventType.objects.cached(name="Receive")
     #references = AccountingReference.objects.all()
     ets = ExchangeType.objects.demand_exchange_types()
     event_ids = ""
@@ -10979,9 +10987,9 @@ def sales_and_distributions(request, agent_id=None):
     start = datetime.date(today.year, 1, 1)
     init = {"start_date": start, "end_date": end}
     dt_selection_form = DateSelectionForm(initial=init, data=request.POST or None)
-    et_cash_receipt = EventType.objects.get(name="Cash Receipt")
-    et_shipment = EventType.objects.get(name="Shipment")   
-    et_distribution = EventType.objects.get(name="Distribution")   
+    et_cash_receipt = EventType.objects.cached(name="Cash Receipt")
+    et_shipment = EventType.objects.cached(name="Shipment")   
+    et_distribution = EventType.objects.cached(name="Distribution")   
     references = AccountingReference.objects.all()
     event_ids = ""
     select_all = True
@@ -11109,100 +11117,158 @@ def distributions(request, agent_id=None):
         "user_agent": user_agent,
     }, context_instance=RequestContext(request))
   
-@login_required    
-def exchange_events_csv(request):
-    #import pdb; pdb.set_trace()
+def csv_event_request_ok(request):
+    """Whether an event csv export names its events or starts from a date.
+
+    Without either it would read every event, so the views answer 400.
+    """
+    return request.GET.get("event-ids") is not None or bool(request.GET.get("from"))
+
+def csv_event_batches(request, events, selected, batch_size=500):
+    """The events to export, in lists of at most batch_size.
+
+    Either the events named by the event-ids GET parameter, in that order,
+    or, without it, the selected events (the ones the export is about)
+    in the from and to dates (as in json_date_window)
+    and of the context-agent and event-type ids, in id order.
+    A batch is fetched only when the one before it has been written.
+    """
     event_ids = request.GET.get("event-ids")
-    response = HttpResponse(content_type='text/csv')
-    response['Content-Disposition'] = 'attachment; filename=contributions.csv'
-    writer = csv.writer(response)
-    writer.writerow(["Exchange Type", "Exchange ID", "Transfer Type", "Transfer ID", "Event ID", "Date", "Event Type", "Resource Type", "Quantity", "Unit of Quantity", "Value", "Unit of Value", "From Agent", "To Agent", "Project", "Description", "URL"])
-    event_ids_split = event_ids.split(",")
-    for event_id in event_ids_split:
-        event = EconomicEvent.objects.get(pk=event_id)
-        if event.from_agent == None:
-            from_agent = ""
-        else:
-            from_agent = event.from_agent.nick
-        if event.to_agent == None:
-            to_agent = ""
-        else:
-            to_agent = event.to_agent.nick  
-        if event.url == "":
+    if event_ids is not None:
+        try:
+            ids = [int(id) for id in event_ids.split(",") if id.strip()]
+        except ValueError:
+            raise Http404
+        return event_batches_by_id(events, ids, batch_size)
+    start, end = json_date_window(request)
+    events = selected.filter(event_date__gte=start)
+    if end:
+        events = events.filter(event_date__lte=end)
+    for param, lookup in (("context-agent", "context_agent__id"), ("event-type", "event_type__id")):
+        value = request.GET.get(param)
+        if value:
+            try:
+                events = events.filter(**{lookup: int(value)})
+            except ValueError:
+                raise Http404
+    return event_batches(events, batch_size)
+
+def event_batches_by_id(events, ids, batch_size):
+    for i in range(0, len(ids), batch_size):
+        batch = ids[i:i + batch_size]
+        found = events.in_bulk(batch)
+        yield [found[id] for id in batch if id in found]
+
+def event_batches(events, batch_size):
+    last_id = 0
+    while True:
+        batch = list(events.filter(id__gt=last_id).order_by("id")[:batch_size])
+        if not batch:
+            return
+        yield batch
+        last_id = batch[-1].id
+
+def streaming_csv_response(filename, header, rows):
+    response = StreamingHttpResponse(stream_csv(header, rows), content_type='text/csv')
+    response['Content-Disposition'] = 'attachment; filename=%s' % filename
+    return response
+
+def exchange_event_rows(batches):
+    for batch in batches:
+        for event in batch:
+            if event.from_agent == None:
+                from_agent = ""
+            else:
+                from_agent = event.from_agent.nick
+            if event.to_agent == None:
+                to_agent = ""
+            else:
+                to_agent = event.to_agent.nick
+            exchange = event.exchange
             if event.transfer:
-                if event.transfer.exchange.url == "":
-                    url = "" 
-                else:
-                    url = event.transfer.exchange.url
+                exchange = event.transfer.exchange
+            if event.url == "" and exchange:
+                url = exchange.url
             else:
-                if event.exchange.url == "":
-                    url = "" 
-                else:
-                    url = event.exchange.url                
-        else:
-            url = ""
-        if event.exchange:
-            exchange_name = event.exchange.exchange_type.name
-            exchange_id = event.exchange.id
-        else:
-            exchange_name = ""
-            exchange_id = ""
-        if event.transfer:
-            transfer_name = event.transfer.transfer_type.name
-            transfer_id = event.transfer.id
-            exchange_name = event.transfer.exchange.exchange_type.name
-            exchange_id = event.transfer.exchange.id
-        else:
-            transfer_name = ""
-            transfer_id = ""
-        writer.writerow(
-            [exchange_name,
-             exchange_id,
-             transfer_name,
-             transfer_id,
-             event.id, 
-             event.event_date,
-             event.event_type.name,
-             event.resource_type.name,
-             event.quantity,
-             event.unit_of_quantity,
-             event.value,
-             event.unit_of_value,
-             from_agent,
-             to_agent,
-             event.context_agent.name,
-             event.description,
-             url,  
+                url = ""
+            if exchange:
+                exchange_name = exchange.exchange_type.name
+                exchange_id = exchange.id
+            else:
+                exchange_name = ""
+                exchange_id = ""
+            if event.transfer:
+                transfer_name = event.transfer.transfer_type.name
+                transfer_id = event.transfer.id
+            else:
+                transfer_name = ""
+                transfer_id = ""
+            yield [exchange_name,
+                exchange_id,
+                transfer_name,
+                transfer_id,
+                event.id,
+                event.event_date,
+                event.event_type.name,
+                event.resource_type.name,
+                event.quantity,
+                event.unit_of_quantity,
+                event.value,
+                event.unit_of_value,
+                from_agent,
+                to_agent,
+                event.context_agent.name if event.context_agent else "",
+                event.description,
+                url,
             ]
-        )
-    return response
-    
-   
+
+@login_required    
+def exchange_events_csv(request):
+    #import pdb; pdb.set_trace()
+    if not csv_event_request_ok(request):
+        return HttpResponseBadRequest("Export needs event-ids or a from date.")
+    related = ("event_type", "resource_type", "from_agent", "to_agent", "context_agent",
+        "unit_of_quantity", "unit_of_value",
+        "exchange__exchange_type",
+        "transfer__transfer_type", "transfer__exchange__exchange_type")
+    events = EconomicEvent.objects.select_related(*related)
+    selected = EconomicEvent.objects.filter(
+        Q(exchange__isnull=False) | Q(transfer__isnull=False)).select_related(*related)
+    header = ["Exchange Type", "Exchange ID", "Transfer Type", "Transfer ID", "Event ID", "Date", "Event Type", "Resource Type", "Quantity", "Unit of Quantity", "Value", "Unit of Value", "From Agent", "To Agent", "Project", "Description", "URL"]
+    rows = exchange_event_rows(csv_event_batches(request, events, selected))
+    return streaming_csv_response("contributions.csv", header, rows)
+    
+def contribution_event_rows(batches, field_names):
+    fields = [EconomicEvent._meta.get_field(name) for name in field_names]
+    related = RelatedLabels(EconomicEvent, [f.name for f in fields if f.rel])
+    for batch in batches:
+        batch = [dict((f.attname, getattr(event, f.attname)) for f in fields) for event in batch]
+        related.load(batch)
+        for event in batch:
+            row = []
+            for field in fields:
+                x = event[field.attname]
+                if field.rel:
+                    x = related.label(field.attname, x)
+                else:
+                    try:
+                        x = x.encode('latin-1', 'replace')
+                    except AttributeError:
+                        pass
+                row.append(x)
+            yield row
+
 @login_required    
 def contribution_events_csv(request):
     #import pdb; pdb.set_trace()
-    event_ids = request.GET.get("event-ids")
-    response = HttpResponse(content_type='text/csv')
-    response['Content-Disposition'] = 'attachment; filename=contributions.csv'
-    writer = csv.writer(response)
-    #writer.writerow(["Date", "Event Type", "Resource Type", "Quantity", "Unit of Quantity", "Value", "Unit of Value", "From Agent", "To Agent", "Project", "Description", "URL", "Use Case", "Event ID", "Exchange ID"])
-    event_ids_split = event_ids.split(",")
-    queryset = EconomicEvent.objects.filter(id__in=event_ids_split)
+    if not csv_event_request_ok(request):
+        return HttpResponseBadRequest("Export needs event-ids or a from date.")
     opts = EconomicEvent._meta
     field_names = [field.name for field in opts.fields]
-    writer.writerow(field_names)
-    for obj in queryset:
-        row = []
-        for field in field_names:
-            x = getattr(obj, field)
-            try:
-                x = x.encode('latin-1', 'replace')
-            except AttributeError:
-                pass
-            row.append(x)
-        writer.writerow(row)
-
-    return response
+    events = EconomicEvent.objects.all()
+    selected = EconomicEvent.objects.contributions()
+    rows = contribution_event_rows(csv_event_batches(request, events, selected), field_names)
+    return streaming_csv_response("contributions.csv", field_names, rows)
 
 
 def exchange_logging(request, exchange_type_id=None, exchange_id=None, context_agent_id=None): 
@@ -11287,16 +11353,19 @@ def exchange_logging(request, exchange_type_id=None, exchange_id=None, context_a
             if request.user == exchange.created_by:
                 logger = True
 
+            # the work event forms share their choices
+            choices = FormChoices()
             for event in work_events:
                 event.changeform = WorkEventAgentForm(
                     context_agent=context_agent,
+                    choices=choices,
                     instance=event, 
                     prefix=str(event.id))
             work_init = {
                 "from_agent": agent,
                 "event_date": datetime.date.today()
             }
-            add_work_form = WorkEventAgentForm(initial=work_init, context_agent=context_agent)
+            add_work_form = WorkEventAgentForm(initial=work_init, context_agent=context_agent, choices=choices)
  
             #import pdb; pdb.set_trace()
             for slot in slots:
@@ -11750,7 +11819,7 @@ def distribution_logging(request, distribution_id=None):
         if request.user.is_superuser:
             logger = True
     pattern = None
-    use_case = UseCase.objects.get(identifier="distribution")
+    use_case = UseCase.objects.cached(identifier="distribution")
     patterns = ProcessPattern.objects.usecase_patterns(use_case)
     if patterns:
         pattern = patterns[0]
@@ -11820,7 +11889,7 @@ def create_distribution_using_value_equation(request, agent_id, value_equation_i
     else:
         ve = None
     buckets = []
-    use_case = UseCase.objects.get(identifier="distribution")
+    use_case = UseCase.objects.cached(identifier="distribution")
     pattern = None
     patts = ProcessPattern.objects.usecase_patterns(use_case)
     if patts:
@@ -12163,6 +12232,7 @@ def value_equation_sandbox(request, value_equation_id=None):
     hours = None
     agent_subtotals = None
     event_count = 0
+    profile = None
     if ves:
         if not ve:
             ve = ves[0]
@@ -12182,7 +12252,10 @@ def value_equation_sandbox(request, value_equation_id=None):
                         serialized_filters[bucket.id] = ser_string
                         bucket.form = bucket_form
             #import pdb; pdb.set_trace()
-            agent_totals, details = ve.run_value_equation(amount_to_distribute=Decimal(amount), serialized_filters=serialized_filters)
+            if data["profile"]:
+                agent_totals, details, profile = ve.profile_value_equation(amount_to_distribute=Decimal(amount), serialized_filters=serialized_filters)
+            else:
+                agent_totals, details = ve.run_value_equation(amount_to_distribute=Decimal(amount), serialized_filters=serialized_filters)
             total = sum(at.quantity for at in agent_totals)
             hours = sum(d.quantity for d in details)
             #import pdb; pdb.set_trace()
@@ -12228,6 +12301,7 @@ def value_equation_sandbox(request, value_equation_id=None):
         "event_count": event_count,
         "hours": hours,
         "ve": ve,
+        "profile": profile,
     }, context_instance=RequestContext(request))
 
 def json_value_equation_bucket(request, value_equation_id):
@@ -12437,11 +12511,12 @@ def cash_report(request):
     start = datetime.date(end.year, end.month, 1)
     init = {"start_date": start, "end_date": end}
     dt_selection_form = DateSelectionForm(initial=init, data=request.POST or None)
-    starting_balance = 0
+    starting_balance = None
     balance_form = BalanceForm(data=request.POST or None)
     event_ids = ""
     select_all = True
     selected_vas = "all"
+    accounts = None
     external_accounts = None
     virtual_accounts = EconomicResource.objects.virtual_accounts()
     option = "S"
@@ -12451,15 +12526,13 @@ def cash_report(request):
         if dt_selection_form.is_valid():
             start = dt_selection_form.cleaned_data["start_date"]
             end = dt_selection_form.cleaned_data["end_date"]
-            events = EconomicEvent.objects.virtual_account_events(start_date=start, end_date=end)
         else:
-            events = EconomicEvent.objects.virtual_account_events()
+            start = None
+            end = None
         if balance_form.is_valid():
             starting_balance = balance_form.cleaned_data["starting_balance"]
-            if starting_balance == '' or starting_balance == None:
-                starting_balance = 0
-        else:
-            starting_balance = 0
+            if starting_balance == '':
+                starting_balance = None
         #import pdb; pdb.set_trace()
         option = request.POST["option"]
         selected_vas = request.POST["selected-vas"]
@@ -12472,25 +12545,29 @@ def cash_report(request):
                 select_all = True
             else:
                 select_all = False
-                events_included = []
-                for event in events:
-                    if str(event.resource.id) in vals:
-                        events_included.append(event)
-                events = events_included
-    else:
-        events = EconomicEvent.objects.virtual_account_events(start_date=start, end_date=end)
- 
-    in_total = 0
-    out_total = 0
+                accounts = [int(v) for v in vals if v.isdigit()]
+    events = EconomicEvent.objects.virtual_account_events(start_date=start, end_date=end)
+    if accounts is not None:
+        events = events.filter(resource__in=accounts)
+    events = events.select_related("resource", "event_type", "accounting_reference")
+
+    # totals and the opening balance come from the daily account balances,
+    # so they need no pass over the events before start
+    balances = VirtualAccountBalance.objects
+    in_total, out_total = balances.flows(start, end, accounts)
+    if starting_balance is None:
+        if start:
+            opening = balances.balances(start - datetime.timedelta(days=1), accounts)
+            starting_balance = sum(opening.values(), Decimal("0"))
+        else:
+            starting_balance = 0
     comma = ""
     summary = {}
     for event in events:
         if event.creates_resources():
             event.in_out = "in"
-            in_total += event.quantity
         else:
             event.in_out = "out"
-            out_total += event.quantity
         if event.accounting_reference:
             event.account = event.accounting_reference.name
         else:
@@ -12523,52 +12600,52 @@ def cash_report(request):
         "option": option,
     }, context_instance=RequestContext(request))
   
+def cash_event_rows(batches):
+    for batch in batches:
+        for event in batch:
+            if event.from_agent == None:
+                from_agent = ""
+            else:
+                from_agent = event.from_agent.nick
+            if event.to_agent == None:
+                to_agent = ""
+            else:
+                to_agent = event.to_agent.nick
+            exchange = event.exchange
+            if event.url == "" and exchange:
+                url = exchange.url
+            else:
+                url = ""
+            yield [event.event_date,
+                event.event_type.name,
+                event.resource_type.name,
+                event.quantity,
+                event.unit_of_quantity,
+                event.value,
+                event.unit_of_value,
+                from_agent,
+                to_agent,
+                event.context_agent.name if event.context_agent else "",
+                event.event_reference,
+                event.description,
+                url,
+                exchange.use_case if exchange else "",
+                event.id,
+                exchange.id if exchange else "",
+            ]
+
 @login_required    
 def cash_events_csv(request):
     #import pdb; pdb.set_trace()
-    event_ids = request.GET.get("event-ids")
-    response = HttpResponse(content_type='text/csv')
-    response['Content-Disposition'] = 'attachment; filename=contributions.csv'
-    writer = csv.writer(response)
-    writer.writerow(["Date", "Event Type", "Resource Type", "Quantity", "Unit of Quantity", "Value", "Unit of Value", "From Agent", "To Agent", "Project", "Reference", "Description", "URL", "Use Case", "Event ID", "Exchange ID"])
-    event_ids_split = event_ids.split(",")
-    for event_id in event_ids_split:
-        event = EconomicEvent.objects.get(pk=event_id)
-        if event.from_agent == None:
-            from_agent = ""
-        else:
-            from_agent = event.from_agent.nick
-        if event.to_agent == None:
-            to_agent = ""
-        else:
-            to_agent = event.to_agent.nick  
-        if event.url == "":
-            if event.exchange.url == "":
-                url = "" 
-            else:
-                url = event.exchange.url
-        else:
-            url = ""     
-        writer.writerow(
-            [event.event_date,
-             event.event_type.name,
-             event.resource_type.name,
-             event.quantity,
-             event.unit_of_quantity,
-             event.value,
-             event.unit_of_value,
-             from_agent,
-             to_agent,
-             event.context_agent.name,
-             event.event_reference,
-             event.description,
-             url,
-             event.exchange.use_case,
-             event.id,
-             event.exchange.id   
-            ]
-        )
-    return response
+    if not csv_event_request_ok(request):
+        return HttpResponseBadRequest("Export needs event-ids or a from date.")
+    related = ("event_type", "resource_type", "from_agent", "to_agent", "context_agent",
+        "unit_of_quantity", "unit_of_value", "exchange__use_case")
+    events = EconomicEvent.objects.select_related(*related)
+    selected = EconomicEvent.objects.virtual_account_events().select_related(*related)
+    header = ["Date", "Event Type", "Resource Type", "Quantity", "Unit of Quantity", "Value", "Unit of Value", "From Agent", "To Agent", "Project", "Reference", "Description", "URL", "Use Case", "Event ID", "Exchange ID"]
+    rows = cash_event_rows(csv_event_batches(request, events, selected))
+    return streaming_csv_response("contributions.csv", header, rows)
 
 def virtual_accounts(request):
     #import pdb; pdb.set_trace()
@@ -12588,7 +12665,7 @@ def payout_from_virtual_account(request, account_id):
     if request.method == "POST":
         acct = get_object_or_404(EconomicResource, pk=account_id)
         owner = acct.owner()
-        event_type = EventType.objects.get(name="Payout")
+        event_type = EventType.objects.cached(name="Payout")
         context = None
         cas = acct.context_agents() #todo: what is correct here?
         if cas:
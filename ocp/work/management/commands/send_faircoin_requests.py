@@ -23,9 +23,31 @@ from django_rea.valueaccounting.process_faircoin_requests import *
 class Command(BaseCommand):
     help = "Send new FairCoin address and transaction requests to the network."
 
+    def add_arguments(self, parser):
+        parser.add_argument("--worker", action="store_true",
+            help="claim requests in batches and send them concurrently, with retries")
+        parser.add_argument("--batch-size", type=int, default=50)
+        parser.add_argument("--threads", type=int, default=4)
+        parser.add_argument("--attempts", type=int, default=3)
+        parser.add_argument("--backoff", type=float, default=1.0,
+            help="seconds to wait before the first retry, doubled for each next one")
+        parser.add_argument("--poll", type=float, default=0,
+            help="keep running, looking for new requests every POLL seconds")
+        parser.add_argument("--resolve", type=int, metavar="EVENT_ID",
+            help="settle an event left sending, after checking the address history")
+        parser.add_argument("--tx-hash",
+            help="with --resolve: the transaction that went out; without it, the event is requested again")
+
     def handle(self, *args, **options):
         logger.info("-" * 72)
         
+        if options.get("resolve"):
+            event = EconomicEvent.objects.get(pk=options["resolve"])
+            resolve_sending(event, options.get("tx_hash"))
+            return
+        if options.get("worker"):
+            return self.run_worker(options)
+
         try:
             lock = acquire_lock()
         except Exception:
@@ -52,4 +74,29 @@ class Command(BaseCommand):
             #shd this be in broadcast.py?
             lock.release()
             logger.debug("released.")
-            
+
+    def run_worker(self, options):
+        lock = acquire_lock()
+        if not lock:
+            return
+        worker = BroadcastWorker(
+            batch_size=options["batch_size"],
+            threads=options["threads"],
+            attempts=options["attempts"],
+            backoff=options["backoff"],
+        )
+        try:
+            while True:
+                try:
+                    msg = worker.run()
+                    logger.info(msg)
+                except Exception:
+                    _, e, _ = sys.exc_info()
+                    logger.critical("an exception occurred in the broadcast worker: {0}".format(e))
+                if not options["poll"]:
+                    break
+                time.sleep(options["poll"])
+        finally:
+            logger.debug("releasing lock normally...")
+            lock.release()
+            logger.debug("released.")
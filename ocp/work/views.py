@@ -192,7 +192,7 @@ def profile(request):
     agent = get_agent(request)
     change_form = WorkAgentCreateForm(instance=agent)
     skills = EconomicResourceType.objects.filter(behavior="work")
-    et_work = EventType.objects.get(name="Time Contribution")
+    et_work = EventType.objects.cached(name="Time Contribution")
     arts = agent.resource_types.filter(event_type=et_work)
     agent_skills = []
     user = request.user
@@ -270,8 +270,8 @@ def share_payment(request, agent_id):
         from_agent = agent
         to_resource = pay_to_account
         to_agent = pay_to_agent
-        et_give = EventType.objects.get(name="Give")
-        et_receive = EventType.objects.get(name="Receive")
+        et_give = EventType.objects.cached(name="Give")
+        et_receive = EventType.objects.cached(name="Receive")
         date = datetime.date.today()
         fc = EconomicAgent.objects.freedom_coop()
 
@@ -385,7 +385,7 @@ def share_payment(request, agent_id):
             if aa.has_associate == pay_to_agent:
                 aa.delete()
 
-        association_type = AgentAssociationType.objects.get(name="Member")
+        association_type = AgentAssociationType.objects.cached(name="Member")
         fc_aa = AgentAssociation(
             is_associate=agent,
             has_associate=fc,
@@ -499,7 +499,7 @@ def update_skills(request, agent_id):
         if not user_agent:
             return render_to_response('valueaccounting/no_permission.html')
         #import pdb; pdb.set_trace()
-        et_work = EventType.objects.get(name="Time Contribution")
+        et_work = EventType.objects.cached(name="Time Contribution")
         arts = agent.resource_types.filter(event_type=et_work)
         old_skill_rts = []
         for art in arts:
@@ -618,6 +618,8 @@ def process_logging(request, process_id):
     work_now = settings.USE_WORK_NOW
     to_be_changed_requirement = None
     changeable_requirement = None
+    # the requirement and event forms share their choices
+    choices = FormChoices()
 
     work_reqs = process.work_requirements()
     consume_reqs = process.consumed_input_requirements()
@@ -633,14 +635,14 @@ def process_logging(request, process_id):
             super_logger = True
         #import pdb; pdb.set_trace()
         for req in work_reqs:
-            req.changeform = req.change_work_form()
+            req.changeform = req.change_work_form(choices=choices)
             if agent == req.from_agent:
                 logger = True
                 worker = True
             init = {"from_agent": agent,
                 "event_date": todays_date,
                 "is_contribution": True,}
-            req.input_work_form_init = req.input_event_form_init(init=init)
+            req.input_work_form_init = req.input_event_form_init(init=init, choices=choices)
         for req in consume_reqs:
             req.changeform = req.change_form()
         for req in use_reqs:
@@ -649,14 +651,15 @@ def process_logging(request, process_id):
             event.changeform = UnplannedWorkEventForm(
                 pattern=pattern,
                 context_agent=context_agent,
+                choices=choices,
                 instance=event,
                 prefix=str(event.id))
         output_resource_types = pattern.output_resource_types()
         unplanned_output_form = UnplannedOutputForm(prefix='unplannedoutput')
         unplanned_output_form.fields["resource_type"].queryset = output_resource_types
         role_formset = resource_role_agent_formset(prefix="resource")
-        produce_et = EventType.objects.get(name="Resource Production")
-        change_et = EventType.objects.get(name="Change")
+        produce_et = EventType.objects.cached(name="Resource Production")
+        change_et = EventType.objects.cached(name="Change")
         #import pdb; pdb.set_trace()
         if "out" in slots:
             if logger:
@@ -685,16 +688,16 @@ def process_logging(request, process_id):
                         "unit_of_quantity": work_unit,
                         "is_contribution": True,
                     }
-                    unplanned_work_form = UnplannedWorkEventForm(prefix="unplanned", context_agent=context_agent, initial=work_init)
+                    unplanned_work_form = UnplannedWorkEventForm(prefix="unplanned", context_agent=context_agent, choices=choices, initial=work_init)
                     unplanned_work_form.fields["resource_type"].queryset = work_resource_types
                     #if logger:
                     #    add_work_form = WorkCommitmentForm(initial=work_init, prefix='work', pattern=pattern)
                 else:
-                    unplanned_work_form = UnplannedWorkEventForm(prefix="unplanned", pattern=pattern, context_agent=context_agent, initial=work_init)
+                    unplanned_work_form = UnplannedWorkEventForm(prefix="unplanned", pattern=pattern, context_agent=context_agent, choices=choices, initial=work_init)
                     #is this correct? see commented-out lines above
                 if logger:
                     date_init = {"due_date": process.end_date,}
-                    add_work_form = WorkCommitmentForm(prefix='work', pattern=pattern, initial=date_init)
+                    add_work_form = WorkCommitmentForm(prefix='work', pattern=pattern, choices=choices, initial=date_init)
 
         if "cite" in slots:
             unplanned_cite_form = UnplannedCiteEventForm(prefix='unplannedcite', pattern=pattern)
@@ -879,7 +882,7 @@ def my_history(request):
             for de in claim.distribution_events():
                 claim_distributions += de.value
                 claim_distro_events.append(de.event)
-    et = EventType.objects.get(name="Distribution")
+    et = EventType.objects.cached(name="Distribution")
     all_distro_evts = EconomicEvent.objects.filter(to_agent=agent, event_type=et)
     other_distro_evts = [d for d in all_distro_evts if d not in claim_distro_events]
     other_distributions = sum(de.quantity for de in other_distro_evts)
@@ -1206,7 +1209,7 @@ def transfer_faircoins(request, resource_id):
                 if to_resources:
                     to_resource = to_resources[0] #shd be only one
                     to_agent = to_resource.owner()
-                et_give = EventType.objects.get(name="Give")
+                et_give = EventType.objects.cached(name="Give")
                 if to_agent:
                     tt = faircoin_internal_transfer_type()
                     xt = tt.exchange_type
@@ -1264,7 +1267,7 @@ def transfer_faircoins(request, resource_id):
                 if to_agent:
                     from django_rea.valueaccounting.faircoin_utils import network_fee
                     quantity = quantity - Decimal(float(network_fee()) / 1.e6)
-                    et_receive = EventType.objects.get(name="Receive")
+                    et_receive = EventType.objects.cached(name="Receive")
                     event = EconomicEvent(
                         event_type = et_receive,
                         event_date = date,
@@ -1326,7 +1329,7 @@ def membership_request(request):
             description = data["description"]
             mbr_req = membership_form.save()
 
-            event_type = EventType.objects.get(relationship="todo")
+            event_type = EventType.objects.cached(relationship="todo")
             description = "Create an Agent and User for the Membership Request from "
             description += name
             membership_url= get_url_starter() + "/accounting/membership-request/" + str(mbr_req.id) + "/"
@@ -1760,7 +1763,7 @@ def create_your_project(request):
             project.agent = agent
             project.save()
 
-            association_type = AgentAssociationType.objects.get(identifier="manager")
+            association_type = AgentAssociationType.objects.cached(identifier="manager")
             fc_aa = AgentAssociation(
                 is_associate=user_agent,
                 has_associate=agent,
@@ -1770,7 +1773,7 @@ def create_your_project(request):
             fc_aa.save()
 
             fc = EconomicAgent.objects.freedom_coop()
-            association_type = AgentAssociationType.objects.get(identifier="child")
+            association_type = AgentAssociationType.objects.cached(identifier="child")
             fc_aa = AgentAssociation(
                 is_associate=agent,
                 has_associate=fc,
@@ -2136,7 +2139,7 @@ def joinaproject_request(request, form_slug = False):
             #        )
             #    fc_aa.save()
 
-            event_type = EventType.objects.get(relationship="todo")
+            event_type = EventType.objects.cached(relationship="todo")
             description = "Create an Agent and User for the Join Request from "
             description += name
             join_url = get_url_starter() + "/work/agent/" + str(jn_req.project.agent.id) +"/join-requests/"
@@ -2503,7 +2506,7 @@ def decline_request(request, join_request_id):
     mbr_req.save()
     if mbr_req.agent and mbr_req.project:
         # modify relation to active
-        ass_type = AgentAssociationType.objects.get(identifier="participant")
+        ass_type = AgentAssociationType.objects.cached(identifier="participant")
         ass = AgentAssociation.objects.get(is_associate=mbr_req.agent, has_associate=mbr_req.project.agent, association_type=ass_type)
         ass.state = "potential"
         ass.save()
@@ -2535,7 +2538,7 @@ def accept_request(request, join_request_id):
     mbr_req.save()
 
     # modify relation to active
-    association_type = AgentAssociationType.objects.get(identifier="participant")
+    association_type = AgentAssociationType.objects.cached(identifier="participant")
     try:
       association = AgentAssociation.objects.get(is_associate=mbr_req.agent, has_associate=mbr_req.project.agent, association_type=association_type)
       association.state = "active"
@@ -2627,7 +2630,7 @@ def join_project(request, project_id):
     if request.method == "POST":
         project = get_object_or_404(EconomicAgent, pk=project_id)
         user_agent = get_agent(request)
-        association_type = AgentAssociationType.objects.get(identifier="participant")
+        association_type = AgentAssociationType.objects.cached(identifier="participant")
         aa = AgentAssociation(
             is_associate=user_agent,
             has_associate=project,